@@ -297,10 +297,10 @@ class AccountBackend(RedisConn):
         accounts = conn.hkeys('accounts:')
         return accounts
 
-    def update_container(self, account_id, name, mtime, dtime, object_count,
-                         bytes_used, autocreate_account=None,
-                         autocreate_container=True):
-        conn = self.conn
+    def _update_container_args(self, account_id, name, mtime, dtime,
+                               object_count, bytes_used, autocreate_account,
+                               autocreate_container):
+        """Build the keys and arguments of the update_container script."""
         if not account_id or not name:
             raise BadRequest("Missing account or container")
 
@@ -326,21 +326,72 @@ class AccountBackend(RedisConn):
         args = [name, mtime, dtime, object_count, bytes_used,
                 autocreate_account, Timestamp(time()).normal, EXPIRE_TIME,
                 autocreate_container]
+        return keys, args
+
+    @staticmethod
+    def _update_container_error(exc, account_id, name):
+        """Convert an error of the update_container script."""
+        if str(exc) == "no_account":
+            return NotFound("Account %s not found" % account_id)
+        if str(exc) == "no_container":
+            return NotFound("Container %s not found" % name)
+        elif str(exc) == "no_update_needed":
+            return Conflict("No update needed, "
+                            "event older than last container update")
+        return exc
+
+    def update_container(self, account_id, name, mtime, dtime, object_count,
+                         bytes_used, autocreate_account=None,
+                         autocreate_container=True):
+        conn = self.conn
+        keys, args = self._update_container_args(
+            account_id, name, mtime, dtime, object_count, bytes_used,
+            autocreate_account, autocreate_container)
         try:
             self.script_update_container(keys=keys, args=args, client=conn)
         except redis.exceptions.ResponseError as exc:
-            if str(exc) == "no_account":
-                raise NotFound("Account %s not found" % account_id)
-            if str(exc) == "no_container":
-                raise NotFound("Container %s not found" % name)
-            elif str(exc) == "no_update_needed":
-                raise Conflict("No update needed, "
-                               "event older than last container update")
-            else:
-                raise
+            raise self._update_container_error(exc, account_id, name)
 
         return name
 
+    def update_containers(self, updates, autocreate_account=None):
+        """
+        Update several containers, possibly of several accounts,
+        with a single round trip to Redis.
+
+        :param updates: `dict` objects with 'account' and 'name' keys,
+            and optional 'mtime', 'dtime', 'objects' and 'bytes' keys
+        :returns: a `list` with, for each update, None if it succeeded,
+            or the exception explaining why it failed
+        """
+        results = [None] * len(updates)
+        pipeline = self.conn.pipeline(False)
+        queued = list()
+        for i, update in enumerate(updates):
+            try:
+                keys, args = self._update_container_args(
+                    update.get('account'), update.get('name'),
+                    update.get('mtime'), update.get('dtime'),
+                    update.get('objects'), update.get('bytes'),
+                    autocreate_account, True)
+            except BadRequest as exc:
+                results[i] = exc
+                continue
+            except ValueError as exc:
+                results[i] = BadRequest(str(exc))
+                continue
+            self.script_update_container(keys=keys, args=args,
+                                         client=pipeline)
+            queued.append(i)
+        if queued:
+            replies = pipeline.execute(raise_on_error=False)
+            for i, reply in zip(queued, replies):
+                if isinstance(reply, redis.exceptions.ResponseError):
+                    results[i] = self._update_container_error(
+                        reply, updates[i].get('account'),
+                        updates[i].get('name'))
+        return results
+
     def _raw_listing(self, account_id, limit, marker, end_marker, delimiter,
                      prefix):
         """Fetch tuple list of containers matching options.
@@ -192,6 +192,23 @@ class AccountClient(HttpApi):
                                            data=json.dumps(metadata), **kwargs)
         return body
 
+    def container_update_many(self, updates, **kwargs):
+        """
+        Update several containers, possibly belonging to several accounts,
+        with a single request.
+
+        :param updates: container metadata ("account", "name", and
+            optionally "bytes", "objects", "mtime", "dtime")
+        :type updates: `list` of `dict`
+        :returns: for each update, in the same order, a `dict` with
+            the "status" of the update (an HTTP status code), and an
+            error "message" if it failed
+        """
+        _resp, body = self.account_request(
+            None, 'POST', 'container/update_many',
+            data=json.dumps({'containers': updates}), **kwargs)
+        return body
+
     def container_reset(self, account, container, mtime, **kwargs):
         """
         Reset container of an account
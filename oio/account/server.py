@@ -16,7 +16,8 @@
 
 from werkzeug.wrappers import Response
 from werkzeug.routing import Map, Rule
-from werkzeug.exceptions import NotFound, BadRequest, Conflict
+from werkzeug.exceptions import NotFound, BadRequest, Conflict, \
+    HTTPException
 from functools import wraps
 
 from oio.account.backend import AccountBackend
@@ -57,6 +58,8 @@ class Account(WerkzeugApp):
             Rule('/v1.0/account/flush', endpoint='account_flush'),
             Rule('/v1.0/account/container/update',
                  endpoint='account_container_update'),
+            Rule('/v1.0/account/container/update_many',
+                 endpoint='account_container_update_many'),
             Rule('/v1.0/account/container/reset',
                  endpoint='account_container_reset')
         ])
@@ -178,6 +181,55 @@ class Account(WerkzeugApp):
         result = json.dumps(info)
         return Response(result)
 
+    # ACCT{{
+    # POST /v1.0/account/container/update_many
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # Update several containers, possibly belonging to several accounts,
+    # in a single request. The reply tells, for each container (in the
+    # same order), the status of its update.
+    #
+    # .. code-block:: http
+    #
+    #    POST /v1.0/account/container/update_many HTTP/1.1
+    #    Host: 127.0.0.1:6021
+    #    Content-Length: 124
+    #
+    #    {"containers": [{"account": "myaccount", "name": "ct0",
+    #                     "mtime": 1511343903.15, "objects": 1,
+    #                     "bytes": 42},
+    #                    {"account": "myaccount", "name": "ct1",
+    #                     "dtime": 1511343903.16}]}
+    #
+    # .. code-block:: http
+    #
+    #    HTTP/1.1 200 OK
+    #    Content-Type: text/json; charset=utf-8
+    #
+    #    [{"status": 200},
+    #     {"status": 409, "message": "No update needed, event older
+    #      than last container update"}]
+    #
+    # }}ACCT
+    def on_account_container_update_many(self, req):
+        try:
+            updates = json.loads(req.get_data())['containers']
+        except (ValueError, KeyError, TypeError):
+            return BadRequest('Expected a list of containers')
+        if not isinstance(updates, list):
+            return BadRequest('Expected a list of containers')
+        # Exceptions are catched by dispatch_request
+        errors = self.backend.update_containers(updates)
+        results = list()
+        for err in errors:
+            if err is None:
+                results.append({'status': 200})
+            elif isinstance(err, HTTPException):
+                results.append({'status': err.code,
+                                'message': err.description})
+            else:
+                results.append({'status': 500, 'message': str(err)})
+        return Response(json.dumps(results), mimetype='text/json')
+
     def on_account_container_reset(self, req):
         account_id = self._get_account_id(req)
         data = json.loads(req.get_data())
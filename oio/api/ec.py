@@ -17,17 +17,26 @@ import collections
 import math
 import hashlib
 import logging
+import os
+import signal
+import struct
+import sys
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
-from eventlet import Queue, Timeout, GreenPile
+import eventlet
+from eventlet import Queue, Timeout, GreenPile, greenio, patcher
+from eventlet.queue import Empty, LightQueue
 from greenlet import GreenletExit
+from six import reraise
+from six.moves import cPickle as pickle
 from oio.common import exceptions
 from oio.common.exceptions import SourceReadError
 from oio.common.http import HeadersDict, parse_content_range, \
     ranges_from_http_header, headers_from_object_metadata
-from oio.common.utils import fix_ranges
+from oio.common.http_eventlet import send_chunk
+from oio.common.utils import fix_ranges, monotonic_time
 from oio.api import io
 from oio.common.constants import CHUNK_HEADERS
 from oio.common import green
@@ -35,6 +44,351 @@ from oio.common import green
 
 logger = logging.getLogger(__name__)
 
+_original_socket = patcher.original('socket')
+
+# Number of segments being encoded or decoded at the same time
+# by one stream, when the codec is offloaded to child processes.
+EC_CODEC_QUEUE_DEPTH = 4
+
+
+def _timed_call(func, *args):
+    start = monotonic_time()
+    result = func(*args)
+    return result, monotonic_time() - start
+
+
+class _InlineCall(object):
+    """
+    Result of a codec call done in the calling greenthread.
+    Mimics the parts of `eventlet.greenthread.GreenThread` we use.
+    """
+
+    dead = True
+
+    def __init__(self, func, *args):
+        self._exc_info = None
+        try:
+            self._result = func(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def wait(self):
+        if self._exc_info:
+            reraise(*self._exc_info)
+        return self._result
+
+    def kill(self, *_args):
+        pass
+
+
+# Size of the pieces of data sent at once to codec processes
+_CODEC_SEND_SIZE = 65536
+
+
+class _Blob(int):
+    """Placeholder for a string sent apart from the pickled message."""
+
+
+def _extract_blobs(obj, blobs):
+    """
+    Replace the large strings in `obj` by placeholders: pickling them
+    would block the hub while copying them several times.
+    """
+    if isinstance(obj, bytes) and len(obj) > _CODEC_SEND_SIZE:
+        blobs.append(obj)
+        return _Blob(len(blobs) - 1)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_extract_blobs(x, blobs) for x in obj)
+    return obj
+
+
+def _restore_blobs(obj, blobs):
+    if isinstance(obj, _Blob):
+        return blobs[obj]
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_restore_blobs(x, blobs) for x in obj)
+    return obj
+
+
+def _send_all(sock, data):
+    view = memoryview(data)
+    while view:
+        sent = sock.send(view[:_CODEC_SEND_SIZE])
+        view = view[sent:]
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            raise EOFError('codec connection closed')
+        received += count
+    return bytes(buf)
+
+
+def _send_msg(sock, obj):
+    blobs = list()
+    header = pickle.dumps((_extract_blobs(obj, blobs),
+                           [len(blob) for blob in blobs]),
+                          pickle.HIGHEST_PROTOCOL)
+    _send_all(sock, struct.pack('!Q', len(header)) + header)
+    for blob in blobs:
+        _send_all(sock, blob)
+
+
+def _recv_msg(sock):
+    size, = struct.unpack('!Q', _recv_exact(sock, 8))
+    obj, sizes = pickle.loads(_recv_exact(sock, size))
+    blobs = [_recv_exact(sock, blob_size) for blob_size in sizes]
+    return _restore_blobs(obj, blobs)
+
+
+def _codec_worker(sock):
+    """
+    Serve the codec calls sent by the parent process,
+    until it closes the connection.
+    """
+    from pyeclib.ec_iface import ECDriver
+    drivers = dict()
+    while True:
+        try:
+            (ec_type, k, m), method, args = _recv_msg(sock)
+        except EOFError:
+            return
+        try:
+            driver = drivers.get((ec_type, k, m))
+            if driver is None:
+                driver = ECDriver(k=k, m=m, ec_type=ec_type)
+                drivers[(ec_type, k, m)] = driver
+            response = (True, _timed_call(getattr(driver, method), *args))
+        except Exception as exc:
+            response = (False, exc)
+        try:
+            _send_msg(sock, response)
+        except (pickle.PicklingError, TypeError):
+            _send_msg(sock, (False, exceptions.OioException(
+                repr(response[1]))))
+
+
+def _close_fds(keep):
+    """Close all the file descriptors of the process, except `keep`."""
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        try:
+            max_fd = os.sysconf('SC_OPEN_MAX')
+        except (ValueError, OSError):
+            max_fd = 1024
+        fds = range(max_fd)
+    for fd in fds:
+        if fd > 2 and fd != keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+# Codec processes killed but not waited for yet
+_unreaped = set()
+
+
+def _reap_children():
+    """Wait for the codec processes which have exited, without blocking."""
+    for pid in list(_unreaped):
+        try:
+            done, _status = os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            done = pid
+        if done:
+            _unreaped.discard(pid)
+
+
+class _CodecProcess(object):
+    """A child process running erasure code computations."""
+
+    def __init__(self):
+        _reap_children()
+        parent_sock, child_sock = _original_socket.socketpair()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # Child: serve requests with blocking sockets, never
+            # go back to the code of the parent. Do not keep the
+            # sockets of the parent open (the other codec processes
+            # would never get EOF, clients would never be disconnected).
+            try:
+                _close_fds(child_sock.fileno())
+                _codec_worker(child_sock)
+            finally:
+                os._exit(0)
+        child_sock.close()
+        self.sock = greenio.GreenSocket(parent_sock)
+
+    def call(self, spec, method, args):
+        _send_msg(self.sock, (spec, method, args))
+        return _recv_msg(self.sock)
+
+    def close(self):
+        """Kill the process, do not wait for it to exit."""
+        if self.pid is None:
+            return
+        self.sock.close()
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        _unreaped.add(self.pid)
+        self.pid = None
+        _reap_children()
+
+
+class CodecExecutor(object):
+    """
+    Runs erasure code computations.
+
+    With `processes` set to 0 (the default), computations are done
+    in the calling greenthread, which blocks the eventlet hub.
+    Otherwise they are sent to a pool of child processes (started on
+    demand), the calling greenthread waits for the result without
+    blocking the hub, and each stream keeps up to `queue_depth`
+    segments in flight. pyeclib holds the GIL while computing,
+    native threads would not free the hub.
+    """
+
+    def __init__(self, processes=0, queue_depth=None):
+        self.processes = int(processes or 0)
+        self.queue_depth = int(queue_depth or EC_CODEC_QUEUE_DEPTH)
+        self._idle = eventlet.Queue()
+        self._started = 0
+        # All the processes started, idle or busy
+        self._procs = set()
+
+    def _get_process(self):
+        if self._idle.empty() and self._started < self.processes:
+            self._started += 1
+            try:
+                proc = _CodecProcess()
+            except Exception:
+                self._started -= 1
+                raise
+            self._procs.add(proc)
+            return proc
+        return self._idle.get()
+
+    def _discard(self, proc):
+        proc.close()
+        if proc in self._procs:
+            self._procs.discard(proc)
+            self._started -= 1
+
+    def execute(self, storage_method, method, *args):
+        """
+        Call `method(*args)` on the erasure code driver
+        of `storage_method`.
+
+        :returns: a tuple with the result of the call
+            and the time spent computing it
+        """
+        if self.processes <= 0:
+            return _timed_call(getattr(storage_method.driver, method),
+                               *args)
+        spec = (storage_method.ec_type, storage_method.ec_nb_data,
+                storage_method.ec_nb_parity)
+        proc = self._get_process()
+        try:
+            success, result = proc.call(spec, method, args)
+        except BaseException:
+            # The exchange has been interrupted, the process
+            # cannot be reused.
+            self._discard(proc)
+            raise
+        if proc in self._procs:
+            self._idle.put(proc)
+        if not success:
+            raise result
+        return result
+
+    def spawn(self, func, *args):
+        """
+        Call `func(*args)` in a new greenthread if computations
+        are offloaded, immediately otherwise.
+
+        :returns: an object with `dead`, `wait()` and `kill()`
+            like `eventlet.greenthread.GreenThread`
+        """
+        if self.processes > 0:
+            return eventlet.spawn(func, *args)
+        return _InlineCall(func, *args)
+
+    def close(self):
+        """Kill the child processes, idle or busy, without blocking."""
+        while not self._idle.empty():
+            self._idle.get()
+        for proc in list(self._procs):
+            self._discard(proc)
+
+
+INLINE_CODEC_EXECUTOR = CodecExecutor()
+
+
+class ECCodec(object):
+    """
+    Erasure code computations done on behalf of one request.
+
+    Accumulates the time spent encoding, decoding or reconstructing
+    in `codec_time` and in the 'ec_codec' entry of `perfdata`.
+    """
+
+    def __init__(self, storage_method, executor=None, perfdata=None):
+        self.storage_method = storage_method
+        self.executor = executor or INLINE_CODEC_EXECUTOR
+        self.perfdata = perfdata
+        self.codec_time = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.executor.queue_depth
+
+    def _execute(self, method, *args):
+        result, elapsed = self.executor.execute(self.storage_method,
+                                                method, *args)
+        self.codec_time += elapsed
+        if self.perfdata is not None:
+            self.perfdata['ec_codec'] = \
+                self.perfdata.get('ec_codec', 0.0) + elapsed
+        return result
+
+    def encode(self, segment):
+        return self._execute('encode', segment)
+
+    def decode(self, fragments):
+        return self._execute('decode', fragments)
+
+    def reconstruct(self, fragments, missing):
+        return self._execute('reconstruct', fragments, missing)
+
+    def encode_async(self, segment):
+        return self.executor.spawn(self.encode, segment)
+
+    def decode_async(self, fragments):
+        return self.executor.spawn(self.decode, fragments)
+
+
+def _pop_ready(pending, depth):
+    """
+    Pop the results of the calls at the head of `pending` which are
+    already done, waiting for some if more than `depth` are in flight.
+    """
+    while pending and (pending[0].dead or len(pending) > depth):
+        yield pending.popleft().wait()
+
+
+def _kill_all(pending):
+    while pending:
+        pending.popleft().kill()
+
 
 def segment_range_to_fragment_range(segment_start, segment_end, segment_size,
                                     fragment_size):
@@ -96,10 +450,18 @@ class ECChunkDownloadHandler(object):
 
     def __init__(self, storage_method, chunks, meta_start, meta_end, headers,
                  connection_timeout=None, read_timeout=None,
-                 **_kwargs):
+                 **kwargs):
         """
         :param connection_timeout: timeout to establish the connections
         :param read_timeout: timeout to read a buffer of data
+        :keyword rawx_pool: pool of keep-alive connections to rawx services
+        :keyword ec_codec_executor: how to run erasure code computations
+        :type ec_codec_executor: `CodecExecutor`
+        :keyword perfdata: optional `dict` that will be filled with
+            the time spent decoding, and hedging counters
+        :keyword hedging: when to send requests to parity fragments
+            while waiting for the responses of data fragments
+        :type hedging: `oio.api.io.HedgingPolicy`
         """
         self.storage_method = storage_method
         self.chunks = chunks
@@ -111,6 +473,12 @@ class ECChunkDownloadHandler(object):
         self.headers = headers
         self.connection_timeout = connection_timeout
         self.read_timeout = read_timeout
+        self.rawx_pool = kwargs.get('rawx_pool')
+        self.hedging = kwargs.get('hedging')
+        self.perfdata = kwargs.get('perfdata')
+        self.codec = ECCodec(storage_method,
+                             executor=kwargs.get('ec_codec_executor'),
+                             perfdata=self.perfdata)
 
     def _get_range_infos(self):
         """
@@ -156,26 +524,97 @@ class ECChunkDownloadHandler(object):
         reader = io.ChunkReader(chunk_iter, storage_method.ec_fragment_size,
                                 headers, self.connection_timeout,
                                 self.read_timeout,
-                                align=True)
-        return (reader, reader.get_iter())
+                                align=True, rawx_pool=self.rawx_pool)
+        start = monotonic_time()
+        parts_iter = reader.get_iter()
+        if self.hedging is not None:
+            self.hedging.record(monotonic_time() - start)
+        return (reader, parts_iter)
+
+    def _get_fragments_hedged(self, chunk_iter, range_infos, delay):
+        """
+        Start `ec_nb_data` readers. Each time `delay` seconds elapse
+        before enough of them are ready, start an extra reader, which
+        takes the next fragment (a parity fragment, unless some data
+        fragments could not be read). The first `ec_nb_data` valid
+        readers win, the others are cancelled.
+        """
+        nb_data = self.storage_method.ec_nb_data
+        max_hedged = len(self.chunks) - nb_data
+        results = LightQueue()
+        # Start time of the fetchers still running
+        pending = dict()
+
+        def _fetch(hedged_, key):
+            try:
+                res = self._get_fragment(chunk_iter, range_infos,
+                                         self.storage_method)
+            except Exception as err:
+                res = err
+            pending.pop(key, None)
+            results.put((hedged_, res))
+
+        def _spawn(hedged_):
+            key = object()
+            pending[key] = monotonic_time()
+            return eventlet.spawn(_fetch, hedged_, key)
+
+        fetchers = [_spawn(False) for _j in range(nb_data)]
+        running = nb_data
+        hedged = wins = 0
+        readers = []
+        while running and len(readers) < nb_data:
+            try:
+                is_hedged, res = results.get(
+                    timeout=delay if hedged < max_hedged else None)
+            except Empty:
+                fetchers.append(_spawn(True))
+                running += 1
+                hedged += 1
+                continue
+            running -= 1
+            if isinstance(res, Exception) or \
+                    res[0].status not in (200, 206):
+                continue
+            readers.append(res)
+            if is_hedged:
+                wins += 1
+
+        for fetcher in fetchers:
+            fetcher.kill()
+        # The cancelled fetchers would have been ready later than now
+        now = monotonic_time()
+        for started in pending.values():
+            self.hedging.record(now - started)
+        # Close the readers which became ready too late
+        while not results.empty():
+            _h, res = results.get()
+            if not isinstance(res, Exception) and res[0].source:
+                io.close_source(res[0].source)
+        io.hedging_stats(self.perfdata, hedged, wins)
+        return readers
 
     def get_stream(self):
         range_infos = self._get_range_infos()
         chunk_iter = iter(self.chunks)
 
-        # we use eventlet GreenPool to manage readers
-        with green.ContextPool(self.storage_method.ec_nb_data) as pool:
-            pile = GreenPile(pool)
-            # we use eventlet GreenPile to spawn readers
-            for _j in range(self.storage_method.ec_nb_data):
-                pile.spawn(self._get_fragment, chunk_iter, range_infos,
-                           self.storage_method)
-
-            readers = []
-            for reader, parts_iter in pile:
-                if reader.status in (200, 206):
-                    readers.append((reader, parts_iter))
-                # TODO log failures?
+        if self.hedging is not None and self.hedging.delay is not None:
+            readers = self._get_fragments_hedged(
+                chunk_iter, range_infos, self.hedging.delay)
+        else:
+            # we use eventlet GreenPool to manage readers
+            with green.ContextPool(self.storage_method.ec_nb_data) as pool:
+                pile = GreenPile(pool)
+                # we use eventlet GreenPile to spawn readers
+                for _j in range(self.storage_method.ec_nb_data):
+                    pile.spawn(self._get_fragment, chunk_iter, range_infos,
+                               self.storage_method)
+
+                readers = []
+                for reader, parts_iter in pile:
+                    if reader.status in (200, 206):
+                        readers.append((reader, parts_iter))
+                    # TODO log failures?
 
         # with EC we need at least ec_nb_data valid readers
         if len(readers) >= self.storage_method.ec_nb_data:
@@ -185,7 +624,8 @@ class ECChunkDownloadHandler(object):
             fragment_length = int(resp_headers.get('Content-Length'))
             read_iterators = [it for _, it in readers]
             stream = ECStream(self.storage_method, read_iterators, range_infos,
-                              self.meta_length, fragment_length)
+                              self.meta_length, fragment_length,
+                              codec=self.codec)
             # start the stream
             stream.start()
             return stream
@@ -200,12 +640,13 @@ class ECStream(object):
     Handles the different readers.
     """
     def __init__(self, storage_method, readers, range_infos, meta_length,
-                 fragment_length):
+                 fragment_length, codec=None):
         self.storage_method = storage_method
         self.readers = readers
         self.range_infos = range_infos
         self.meta_length = meta_length
         self.fragment_length = fragment_length
+        self.codec = codec or ECCodec(storage_method)
 
     def start(self):
         self._iter = io.chain(self._stream())
@@ -297,34 +738,45 @@ class ECStream(object):
                 # close the iterator
                 fragment_iterator.close()
 
+        # segments being decoded, in order
+        pending = collections.deque()
+
         # we use eventlet GreenPool to manage the read of fragments
         with green.ContextPool(len(fragment_iterators)) as pool:
             # spawn coroutines to read the fragments
             for fragment_iterator, queue in zip(fragment_iterators, queues):
                 pool.spawn(put_in_queue, fragment_iterator, queue)
 
-            # main decoding loop
-            while True:
-                data = []
-                # get the fragments from the queues
-                for queue in queues:
-                    fragment = queue.get()
-                    queue.task_done()
-                    data.append(fragment)
-
-                if not all(data):
-                    # one of the readers returned None
-                    # impossible to read segment
-                    break
-                # actually decode the fragments into a segment
-                try:
-                    segment = self.storage_method.driver.decode(data)
-                except exceptions.ECError:
-                    # something terrible happened
-                    logger.exception("ERROR decoding fragments")
-                    raise
-
-                yield segment
+            try:
+                # main decoding loop
+                while True:
+                    data = []
+                    # get the fragments from the queues
+                    for queue in queues:
+                        fragment = queue.get()
+                        queue.task_done()
+                        data.append(fragment)
+
+                    if not all(data):
+                        # one of the readers returned None
+                        # impossible to read segment
+                        break
+                    # actually decode the fragments into a segment,
+                    # while we read the next fragments
+                    pending.append(self.codec.decode_async(data))
+                    for segment in _pop_ready(pending,
+                                              self.codec.queue_depth):
+                        yield segment
+
+                # segments still being decoded
+                for segment in _pop_ready(pending, 0):
+                    yield segment
+            except exceptions.ECError:
+                # something terrible happened
+                logger.exception("ERROR decoding fragments")
+                raise
+            finally:
+                _kill_all(pending)
 
     def _convert_range(self, req_start, req_end, length):
         try:
@@ -453,22 +905,27 @@ class ECStream(object):
         return self
 
 
-def ec_encode(storage_method, n):
+def ec_encode(storage_method, n, codec=None):
     """
     Encode EC segments
+
+    When the codec is offloaded, the fragments of a segment may be
+    returned by a later call, and the final call returns everything
+    that is left.
     """
+    codec = codec or ECCodec(storage_method)
     segment_size = storage_method.ec_segment_size
 
     buf = collections.deque()
     total_len = 0
+    # segments being encoded, in order
+    pending = collections.deque()
 
-    data = yield
-    while data:
-        buf.append(data)
-        total_len += len(data)
-
-        if total_len >= segment_size:
-            data_to_encode = []
+    try:
+        data = yield
+        while data:
+            buf.append(data)
+            total_len += len(data)
 
             while total_len >= segment_size:
                 # take data from buf
@@ -485,41 +942,46 @@ def ec_encode(storage_method, n):
                     parts.append(part)
                     amount -= len(part)
                     total_len -= len(part)
-                data_to_encode.append(b''.join(parts))
-
-            # let's encode!
-            encode_result = []
-            for d in data_to_encode:
-                encode_result.append(storage_method.driver.encode(d))
-
-            # transform the result
-            #
-            # from:
-            # [[fragment_0_0, fragment_1_0, fragment_2_0, ...],
-            #  [fragment_0_1, fragment_1_1, fragment_2_1, ...], ...]
-            #
-            # to:
-            #
-            # [(fragment_0_0 + fragment_0_1 + ...), # write to chunk 0
-            # [(fragment_1_0 + fragment_1_1 + ...), # write to chunk 1
-            # [(fragment_2_0 + fragment_2_1 + ...), # write to chunk 2
-            #  ...]
-
-            result = [b''.join(p) for p in zip(*encode_result)]
-            data = yield result
+                # let's encode!
+                pending.append(codec.encode_async(b''.join(parts)))
+
+            encode_result = list(_pop_ready(pending, codec.queue_depth))
+            if encode_result:
+                # transform the result
+                #
+                # from:
+                # [[fragment_0_0, fragment_1_0, fragment_2_0, ...],
+                #  [fragment_0_1, fragment_1_1, fragment_2_1, ...], ...]
+                #
+                # to:
+                #
+                # [(fragment_0_0 + fragment_0_1 + ...), # write to chunk 0
+                # [(fragment_1_0 + fragment_1_1 + ...), # write to chunk 1
+                # [(fragment_2_0 + fragment_2_1 + ...), # write to chunk 2
+                #  ...]
+
+                result = [b''.join(p) for p in zip(*encode_result)]
+                data = yield result
+            else:
+                # not enough data to encode,
+                # or segments still being encoded
+                data = yield None
+
+        # empty input data
+        # which means end of stream
+        # wait for the segments being encoded,
+        # then encode what is left in the buf
+        encode_result = list(_pop_ready(pending, 0))
+        whats_left = b''.join(buf)
+        if whats_left:
+            encode_result.append(codec.encode(whats_left))
+        if encode_result:
+            last_fragments = [b''.join(p) for p in zip(*encode_result)]
         else:
-            # not enough data to encode
-            data = yield None
-
-    # empty input data
-    # which means end of stream
-    # encode what is left in the buf
-    whats_left = b''.join(buf)
-    if whats_left:
-        last_fragments = storage_method.driver.encode(whats_left)
-    else:
-        last_fragments = [b''] * n
-    yield last_fragments
+            last_fragments = [b''] * n
+        yield last_fragments
+    finally:
+        _kill_all(pending)
 
 
 class EcChunkWriter(object):
@@ -569,7 +1031,8 @@ class EcChunkWriter(object):
         with green.ConnectionTimeout(
                 connection_timeout or io.CONNECTION_TIMEOUT):
             conn = io.http_connect(
-                parsed.netloc, 'PUT', parsed.path, hdrs)
+                parsed.netloc, 'PUT', parsed.path, hdrs,
+                pool=kwargs.get('rawx_pool'))
             conn.chunk = chunk
         return cls(chunk, conn, write_timeout=write_timeout, **kwargs)
 
@@ -585,11 +1048,9 @@ class EcChunkWriter(object):
             # use HTTP transfer encoding chunked
             # to write data to RAWX
             if not self.failed:
-                # format the chunk
-                to_send = b"%x\r\n%s\r\n" % (len(data), data)
                 try:
                     with green.ChunkWriteTimeout(self.write_timeout):
-                        self.conn.send(to_send)
+                        send_chunk(self.conn, data)
                         self.bytes_transferred += len(data)
                 except (Exception, green.ChunkWriteTimeout) as exc:
                     self.failed = True
@@ -658,6 +1119,10 @@ class EcMetachunkWriter(io.MetachunkWriter):
         self.connection_timeout = connection_timeout or io.CONNECTION_TIMEOUT
         self.write_timeout = write_timeout or io.CHUNK_TIMEOUT
         self.read_timeout = read_timeout or io.CLIENT_TIMEOUT
+        self.rawx_pool = kwargs.get('rawx_pool')
+        self.codec = ECCodec(storage_method,
+                             executor=kwargs.get('ec_codec_executor'),
+                             perfdata=kwargs.get('perfdata'))
 
     def stream(self, source, size):
         writers = self._get_writers()
@@ -685,7 +1150,8 @@ class EcMetachunkWriter(io.MetachunkWriter):
         bytes_transferred = 0
 
         # create EC encoding generator
-        ec_stream = ec_encode(self.storage_method, len(self.meta_chunk))
+        ec_stream = ec_encode(self.storage_method, len(self.meta_chunk),
+                              codec=self.codec)
         # init generator
         ec_stream.send(None)
 
@@ -791,7 +1257,8 @@ class EcMetachunkWriter(io.MetachunkWriter):
                 chunk, self.sysmeta, self.reqid,
                 connection_timeout=self.connection_timeout,
                 write_timeout=self.write_timeout,
-                chunk_checksum_algo=self.chunk_checksum_algo)
+                chunk_checksum_algo=self.chunk_checksum_algo,
+                rawx_pool=self.rawx_pool)
             return writer, chunk
         except (Exception, Timeout) as exc:
             msg = str(exc)
@@ -825,11 +1292,16 @@ class EcMetachunkWriter(io.MetachunkWriter):
                         failed_chunks.append(writer.chunk)
                     else:
                         success_chunks.append(writer.chunk)
+                        if writer.conn.pool is not None:
+                            # Drain the response so the connection
+                            # is reusable
+                            resp.read()
                 else:
                     logger.error("Wrong status code from %s (%s) %s",
                                  writer.chunk, resp.status, resp.reason)
                     writer.chunk['error'] = 'resp: HTTP %s' % resp.status
                     failed_chunks.append(writer.chunk)
+                writer.conn.release()
             else:
                 failed_chunks.append(writer.chunk)
 
@@ -868,14 +1340,52 @@ class ECWriteHandler(io.WriteHandler):
     """
     Handles writes to an EC content.
     For initialization parameters, see oio.api.io.WriteHandler.
+
+    :keyword ec_codec_executor: how to run erasure code computations
+    :type ec_codec_executor: `CodecExecutor`
+    :keyword perfdata: optional `dict` that will be filled with
+        the time spent encoding
     """
 
-    def stream(self):
-        # the checksum context for the content
-        global_checksum = hashlib.md5()
-        total_bytes_transferred = 0
+    def __init__(self, *args, **kwargs):
+        super(ECWriteHandler, self).__init__(*args, **kwargs)
+        self.ec_codec_executor = kwargs.get('ec_codec_executor')
+        self.perfdata = kwargs.get('perfdata')
+
+    def _metachunk_writer(self, meta_chunk, global_checksum):
+        return EcMetachunkWriter(
+            self.sysmeta, meta_chunk,
+            global_checksum, self.storage_method,
+            reqid=self.headers.get('X-oio-req-id'),
+            connection_timeout=self.connection_timeout,
+            write_timeout=self.write_timeout,
+            read_timeout=self.read_timeout,
+            chunk_checksum_algo=self.chunk_checksum_algo,
+            rawx_pool=self.rawx_pool,
+            ec_codec_executor=self.ec_codec_executor,
+            perfdata=self.perfdata)
+
+    @staticmethod
+    def _uploaded_chunks(chunks, checksum, bytes_transferred):
         content_chunks = []
+        # chunks checksum is the metachunk hash
+        # chunks size is the metachunk size
+        for chunk in chunks:
+            chunk['hash'] = checksum
+            chunk['size'] = bytes_transferred
+            # add the chunks whose upload succeeded
+            # to the content chunk list
+            if not chunk.get('error'):
+                content_chunks.append(chunk)
+        return content_chunks
+
+    def _write_metachunk(self, meta_chunk, source, size):
+        handler = self._metachunk_writer(meta_chunk, io.NullChecksum())
+        bytes_transferred, checksum, chunks = handler.stream(source, size)
+        return bytes_transferred, self._uploaded_chunks(
+            chunks, checksum, bytes_transferred)
 
+    def stream(self):
         # the platform chunk size
         chunk_size = self.sysmeta['chunk_size']
 
@@ -883,6 +1393,14 @@ class ECWriteHandler(io.WriteHandler):
         max_size = self.storage_method.ec_nb_data * chunk_size
         max_size = max_size - max_size % self.storage_method.ec_segment_size
 
+        if self.metachunks_in_flight > 1:
+            return self.pipelined_stream(max_size, self._write_metachunk)
+
+        # the checksum context for the content
+        global_checksum = hashlib.md5()
+        total_bytes_transferred = 0
+        content_chunks = []
+
         # meta chunks:
         #
         # {0: [{"url": "http://...", "pos": "0.0"},
@@ -894,26 +1412,11 @@ class ECWriteHandler(io.WriteHandler):
         # iterate through the meta chunks
         bytes_transferred = -1
         for meta_chunk in self.chunk_prep():
-            handler = EcMetachunkWriter(
-                self.sysmeta, meta_chunk,
-                global_checksum, self.storage_method,
-                reqid=self.headers.get('X-oio-req-id'),
-                connection_timeout=self.connection_timeout,
-                write_timeout=self.write_timeout,
-                read_timeout=self.read_timeout,
-                chunk_checksum_algo=self.chunk_checksum_algo)
+            handler = self._metachunk_writer(meta_chunk, global_checksum)
             bytes_transferred, checksum, chunks = handler.stream(self.source,
                                                                  max_size)
-
-            # chunks checksum is the metachunk hash
-            # chunks size is the metachunk size
-            for chunk in chunks:
-                chunk['hash'] = checksum
-                chunk['size'] = bytes_transferred
-                # add the chunks whose upload succeeded
-                # to the content chunk list
-                if not chunk.get('error'):
-                    content_chunks.append(chunk)
+            content_chunks += self._uploaded_chunks(
+                chunks, checksum, bytes_transferred)
 
             total_bytes_transferred += bytes_transferred
             if bytes_transferred < max_size:
@@ -930,12 +1433,16 @@ class ECWriteHandler(io.WriteHandler):
 class ECRebuildHandler(object):
     def __init__(self, meta_chunk, missing, storage_method,
                  connection_timeout=None, read_timeout=None,
-                 **_kwargs):
+                 **kwargs):
         self.meta_chunk = meta_chunk
         self.missing = missing
         self.storage_method = storage_method
         self.connection_timeout = connection_timeout or io.CONNECTION_TIMEOUT
         self.read_timeout = read_timeout or io.CHUNK_TIMEOUT
+        self.rawx_pool = kwargs.get('rawx_pool')
+        self.codec = ECCodec(storage_method,
+                             executor=kwargs.get('ec_codec_executor'),
+                             perfdata=kwargs.get('perfdata'))
 
     def _get_response(self, chunk, headers):
         resp = None
@@ -943,13 +1450,16 @@ class ECRebuildHandler(object):
         try:
             with green.ConnectionTimeout(self.connection_timeout):
                 conn = io.http_connect(
-                    parsed.netloc, 'GET', parsed.path, headers)
+                    parsed.netloc, 'GET', parsed.path, headers,
+                    pool=self.rawx_pool)
 
             with Timeout(self.read_timeout):
                 resp = conn.getresponse()
+                resp.conn = conn
             if resp.status != 200:
                 logger.warning('Invalid GET response from %s: %s %s',
                                chunk, resp.status, resp.reason)
+                io.close_source(resp)
                 resp = None
         except (Exception, Timeout):
             logger.exception('ERROR fetching %s', chunk)
@@ -1007,8 +1517,10 @@ class ECRebuildHandler(object):
                     break
                 rebuilt_frag = self._reconstruct(frag)
                 yield rebuilt_frag
+            for resp in resps:
+                io.close_source(resp)
 
         return frag_iter()
 
     def _reconstruct(self, frag):
-        return self.storage_method.driver.reconstruct(frag, [self.missing])[0]
+        return self.codec.reconstruct(frag, [self.missing])[0]
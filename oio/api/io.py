@@ -14,20 +14,25 @@
 # License along with this library.
 
 from __future__ import absolute_import
+from collections import deque
 from io import BufferedReader, RawIOBase, IOBase
+import hashlib
 import itertools
 import logging
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
+import eventlet
 from eventlet import sleep, Timeout
+from eventlet.queue import Empty, LightQueue
+from eventlet.semaphore import Semaphore
 from oio.common import exceptions as exc
 from oio.common.http import parse_content_type,\
     parse_content_range, ranges_from_http_header, http_header_from_ranges
 from oio.common.http_eventlet import http_connect
 from oio.common.utils import GeneratorIO, group_chunk_errors, \
-    deadline_to_timeout
+    deadline_to_timeout, monotonic_time
 from oio.common import green
 from oio.common.storage_method import STORAGE_METHODS
 
@@ -45,10 +50,17 @@ CLIENT_TIMEOUT = 60.0
 
 PUT_QUEUE_DEPTH = 10
 
+# Maximum number of metachunks to ask for in a content/prepare request
+PREPARE_BATCH_SIZE = 16
+
 
 def close_source(source):
+    """
+    Close the connection of a response, or give it back to its pool
+    if the response has been read completely.
+    """
     try:
-        source.conn.close()
+        source.conn.release()
     except Exception:
         pass
 
@@ -77,12 +89,39 @@ class IOBaseWrapper(RawIOBase):
         return len(read_data)
 
 
+class NullChecksum(object):
+    """Checksum object that ignores the data."""
+
+    def update(self, *_args, **_kwargs):
+        pass
+
+
+class MetachunkBuffer(object):
+    """
+    Data of a metachunk read ahead from the source of an upload,
+    exposed as a source for a metachunk writer.
+    Blocks are released as they are read.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = deque(blocks)
+
+    def read(self, size=-1):
+        if not self.blocks:
+            return b''
+        block = self.blocks.popleft()
+        if 0 <= size < len(block):
+            self.blocks.appendleft(block[size:])
+            block = block[:size]
+        return block
+
+
 class WriteHandler(object):
     def __init__(self, source, sysmeta, chunk_preparer,
                  storage_method, headers=None,
                  connection_timeout=None, write_timeout=None,
                  read_timeout=None, deadline=None, chunk_checksum_algo='md5',
-                 **_kwargs):
+                 **kwargs):
         """
         :param connection_timeout: timeout to establish the connection
         :param write_timeout: timeout to send a buffer of data
@@ -90,6 +129,13 @@ class WriteHandler(object):
         :param chunk_checksum_algo: algorithm to use to compute chunk
             checksums locally. Can be `None` to disable local checksum
             computation and let the rawx compute it (will be md5).
+        :keyword rawx_pool: pool of keep-alive connections to rawx services
+        :type rawx_pool: `oio.common.http_eventlet.ConnectionPool`
+        :keyword metachunks_in_flight: maximum number of metachunks
+            uploaded at the same time. When greater than 1, metachunks
+            are read ahead from the source and kept in memory until
+            their upload is finished.
+        :type metachunks_in_flight: `int`
         """
         if isinstance(source, IOBase):
             self.source = BufferedReader(source)
@@ -110,6 +156,9 @@ class WriteHandler(object):
         self._read_timeout = read_timeout or CLIENT_TIMEOUT
         self._write_timeout = write_timeout or CHUNK_TIMEOUT
         self.chunk_checksum_algo = chunk_checksum_algo
+        self.rawx_pool = kwargs.get('rawx_pool')
+        self.metachunks_in_flight = int(
+            kwargs.get('metachunks_in_flight') or 1)
 
     @property
     def read_timeout(self):
@@ -135,6 +184,91 @@ class WriteHandler(object):
         """
         raise NotImplementedError()
 
+    def _read_metachunk(self, size, checksum):
+        """
+        Read up to `size` bytes from the source, and update `checksum`.
+
+        :returns: a tuple with a `MetachunkBuffer` and the number
+            of bytes read
+        """
+        blocks = []
+        remaining = size
+        try:
+            while remaining > 0:
+                with green.SourceReadTimeout(self.read_timeout):
+                    try:
+                        data = self.source.read(
+                            min(WRITE_CHUNK_SIZE, remaining))
+                    except (ValueError, IOError) as err:
+                        raise exc.SourceReadError(str(err))
+                if not data:
+                    break
+                checksum.update(data)
+                blocks.append(data)
+                remaining -= len(data)
+        except green.SourceReadTimeout as err:
+            logger.warn('Source read timeout (%s)', err)
+            raise exc.SourceReadTimeout(err)
+        return MetachunkBuffer(blocks), size - remaining
+
+    def pipelined_stream(self, size, write_metachunk):
+        """
+        Upload up to `metachunks_in_flight` metachunks at the same time,
+        so the upload of a metachunk does not wait for the responses
+        of the previous one. At most `metachunks_in_flight` x `size`
+        bytes of data are kept in memory.
+
+        :param size: maximum size of a metachunk
+        :param write_metachunk: function uploading a metachunk. It is
+            called with the metachunk, a source and the size of the data
+            to read from it, and returns the number of bytes transferred
+            and the list of chunks to be saved in the container.
+        :returns: same as `stream()`
+        """
+        # The data is read in order, the content checksum is computed
+        # while reading.
+        global_checksum = hashlib.md5()
+        slots = Semaphore(self.metachunks_in_flight)
+        errors = []
+        uploads = []
+
+        def _upload(meta_chunk, source, length):
+            try:
+                return write_metachunk(meta_chunk, source, length)
+            except Exception as err:
+                errors.append(err)
+                return err
+            finally:
+                slots.release()
+
+        try:
+            for meta_chunk in self.chunk_prep():
+                slots.acquire()
+                if errors:
+                    raise errors[0]
+                source, length = self._read_metachunk(size, global_checksum)
+                uploads.append(
+                    eventlet.spawn(_upload, meta_chunk, source, length))
+                if length < size or len(self.source.peek()) == 0:
+                    break
+
+            content_chunks = []
+            total_bytes_transferred = 0
+            for upload in uploads:
+                res = upload.wait()
+                if isinstance(res, Exception):
+                    raise res
+                bytes_transferred, chunks = res
+                content_chunks += chunks
+                total_bytes_transferred += bytes_transferred
+        except BaseException:
+            for upload in uploads:
+                upload.kill()
+            raise
+
+        return (content_chunks, total_bytes_transferred,
+                global_checksum.hexdigest())
+
 
 def consume(it):
     for _x in it:
@@ -190,6 +324,172 @@ def discard_bytes(buf_size, start):
     return (buf_size - (start % buf_size)) % buf_size
 
 
+class RecordBuffer(object):
+    """
+    Receive buffer yielding fixed-size records.
+
+    Pieces of data read from the source are queued as they are, and are
+    only copied when a record is extracted. A record made of a whole piece
+    is yielded without any copy, a record spanning several pieces is
+    joined once. Pending bytes are never copied again when new data
+    arrives, whatever the record size.
+    """
+
+    def __init__(self, record_size=None, read_size=READ_CHUNK_SIZE):
+        """
+        :param record_size: size of the records to yield, `None` to
+            yield whatever has been read
+        :param read_size: maximum number of bytes to read at once
+        """
+        self.record_size = record_size
+        self.read_size = read_size
+        self._pieces = deque()
+        # offset of the first pending byte in the first piece
+        self._offset = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        """Drop all pending bytes."""
+        self._pieces.clear()
+        self._offset = 0
+        self._size = 0
+
+    def fill(self, source):
+        """
+        Read at most `read_size` bytes from `source` into the buffer.
+
+        :returns: the number of bytes read, 0 at end of stream
+        """
+        data = source.read(self.read_size)
+        if data:
+            self._pieces.append(data)
+            self._size += len(data)
+        return len(data)
+
+    def _take(self, size):
+        """Extract `size` bytes (at most one copy)."""
+        if not size:
+            return b''
+        self._size -= size
+        piece = self._pieces[0]
+        start = self._offset
+        end = start + size
+        if end < len(piece):
+            self._offset = end
+            return piece[start:end]
+        self._pieces.popleft()
+        self._offset = 0
+        if end == len(piece):
+            # records aligned on reads are not copied at all
+            return piece[start:] if start else piece
+        # the record spans several pieces: join them
+        parts = [piece[start:]]
+        size = end - len(piece)
+        while size:
+            piece = self._pieces[0]
+            if size < len(piece):
+                parts.append(piece[:size])
+                self._offset = size
+                break
+            parts.append(self._pieces.popleft())
+            size -= len(piece)
+        return b''.join(parts)
+
+    def discard(self, size):
+        """
+        Drop at most `size` pending bytes.
+
+        :returns: the number of bytes actually dropped
+        """
+        size = min(size, self._size)
+        self._size -= size
+        remaining = size
+        while remaining:
+            avail = len(self._pieces[0]) - self._offset
+            if remaining < avail:
+                self._offset += remaining
+                break
+            self._pieces.popleft()
+            self._offset = 0
+            remaining -= avail
+        return size
+
+    def records(self):
+        """
+        Yield complete records (or all pending bytes if `record_size`
+        is `None`).
+        """
+        if self.record_size is None:
+            if self._size:
+                yield self.flush()
+            return
+        record_size = self.record_size
+        while self._size >= record_size:
+            yield self._take(record_size)
+
+    def flush(self):
+        """Extract all pending bytes."""
+        return self._take(self._size)
+
+
+class HedgingPolicy(object):
+    """
+    Tell how long to wait for the response of a rawx service before
+    sending an extra request to another chunk (another replica,
+    or a parity fragment). The first valid responses win.
+
+    :param delay: fixed delay before sending an extra request, in seconds.
+        `None` disables hedging (until `percentile` gives a delay).
+    :param percentile: if set, send an extra request when the response
+        time goes beyond this percentile (e.g. 95) of the recently
+        observed response times. `delay` is used until enough response
+        times have been observed. The requests cancelled because another
+        one won are counted with the time they have been waiting
+        (a lower bound of their response time), otherwise only
+        the fastest responses would be observed, and the delay
+        would keep decreasing.
+    :param window: number of response times to keep
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, delay=None, percentile=None, window=1000):
+        self.delay = delay
+        self.percentile = percentile
+        self.samples = deque(maxlen=window)
+        self._recorded = 0
+
+    def record(self, duration):
+        """
+        Record the response time of a request, or the time a cancelled
+        request has been waiting.
+        """
+        if self.percentile is None:
+            return
+        self.samples.append(duration)
+        self._recorded += 1
+        # Do not sort the samples for each request
+        if self._recorded % self.MIN_SAMPLES == 0:
+            ordered = sorted(self.samples)
+            index = int(len(ordered) * self.percentile / 100.0)
+            self.delay = ordered[min(index, len(ordered) - 1)]
+
+
+def hedging_stats(perfdata, hedged, wins):
+    """
+    Count in `perfdata` the extra requests sent because of a hedging
+    policy, and how many of their responses have been used.
+    """
+    if perfdata is None or not hedged:
+        return
+    perfdata['hedged_requests'] = \
+        perfdata.get('hedged_requests', 0) + hedged
+    perfdata['hedged_wins'] = perfdata.get('hedged_wins', 0) + wins
+
+
 class ChunkReader(object):
     """
     Reads a chunk.
@@ -197,7 +497,7 @@ class ChunkReader(object):
 
     def __init__(self, chunk_iter, buf_size, headers,
                  connection_timeout=None, read_timeout=None,
-                 align=False, **_kwargs):
+                 align=False, **kwargs):
         """
         :param chunk_iter:
         :param buf_size: size of the read buffer
@@ -206,6 +506,13 @@ class ChunkReader(object):
         :param read_timeout: timeout to read a buffer of data
         :param align: if True, the reader will skip some bytes to align
                       on `buf_size`
+        :keyword rawx_pool: pool of keep-alive connections to rawx services
+        :type rawx_pool: `oio.common.http_eventlet.ConnectionPool`
+        :keyword hedging: when to send requests to other chunks
+            while waiting for the response of a chunk
+        :type hedging: `HedgingPolicy`
+        :keyword perfdata: optional `dict` that will be filled with
+            hedging counters
         """
         self.chunk_iter = chunk_iter
         self.source = None
@@ -220,6 +527,9 @@ class ChunkReader(object):
         self.align = align
         self.connection_timeout = connection_timeout or CONNECTION_TIMEOUT
         self.read_timeout = read_timeout or CHUNK_TIMEOUT
+        self.rawx_pool = kwargs.get('rawx_pool')
+        self.hedging = kwargs.get('hedging')
+        self.perfdata = kwargs.get('perfdata')
         self._resp_by_chunk = dict()
 
     @property
@@ -278,14 +588,29 @@ class ChunkReader(object):
         Save the response object in `self.sources` list.
         """
         try:
+            start = monotonic_time()
+            raw_url = chunk["url"]
+            parsed = urlparse(raw_url)
             with green.ConnectionTimeout(self.connection_timeout):
-                raw_url = chunk["url"]
-                parsed = urlparse(raw_url)
                 conn = http_connect(parsed.netloc, 'GET', parsed.path,
-                                    self.request_headers)
-            with green.OioTimeout(self.read_timeout):
-                source = conn.getresponse()
-                source.conn = conn
+                                    self.request_headers,
+                                    pool=self.rawx_pool)
+            try:
+                with green.OioTimeout(self.read_timeout):
+                    source = conn.getresponse()
+            except Exception:
+                if not conn.reused:
+                    raise
+                # The connection came from the pool and has been closed
+                # by the server: retry once.
+                conn.close()
+                with green.ConnectionTimeout(self.connection_timeout):
+                    conn = http_connect(parsed.netloc, 'GET', parsed.path,
+                                        self.request_headers,
+                                        pool=self.rawx_pool)
+                with green.OioTimeout(self.read_timeout):
+                    source = conn.getresponse()
+            source.conn = conn
         except (Exception, Timeout) as error:
             logger.exception('Connection failed to %s (reqid=%s)',
                              chunk, self.reqid)
@@ -293,6 +618,8 @@ class ChunkReader(object):
             return False
 
         if source.status in (200, 206):
+            if self.hedging is not None:
+                self.hedging.record(monotonic_time() - start)
             self.status = source.status
             self._headers = source.getheaders()
             self.sources.append((source, chunk))
@@ -309,6 +636,9 @@ class ChunkReader(object):
         Iterate on chunks until one answers,
         and return the response object.
         """
+        if self.hedging is not None and self.hedging.delay is not None:
+            return self._get_source_hedged(self.hedging.delay)
+
         for chunk in self.chunk_iter:
             # continue to iterate until we find a valid source
             if self._get_request(chunk):
@@ -319,9 +649,71 @@ class ChunkReader(object):
             return source, chunk
         return None, None
 
+    def _get_source_hedged(self, delay):
+        """
+        Like `_get_source`, but when a chunk does not answer within
+        `delay` seconds, send a request to the next chunk too.
+        The first valid response wins, the other requests are cancelled.
+        """
+        results = LightQueue()
+        # Start time of the requests still running, by chunk URL
+        pending = dict()
+
+        def _request(chunk_):
+            result = self._get_request(chunk_)
+            pending.pop(chunk_['url'], None)
+            results.put((chunk_, result))
+
+        requests = []
+        hedged = []
+        running = 0
+        winner = None
+        chunk = next(self.chunk_iter, None)
+        while chunk is not None or running:
+            if chunk is not None:
+                pending[chunk['url']] = monotonic_time()
+                requests.append(eventlet.spawn(_request, chunk))
+                running += 1
+                chunk = None
+            try:
+                done, valid = results.get(timeout=delay)
+            except Empty:
+                chunk = next(self.chunk_iter, None)
+                if chunk is not None:
+                    hedged.append(chunk)
+                continue
+            running -= 1
+            if valid:
+                winner = done
+                break
+            # Invalid response, try the next chunk right now
+            chunk = next(self.chunk_iter, None)
+
+        for request in requests:
+            request.kill()
+        # The cancelled requests would have answered later than now
+        now = monotonic_time()
+        for started in pending.values():
+            self.hedging.record(now - started)
+        # Close the valid responses which arrived too late
+        for source, chunk in self.sources:
+            if chunk is not winner:
+                close_source(source)
+        self.sources = [(source, chunk) for source, chunk in self.sources
+                        if chunk is winner]
+        hedging_stats(self.perfdata, len(hedged),
+                      int(any(chunk is winner for chunk in hedged)))
+
+        if self.sources:
+            return self.sources.pop()
+        return None, None
+
     def get_iter(self):
         source, chunk = self._get_source()
         if source:
+            # Keep the first response, to be able to close it
+            # if the iterator is never used
+            self.source = source
             return self._get_iter(chunk, source)
         errors = group_chunk_errors(self._resp_by_chunk.items())
         if len(errors) == 1:
@@ -394,13 +786,12 @@ class ChunkReader(object):
     def iter_from_resp(self, source, parts_iter, part, chunk):
         bytes_consumed = 0
         count = 0
-        buf = b''
+        buf = RecordBuffer(self.buf_size)
         while True:
             try:
                 with green.ChunkReadTimeout(self.read_timeout):
-                    data = part.read(READ_CHUNK_SIZE)
+                    read = buf.fill(part)
                     count += 1
-                    buf += data
             except green.ChunkReadTimeout as crto:
                 try:
                     self.recover(bytes_consumed)
@@ -409,7 +800,7 @@ class ChunkReader(object):
                 except exc.EmptyByteRange:
                     # we are done already
                     break
-                buf = b''
+                buf.clear()
                 # find a new source to perform recovery
                 new_source, new_chunk = self._get_source()
                 if new_source:
@@ -437,36 +828,25 @@ class ChunkReader(object):
                     raise
             else:
                 # discard bytes
-                if buf and self.discard_bytes:
-                    if self.discard_bytes < len(buf):
-                        buf = buf[self.discard_bytes:]
-                        bytes_consumed += self.discard_bytes
-                        self.discard_bytes = 0
-                    else:
-                        self.discard_bytes -= len(buf)
-                        bytes_consumed += len(buf)
-                        buf = b''
+                if self.discard_bytes:
+                    discarded = buf.discard(self.discard_bytes)
+                    self.discard_bytes -= discarded
+                    bytes_consumed += discarded
 
                 # no data returned
                 # flush out buffer
-                if not data:
-                    if buf:
-                        bytes_consumed += len(buf)
-                        yield buf
-                    buf = b''
+                if not read:
+                    data = buf.flush()
+                    if data:
+                        bytes_consumed += len(data)
+                        yield data
                     break
 
-                # If buf_size is defined, yield bounded data buffers
-                if self.buf_size is not None:
-                    while len(buf) >= self.buf_size:
-                        read_d = buf[:self.buf_size]
-                        buf = buf[self.buf_size:]
-                        yield read_d
-                        bytes_consumed += len(read_d)
-                else:
-                    yield buf
-                    bytes_consumed += len(buf)
-                    buf = b''
+                # If buf_size is defined, yield bounded data buffers,
+                # else yield everything we have.
+                for data in buf.records():
+                    yield data
+                    bytes_consumed += len(data)
 
                 # avoid starvation by forcing sleep()
                 # every once in a while
@@ -581,25 +961,93 @@ class MetachunkWriter(object):
 
 
 class MetachunkPreparer(object):
-    """Get metadata for a new object and continuously yield new metachunks."""
+    """
+    Get metadata for a new object and continuously yield new metachunks.
+
+    Chunk locations are asked to the proxy by batches of metachunks.
+    When the length of the content is known, the first request asks for
+    all of them. Otherwise the size of the batches doubles each time
+    (up to `prepare_batch_size`), and the next batch is fetched in the
+    background while the last metachunk of the current one is uploaded.
+    """
 
     def __init__(self, container_client, account, container, obj_name,
-                 policy=None, **kwargs):
+                 policy=None, content_length=None,
+                 prepare_batch_size=PREPARE_BATCH_SIZE, **kwargs):
+        """
+        :param content_length: length of the content, if known
+        :param prepare_batch_size: maximum number of metachunks
+            to ask for at once (after the first request)
+        """
         self.account = account
         self.container = container
         self.obj_name = obj_name
         self.policy = policy
         self.container_client = container_client
+        self.content_length = content_length
+        self.prepare_batch_size = max(1, int(prepare_batch_size))
         self.extra_kwargs = kwargs
 
-        # TODO: optimize by asking more than one metachunk at a time
-        self.obj_meta, self.first_body = self.container_client.content_prepare(
-            account, container, obj_name, size=1, stgpol=policy,
+        if content_length:
+            first_size = content_length
+        else:
+            first_size = 1
+        self.obj_meta, first_body = self.container_client.content_prepare(
+            account, container, obj_name, size=first_size, stgpol=policy,
             autocreate=True, **kwargs)
         self.stg_method = STORAGE_METHODS.load(self.obj_meta['chunk_method'])
+        self._ready = deque(self._split_body(first_body))
+        self.first_body = self._ready[0]
+        self._batch = len(self._ready)
+        self._prefetch = None
+        self.stats = {'requests': 1, 'prefetched': 0}
 
         self._all_chunks = list()
 
+    @property
+    def metachunk_size(self):
+        """Amount of data the proxy expects in each metachunk."""
+        chunk_size = int(self.obj_meta.get('chunk_size') or 1)
+        if self.stg_method.ec:
+            return chunk_size * self.stg_method.ec_nb_data
+        return chunk_size
+
+    def _split_body(self, body):
+        """Split the chunks returned by the proxy into metachunks."""
+        by_pos = dict()
+        for chunk in body:
+            by_pos.setdefault(int(chunk['pos'].split('.')[0]),
+                              list()).append(chunk)
+        return [by_pos[pos] for pos in sorted(by_pos)]
+
+    def _fetch(self, count):
+        _, body = self.container_client.content_prepare(
+            self.account, self.container, self.obj_name,
+            count * self.metachunk_size,
+            stgpol=self.policy, autocreate=True, **self.extra_kwargs)
+        return self._split_body(body)
+
+    def _next_batch_size(self, count):
+        """
+        :param count: number of metachunks already received
+        """
+        if self.content_length:
+            expected = -(-self.content_length // self.metachunk_size)
+            if expected > count:
+                return min(expected - count, self.prepare_batch_size)
+        self._batch = min(self._batch * 2, self.prepare_batch_size)
+        return self._batch
+
+    def _expect_more(self, count):
+        """
+        Tell if we are sure that the upload will need more than
+        `count` metachunks.
+        """
+        if not self.content_length:
+            # The first metachunk was not enough, bet on a large object
+            return count > 1
+        return count * self.metachunk_size < self.content_length
+
     def _fix_mc_pos(self, chunks, mc_pos):
         for chunk in chunks:
             raw_pos = chunk['pos'].split('.')
@@ -611,17 +1059,38 @@ class MetachunkPreparer(object):
 
     def __call__(self):
         mc_pos = self.extra_kwargs.get('meta_pos', 0)
-        self._fix_mc_pos(self.first_body, mc_pos)
-        self._all_chunks.extend(self.first_body)
-        yield self.first_body
-        while True:
-            mc_pos += 1
-            _, next_body = self.container_client.content_prepare(
-                    self.account, self.container, self.obj_name, 1,
-                    stgpol=self.policy, autocreate=True, **self.extra_kwargs)
-            self._fix_mc_pos(next_body, mc_pos)
-            self._all_chunks.extend(next_body)
-            yield next_body
+        received = len(self._ready)
+        count = 0
+        try:
+            while True:
+                if not self._ready:
+                    if self._prefetch is not None:
+                        batch = self._prefetch.wait()
+                        self._prefetch = None
+                    else:
+                        batch = self._fetch(self._next_batch_size(received))
+                        self.stats['requests'] += 1
+                    received += len(batch)
+                    self._ready.extend(batch)
+                body = self._ready.popleft()
+                count += 1
+                self._fix_mc_pos(body, mc_pos)
+                self._all_chunks.extend(body)
+                if not self._ready and self._expect_more(count):
+                    # Fetch the next batch while this one is uploaded
+                    self._prefetch = eventlet.spawn(
+                        self._fetch, self._next_batch_size(received))
+                    self.stats['requests'] += 1
+                    self.stats['prefetched'] += 1
+                yield body
+                mc_pos += 1
+        finally:
+            if self._prefetch is not None:
+                self._prefetch.kill()
+                self._prefetch = None
+            # Unused chunk locations have not been created on any rawx,
+            # just forget them.
+            self._ready.clear()
 
     def all_chunks_so_far(self):
         """Get the list of all chunks yielded so far."""
@@ -18,26 +18,33 @@ from __future__ import absolute_import
 from six import string_types
 
 from io import BytesIO
+from collections import defaultdict, deque
 from functools import wraps, partial
 import os
+import stat
 import warnings
 import time
 import random
 
 try:
-    from urllib.parse import quote_plus, unquote_plus
+    from urllib.parse import quote_plus, unquote_plus, urlparse
 except ImportError:
     from urllib import quote_plus, unquote_plus
+    from urlparse import urlparse
+
+import eventlet
+from eventlet import Semaphore
 
 from oio.common import exceptions as exc
-from oio.api.ec import ECWriteHandler
-from oio.api.io import MetachunkPreparer
+from oio.api.ec import ECWriteHandler, CodecExecutor
+from oio.api.io import HedgingPolicy, MetachunkPreparer
 from oio.api.replication import ReplicatedWriteHandler
 from oio.api.backblaze_http import BackblazeUtilsException, BackblazeUtils
 from oio.api.backblaze import BackblazeWriteHandler, \
     BackblazeChunkDownloadHandler
-from oio.common.utils import cid_from_name, GeneratorIO, monotonic_time
-from oio.common.easy_value import float_value, true_value
+from oio.common.utils import cid_from_name, GeneratorIO, \
+    monotonic_time
+from oio.common.easy_value import float_value, int_value, true_value
 from oio.common.logger import get_logger
 from oio.common.decorators import ensure_headers, ensure_request_id
 from oio.common.storage_method import STORAGE_METHODS
@@ -45,7 +52,29 @@ from oio.common.constants import OIO_VERSION, CHUNK_HEADERS, HEADER_PREFIX
 from oio.common.decorators import handle_account_not_found, \
     handle_container_not_found, handle_object_not_found
 from oio.common.storage_functions import _sort_chunks, fetch_stream, \
-    fetch_stream_ec
+    fetch_stream_ec, fetch_stream_parallel, DOWNLOAD_SEGMENT_SIZE
+
+SNAPSHOT_CONCURRENCY = 10
+SNAPSHOT_LINKS_PER_HOST = 4
+SNAPSHOT_REPORT_INTERVAL = 10.0
+
+
+def _source_length(source):
+    """
+    Get the number of bytes that remain to be read from `source`,
+    or `None` if it cannot be known in advance.
+    """
+    try:
+        if isinstance(source, BytesIO):
+            length = len(source.getvalue()) - source.tell()
+        else:
+            stats = os.fstat(source.fileno())
+            if not stat.S_ISREG(stats.st_mode):
+                return None
+            length = stats.st_size - source.tell()
+    except Exception:
+        return None
+    return length if length > 0 else None
 
 
 # TODO(FVE): decorate more methods
@@ -78,7 +107,10 @@ class ObjectStorageApi(object):
         - `write_timeout`: `float`
     """
     TIMEOUT_KEYS = ('connection_timeout', 'read_timeout', 'write_timeout')
-    EXTRA_KEYWORDS = ('chunk_checksum_algo')
+    EXTRA_KEYWORDS = ('chunk_checksum_algo', 'rawx_pool',
+                      'prepare_batch_size', 'ec_codec_executor',
+                      'metachunks_in_flight', 'download_concurrency',
+                      'download_segment_size', 'hedging')
 
     def __init__(self, namespace, logger=None, **kwargs):
         """
@@ -100,6 +132,49 @@ class ObjectStorageApi(object):
         :type pool_manager: `urllib3.PoolManager`
         :keyword chunk_checksum_algo: algorithm to use for chunk checksums.
             Only 'md5' and `None` are supported at the moment.
+        :keyword rawx_pool: a pool of keep-alive connections that will be
+            used for chunk uploads and downloads
+        :type rawx_pool: `oio.common.http_eventlet.ConnectionPool`
+        :keyword prepare_batch_size: maximum number of metachunks to
+            allocate at once when uploading objects of unknown length
+        :type prepare_batch_size: `int`
+        :keyword ec_codec_processes: number of child processes computing
+            erasure codes, 0 to compute them in the calling greenthread
+        :type ec_codec_processes: `int`
+        :keyword ec_codec_queue_depth: number of segments each EC upload
+            or download keeps in flight when erasure codes are computed
+            in child processes
+        :type ec_codec_queue_depth: `int`
+        :keyword metachunks_in_flight: maximum number of metachunks
+            uploaded at the same time by `object_create`. Each of them is
+            kept in memory until its upload is finished.
+        :type metachunks_in_flight: `int`
+        :keyword download_concurrency: number of ranges of replicated
+            objects downloaded at the same time by `object_fetch`
+        :type download_concurrency: `int`
+        :keyword download_segment_size: size of the ranges downloaded
+            at the same time
+        :type download_segment_size: `int`
+        :keyword hedge_delay: when downloading, time to wait for the
+            response of a rawx service before sending a request to another
+            replica or to a parity fragment (disabled by default)
+        :type hedge_delay: `float` seconds
+        :keyword hedge_percentile: when downloading, send requests to
+            other replicas or parity fragments when the response time goes
+            beyond this percentile of the recent response times
+        :type hedge_percentile: `float`
+        :keyword content_cache_size: number of object descriptions
+            (metadata and chunks) kept in memory, to save requests to the
+            proxy when the same objects are read again and again
+            (disabled by default). Hits, misses and latencies are
+            counted in `perfdata`.
+        :type content_cache_size: `int`
+        :keyword content_cache_ttl: how long object descriptions are
+            kept in memory. Modifications done through this API are seen
+            immediately, modifications done by other clients are seen
+            after this delay, unless the events they emit are passed to
+            `self.container.content_cache_event()`.
+        :type content_cache_ttl: `float` seconds
         """
         self.namespace = namespace
         conf = {"namespace": self.namespace}
@@ -110,6 +185,19 @@ class ObjectStorageApi(object):
         for key in self.__class__.EXTRA_KEYWORDS:
             if key in kwargs:
                 self._global_kwargs[key] = kwargs[key]
+        # Codec processes started by this object, stopped by `close()`
+        self._codec_executor = None
+        if kwargs.get('ec_codec_processes') and \
+                'ec_codec_executor' not in self._global_kwargs:
+            self._codec_executor = CodecExecutor(
+                int_value(kwargs['ec_codec_processes'], 0),
+                int_value(kwargs.get('ec_codec_queue_depth'), None))
+            self._global_kwargs['ec_codec_executor'] = self._codec_executor
+        if (kwargs.get('hedge_delay') or kwargs.get('hedge_percentile')) \
+                and 'hedging' not in self._global_kwargs:
+            self._global_kwargs['hedging'] = HedgingPolicy(
+                float_value(kwargs.get('hedge_delay'), None),
+                float_value(kwargs.get('hedge_percentile'), None))
 
         from oio.account.client import AccountClient
         from oio.container.client import ContainerClient
@@ -139,6 +227,15 @@ class ObjectStorageApi(object):
                 connection_pool=connection_pool, perfdata=perfdata)
         return self._blob_client
 
+    def close(self):
+        """
+        Stop the erasure code processes started by this object
+        (see `ec_codec_processes`). Executors passed
+        with `ec_codec_executor` are left to their owner.
+        """
+        if self._codec_executor is not None:
+            self._codec_executor.close()
+
     # FIXME(FVE): this method should not exist
     # This high-level API should use lower-level APIs,
     # not do request directly to the proxy.
@@ -331,10 +428,16 @@ class ObjectStorageApi(object):
     @ensure_headers
     @ensure_request_id
     def container_snapshot(self, account, container, dst_account,
-                           dst_container, batch=100, **kwargs):
+                           dst_container, batch=100,
+                           concurrency=SNAPSHOT_CONCURRENCY,
+                           links_per_host=SNAPSHOT_LINKS_PER_HOST,
+                           marker=None, progress_callback=None, **kwargs):
         """
         Create a copy of the container (only the content of the database)
 
+        All versions of all objects are copied. The chunks of the copy
+        are hard links to the chunks of the target.
+
         :param account: account in which the target is
         :type account: `str`
         :param container: name of the target
@@ -343,42 +446,175 @@ class ObjectStorageApi(object):
         :type dst_account: `str`
         :param dst_container: name of the snapshot
         :type dst_container: `str`
-        """
+        :param batch: minimum number of chunks updated at once in the
+            snapshot (all versions of an object are updated at once)
+        :type batch: `int`
+        :param concurrency: number of objects whose chunks are linked
+            at the same time
+        :type concurrency: `int`
+        :param links_per_host: maximum number of chunks linked at the
+            same time on each rawx service
+        :type links_per_host: `int`
+        :param marker: resume an interrupted snapshot after this object
+            (the snapshot container must already exist)
+        :type marker: `str`
+        :param progress_callback: function called with a `dict` of
+            statistics ('objects', 'chunks', 'elapsed', 'rate' and
+            'marker') each time a batch of objects has been updated in
+            the snapshot. Passing 'marker' to this method will resume
+            the snapshot after this batch.
+        :returns: the statistics of the snapshot
+        :rtype: `dict`
+        :raises OioException: if an object has more versions than can
+            be listed at once. The versions of this object are not
+            in the snapshot, which must not be used.
+        """
+        batch = int_value(batch, 100)
         try:
             self.container.container_freeze(account, container, **kwargs)
-            self.container.container_snapshot(
-                account, container, dst_account, dst_container, **kwargs)
-            resp = self.object_list(dst_account, dst_container, **kwargs)
-            obj_gen = resp['objects']
-            target_beans = []
-            copy_beans = []
-            for obj in obj_gen:
-                data = self.object_locate(
-                    account, container, obj["name"], **kwargs)
-                chunks = [chunk['url'] for chunk in data[1]]
-                copies = self._generate_copies(chunks)
-                fullpath = self._generate_fullpath(
-                    dst_account, dst_container, obj['name'], obj['version'])
-                self._link_chunks(chunks, copies, fullpath[0], **kwargs)
-                t_beans, c_beans = self._prepare_meta2_raw_update(
-                    data[1], copies, obj['content'])
-                target_beans.extend(t_beans)
-                copy_beans.extend(c_beans)
-                if len(target_beans) > batch:
-                    self.container.container_raw_update(
-                        target_beans, copy_beans,
-                        dst_account, dst_container,
-                        frozen=True, **kwargs)
-                    target_beans = []
-                    copy_beans = []
-            if target_beans:
-                self.container.container_raw_update(
-                    target_beans, copy_beans,
-                    dst_account, dst_container,
-                    frozen=True, **kwargs)
+            if marker is None:
+                self.container.container_snapshot(
+                    account, container, dst_account, dst_container,
+                    **kwargs)
+            return self._snapshot_chunks(
+                dst_account, dst_container, batch, concurrency,
+                links_per_host, marker, progress_callback, **kwargs)
         finally:
             self.container.container_enable(account, container, **kwargs)
 
+    def _object_versions(self, account, container, name, **kwargs):
+        """
+        List all versions of one object.
+
+        :raises OioException: if they do not fit in one listing page
+        """
+        resp = self.object_list(account, container, prefix=name,
+                                versions=True, **kwargs)
+        if resp.get('truncated') and resp['objects'][-1]['name'] == name:
+            raise exc.OioException(
+                'Too many versions of %s/%s/%s to list them all' %
+                (account, container, name))
+        return [obj for obj in resp['objects'] if obj['name'] == name]
+
+    def _snapshot_listing(self, account, container, marker=None, **kwargs):
+        """
+        List all versions of all objects of a container.
+
+        meta2 lists the objects whose name comes after the marker, so a
+        page ending in the middle of the versions of an object would
+        make the next page skip the remaining ones: they are listed
+        apart before going on.
+        """
+        while True:
+            resp = self.object_list(account, container, marker=marker,
+                                    versions=True, **kwargs)
+            objects = resp['objects']
+            for obj in objects:
+                yield obj
+            if not resp.get('truncated') or not objects:
+                break
+            last_name = objects[-1]['name']
+            listed = set(obj['version'] for obj in objects
+                         if obj['name'] == last_name)
+            for obj in self._object_versions(account, container, last_name,
+                                             **kwargs):
+                if obj['version'] not in listed:
+                    yield obj
+            marker = last_name
+
+    def _snapshot_object(self, account, container, obj, link_limits,
+                         **kwargs):
+        """
+        Link the chunks of an object of a snapshot.
+
+        :returns: the object and the lists of original and
+            replacement chunk beans, or the exception that
+            prevented the links
+        """
+        try:
+            _, chunks = self.object_locate(
+                account, container, obj['name'], version=obj['version'],
+                properties=False, **kwargs)
+            targets = [chunk['url'] for chunk in chunks]
+            copies = self._generate_copies(targets)
+            fullpath = self._generate_fullpath(
+                account, container, obj['name'], obj['version'])
+            self._link_chunks(targets, copies, fullpath[0],
+                              link_limits=link_limits, **kwargs)
+            target_beans, copy_beans = self._prepare_meta2_raw_update(
+                chunks, copies, obj['content'])
+            return obj, target_beans, copy_beans
+        except Exception as err:
+            return err
+
+    def _snapshot_chunks(self, account, container, batch, concurrency,
+                         links_per_host, marker, progress_callback,
+                         **kwargs):
+        """
+        Replace the chunks of all objects of a snapshot by hard links.
+        """
+        link_limits = defaultdict(partial(Semaphore, links_per_host))
+        stats = {'objects': 0, 'chunks': 0, 'elapsed': 0.0, 'rate': 0.0,
+                 'marker': marker}
+        start = monotonic_time()
+        state = {'last_report': start, 'last_name': marker, 'objects': 0,
+                 'targets': list(), 'copies': list()}
+
+        def _flush():
+            self.container.container_raw_update(
+                state['targets'], state['copies'], account, container,
+                frozen=True, **kwargs)
+            stats['objects'] += state['objects']
+            stats['chunks'] += len(state['targets'])
+            stats['marker'] = state['last_name']
+            stats['elapsed'] = monotonic_time() - start
+            stats['rate'] = stats['objects'] / (stats['elapsed'] or 1.0)
+            state['targets'] = list()
+            state['copies'] = list()
+            state['objects'] = 0
+            if progress_callback:
+                progress_callback(dict(stats))
+            now = monotonic_time()
+            if now - state['last_report'] >= SNAPSHOT_REPORT_INTERVAL:
+                self.logger.info(
+                    'Snapshot %s/%s: %d objects, %d chunks '
+                    '(%.1f objects/s), marker=%s',
+                    account, container, stats['objects'], stats['chunks'],
+                    stats['rate'], stats['marker'])
+                state['last_report'] = now
+
+        def _collect(res):
+            if isinstance(res, Exception):
+                raise res
+            obj, t_beans, c_beans = res
+            # Never split the versions of an object, so the marker
+            # is always a safe point to resume from.
+            if obj['name'] != state['last_name'] and \
+                    len(state['targets']) >= batch:
+                _flush()
+            state['targets'].extend(t_beans)
+            state['copies'].extend(c_beans)
+            state['objects'] += 1
+            state['last_name'] = obj['name']
+
+        in_flight = deque()
+        try:
+            for obj in self._snapshot_listing(account, container,
+                                              marker=marker, **kwargs):
+                in_flight.append(eventlet.spawn(
+                    self._snapshot_object, account, container, obj,
+                    link_limits, **kwargs))
+                if len(in_flight) >= concurrency:
+                    _collect(in_flight.popleft().wait())
+            while in_flight:
+                _collect(in_flight.popleft().wait())
+        finally:
+            for job in in_flight:
+                job.kill()
+        if state['targets']:
+            _flush()
+        return stats
+
     @handle_container_not_found
     @ensure_headers
     @ensure_request_id
@@ -548,6 +784,10 @@ class ObjectStorageApi(object):
             (`oio.common.utils.monotonic_time`). This supersedes `timeout`
             or `read_timeout` keyword arguments.
         :type deadline: `float` seconds
+        :keyword metachunks_in_flight: maximum number of metachunks
+            uploaded at the same time (default: 1). Data is read ahead
+            from the source, up to `metachunks_in_flight` metachunks.
+        :type metachunks_in_flight: `int`
 
         :returns: `list` of chunks, size and hash of the what has been uploaded
         """
@@ -911,14 +1151,33 @@ class ObjectStorageApi(object):
         :keyword perfdata: optional `dict` that will be filled with metrics
             of time spent to resolve the meta2 address, to do the meta2
             request, and the time-to-first-byte, as seen by this API.
+        :keyword hedging: when to send requests to other replicas or
+            to parity fragments while waiting for rawx responses. The
+            number of extra requests, and how many of them have been used,
+            are counted in `perfdata`.
+        :type hedging: `oio.api.io.HedgingPolicy`
+        :keyword download_concurrency: number of ranges of a replicated
+            object downloaded at the same time, from different replicas
+            (default: 1, download metachunks one after the other)
+        :type download_concurrency: `int`
+        :keyword download_segment_size: size of the ranges downloaded
+            at the same time. At most `download_concurrency` of them
+            are kept in memory.
+        :type download_segment_size: `int`
 
         :returns: a dictionary of object metadata and
             a stream of object data
         :rtype: tuple
         """
+        download_concurrency = int_value(
+            kwargs.pop('download_concurrency', None), 1)
+        download_segment_size = int_value(
+            kwargs.pop('download_segment_size', None),
+            DOWNLOAD_SEGMENT_SIZE)
         perfdata = kwargs.get('perfdata', self.container.perfdata)
         if perfdata is not None:
             req_start = monotonic_time()
+            kwargs['perfdata'] = perfdata
 
         meta, raw_chunks = self.object_locate(
             account, container, obj, version=version, **kwargs)
@@ -933,6 +1192,11 @@ class ObjectStorageApi(object):
             stream = self._fetch_stream_backblaze(meta, chunks, ranges,
                                                   storage_method, key_file,
                                                   **kwargs)
+        elif download_concurrency > 1:
+            stream = fetch_stream_parallel(
+                chunks, ranges, storage_method,
+                concurrency=download_concurrency,
+                segment_size=download_segment_size, **kwargs)
         else:
             stream = fetch_stream(chunks, ranges, storage_method, **kwargs)
 
@@ -1059,7 +1323,7 @@ class ObjectStorageApi(object):
         """Call content/prepare, initialize chunk uploaders."""
         chunk_prep = MetachunkPreparer(
             self.container, account, container, obj_name,
-            policy=policy, **kwargs)
+            policy=policy, content_length=_source_length(source), **kwargs)
         obj_meta = chunk_prep.obj_meta
         obj_meta.update(sysmeta)
         obj_meta['content_path'] = obj_name
@@ -1075,6 +1339,7 @@ class ObjectStorageApi(object):
 
         storage_method = STORAGE_METHODS.load(obj_meta['chunk_method'])
         if storage_method.ec:
+            kwargs.setdefault('perfdata', self.container.perfdata)
             write_handler_cls = ECWriteHandler
         elif storage_method.backblaze:
             backblaze_info = self._b2_credentials(storage_method, key_file)
@@ -1290,7 +1555,8 @@ class ObjectStorageApi(object):
             copies.append(tmp)
         return copies
 
-    def _link_chunks(self, targets, copies, fullpath, **kwargs):
+    def _link_chunks(self, targets, copies, fullpath, link_limits=None,
+                     **kwargs):
         """
         Create chunk hard links.
 
@@ -1298,13 +1564,23 @@ class ObjectStorageApi(object):
         :param copies: new chunk URLs
         :param fullpath: full path to the object whose chunks will
             be hard linked
+        :param link_limits: semaphores limiting the number of links
+            created at the same time, by rawx service
+        :type link_limits: `dict`
         """
         out_kwargs = dict(kwargs)
-        headers = out_kwargs.pop('headers', dict())
+        # Not modifying the caller's headers, they may be shared
+        # with other greenthreads.
+        headers = dict(out_kwargs.pop('headers', None) or {})
         headers.update(((CHUNK_HEADERS['full_path'], fullpath), ))
         for target, copy in zip(targets, copies):
-            res = self.blob_client.chunk_link(target, copy,
-                                              headers=headers, **out_kwargs)
+            if link_limits is not None:
+                with link_limits[urlparse(target).netloc]:
+                    res = self.blob_client.chunk_link(
+                        target, copy, headers=headers, **out_kwargs)
+            else:
+                res = self.blob_client.chunk_link(
+                    target, copy, headers=headers, **out_kwargs)
             if res.status != 201:
                 raise exc.ChunkException(res.status)
 
@@ -25,6 +25,7 @@ from six import text_type
 from oio.common import exceptions as exc
 from oio.common.exceptions import SourceReadError
 from oio.common.http import headers_from_object_metadata
+from oio.common.http_eventlet import frame_chunk
 from oio.common.utils import encode
 from oio.api import io
 from oio.common.constants import CHUNK_HEADERS
@@ -60,6 +61,7 @@ class ReplicatedMetachunkWriter(io.MetachunkWriter):
         self.write_timeout = write_timeout or io.CHUNK_TIMEOUT
         self.read_timeout = read_timeout or io.CLIENT_TIMEOUT
         self.headers = headers or {}
+        self.rawx_pool = kwargs.get('rawx_pool')
 
     def stream(self, source, size=None):
         bytes_transferred = 0
@@ -114,11 +116,11 @@ class ReplicatedMetachunkWriter(io.MetachunkWriter):
                     if meta_checksum:
                         meta_checksum.update(data)
                     bytes_transferred += len(data)
+                    # frame the data once, all connections share the buffer
+                    data_put = frame_chunk(data)
                     # copy current_conns to be able to remove a failed conn
                     for conn in current_conns[:]:
                         if not conn.failed:
-                            data_put = ('%x\r\n' % len(data)).encode()
-                            data_put += data + b'\r\n'
                             conn.queue.put(data_put)
                         else:
                             current_conns.remove(conn)
@@ -183,7 +185,8 @@ class ReplicatedMetachunkWriter(io.MetachunkWriter):
 
             with green.ConnectionTimeout(self.connection_timeout):
                 conn = io.http_connect(
-                    parsed.netloc, 'PUT', parsed.path, hdrs)
+                    parsed.netloc, 'PUT', parsed.path, hdrs,
+                    pool=self.rawx_pool)
                 conn.chunk = chunk
             return conn, chunk
         except (Exception, Timeout) as err:
@@ -230,7 +233,7 @@ class ReplicatedMetachunkWriter(io.MetachunkWriter):
         `failures` list.
         Otherwise put `conn.chunk` in `successes` list.
 
-        And then close `conn`.
+        And then release `conn` (close it or give it back to its pool).
         """
         if resp:
             if isinstance(resp, (Exception, Timeout)):
@@ -257,7 +260,10 @@ class ReplicatedMetachunkWriter(io.MetachunkWriter):
                 else:
                     conn.chunk['hash'] = checksum or rawx_checksum
                     successes.append(conn.chunk)
-        conn.close()
+                    if conn.pool is not None:
+                        # Drain the response so the connection is reusable
+                        resp.read()
+        conn.release()
 
 
 class ReplicatedWriteHandler(io.WriteHandler):
@@ -266,20 +272,33 @@ class ReplicatedWriteHandler(io.WriteHandler):
     For initialization parameters, see oio.api.io.WriteHandler.
     """
 
+    def _metachunk_writer(self, meta_chunk, global_checksum):
+        return ReplicatedMetachunkWriter(
+            self.sysmeta, meta_chunk, global_checksum, self.storage_method,
+            connection_timeout=self.connection_timeout,
+            write_timeout=self.write_timeout,
+            read_timeout=self.read_timeout,
+            headers=self.headers,
+            chunk_checksum_algo=self.chunk_checksum_algo,
+            rawx_pool=self.rawx_pool)
+
+    def _write_metachunk(self, meta_chunk, source, size):
+        handler = self._metachunk_writer(meta_chunk, io.NullChecksum())
+        bytes_transferred, _h, chunks = handler.stream(source, size)
+        return bytes_transferred, chunks
+
     def stream(self):
+        if self.metachunks_in_flight > 1:
+            return self.pipelined_stream(self.sysmeta['chunk_size'],
+                                         self._write_metachunk)
+
         global_checksum = hashlib.md5()
         total_bytes_transferred = 0
         content_chunks = []
 
         for meta_chunk in self.chunk_prep():
             size = self.sysmeta['chunk_size']
-            handler = ReplicatedMetachunkWriter(
-                self.sysmeta, meta_chunk, global_checksum, self.storage_method,
-                connection_timeout=self.connection_timeout,
-                write_timeout=self.write_timeout,
-                read_timeout=self.read_timeout,
-                headers=self.headers,
-                chunk_checksum_algo=self.chunk_checksum_algo)
+            handler = self._metachunk_writer(meta_chunk, global_checksum)
             bytes_transferred, _h, chunks = handler.stream(self.source, size)
             content_chunks += chunks
 
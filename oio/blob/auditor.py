@@ -14,25 +14,83 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from collections import defaultdict
 from contextlib import closing
 import hashlib
+import io
+from itertools import islice
+import math
+import random
 import time
 
+import eventlet
+from eventlet import tpool
+
 from oio.blob.utils import check_volume, read_chunk_metadata
 from oio.container.client import ContainerClient
 from oio.common.daemon import Daemon
 from oio.common import exceptions as exc
-from oio.common.utils import paths_gen
-from oio.common.easy_value import int_value
+from oio.common.utils import paths_gen, fadvise, POSIX_FADV_SEQUENTIAL, \
+    POSIX_FADV_DONTNEED, LRUCache
+from oio.common.easy_value import int_value, true_value
 from oio.common.logger import get_logger
-from oio.common.green import ratelimit
+from oio.common.green import ratelimit_delay
 
 
 SLEEP_TIME = 30
+READ_BLOCK_SIZE = 1024 * 1024
+BATCH_SIZE = 100
+# Maximum number of chunk audit durations kept
+# to compute percentiles, per report interval
+MAX_LATENCY_SAMPLES = 10000
+# Returned by the location cache when the key is missing
+_MISSING = object()
+
+
+def percentile(sorted_values, pct):
+    """
+    Get the `pct` percentile (nearest rank) of a sorted list of values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def _content_key(meta):
+    return (meta['container_id'], meta['content_path'],
+            meta.get('content_version'))
+
+
+class RateLimiter(object):
+    """
+    Rate limit shared by several greenthreads.
+    """
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.run_time = 0
+
+    def wait(self, increment=1):
+        # Book the time slot before sleeping, so that greenthreads
+        # waiting at the same time do not share the same slot.
+        self.run_time, delay = ratelimit_delay(
+            self.run_time, self.max_rate, increment=increment)
+        if delay:
+            eventlet.sleep(delay)
 
 
 class BlobAuditorWorker(object):
-    def __init__(self, conf, logger, volume):
+    def __init__(self, conf, logger, volume, chunks_limiter=None,
+                 bytes_limiter=None):
+        """
+        :param chunks_limiter: limit of chunks per second,
+            to be shared with other workers
+        :type chunks_limiter: `RateLimiter`
+        :param bytes_limiter: limit of bytes per second,
+            to be shared with other workers
+        :type bytes_limiter: `RateLimiter`
+        """
         self.conf = conf
         self.logger = logger
         self.volume = volume
@@ -43,19 +101,56 @@ class BlobAuditorWorker(object):
         self.faulty_chunks = 0
         self.corrupted_chunks = 0
         self.last_reported = 0
-        self.chunks_run_time = 0
-        self.bytes_running_time = 0
         self.bytes_processed = 0
         self.total_bytes_processed = 0
         self.total_chunks_processed = 0
+        self.audit_time = 0.0
+        self.latencies = []
+        self.latencies_seen = 0
         self.report_interval = int_value(
             conf.get('report_interval'), 3600)
         self.max_chunks_per_second = int_value(
             conf.get('chunks_per_second'), 30)
         self.max_bytes_per_second = int_value(
             conf.get('bytes_per_second'), 10000000)
+        self.concurrency = int_value(conf.get('concurrency'), 1)
+        self.read_block_size = int_value(
+            conf.get('read_block_size'), READ_BLOCK_SIZE)
+        self.drop_cache = true_value(conf.get('drop_cache', True))
+        # Number of chunks whose contents are located together
+        self.batch_size = int_value(conf.get('batch_size'), BATCH_SIZE)
+        # Results of content_locate, by (container, path, version)
+        self.locate_cache = LRUCache(
+            int_value(conf.get('locate_cache_size'), 1000))
+        self.chunks_limiter = chunks_limiter or \
+            RateLimiter(self.max_chunks_per_second)
+        self.bytes_limiter = bytes_limiter or \
+            RateLimiter(self.max_bytes_per_second)
         self.container_client = ContainerClient(conf, logger=self.logger)
 
+    def _add_latency(self, duration):
+        """Keep a uniform sample of chunk audit durations."""
+        self.latencies_seen += 1
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(duration)
+        else:
+            idx = random.randint(0, self.latencies_seen - 1)
+            if idx < MAX_LATENCY_SAMPLES:
+                self.latencies[idx] = duration
+
+    def _chunk_done(self, duration):
+        self.passes += 1
+        self.total_chunks_processed += 1
+        self.audit_time += duration
+        self._add_latency(duration)
+
+    def _audit_paths(self, paths):
+        while True:
+            batch = list(islice(paths, self.batch_size))
+            if not batch:
+                break
+            self.safe_chunks_audit(batch)
+
     def audit_pass(self):
         self.namespace, self.address = check_volume(self.volume)
 
@@ -65,22 +160,25 @@ class BlobAuditorWorker(object):
         total_corrupted = 0
         total_orphans = 0
         total_faulty = 0
-        audit_time = 0
+        last_hits = self.locate_cache.hits
+        last_misses = self.locate_cache.misses
 
+        # All greenthreads consume the same generator
         paths = paths_gen(self.volume)
+        pool = eventlet.GreenPool(self.concurrency)
+        for _ in range(self.concurrency):
+            pool.spawn(self._audit_paths, paths)
 
-        for path in paths:
-            loop_time = time.time()
-            self.safe_chunk_audit(path)
-            self.chunks_run_time = ratelimit(
-                self.chunks_run_time,
-                self.max_chunks_per_second
-            )
-            self.total_chunks_processed += 1
+        while pool.running():
+            eventlet.sleep(min(1.0, self.report_interval))
             now = time.time()
 
             if now - self.last_reported >= self.report_interval:
+                latencies = sorted(self.latencies)
+                hits = self.locate_cache.hits - last_hits
+                misses = self.locate_cache.misses - last_misses
                 self.logger.info(
+                    '%(volume)s '
                     '%(start_time)s '
                     '%(passes)d '
                     '%(corrupted)d '
@@ -90,8 +188,14 @@ class BlobAuditorWorker(object):
                     '%(c_rate).2f '
                     '%(b_rate).2f '
                     '%(total).2f '
-                    '%(audit_time).2f'
-                    '%(audit_rate).2f' % {
+                    '%(audit_time).2f '
+                    '%(audit_rate).2f '
+                    'p50=%(p50).4f '
+                    'p90=%(p90).4f '
+                    'p99=%(p99).4f '
+                    'locate_hit_rate=%(hit_rate).2f '
+                    'locate_saved=%(saved)d' % {
+                        'volume': self.volume,
                         'start_time': time.ctime(report_time),
                         'passes': self.passes,
                         'corrupted': self.corrupted_chunks,
@@ -101,8 +205,13 @@ class BlobAuditorWorker(object):
                         'c_rate': self.passes / (now - report_time),
                         'b_rate': self.bytes_processed / (now - report_time),
                         'total': (now - start_time),
-                        'audit_time': audit_time,
-                        'audit_rate': audit_time / (now - start_time)
+                        'audit_time': self.audit_time,
+                        'audit_rate': self.audit_time / (now - start_time),
+                        'p50': percentile(latencies, 50),
+                        'p90': percentile(latencies, 90),
+                        'p99': percentile(latencies, 99),
+                        'hit_rate': hits / float(hits + misses or 1),
+                        'saved': hits,
                     }
                 )
                 report_time = now
@@ -116,10 +225,15 @@ class BlobAuditorWorker(object):
                 self.faulty_chunks = 0
                 self.errors = 0
                 self.bytes_processed = 0
+                self.latencies = []
+                self.latencies_seen = 0
+                last_hits = self.locate_cache.hits
+                last_misses = self.locate_cache.misses
                 self.last_reported = now
-            audit_time += (now - loop_time)
+        pool.waitall()
         elapsed = (time.time() - start_time) or 0.000001
         self.logger.info(
+            '%(volume)s '
             '%(elapsed).02f '
             '%(corrupted)d '
             '%(faulty)d '
@@ -129,6 +243,7 @@ class BlobAuditorWorker(object):
             '%(bytes_rate).2f '
             '%(audit_time).2f '
             '%(audit_rate).2f' % {
+                'volume': self.volume,
                 'elapsed': elapsed,
                 'corrupted': total_corrupted + self.corrupted_chunks,
                 'faulty': total_faulty + self.faulty_chunks,
@@ -136,14 +251,19 @@ class BlobAuditorWorker(object):
                 'errors': total_errors + self.errors,
                 'chunk_rate': self.total_chunks_processed / elapsed,
                 'bytes_rate': self.total_bytes_processed / elapsed,
-                'audit_time': audit_time,
-                'audit_rate': audit_time / elapsed
+                'audit_time': self.audit_time,
+                'audit_rate': self.audit_time / elapsed
             }
         )
 
-    def safe_chunk_audit(self, path):
+    def _safe_call(self, path, func, *args):
+        """
+        Call `func(*args)`, count and log the errors about chunk `path`.
+
+        :returns: the result of the call, or None in case of error
+        """
         try:
-            self.chunk_audit(path)
+            return func(*args)
         except exc.FaultyChunk as err:
             self.faulty_chunks += 1
             self.logger.error('ERROR faulty chunk %s: %s', path, err)
@@ -156,11 +276,46 @@ class BlobAuditorWorker(object):
         except Exception:
             self.errors += 1
             self.logger.exception('ERROR while auditing chunk %s', path)
+        return None
 
-        self.passes += 1
+    def safe_chunk_audit(self, path):
+        self.safe_chunks_audit([path])
+
+    def safe_chunks_audit(self, paths):
+        """
+        Check the data of each chunk, then check the chunks
+        of each content against a single location of the content.
+        """
+        durations = dict()
+        by_content = defaultdict(list)
+        for path in paths:
+            self.chunks_limiter.wait()
+            start = time.time()
+            meta = self._safe_call(path, self.chunk_data_audit, path)
+            durations[path] = time.time() - start
+            if meta is None:
+                self._chunk_done(durations[path])
+            else:
+                by_content[_content_key(meta)].append((path, meta))
+
+        for chunks in by_content.values():
+            for path, meta in chunks:
+                start = time.time()
+                self._safe_call(path, self.chunk_location_audit, meta)
+                self._chunk_done(durations[path] + time.time() - start)
 
     def chunk_audit(self, path):
-        with open(path) as f:
+        meta = self.chunk_data_audit(path)
+        self.chunk_location_audit(meta)
+
+    def chunk_data_audit(self, path):
+        """
+        Check the size and the checksum of the chunk data.
+
+        :returns: the metadata of the chunk
+        """
+        # Unbuffered, the reader reads blocks directly into its buffer
+        with io.open(path, 'rb', buffering=0) as f:
             try:
                 meta = read_chunk_metadata(f)
             except exc.MissingAttribute as e:
@@ -168,44 +323,66 @@ class BlobAuditorWorker(object):
                     'Missing extended attribute %s' % e)
             size = int(meta['chunk_size'])
             md5_checksum = meta['chunk_hash'].lower()
-            reader = ChunkReader(f, size, md5_checksum)
+            reader = ChunkReader(f, size, md5_checksum,
+                                 buf_size=self.read_block_size,
+                                 drop_cache=self.drop_cache,
+                                 offload=True)
             with closing(reader):
                 for buf in reader:
                     buf_len = len(buf)
-                    self.bytes_running_time = ratelimit(
-                        self.bytes_running_time,
-                        self.max_bytes_per_second,
-                        increment=buf_len)
+                    self.bytes_limiter.wait(increment=buf_len)
                     self.bytes_processed += buf_len
                     self.total_bytes_processed += buf_len
+        return meta
 
+    def locate(self, meta):
+        """
+        Get the list of chunks of the content the chunk belongs to,
+        from the cache if possible.
+
+        :returns: the list of chunks, or None if the content
+            does not exist
+        """
+        key = _content_key(meta)
+        data = self.locate_cache.get(key, _MISSING)
+        if data is _MISSING:
+            container_id, content_path, version = key
             try:
-                container_id = meta['container_id']
-                content_path = meta['content_path']
                 _obj_meta, data = self.container_client.content_locate(
-                    cid=container_id, path=content_path, properties=False)
+                    cid=container_id, path=content_path, version=version,
+                    properties=False)
+            except exc.NotFound:
+                data = None
+            self.locate_cache.put(key, data)
+        return data
 
-                # Check chunk data
-                chunk_data = None
-                metachunks = set()
-                for c in data:
-                    if c['url'].endswith(meta['chunk_id']):
-                        metachunks.add(c['pos'].split('.', 2)[0])
-                        chunk_data = c
-                if not chunk_data:
-                    raise exc.OrphanChunk('Not found in content')
+    def chunk_location_audit(self, meta):
+        """
+        Check the chunk is referenced by its content,
+        with the same size, hash and position.
+        """
+        data = self.locate(meta)
+        if data is None:
+            raise exc.OrphanChunk('Chunk not found in container')
 
-                if chunk_data['size'] != int(meta['chunk_size']):
-                    raise exc.FaultyChunk('Invalid chunk size found')
+        # Check chunk data
+        chunk_data = None
+        metachunks = set()
+        for c in data:
+            if c['url'].endswith(meta['chunk_id']):
+                metachunks.add(c['pos'].split('.', 2)[0])
+                chunk_data = c
+        if not chunk_data:
+            raise exc.OrphanChunk('Not found in content')
 
-                if chunk_data['hash'] != meta['chunk_hash']:
-                    raise exc.FaultyChunk('Invalid chunk hash found')
+        if chunk_data['size'] != int(meta['chunk_size']):
+            raise exc.FaultyChunk('Invalid chunk size found')
 
-                if chunk_data['pos'] != meta['chunk_pos']:
-                    raise exc.FaultyChunk('Invalid chunk position found')
+        if chunk_data['hash'] != meta['chunk_hash']:
+            raise exc.FaultyChunk('Invalid chunk hash found')
 
-            except exc.NotFound:
-                raise exc.OrphanChunk('Chunk not found in container')
+        if chunk_data['pos'] != meta['chunk_pos']:
+            raise exc.FaultyChunk('Invalid chunk position found')
 
 
 class BlobAuditor(Daemon):
@@ -215,15 +392,31 @@ class BlobAuditor(Daemon):
         volume = conf.get('volume')
         if not volume:
             raise exc.ConfigurationException('No volume specified for auditor')
+        # Several volumes may be audited in parallel
+        self.volumes = [vol.strip() for vol in volume.split(',')
+                        if vol.strip()]
         self.volume = volume
+        # Budgets are shared by all volumes
+        self.chunks_limiter = RateLimiter(
+            int_value(conf.get('chunks_per_second'), 30))
+        self.bytes_limiter = RateLimiter(
+            int_value(conf.get('bytes_per_second'), 10000000))
+
+    def audit_volume(self, volume):
+        try:
+            worker = BlobAuditorWorker(self.conf, self.logger, volume,
+                                       chunks_limiter=self.chunks_limiter,
+                                       bytes_limiter=self.bytes_limiter)
+            worker.audit_pass()
+        except Exception as e:
+            self.logger.exception('ERROR in audit of %s: %s' % (volume, e))
 
     def run(self, *args, **kwargs):
         while True:
-            try:
-                worker = BlobAuditorWorker(self.conf, self.logger, self.volume)
-                worker.audit_pass()
-            except Exception as e:
-                self.logger.exception('ERROR in audit: %s' % e)
+            pool = eventlet.GreenPool(len(self.volumes))
+            for volume in self.volumes:
+                pool.spawn(self.audit_volume, volume)
+            pool.waitall()
             self._sleep()
 
     def _sleep(self):
@@ -231,20 +424,59 @@ class BlobAuditor(Daemon):
 
 
 class ChunkReader(object):
-    def __init__(self, fp, size, md5_checksum):
+    """
+    Read a chunk file by blocks of `buf_size` bytes, and check its size
+    and its checksum when closed.
+
+    Blocks are read into the same buffer, thus each block yielded
+    is only valid until the next one is read.
+
+    :param drop_cache: tell the kernel the data will be read sequentially
+        and will not be needed once read, so that the audit does not
+        evict data from the page cache
+    :param offload: read and hash the blocks in a native thread,
+        letting other greenthreads run
+    """
+
+    def __init__(self, fp, size, md5_checksum, buf_size=READ_BLOCK_SIZE,
+                 drop_cache=True, offload=False):
         self.fp = fp
         self.size = size
         self.md5_checksum = md5_checksum
+        self.buf_size = buf_size
+        self.drop_cache = drop_cache
+        self.offload = offload
         self.bytes_read = 0
         self.iter_md5 = None
+        self._buf = None
+
+    def _read_block(self):
+        """Read one block into the buffer, hash it and return its size."""
+        if hasattr(self.fp, 'readinto'):
+            read = self.fp.readinto(self._buf)
+            data = memoryview(self._buf)[:read]
+        else:
+            data = self.fp.read(self.buf_size)
+            read = len(data)
+        if read:
+            self.iter_md5.update(data)
+            if self.drop_cache:
+                fadvise(self.fp.fileno(), POSIX_FADV_DONTNEED,
+                        self.bytes_read, read)
+            self.bytes_read += read
+        return data
 
     def __iter__(self):
         self.iter_md5 = hashlib.md5()
+        self._buf = bytearray(self.buf_size)
+        if self.drop_cache:
+            fadvise(self.fp.fileno(), POSIX_FADV_SEQUENTIAL)
         while True:
-            buf = self.fp.read()
+            if self.offload:
+                buf = tpool.execute(self._read_block)
+            else:
+                buf = self._read_block()
             if buf:
-                self.iter_md5.update(buf)
-                self.bytes_read += len(buf)
                 yield buf
             else:
                 break
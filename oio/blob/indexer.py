@@ -17,18 +17,20 @@
 import time
 from datetime import datetime
 from random import random
-from string import hexdigits
+
+import eventlet
+from eventlet import tpool
+from eventlet.queue import Empty, LightQueue
 
 from oio.blob.utils import check_volume, read_chunk_metadata
-from oio.rdir.client import RdirClient
+from oio.rdir.client import RdirClient, RDIR_PUSH_BATCH_SIZE
 from oio.common.daemon import Daemon
 from oio.common import exceptions as exc
 from oio.common.utils import paths_gen
-from oio.common.easy_value import int_value
+from oio.common.easy_value import int_value, float_value
 from oio.common.logger import get_logger
 from oio.common.green import ratelimit
 from oio.common.exceptions import OioNetworkException
-from oio.common.constants import STRLEN_CHUNKID
 
 
 class BlobIndexer(Daemon):
@@ -51,29 +53,60 @@ class BlobIndexer(Daemon):
             conf.get('report_interval'), 3600)
         self.max_chunks_per_second = int_value(
             conf.get('chunks_per_second'), 30)
+        # Records are sent to rdir when there are batch_size of them,
+        # or when the oldest one has been waiting for batch_age seconds.
+        self.batch_size = int_value(
+            conf.get('batch_size'), RDIR_PUSH_BATCH_SIZE)
+        self.batch_age = float_value(conf.get('batch_age'), 1.0)
         self.index_client = RdirClient(conf, logger=self.logger)
         self.namespace, self.volume_id = check_volume(self.volume)
 
-    def index_pass(self):
+    def _read_records(self, paths, queue):
+        """
+        Read the metadata of the chunks, and put index records
+        in the queue. Put None when done.
 
-        def safe_update_index(path):
-            chunk_id = path.rsplit('/', 1)[-1]
-            if len(chunk_id) != STRLEN_CHUNKID:
-                return
-            for c in chunk_id:
-                if c not in hexdigits:
-                    return
-            try:
-                self.update_index(path)
-                self.successes += 1
+        The extended attributes are read in the thread pool,
+        not to block the greenthread pushing the previous batch.
+        """
+        try:
+            for path in paths:
+                try:
+                    queue.put((path, tpool.execute(self.chunk_record, path)))
+                except Exception:
+                    self.errors += 1
+                    self.total_since_last_reported += 1
+                    self.logger.exception('ERROR while updating %s', path)
+                self.chunks_run_time = ratelimit(
+                    self.chunks_run_time,
+                    self.max_chunks_per_second
+                )
+        finally:
+            queue.put(None)
+
+    def _flush(self, batch):
+        """Push a batch of records to rdir, count successes and errors."""
+        if not batch:
+            return
+        records = {id(record): path for path, record in batch}
+        failed = self.index_client.chunk_push_many(
+            self.volume_id, [record for _path, record in batch],
+            batch_size=self.batch_size)
+        for record, err in failed:
+            path = records.get(id(record), record.get('chunk_id'))
+            if isinstance(err, OioNetworkException):
+                self.logger.warn('ERROR while updating %s: %s', path, err)
+            else:
+                self.logger.error('ERROR while updating %s: %s', path, err)
+        self.errors += len(failed)
+        self.successes += len(batch) - len(failed)
+        self.total_since_last_reported += len(batch)
+        failed_ids = set(id(record) for record, _err in failed)
+        for path, record in batch:
+            if id(record) not in failed_ids:
                 self.logger.debug('Updated %s', path)
-            except OioNetworkException as exc:
-                self.errors += 1
-                self.logger.warn('ERROR while updating %s: %s', path, exc)
-            except Exception:
-                self.errors += 1
-                self.logger.exception('ERROR while updating %s', path)
-            self.total_since_last_reported += 1
+
+    def index_pass(self):
 
         def report(tag):
             total = self.errors + self.successes
@@ -104,32 +137,58 @@ class BlobIndexer(Daemon):
         self.errors = 0
         self.successes = 0
 
-        paths = paths_gen(self.volume)
+        paths = paths_gen(self.volume, chunks_only=True)
         report('started')
-        for path in paths:
-            safe_update_index(path)
-            self.chunks_run_time = ratelimit(
-                self.chunks_run_time,
-                self.max_chunks_per_second
-            )
+        # Metadata is read while the previous batch is being sent
+        queue = LightQueue(self.batch_size)
+        reader = eventlet.spawn(self._read_records, paths, queue)
+        batch = []
+        batch_start = 0
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(0.0, batch_start + self.batch_age - time.time())
+            try:
+                item = queue.get(timeout=timeout)
+            except Empty:
+                self._flush(batch)
+                batch = []
+                continue
+            if item is None:
+                break
+            if not batch:
+                batch_start = time.time()
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
             now = time.time()
             if now - self.last_reported >= self.report_interval:
                 report('running')
+        self._flush(batch)
+        reader.wait()
         report('ended')
 
-    def update_index(self, path):
+    def chunk_record(self, path):
+        """Build the index record of the chunk at `path`."""
         with open(path) as f:
             try:
                 meta = read_chunk_metadata(f)
             except exc.MissingAttribute as e:
                 raise exc.FaultyChunk(
                     'Missing extended attribute %s' % e)
-            data = {'mtime': int(time.time())}
-            self.index_client.chunk_push(self.volume_id,
-                                         meta['container_id'],
-                                         meta['content_id'],
-                                         meta['chunk_id'],
-                                         **data)
+        return {'container_id': meta['container_id'],
+                'content_id': meta['content_id'],
+                'chunk_id': meta['chunk_id'],
+                'mtime': int(time.time())}
+
+    def update_index(self, path):
+        record = self.chunk_record(path)
+        self.index_client.chunk_push(self.volume_id,
+                                     record.pop('container_id'),
+                                     record.pop('content_id'),
+                                     record.pop('chunk_id'),
+                                     **record)
 
     def run(self, *args, **kwargs):
         time.sleep(random() * self.interval)
@@ -614,22 +614,48 @@ class SnapshotContainer(lister.Lister):
         parser.add_argument(
             '--chunk-batch-size',
             metavar='<size>',
+            type=int,
             default=100,
             help=('The number of chunks updated at the same time.')
         )
+        parser.add_argument(
+            '--concurrency',
+            metavar='<objects>',
+            type=int,
+            default=10,
+            help=('The number of objects whose chunks are linked '
+                  'at the same time.')
+        )
+        parser.add_argument(
+            '--marker',
+            metavar='<object>',
+            help=('Resume an interrupted snapshot after this object '
+                  '(the last marker logged). Requires --dst-container.')
+        )
         return parser
 
+    def _log_progress(self, stats):
+        self.log.info('%d objects, %d chunks (%.1f objects/s), marker=%s',
+                      stats['objects'], stats['chunks'], stats['rate'],
+                      stats['marker'])
+
     def take_action(self, parsed_args):
         self.log.debug('take_action(%s)', parsed_args)
 
         account = self.app.client_manager.account
         container = parsed_args.container
         dst_account = parsed_args.dst_account or account
+        if parsed_args.marker is not None and not parsed_args.dst_container:
+            from argparse import ArgumentError
+            raise ArgumentError(parsed_args.marker,
+                                "--marker requires --dst-container")
         dst_container = (parsed_args.dst_container or
                          (container + "-" + Timestamp(time()).normal))
         batch = parsed_args.chunk_batch_size
 
         self.app.client_manager.storage.container_snapshot(
-            account, container, dst_account, dst_container, batch=batch)
+            account, container, dst_account, dst_container, batch=batch,
+            concurrency=parsed_args.concurrency, marker=parsed_args.marker,
+            progress_callback=self._log_progress)
         lines = [(dst_account, dst_container, "OK")]
         return ('Account', 'Container', 'Status'), lines
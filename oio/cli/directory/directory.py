@@ -19,7 +19,8 @@ from eventlet import Queue, GreenPile
 from oio.common.configuration import load_namespace_conf
 from oio.common.exceptions import ClientException
 from oio.common import green
-from oio.directory.meta0 import generate_prefixes, count_prefixes
+from oio.directory.meta0 import generate_prefixes, count_prefixes, \
+    APPLY_CONCURRENCY, APPLY_CONCURRENCY_PER_SERVICE, ApplyJournal
 
 
 class DirectoryCmd(Command):
@@ -84,10 +85,9 @@ class DirectoryInit(DirectoryCmd):
             self.log.info("Checking...")
             return mapping.check_replicas()
 
-        # Bootstrap with the 'random' strategy, then rebalance with the
-        # 'less_prefixes' strategy to ensure the same number of prefixes
-        # per meta1. This is faster than bootstrapping directly with the
-        # 'less_prefixes' strategy.
+        # Bootstrap with the 'less_bases' strategy, then rebalance
+        # to ensure the same number of prefixes per meta1 (in case
+        # location constraints prevented it).
         checked = False
         for i in range(3):
             self.log.info("Computing meta1 prefix mapping (pass %d)", i)
@@ -157,19 +157,75 @@ class DirectoryList(DirectoryCmd):
         print(mapping.to_json())
 
 
-class DirectoryRebalance(DirectoryCmd):
+class DirectoryApplyCmd(DirectoryCmd):
+    """Base class for subcommands moving bases between meta1 services"""
+
+    def get_parser(self, prog_name):
+        parser = super(DirectoryApplyCmd, self).get_parser(prog_name)
+        parser.add_argument(
+            '--concurrency', metavar='<N>', type=int,
+            default=APPLY_CONCURRENCY,
+            help="Number of bases to move in parallel (%d by default)" %
+            APPLY_CONCURRENCY)
+        parser.add_argument(
+            '--concurrency-per-meta1', metavar='<N>', type=int,
+            default=APPLY_CONCURRENCY_PER_SERVICE,
+            help=("Number of bases to move in parallel on each meta1 "
+                  "service (%d by default)" % APPLY_CONCURRENCY_PER_SERVICE))
+        parser.add_argument(
+            '--journal', metavar='<FILE>',
+            help=("Save the plan and the progress in this file. When it "
+                  "exists, resume the plan it records (computed by the "
+                  "same command, with the same arguments) instead of "
+                  "computing a new one. A journal whose plan has been "
+                  "fully applied is refused"))
+        return parser
+
+    def origin(self, parsed_args):
+        """
+        Describe the operation, to tell if a saved plan
+        has been computed for it.
+        """
+        raise NotImplementedError()
+
+    def resume(self, mapping, parsed_args):
+        """
+        Resume the plan saved in the journal, if there is one.
+
+        :returns: True if a plan has been resumed
+        """
+        if not (parsed_args.journal and
+                ApplyJournal.has_plan(parsed_args.journal)):
+            return False
+        self.apply(mapping, None, parsed_args)
+        return True
+
+    def apply(self, mapping, moved, parsed_args):
+        mapping.apply(moved, concurrency=parsed_args.concurrency,
+                      per_service=parsed_args.concurrency_per_meta1,
+                      journal=parsed_args.journal,
+                      origin=self.origin(parsed_args),
+                      read_timeout=parsed_args.meta0_timeout)
+
+
+class DirectoryRebalance(DirectoryApplyCmd):
     """Rebalance the container prefixes."""
 
+    def origin(self, parsed_args):
+        return {'command': 'rebalance'}
+
     def take_action(self, parsed_args):
         self.log.debug('take_action(%s)', parsed_args)
         mapping = self.get_prefix_mapping(parsed_args)
+        if self.resume(mapping, parsed_args):
+            return
         mapping.load(read_timeout=parsed_args.meta0_timeout)
         moved = mapping.rebalance()
-        mapping.apply(moved, read_timeout=parsed_args.meta0_timeout)
+        self.apply(mapping, moved, parsed_args)
         self.log.info("Moved %s", moved)
 
 
-class DirectoryDecommission(DirectoryCmd):
+class DirectoryDecommission(DirectoryApplyCmd):
     """Decommission a Meta1 service (or only some bases)."""
 
     def get_parser(self, prog_name):
@@ -180,13 +236,19 @@ class DirectoryDecommission(DirectoryCmd):
                             help="Name of bases to decommission")
         return parser
 
+    def origin(self, parsed_args):
+        return {'command': 'decommission', 'addr': parsed_args.addr,
+                'bases': sorted(parsed_args.base)}
+
     def take_action(self, parsed_args):
         self.log.debug('take_action(%s)', parsed_args)
         mapping = self.get_prefix_mapping(parsed_args)
+        if self.resume(mapping, parsed_args):
+            return
         mapping.load(read_timeout=parsed_args.meta0_timeout)
         moved = mapping.decommission(parsed_args.addr,
                                      bases_to_remove=parsed_args.base)
-        mapping.apply(moved, read_timeout=parsed_args.meta0_timeout)
+        self.apply(mapping, moved, parsed_args)
         self.log.info("Moved %s", moved)
 
 
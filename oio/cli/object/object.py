@@ -378,6 +378,15 @@ class SaveObject(ObjectCommandMixin, command.Command):
             metavar='<key_file>',
             help='File containing application keys'
         )
+        parser.add_argument(
+            '--concurrency',
+            metavar='<concurrency>',
+            type=int,
+            default=1,
+            help=('The number of ranges downloaded at the same time, '
+                  'from different replicas. '
+                  '(Only used for replicated objects. Default: 1)')
+        )
         return parser
 
     def take_action(self, parsed_args):
@@ -401,6 +410,7 @@ class SaveObject(ObjectCommandMixin, command.Command):
             obj,
             key_file=key_file,
             properties=False,
+            download_concurrency=parsed_args.concurrency,
         )
         if not os.path.exists(os.path.dirname(filename)):
             if len(os.path.dirname(filename)) > 0:
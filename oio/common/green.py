@@ -57,17 +57,33 @@ def get_hub():
     return 'poll'
 
 
-def ratelimit(run_time, max_rate, increment=1, rate_buffer=5):
+def ratelimit_delay(run_time, max_rate, increment=1, rate_buffer=5):
+    """
+    Same as `ratelimit`, but do not sleep.
+
+    :returns: a tuple with the new run time,
+        and the number of seconds to sleep
+    """
     if max_rate <= 0 or increment <= 0:
-        return run_time
+        return run_time, 0.0
     clock_accuracy = 1000.0
     now = time.time() * clock_accuracy
     time_per_request = clock_accuracy * (float(increment) / max_rate)
+    delay = 0.0
     if now - run_time > rate_buffer * clock_accuracy:
         run_time = now
     elif run_time - now > time_per_request:
-        eventlet.sleep((run_time - now) / clock_accuracy)
-    return run_time + time_per_request
+        delay = (run_time - now) / clock_accuracy
+    return run_time + time_per_request, delay
+
+
+def ratelimit(run_time, max_rate, increment=1, rate_buffer=5):
+    run_time, delay = ratelimit_delay(run_time, max_rate,
+                                      increment=increment,
+                                      rate_buffer=rate_buffer)
+    if delay:
+        eventlet.sleep(delay)
+    return run_time
 
 
 class ContextPool(eventlet.GreenPool):
@@ -13,17 +13,23 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+import errno
 import logging
+import os
 import socket
+from collections import deque
 
 try:
     from urllib.parse import quote
 except ImportError:
     from urllib import quote
 from eventlet.green.httplib import HTTPConnection, HTTPResponse, _UNKNOWN, \
-        CONTINUE, HTTPMessage
+        CONTINUE, HTTPMessage, NotConnected
+from eventlet.hubs import trampoline
 from six import text_type
 
+from oio.common.utils import monotonic_time
+
 
 class CustomHTTPResponse(HTTPResponse):
     def __init__(self, sock, debuglevel=0, strict=0,
@@ -79,9 +85,108 @@ class CustomHTTPResponse(HTTPResponse):
         self._actual_socket = None
 
 
+CRLF = b'\r\n'
+# Maximum number of buffers in a single writev(2) call
+IOV_MAX = 1024
+
+
+def _wait_writable(sock):
+    trampoline(sock, write=True, timeout=sock.gettimeout(),
+               timeout_exc=socket.timeout('timed out'))
+
+
+def _writev(sock, buffers):
+    fd = sock.fileno()
+    buffers = [memoryview(buf) for buf in buffers if len(buf)]
+    while buffers:
+        try:
+            written = os.writev(fd, buffers[:IOV_MAX])
+        except (IOError, OSError) as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _wait_writable(sock)
+                continue
+            elif err.errno == errno.EINTR:
+                continue
+            raise socket.error(err.errno, os.strerror(err.errno))
+        while written:
+            if written < len(buffers[0]):
+                buffers[0] = buffers[0][written:]
+                break
+            written -= len(buffers.pop(0))
+
+
+def sendv(sock, buffers):
+    """
+    Send all the `buffers` on `sock` with vectored writes (writev(2)),
+    instead of concatenating them first.
+    Falls back to `sendall` if os.writev is not available (Python 2).
+    """
+    if hasattr(os, 'writev'):
+        _writev(sock, buffers)
+    else:
+        sock.sendall(b''.join(buffers))
+
+
+def frame_chunk(data):
+    """
+    Frame `data` as one chunk of a chunked transfer-encoded body.
+    Empty `data` gives the last chunk, which terminates the body.
+    """
+    return b''.join((('%x\r\n' % len(data)).encode(), data, CRLF))
+
+
+def send_chunk(conn, data):
+    """
+    Send `data` as one chunk of a chunked transfer-encoded body.
+    Empty `data` terminates the body.
+    When `conn` supports vectored writes, `data` is not copied.
+    """
+    send_buffers = getattr(conn, 'sendv', None)
+    if send_buffers is None:
+        conn.send(frame_chunk(data))
+    else:
+        send_buffers((('%x\r\n' % len(data)).encode(), data, CRLF))
+
+
 class CustomHttpConnection(HTTPConnection):
     response_class = CustomHTTPResponse
 
+    # Set by ConnectionPool.get()
+    pool = None
+    pool_key = None
+    reused = False
+    _last_response = None
+
+    @property
+    def reusable(self):
+        """
+        Tell if the connection can be used for another request:
+        the last response must have been read completely,
+        and the server must not have asked to close the connection.
+        """
+        resp = self._last_response
+        return (self.sock is not None and resp is not None
+                and resp.isclosed() and not resp.will_close)
+
+    def release(self):
+        """
+        Give the connection back to its pool if it is reusable,
+        close it otherwise.
+        """
+        if self.pool is not None:
+            self.pool.put(self)
+        else:
+            self.close()
+
+    def sendv(self, buffers):
+        """Send several buffers with a single vectored write."""
+        if self.sock is None:
+            if self.auto_open:
+                self.connect()
+            else:
+                raise NotConnected()
+        sendv(self.sock, buffers)
+
     def connect(self):
         r = HTTPConnection.connect(self)
         self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -95,21 +200,123 @@ class CustomHttpConnection(HTTPConnection):
 
     def getresponse(self):
         response = HTTPConnection.getresponse(self)
+        self._last_response = response
         logging.debug('HTTP %s %s:%s %s',
                       self._method, self.host, self.port, self._path)
         return response
 
 
-def http_connect(host, method, path, headers=None, query_string=None):
-    if isinstance(path, text_type):
-        try:
-            path = path.encode('utf-8')
-        except UnicodeError as e:
-            logging.exception('ERROR encoding to UTF-8: %s', str(e))
-    path = quote(b'/' + path)
-    conn = CustomHttpConnection(host)
-    if query_string:
-        path += b'?' + query_string
+def _is_idle_socket_alive(sock):
+    """
+    Check that an idle keep-alive socket has not been closed
+    (or half-closed) by the server: such a socket must not be readable.
+
+    Peek without blocking instead of calling `select()`,
+    which fails on file descriptors above FD_SETSIZE.
+    """
+    # Read from the underlying socket, a green socket would wait
+    raw_sock = getattr(sock, 'fd', sock)
+    try:
+        raw_sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except socket.error as exc:
+        return exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+    except Exception:
+        return False
+    # Either closed by the server (empty read), or unexpected data
+    return False
+
+
+class ConnectionPool(object):
+    """
+    Per-host pool of keep-alive connections, for rawx services.
+
+    Connections are taken with `get()`, and given back with
+    `CustomHttpConnection.release()` once the response has been read
+    completely. Idle connections are dropped after `idle_timeout` seconds,
+    or when the server closed them.
+    """
+
+    def __init__(self, max_idle_per_host=16, idle_timeout=30.0):
+        """
+        :param max_idle_per_host: maximum number of idle connections
+            kept for each host
+        :param idle_timeout: number of seconds after which an idle
+            connection is closed
+        """
+        self.max_idle_per_host = int(max_idle_per_host)
+        self.idle_timeout = float(idle_timeout)
+        self._idle = dict()
+        self.stats = {'hits': 0, 'misses': 0, 'released': 0,
+                      'evicted': 0, 'stale': 0, 'discarded': 0}
+
+    def _evict_expired(self, idle, now):
+        # Oldest connections are on the left
+        while idle and now - idle[0][1] > self.idle_timeout:
+            conn, _ = idle.popleft()
+            conn.close()
+            self.stats['evicted'] += 1
+
+    def get(self, host):
+        """
+        Get a connection to `host`, reuse an idle one if possible.
+        """
+        idle = self._idle.get(host)
+        if idle:
+            self._evict_expired(idle, monotonic_time())
+            while idle:
+                conn, _ = idle.pop()
+                if _is_idle_socket_alive(conn.sock):
+                    self.stats['hits'] += 1
+                    conn.reused = True
+                    return conn
+                conn.close()
+                self.stats['stale'] += 1
+        self.stats['misses'] += 1
+        return self._new_connection(host)
+
+    def _new_connection(self, host):
+        conn = CustomHttpConnection(host)
+        conn.pool = self
+        conn.pool_key = host
+        return conn
+
+    def put(self, conn):
+        """
+        Give a connection back to the pool, or close it if it
+        cannot be reused.
+        """
+        if not conn.reusable:
+            conn.close()
+            self.stats['discarded'] += 1
+            return
+        idle = self._idle.setdefault(conn.pool_key, deque())
+        now = monotonic_time()
+        self._evict_expired(idle, now)
+        if len(idle) >= self.max_idle_per_host:
+            conn.close()
+            self.stats['discarded'] += 1
+            return
+        conn.reused = False
+        idle.append((conn, now))
+        self.stats['released'] += 1
+
+    def purge(self):
+        """Close all connections that have been idle for too long."""
+        now = monotonic_time()
+        for host, idle in list(self._idle.items()):
+            self._evict_expired(idle, now)
+            if not idle:
+                del self._idle[host]
+
+    def clear(self):
+        """Close all idle connections."""
+        for idle in self._idle.values():
+            for conn, _ in idle:
+                conn.close()
+        self._idle.clear()
+
+
+def _send_request(conn, method, path, headers):
     conn.path = path
     conn.putrequest(method, path)
     if headers:
@@ -120,4 +327,38 @@ def http_connect(host, method, path, headers=None, query_string=None):
             else:
                 conn.putheader(header, value)
     conn.endheaders()
+
+
+def http_connect(host, method, path, headers=None, query_string=None,
+                 pool=None):
+    """
+    Connect to `host` and send the request line and headers.
+
+    :param pool: if set, take the connection from this `ConnectionPool`
+        (and retry once with a new connection if a reused one fails)
+    :type pool: `ConnectionPool`
+    """
+    if isinstance(path, text_type):
+        try:
+            path = path.encode('utf-8')
+        except UnicodeError as e:
+            logging.exception('ERROR encoding to UTF-8: %s', str(e))
+    path = quote(b'/' + path)
+    if query_string:
+        path += b'?' + query_string
+    if pool is None:
+        conn = CustomHttpConnection(host)
+        _send_request(conn, method, path, headers)
+        return conn
+    conn = pool.get(host)
+    try:
+        _send_request(conn, method, path, headers)
+    except (socket.error, IOError):
+        if not conn.reused:
+            raise
+        # The server closed the connection while we were not looking
+        conn.close()
+        pool.stats['stale'] += 1
+        conn = pool._new_connection(host)
+        _send_request(conn, method, path, headers)
     return conn
@@ -20,8 +20,20 @@ import math
 import redis
 import redis.sentinel
 
+from oio.common.easy_value import float_value, int_value
+
 
 class RedisConn(object):
+    """
+    Holds a connection to Redis, either to a single server, or to the
+    master elected by Sentinel.
+
+    The client (and its connection pool) is built once. With Sentinel,
+    the master is resolved each time the pool opens a new connection:
+    connections are dropped after a failover error (connection error,
+    or "READONLY" reply from a demoted master), then opened again to the
+    new master.
+    """
 
     def __init__(self, conf, connection=None, **kwargs):
         self.conf = conf
@@ -30,11 +42,25 @@ class RedisConn(object):
         self._sentinel_hosts = conf.get('sentinel_hosts', None)
         self._sentinel_name = conf.get('sentinel_master_name', 'oio')
 
+        self._conn_kwargs = dict()
+        max_connections = int_value(conf.get('redis_max_connections'), None)
+        if max_connections:
+            self._conn_kwargs['max_connections'] = max_connections
+        for key in ('socket_timeout', 'socket_connect_timeout'):
+            timeout = float_value(conf.get('redis_' + key), None)
+            if timeout:
+                self._conn_kwargs[key] = timeout
+
         # Do not use Sentinel if a connection object is provided
         if self._sentinel_hosts and not self._conn:
+            sentinel_kwargs = {
+                'socket_timeout': float_value(
+                    conf.get('sentinel_socket_timeout'),
+                    self._conn_kwargs.get('socket_timeout'))}
             self._sentinel = redis.sentinel.Sentinel(
                     [(h, int(p)) for h, p, in (hp.split(':', 2)
-                     for hp in self._sentinel_hosts.split(','))])
+                     for hp in self._sentinel_hosts.split(','))],
+                    sentinel_kwargs=sentinel_kwargs)
 
     def register_script(self, script):
         """Register a LUA script and return Script object."""
@@ -43,12 +69,16 @@ class RedisConn(object):
     @property
     def conn(self):
         """Retrieve Redis connection (normal or sentinel)"""
-        if self._sentinel:
-            return self._sentinel.master_for(self._sentinel_name)
-        if not self._conn:
-            redis_host = self.conf.get('redis_host', '127.0.0.1')
-            redis_port = int(self.conf.get('redis_port', '6379'))
-            self._conn = redis.StrictRedis(host=redis_host, port=redis_port)
+        if self._conn is None:
+            if self._sentinel:
+                self._conn = self._sentinel.master_for(
+                    self._sentinel_name, redis_class=redis.StrictRedis,
+                    **self._conn_kwargs)
+            else:
+                redis_host = self.conf.get('redis_host', '127.0.0.1')
+                redis_port = int(self.conf.get('redis_port', '6379'))
+                self._conn = redis.StrictRedis(
+                    host=redis_host, port=redis_port, **self._conn_kwargs)
         return self._conn
 
     def acquire_lock_with_timeout(self, lockname, acquire_timeout=10,
@@ -14,15 +14,22 @@
 # License along with this library.
 
 
-import random
+from collections import deque
 from six import iteritems
 
+import eventlet
+
 from oio.api.io import ChunkReader, READ_CHUNK_SIZE
 from oio.api.ec import ECChunkDownloadHandler
 from oio.common import exceptions as exc
 from oio.common.constants import OBJECT_METADATA_PREFIX
 from oio.common.http import http_header_from_ranges
 from oio.common.decorators import ensure_headers
+from oio.common.utils import wrand_choice_index
+
+
+# Size of the ranges downloaded concurrently by fetch_stream_parallel
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
 
 
 def obj_range_to_meta_chunk_range(obj_start, obj_end, meta_sizes):
@@ -96,21 +103,6 @@ def get_meta_ranges(ranges, chunks):
     return range_infos
 
 
-def wrand_choice_index(scores):
-    """Choose an element from the `scores` sequence and return its index"""
-    scores = list(scores)
-    total = sum(scores)
-    target = random.uniform(0, total)
-    upto = 0
-    index = 0
-    for score in scores:
-        if upto + score >= target:
-            return index
-        upto += score
-        index += 1
-    assert False, "Shouldn't get here"
-
-
 def _sort_chunks(raw_chunks, ec_security):
     """
     Sort a list a chunk objects. In addition to the sort,
@@ -189,6 +181,32 @@ def _make_object_metadata(headers):
     return meta
 
 
+def _read_meta_range(pos, chunks, meta_range, headers, **kwargs):
+    """
+    Read a range of the metachunk at position `pos`, trying each chunk
+    of `chunks` in turn until one of them succeeds.
+    """
+    meta_start, meta_end = meta_range
+    if meta_start is not None and meta_end is not None:
+        headers['Range'] = http_header_from_ranges((meta_range, ))
+    reader = ChunkReader(
+        iter(chunks), READ_CHUNK_SIZE, headers=headers,
+        **kwargs)
+    try:
+        it = reader.get_iter()
+    except exc.NotFound as err:
+        raise exc.UnrecoverableContent(
+            "Cannot download position %d: %s" %
+            (pos, err))
+    except Exception as err:
+        raise exc.OioException(
+            "Error while downloading position %d: %s" %
+            (pos, err))
+    for part in it:
+        for dat in part['iter']:
+            yield dat
+
+
 @ensure_headers
 def fetch_stream(chunks, ranges, storage_method, headers=None,
                  **kwargs):
@@ -197,26 +215,79 @@ def fetch_stream(chunks, ranges, storage_method, headers=None,
 
     for meta_range_dict in meta_range_list:
         for pos in sorted(meta_range_dict.keys()):
-            meta_start, meta_end = meta_range_dict[pos]
-            if meta_start is not None and meta_end is not None:
-                headers['Range'] = http_header_from_ranges(
-                    (meta_range_dict[pos], ))
-            reader = ChunkReader(
-                iter(chunks[pos]), READ_CHUNK_SIZE, headers=headers,
-                **kwargs)
-            try:
-                it = reader.get_iter()
-            except exc.NotFound as err:
-                raise exc.UnrecoverableContent(
-                    "Cannot download position %d: %s" %
-                    (pos, err))
-            except Exception as err:
-                raise exc.OioException(
-                    "Error while downloading position %d: %s" %
-                    (pos, err))
-            for part in it:
-                for dat in part['iter']:
+            for dat in _read_meta_range(pos, chunks[pos],
+                                        meta_range_dict[pos], headers,
+                                        **kwargs):
+                yield dat
+
+
+def _split_meta_ranges(meta_range_list, segment_size):
+    """
+    Split metachunk ranges into segments of at most `segment_size` bytes.
+
+    :returns: an iterator over (position, (start, end)) tuples
+    """
+    for meta_range_dict in meta_range_list:
+        for pos in sorted(meta_range_dict.keys()):
+            start, end = meta_range_dict[pos]
+            while start <= end:
+                segment_end = min(start + segment_size - 1, end)
+                yield pos, (start, segment_end)
+                start = segment_end + 1
+
+
+def _fetch_segment(pos, chunks, segment, headers, **kwargs):
+    """
+    Download a segment of a metachunk in memory.
+
+    :returns: the list of data blocks, or the exception that
+        prevented the download
+    """
+    try:
+        return list(_read_meta_range(pos, chunks, segment, dict(headers),
+                                     **kwargs))
+    except Exception as err:
+        return err
+
+
+@ensure_headers
+def fetch_stream_parallel(chunks, ranges, storage_method, headers=None,
+                          concurrency=4,
+                          segment_size=DOWNLOAD_SEGMENT_SIZE, **kwargs):
+    """
+    Download a replicated object, fetching up to `concurrency` segments
+    of `segment_size` bytes at the same time, from different replicas.
+    Each segment fails over to the other replicas of its metachunk.
+    Segments are yielded in order, at most `concurrency` of them are
+    kept in memory.
+    """
+    ranges = ranges or [(None, None)]
+    meta_range_list = get_meta_ranges(ranges, chunks)
+    in_flight = deque()
+
+    def _next_segment():
+        res = in_flight.popleft().wait()
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+    try:
+        for index, (pos, segment) in enumerate(
+                _split_meta_ranges(meta_range_list, segment_size)):
+            if len(in_flight) >= concurrency:
+                for dat in _next_segment():
                     yield dat
+            # Start each segment with a different replica
+            first = index % len(chunks[pos])
+            replicas = chunks[pos][first:] + chunks[pos][:first]
+            in_flight.append(eventlet.spawn(
+                _fetch_segment, pos, replicas, segment, headers, **kwargs))
+        while in_flight:
+            for dat in _next_segment():
+                yield dat
+    finally:
+        for download in in_flight:
+            download.kill()
 
 
 @ensure_headers
@@ -14,11 +14,13 @@
 # License along with this library.
 
 import os
+import re
 import grp
 import pwd
 import fcntl
+from collections import OrderedDict
 from hashlib import sha256
-from random import getrandbits
+from random import getrandbits, uniform
 from io import RawIOBase
 from itertools import islice
 from codecs import getdecoder, getencoder
@@ -28,8 +30,18 @@ try:
 except ImportError:
     from urllib import quote as _quote
 from six import text_type
+from zlib import crc32
+from oio.common.constants import STRLEN_CHUNKID
 from oio.common.exceptions import OioException, DeadlineReached
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 
 try:
     import multiprocessing
@@ -97,10 +109,108 @@ def drop_privileges(user):
     os.umask(0o22)
 
 
-def paths_gen(volume_path):
-    for root, dirs, files in os.walk(volume_path):
-        for name in files:
-            yield os.path.join(root, name)
+_CHUNK_NAME_MATCH = re.compile('^[0-9A-Fa-f]{%d}$' % STRLEN_CHUNKID).match
+_HASH_DIR_MATCH = re.compile('^[0-9A-Fa-f]+$').match
+
+
+class _DirEntry(object):
+    """Minimal replacement for `os.DirEntry` when scandir is missing."""
+
+    __slots__ = ('name', 'path')
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+
+def _scandir(path):
+    if scandir is not None:
+        return scandir(path)
+    return (_DirEntry(path, name) for name in os.listdir(path))
+
+
+def path_shard(name, shards):
+    """
+    Get the shard of a top-level entry of a volume.
+    Hash directories (and chunk files) are hexadecimal, their value
+    is used directly, other names are hashed.
+    """
+    if _HASH_DIR_MATCH(name):
+        return int(name, 16) % shards
+    if isinstance(name, text_type):
+        name = name.encode('utf-8')
+    return (crc32(name) & 0xffffffff) % shards
+
+
+def _walk(dirname, marker, chunks_only, shard, shards):
+    """
+    Walk `dirname` depth-first, entries sorted by name, so that
+    the order of the yielded paths is stable and resumable.
+
+    :param marker: list of path components (relative to `dirname`),
+        skip everything up to (and including) this path
+    """
+    try:
+        entries = sorted(_scandir(dirname), key=lambda e: e.name)
+    except OSError:
+        # Directory removed (or unreadable) while walking
+        return
+    if marker:
+        first, rest = marker[0], marker[1:]
+    else:
+        first, rest = None, None
+    for entry in entries:
+        name = entry.name
+        if first is not None and name < first:
+            continue
+        if shards is not None and path_shard(name, shards) != shard:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if chunks_only and not _HASH_DIR_MATCH(name):
+                continue
+            for path in _walk(entry.path,
+                              rest if name == first else None,
+                              chunks_only, None, None):
+                yield path
+        elif first is not None and name == first:
+            # The marker itself has already been processed
+            continue
+        elif chunks_only and not _CHUNK_NAME_MATCH(name):
+            continue
+        elif not entry.is_dir():
+            yield entry.path
+
+
+def paths_gen(volume_path, marker=None, chunks_only=False,
+              shard=0, shards=1):
+    """
+    Generate the paths of the files of a volume, in a stable order.
+
+    :param marker: resume the walk after this path (absolute,
+        or relative to `volume_path`), usually the last path processed
+        by a previous pass
+    :param chunks_only: only walk hash directories (hexadecimal names)
+        and only yield files named like chunk IDs (no `.pending` files)
+    :param shard: index of the subset of the volume to walk,
+        from 0 to `shards` - 1
+    :param shards: number of subsets the volume is split into,
+        so several workers can walk a volume without overlapping
+    """
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError('shard must be in [0, %d)' % shards)
+    volume_path = volume_path.rstrip('/') or '/'
+    components = None
+    if marker:
+        if marker.startswith(volume_path + '/'):
+            marker = marker[len(volume_path) + 1:]
+        components = [c for c in marker.split('/') if c]
+    return _walk(volume_path, components, chunks_only,
+                 shard, shards if shards > 1 else None)
 
 
 def statfs(volume):
@@ -148,6 +258,75 @@ class RingBuffer(list):
             yield self[i]
 
 
+def wrand_choice_index(scores):
+    """Choose an element from the `scores` sequence and return its index"""
+    scores = list(scores)
+    total = sum(scores)
+    target = uniform(0, total)
+    upto = 0
+    index = 0
+    for score in scores:
+        if upto + score >= target:
+            return index
+        upto += score
+        index += 1
+    assert False, "Shouldn't get here"
+
+
+class LRUCache(object):
+    """
+    A dictionary with a maximum size, dropping the least recently used
+    items first. Counts cache hits and misses.
+
+    When `ttl` is set, items are also dropped when they have been
+    in the cache for more than `ttl` seconds.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value, deadline = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if deadline is not None and deadline < monotonic_time():
+            self.misses += 1
+            return default
+        self._items[key] = (value, deadline)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        if self.max_size <= 0:
+            return
+        deadline = monotonic_time() + self.ttl if self.ttl else None
+        self._items[key] = (value, deadline)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._items.clear()
+
+    def __contains__(self, key):
+        item = self._items.get(key)
+        return item is not None and \
+            (item[1] is None or item[1] >= monotonic_time())
+
+    def __len__(self):
+        return len(self._items)
+
+
 def cid_from_name(account, ref):
     h = sha256()
     for v in [account, '\0', ref]:
@@ -329,6 +508,38 @@ def monotonic_time():
     return __MONOTONIC_TIME()
 
 
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_DONTNEED = 4
+__POSIX_FADVISE = None
+
+
+def fadvise(fd, advice, offset=0, length=0):
+    """
+    Announce an intention to access file data in a specific pattern
+    (see posix_fadvise(2)). Errors are ignored, this is only advice.
+    """
+    global __POSIX_FADVISE
+    if __POSIX_FADVISE is None:
+        if hasattr(os, 'posix_fadvise'):
+            __POSIX_FADVISE = os.posix_fadvise
+        else:
+            from ctypes import CDLL, c_int, c_int64
+            from ctypes.util import find_library
+            try:
+                libc = CDLL(find_library('c'), use_errno=True)
+                posix_fadvise = libc.posix_fadvise
+                posix_fadvise.argtypes = [c_int, c_int64, c_int64, c_int]
+                __POSIX_FADVISE = posix_fadvise
+            except (OSError, AttributeError):
+                def _no_fadvise(*_args):
+                    return 0
+                __POSIX_FADVISE = _no_fadvise
+    try:
+        __POSIX_FADVISE(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
 def deadline_to_timeout(deadline, check=False):
     """Convert a deadline (`float` seconds) to a timeout (`float` seconds)"""
     dl_to = deadline - monotonic_time()
@@ -0,0 +1,161 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import eventlet
+
+from oio.common.exceptions import ServiceUnavailable
+from oio.common.utils import monotonic_time, wrand_choice_index
+
+
+def service_id(namespace, type_, service):
+    """Build the ID of a service, as known by the load balancer."""
+    tags = service.get('tags', {})
+    return '%s|%s|%s' % (namespace, type_,
+                         tags.get('tag.id') or service['addr'])
+
+
+def service_location(service):
+    """Get the location of a service (or its host if it has none)."""
+    tags = service.get('tags', {})
+    return tags.get('tag.loc') or service['addr'].rsplit(':', 1)[0]
+
+
+class ServiceCache(object):
+    """
+    Local copy of the services registered in the conscience, to select
+    services by weighted random on their scores without asking the proxy.
+
+    Each service type is listed at most once every `ttl` seconds.
+    An expired list is still used during `max_stale` seconds, while it
+    is refreshed in the background.
+    """
+
+    def __init__(self, conscience, namespace, ttl=5.0, max_stale=30.0,
+                 logger=None):
+        """
+        :param conscience: client used to list the services
+        :type conscience: `oio.conscience.client.ConscienceClient`
+        """
+        self.conscience = conscience
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.logger = logger
+        self._snapshots = dict()
+        self._refreshing = set()
+
+    def _refresh(self, type_):
+        services = self.conscience.all_services(type_, full=True)
+        self._snapshots[type_] = (monotonic_time(), services)
+        return services
+
+    def _refresh_in_background(self, type_):
+        try:
+            self._refresh(type_)
+        except Exception as exc:
+            if self.logger:
+                self.logger.warn('Failed to refresh %s services: %s',
+                                 type_, exc)
+        finally:
+            self._refreshing.discard(type_)
+
+    def services(self, type_):
+        """
+        Get the list of services of the specified type,
+        from the cache if it is not too old.
+        """
+        snapshot = self._snapshots.get(type_)
+        age = monotonic_time() - snapshot[0] if snapshot else None
+        if age is None or age > self.ttl + self.max_stale:
+            return self._refresh(type_)
+        if age > self.ttl and type_ not in self._refreshing:
+            self._refreshing.add(type_)
+            eventlet.spawn_n(self._refresh_in_background, type_)
+        return snapshot[1]
+
+    def invalidate(self, type_=None):
+        """Forget the services of one type, or of all types."""
+        if type_ is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(type_, None)
+
+    def choose(self, type_, size=1, slot=None, avoid=None, known=None):
+        """
+        Select `size` distinct services of the specified type.
+
+        :param slot: comma-separated list of slots, the services must
+            belong to one of them
+        :param avoid: IDs of the services that must not be selected
+        :param known: IDs of the services already selected. They are not
+            selected again, and services at the same location are
+            selected only if there are not enough other services.
+        :returns: a list of dictionaries with 'addr', 'id' and 'score'
+            of the selected services, like `LbClient.next_instances`
+        :raises ServiceUnavailable: if not enough services match
+        """
+        slots = set()
+        for name in (slot or '').split(','):
+            name = name.strip()
+            if name and not name.startswith(type_):
+                name = '%s-%s' % (type_, name)
+            if name:
+                slots.add(name)
+        if type_ in slots:
+            slots.clear()
+        excluded = set(avoid or ()) | set(known or ())
+        candidates = list()
+        for service in self.services(type_):
+            tags = service.get('tags', {})
+            if service.get('score', 0) <= 0 or not tags.get('tag.up', True):
+                continue
+            if slots and slots.isdisjoint(
+                    tags.get('tag.slots', '').split(',')):
+                continue
+            srv_id = service_id(self.namespace, type_, service)
+            if srv_id in excluded:
+                continue
+            candidates.append((srv_id, service))
+
+        known_locations = set()
+        if known:
+            by_id = dict()
+            for known_type in set(srv.split('|')[1] for srv in known
+                                  if srv.count('|') == 2):
+                for service in self._snapshots.get(known_type, (0, []))[1]:
+                    by_id[service_id(self.namespace, known_type,
+                                     service)] = service
+            for srv_id in known:
+                if srv_id in by_id:
+                    known_locations.add(service_location(by_id[srv_id]))
+                else:
+                    known_locations.add(
+                        srv_id.rsplit('|', 1)[-1].rsplit(':', 1)[0])
+        far = [c for c in candidates
+               if service_location(c[1]) not in known_locations]
+        if len(far) >= size:
+            candidates = far
+
+        if len(candidates) < size:
+            raise ServiceUnavailable(
+                'found only %d services matching the criteria' %
+                len(candidates))
+        chosen = list()
+        for _ in range(size):
+            index = wrand_choice_index(c[1]['score'] for c in candidates)
+            srv_id, service = candidates.pop(index)
+            chosen.append({'addr': service['addr'], 'id': srv_id,
+                           'score': service['score']})
+        return chosen
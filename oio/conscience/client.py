@@ -14,16 +14,24 @@
 # License along with this library.
 
 from oio.common.client import ProxyClient
+from oio.common.easy_value import float_value, int_value
 from oio.common.exceptions import OioException
 from oio.common.json import json
+from oio.conscience.cache import ServiceCache
 
 
 class LbClient(ProxyClient):
     """Simple load balancer client"""
 
-    def __init__(self, conf, **kwargs):
+    def __init__(self, conf, service_cache=None, **kwargs):
+        """
+        :param service_cache: if set, select services locally,
+            and ask the proxy only if it fails
+        :type service_cache: `oio.conscience.cache.ServiceCache`
+        """
         super(LbClient, self).__init__(
             conf, request_prefix="/lb", **kwargs)
+        self.service_cache = service_cache
 
     def next_instances(self, pool, **kwargs):
         """
@@ -34,6 +42,15 @@ class LbClient(ProxyClient):
         :keyword slot: comma-separated list of slots to poll
         :type slot: `str`
         """
+        if self.service_cache is not None and \
+                set(kwargs).issubset(('size', 'slot')):
+            try:
+                return self.service_cache.choose(
+                    pool, size=int_value(kwargs.get('size'), 1),
+                    slot=kwargs.get('slot'))
+            except Exception as exc:
+                self.logger.debug(
+                    'Failed to select %s services locally: %s', pool, exc)
         params = {'type': pool}
         params.update(kwargs)
         resp, body = self._request('GET', '/choose', params=params)
@@ -88,12 +105,34 @@ class LbClient(ProxyClient):
 class ConscienceClient(ProxyClient):
     """Conscience client. Some calls are actually redirected to LbClient."""
 
-    def __init__(self, conf, **kwargs):
+    def __init__(self, conf, lb_cache_ttl=None, lb_cache_max_stale=None,
+                 **kwargs):
+        """
+        :param lb_cache_ttl: if greater than 0, keep a local list
+            of the services to select them without asking the proxy,
+            and refresh it after this delay
+        :type lb_cache_ttl: `float` seconds
+        :param lb_cache_max_stale: how long an expired list of services
+            is still used while it is being refreshed
+        :type lb_cache_max_stale: `float` seconds
+        """
         super(ConscienceClient, self).__init__(
             conf, request_prefix="/conscience", **kwargs)
+        lb_cache_ttl = float_value(
+            lb_cache_ttl or conf.get('lb_cache_ttl'), 0.0)
+        if lb_cache_ttl > 0.0:
+            self.service_cache = ServiceCache(
+                self, self.ns, ttl=lb_cache_ttl,
+                max_stale=float_value(
+                    lb_cache_max_stale or conf.get('lb_cache_max_stale'),
+                    30.0),
+                logger=self.logger)
+        else:
+            self.service_cache = None
         lb_kwargs = dict(kwargs)
         lb_kwargs.pop("pool_manager", None)
-        self.lb = LbClient(conf, pool_manager=self.pool_manager, **lb_kwargs)
+        self.lb = LbClient(conf, pool_manager=self.pool_manager,
+                           service_cache=self.service_cache, **lb_kwargs)
 
     def next_instances(self, pool, **kwargs):
         """
@@ -104,7 +143,7 @@ class ConscienceClient(ProxyClient):
         :keyword slot: comma-separated list of slots to poll
         :type slot: `str`
         """
-        return self.lb.next_instance(pool, **kwargs)
+        return self.lb.next_instances(pool, **kwargs)
 
     def next_instance(self, pool):
         """Get the next service instance from the specified pool"""
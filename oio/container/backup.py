@@ -23,16 +23,16 @@ try:
 except ImportError:
     import json  # noqa
 
-from collections import OrderedDict
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
 import math
 import re
 import os
-import pickle
+import uuid
 from tarfile import TarInfo, REGTYPE, NUL, PAX_FORMAT, BLOCKSIZE, XHDTYPE, \
                     DIRTYPE, AREGTYPE, InvalidHeaderError
 
-from md5py import MD5
-
 
 from redis import ConnectionError
 from werkzeug.wrappers import Response
@@ -49,6 +49,9 @@ from oio.common.logger import get_logger
 from oio.common.wsgi import WerkzeugApp
 from oio.common.redis_conn import RedisConn
 from oio.common.storage_method import STORAGE_METHODS
+from oio.common.easy_value import int_value
+from oio.common.utils import depaginate
+from oio.container.checksum import dump_md5, load_md5, new_md5
 
 RANGE_RE = re.compile(r"^bytes=(\d+)-(\d+)$")
 
@@ -96,7 +99,7 @@ class OioTarEntry(object):
             self._buf = tarinfo.tobuf(format=PAX_FORMAT)
             return
         elif self.name == CONTAINER_MANIFEST:
-            tarinfo.size = len(json.dumps(data, sort_keys=True))
+            tarinfo.size = data.size
             self._filesize = tarinfo.size
             self._buf = tarinfo.tobuf(format=PAX_FORMAT)
             return
@@ -174,6 +177,185 @@ class OioTarEntry(object):
         return self._checksums
 
 
+class Manifest(object):
+    """
+    Map of the tar blocks of a container dump.
+
+    The entries are stored in Redis by segments of consecutive entries,
+    so only the segments covering the requested blocks are loaded.
+    The entry describing the manifest itself (always the first one)
+    is stored in the index, with the first block and the size of each
+    segment.
+    """
+
+    def __init__(self, redis, index):
+        self.redis = redis
+        self.index = index
+        self._starts = [seg[0] for seg in index['segments']]
+        self._offsets = list()
+        offset = len(self._head())
+        for seg in index['segments']:
+            self._offsets.append(offset)
+            offset += seg[1]
+        # Index, raw data, entries and first blocks of the entries
+        # of the last segment loaded
+        self._loaded = (None, None, None, None)
+
+    @classmethod
+    def load(cls, redis, key):
+        """Load the manifest whose index is stored at `key`, if any."""
+        data = redis.get(key)
+        if not data:
+            return None
+        index = json.loads(data, object_pairs_hook=OrderedDict)
+        if not isinstance(index, dict):
+            # Manifest stored as a whole by a previous version
+            return None
+        return cls(redis, index)
+
+    @classmethod
+    def build(cls, redis, key, entries, ttl, segment_size=1000):
+        """
+        Place `entries` one after the other, after the manifest itself,
+        and store them in Redis.
+
+        :param entries: manifest entries, without block positions
+        :returns: the manifest, or `None` if there is no entry
+        """
+        prefix = '%s:%s' % (key, uuid.uuid4().hex)
+        segments = list()
+        segment = list()
+        start_block = 0
+        # Size of the manifest before block positions are shifted
+        size = 0
+
+        def _store(seg_idx, segment):
+            data = json.dumps(segment, sort_keys=True)
+            redis.set('%s:%d' % (prefix, seg_idx), data, ex=ttl)
+            return len(data)
+
+        for entry in entries:
+            entry['start_block'] = start_block
+            start_block += entry['blocks']
+            entry['end_block'] = start_block - 1
+            segment.append(entry)
+            if len(segment) >= segment_size:
+                size += _store(len(segments), segment)
+                segments.append(None)
+                segment = list()
+        if segment:
+            size += _store(len(segments), segment)
+            segments.append(None)
+        if not segments:
+            return None
+
+        head = {
+            'name': CONTAINER_MANIFEST,
+            'size': 0,
+            'hdr_blocks': 1,  # a simple PAX header consume only 1 block
+            'blocks': 0,
+            'start_block': 0,
+            'slo': None,
+        }
+        size += len(json.dumps(head, sort_keys=True))
+        # ensure that we reserved enough blocks after shifting blocks
+        head['blocks'] = 1 + int(math.ceil(size / float(BLOCKSIZE))) * 2
+        head['end_block'] = head['blocks'] - 1
+
+        # Shift the entries after the manifest, and measure
+        # the size of its final version.
+        size = 0
+        pipeline = redis.pipeline()
+        for seg_idx in range(len(segments)):
+            seg_key = '%s:%d' % (prefix, seg_idx)
+            segment = json.loads(redis.get(seg_key),
+                                 object_pairs_hook=OrderedDict)
+            for entry in segment:
+                entry['start_block'] += head['blocks']
+                entry['end_block'] += head['blocks']
+            data = json.dumps(segment, sort_keys=True)
+            segments[seg_idx] = (segment[0]['start_block'], len(data))
+            size += len(data)
+            # Also refresh the expiration time
+            pipeline.set(seg_key, data, ex=ttl)
+        pipeline.execute()
+
+        # Enclosing brackets, and manifest size (which is included
+        # in the manifest)
+        size += 2 + len(json.dumps(head, sort_keys=True)) - 1
+        head['size'] = size
+        while head['size'] != size + len(str(head['size'])):
+            head['size'] = size + len(str(head['size']))
+        assert 1 + (head['size'] - 1) // BLOCKSIZE < head['blocks'], \
+            "Incorrect size for manifest blocks"
+
+        index = {'prefix': prefix,
+                 'blocks': head['blocks'] + start_block,
+                 'manifest': head,
+                 'segments': segments}
+        redis.set(key, json.dumps(index, sort_keys=True), ex=ttl)
+        return cls(redis, index)
+
+    @property
+    def blocks(self):
+        """Total number of blocks of the dump."""
+        return self.index['blocks']
+
+    @property
+    def size(self):
+        """Size of the manifest, serialized as JSON."""
+        return self.index['manifest']['size']
+
+    def _head(self):
+        return '[' + json.dumps(self.index['manifest'], sort_keys=True)
+
+    def _load(self, seg_idx):
+        if self._loaded[0] != seg_idx:
+            data = self.redis.get('%s:%d' % (self.index['prefix'], seg_idx))
+            if data is None:
+                raise ServiceUnavailable("Container manifest has expired")
+            segment = json.loads(data, object_pairs_hook=OrderedDict)
+            self._loaded = (seg_idx, data, segment,
+                            [entry['start_block'] for entry in segment])
+        return self._loaded
+
+    def entries(self, block=0):
+        """
+        Yield entries, starting with the one containing `block`.
+        """
+        manifest = self.index['manifest']
+        if block <= manifest['end_block']:
+            yield manifest
+            block = manifest['end_block'] + 1
+        seg_idx = max(bisect_right(self._starts, block) - 1, 0)
+        entry_idx = max(bisect_right(self._load(seg_idx)[3], block) - 1, 0)
+        while seg_idx < len(self._starts):
+            segment = self._load(seg_idx)[2]
+            for entry in segment[entry_idx:]:
+                yield entry
+            seg_idx += 1
+            entry_idx = 0
+
+    def read(self, start, end):
+        """
+        Get the bytes `start` to `end` (excluded) of the manifest,
+        serialized as JSON.
+        """
+        seg_idx = bisect_right(self._offsets, start) - 1
+        if seg_idx < 0:
+            data, offset = self._head(), 0
+            seg_idx = 0
+        else:
+            data, offset = '', self._offsets[seg_idx]
+        while offset + len(data) < end and seg_idx < len(self._offsets):
+            # Segments are stored exactly as they are serialized
+            data += ', ' + self._load(seg_idx)[1][1:-1]
+            seg_idx += 1
+        if seg_idx == len(self._offsets):
+            data += ']'
+        return data[start - offset:end - offset]
+
+
 class LimitedStream(object):
     """
     Wrap a stream to read no more than size bytes from input stream.
@@ -207,9 +389,9 @@ class LimitedStream(object):
                 self.current_chunk = val
 
                 if val['offset'] == self.offset:
-                    self.md5 = MD5()
+                    self.md5 = new_md5()
                 else:
-                    self.md5 = pickle.loads(val['md5'])
+                    self.md5 = load_md5(val['md5'])
                 self.current_chunk_idx = idx
                 return
         if self.offset < self.entry['size']:
@@ -222,7 +404,7 @@ class LimitedStream(object):
         """Reset the current chunk and return an empty data block."""
         # save MD5 internal status in current_chunk
         if self.current_chunk:
-            self.current_chunk['md5'] = pickle.dumps(self.md5)
+            self.current_chunk['md5'] = dump_md5(self.md5)
             self.md5 = None
             self.current_chunk = None
         return ""
@@ -271,12 +453,16 @@ class ContainerTarFile(object):
     """ Expose a File Object API to be used with wrap_file """
 
     def __init__(self, storage_api, account, container,
-                 range_, oio_map, logger):
+                 range_, manifest, logger):
+        """
+        :type manifest: `Manifest`
+        """
         self.acct = account
         self.container = container
         self.range_ = range_
-        self.oio_map = oio_map
-        self.manifest = oio_map[:]
+        self.manifest = manifest
+        self.entries = manifest.entries(range_[0])
+        self.entry = None
         self.storage = storage_api
         self.logger = logger
         if len(range_) != 2:
@@ -376,9 +562,9 @@ class ContainerTarFile(object):
             data = json.dumps(meta['properties'], sort_keys=True)
         elif name == CONTAINER_MANIFEST:
             struct = self.manifest
-            data = json.dumps(self.manifest, sort_keys=True)
+            data = None
 
-        size = len(data)
+        size = len(data) if data is not None else self.manifest.size
         mem = ""
 
         if size != entry['size']:
@@ -411,7 +597,10 @@ class ContainerTarFile(object):
         else:
             end = range_[1] * BLOCKSIZE + BLOCKSIZE
 
-        mem += data[start:end]
+        if data is None:
+            mem += self.manifest.read(start, end)
+        else:
+            mem += data[start:end]
 
         if last:
             mem += NUL * (BLOCKSIZE - remainder)
@@ -442,35 +631,33 @@ class ContainerTarFile(object):
             self.logger.debug("EOF reached")
             return data
 
-        for val in self.oio_map[:]:
-            if self.range_[0] > val['end_block']:
-                self.oio_map.remove(val)
-                continue
+        while self.entry is None or self.range_[0] > self.entry['end_block']:
+            self.entry = next(self.entries, None)
+            if self.entry is None:
+                return data
+        val = self.entry
 
-            if size > 0 and val['end_block'] - self.range_[0] > size:
-                # TODO (mbonfils) add a unit test
-                end_block = self.range_[0] + size
-            else:
-                end_block = min(self.range_[1], val['end_block'])
+        if size > 0 and val['end_block'] - self.range_[0] > size:
+            # TODO (mbonfils) add a unit test
+            end_block = self.range_[0] + size
+        else:
+            end_block = min(self.range_[1], val['end_block'])
 
-            assert self.range_[0] >= val['start_block']
-            assert self.range_[0] <= self.range_[1], \
-                "Got start %d / end %d" % (self.range_[0], self.range_[1])
+        assert self.range_[0] >= val['start_block']
+        assert self.range_[0] <= self.range_[1], \
+            "Got start %d / end %d" % (self.range_[0], self.range_[1])
 
-            _s = val['start_block']
-            # map ranges to object range
-            range_ = (self.range_[0] - _s, end_block - _s)
-            self.range_ = (end_block + 1, self.range_[1])
+        _s = val['start_block']
+        # map ranges to object range
+        range_ = (self.range_[0] - _s, end_block - _s)
+        self.range_ = (end_block + 1, self.range_[1])
 
-            if 'name' not in val:
-                data = NUL * (range_[1] - range_[0] + 1) * BLOCKSIZE
-            elif val['name'] in (CONTAINER_PROPERTIES, CONTAINER_MANIFEST):
-                data = self.create_tar_oio_properties(val, range_, val['name'])
-            else:
-                data = self.create_tar_oio_stream(val, range_)
-            if end_block == val['end_block']:
-                self.oio_map.remove(val)
-            break
+        if 'name' not in val:
+            data = NUL * (range_[1] - range_[0] + 1) * BLOCKSIZE
+        elif val['name'] in (CONTAINER_PROPERTIES, CONTAINER_MANIFEST):
+            data = self.create_tar_oio_properties(val, range_, val['name'])
+        else:
+            data = self.create_tar_oio_stream(val, range_)
 
         return data
 
@@ -779,6 +966,11 @@ class ContainerBackup(RedisConn, WerkzeugApp):
     # Number of blocks to serve to avoid splitting headers (1MiB)
     BLOCK_ALIGNMENT = 2048
 
+    # Number of objects inspected in parallel to build a manifest
+    MANIFEST_CONCURRENCY = 10
+    # Number of manifest entries stored in each Redis key
+    MANIFEST_SEGMENT_SIZE = 1000
+
     def __init__(self, conf):
         if conf:
             self.conf = read_conf(conf['key_file'],
@@ -804,24 +996,53 @@ class ContainerBackup(RedisConn, WerkzeugApp):
         """Redis connection object"""
         return self.conn
 
-    @redis_cnx
-    def generate_manifest(self, account, container):
-        """
-        Generate a static manifest of a container.
-        It will help to find quickly which part of object app have to serve
-        Manifest is cached into Redis with REDIS_TIMEOUT delay
+    def _tar_entry(self, account, container, name):
+        try:
+            return OioTarEntry(self.proxy, account, container, name)
+        except Exception as err:
+            return err
+
+    def _object_entries(self, account, container):
         """
-        if not container:
-            raise exc.NoSuchContainer()
+        Yield the manifest entries of the objects of a container,
+        in the order of the listing. The objects are inspected
+        concurrently, since each one requires several requests.
 
-        # TODO hash_map should contains if deleted or version flags are set
-        hash_map = "container_streaming:{0}/{1}".format(account, container)
-        cache = self.redis.get(hash_map)
-        if cache:
-            self.logger.debug("using cache")
-            return json.loads(cache, object_pairs_hook=OrderedDict)
+        The service is not monkey-patched, the requests are blocking:
+        the inspections run in a pool of native threads.
+        """
+        concurrency = int_value(self.conf.get('manifest_concurrency'),
+                                self.MANIFEST_CONCURRENCY)
+        objs = depaginate(
+            self.proxy.object_list,
+            listing_key=lambda x: x['objects'],
+            marker_key=lambda x: x.get('next_marker'),
+            truncated_key=lambda x: x['truncated'],
+            account=account,
+            container=container)
+        pool = ThreadPool(concurrency)
+        in_flight = deque()
+        try:
+            for obj in objs:
+                # FIXME: should we backup deleted objects?
+                if obj['deleted']:
+                    continue
+                in_flight.append(pool.apply_async(
+                    self._tar_entry, (account, container, obj['name'])))
+                while len(in_flight) >= concurrency:
+                    yield in_flight.popleft().get()
+            while in_flight:
+                yield in_flight.popleft().get()
+        finally:
+            # Do not start the inspections not started yet,
+            # wait for the running ones.
+            pool.terminate()
 
-        map_objs = []
+    def _manifest_entries(self, account, container):
+        """
+        Yield the entries of the manifest of a container,
+        without their block positions.
+        """
         start_block = 0
 
         meta = self.proxy.container_get_properties(account, container)
@@ -834,88 +1055,62 @@ class ContainerBackup(RedisConn, WerkzeugApp):
                 'size': tar.filesize,
                 'hdr_blocks': tar.header_blocks,
                 'blocks': tar.header_blocks + tar.data_blocks,
-                'start_block': start_block,
             }
             start_block += entry['blocks']
-            entry['end_block'] = start_block - 1
-            map_objs.append(entry)
+            yield entry
 
-        objs = self.proxy.object_list(account, container)
-        for obj in sorted(objs['objects'], key=lambda x: x['name']):
-            # FIXME: should we backup deleted objects?
-            if obj['deleted']:
-                continue
-            tar = OioTarEntry(self.proxy, account, container, obj['name'])
+        for tar in self._object_entries(account, container):
+            if isinstance(tar, Exception):
+                raise tar
             if (start_block / self.BLOCK_ALIGNMENT) != \
                     ((start_block + tar.header_blocks) / self.BLOCK_ALIGNMENT):
                 # header is over boundary, we have to add padding blocks
                 padding = (self.BLOCK_ALIGNMENT -
                            divmod(start_block, self.BLOCK_ALIGNMENT)[1])
-                map_objs.append({
+                yield {
                     'blocks': padding,
                     'size': padding * BLOCKSIZE,
-                    'start_block': start_block,
                     'slo': None,
                     'hdr_blocks': padding,
-                    'end_block': start_block + padding - 1
-                })
+                }
                 start_block += padding
             entry = {
-                'name': obj['name'],
+                'name': tar.name,
                 'size': tar.filesize,
                 'hdr_blocks': tar.header_blocks,
                 'blocks': tar.header_blocks + tar.data_blocks,
-                'start_block': start_block,
                 'slo': tar.slo,
                 'checksums': tar.checksums,
             }
             start_block += entry['blocks']
-            entry['end_block'] = start_block - 1
-            map_objs.append(entry)
-
-        if not map_objs:
-            return map_objs
+            yield entry
 
-        entry = {
-            'name': CONTAINER_MANIFEST,
-            'size': 0,
-            'hdr_blocks': 1,  # a simple PAX header consume only 1 block
-            'blocks': 0,
-            'start_block': 0,
-            'slo': None,
-        }
-        map_objs.insert(0, entry)
-
-        entry['size'] = len(json.dumps(map_objs, sort_keys=True))
-        # ensure that we reserved enough blocks after recomputing offset
-        entry['blocks'] = \
-            1 + int(math.ceil(entry['size'] / float(BLOCKSIZE))) * 2
-
-        tar = OioTarEntry(self.proxy, account, container, CONTAINER_MANIFEST,
-                          data=map_objs)
-
-        assert tar.header_blocks == 1, "Incorrect size for hdr_blocks"
-        assert tar.data_blocks <= entry['blocks']
-
-        # fix start_block and end_block
-        start = 0
-        for _entry in map_objs:
-            _entry['start_block'] = start
-            start += _entry['blocks']
-            _entry['end_block'] = start - 1
+    @redis_cnx
+    def generate_manifest(self, account, container):
+        """
+        Generate a static manifest of a container.
+        It will help to find quickly which part of object app have to serve
+        Manifest is cached into Redis with REDIS_TIMEOUT delay
 
-        tar2 = OioTarEntry(self.proxy, account, container, CONTAINER_MANIFEST,
-                           data=map_objs)
-        entry['size'] = tar2.filesize
+        :rtype: `Manifest`, or `None` if the container is empty
+        """
+        if not container:
+            raise exc.NoSuchContainer()
 
-        assert tar2.header_blocks == tar.header_blocks
-        assert tar2.data_blocks <= entry['blocks'], \
-            "got %d instead of %d" % (tar2.data_blocks, tar.data_blocks)
+        # TODO hash_map should contains if deleted or version flags are set
+        hash_map = "container_streaming:{0}/{1}".format(account, container)
+        manifest = Manifest.load(self.redis, hash_map)
+        if manifest:
+            self.logger.debug("using cache")
+            return manifest
 
+        segment_size = int_value(self.conf.get('manifest_segment_size'),
+                                 self.MANIFEST_SEGMENT_SIZE)
+        manifest = Manifest.build(
+            self.redis, hash_map, self._manifest_entries(account, container),
+            self.REDIS_TIMEOUT, segment_size=segment_size)
         self.logger.debug("add entry to cache")
-        self.redis.set(hash_map, json.dumps(map_objs, sort_keys=True),
-                       ex=self.REDIS_TIMEOUT)
-        return map_objs
+        return manifest
 
     def _do_head(self, _, account, container):
         """
@@ -933,8 +1128,8 @@ class ContainerBackup(RedisConn, WerkzeugApp):
             return Response(status=204)
 
         hdrs = {
-            'X-Blocks': sum([i['blocks'] for i in results]),
-            'Content-Length': sum([i['blocks'] for i in results]) * BLOCKSIZE,
+            'X-Blocks': results.blocks,
+            'Content-Length': results.blocks * BLOCKSIZE,
             'Accept-Ranges': 'bytes',
             'Content-Type': 'application/tar',
         }
@@ -976,7 +1171,7 @@ class ContainerBackup(RedisConn, WerkzeugApp):
             self.logger.info("no data for %s %s", account, container)
             return Response(status=204)
 
-        blocks = sum([i['blocks'] for i in results])
+        blocks = results.blocks
         length = blocks * BLOCKSIZE
 
         if 'Range' not in req.headers:
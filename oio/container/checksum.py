@@ -0,0 +1,130 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+"""
+MD5 checksums whose intermediate state can be saved, and resumed later,
+possibly by another process.
+
+`hashlib` does not expose the state of its hash objects, so the MD5
+functions of OpenSSL's libcrypto are called directly, and the MD5_CTX
+structure is saved as is. The pure-Python `md5py` module is used when
+libcrypto is not available.
+"""
+
+from base64 import b64decode, b64encode
+from ctypes import CDLL, c_char_p, c_size_t, c_void_p, \
+    create_string_buffer, memmove
+from ctypes.util import find_library
+from hashlib import md5 as _native_md5
+from binascii import hexlify
+import pickle
+
+from md5py import MD5
+
+
+# MD5_CTX: A, B, C, D, Nl, Nh, data[16], num (32 bits each)
+MD5_CTX_SIZE = 92
+# Allocate more, in case the structure is bigger than expected
+_CTX_ALLOC_SIZE = 256
+STATE_PREFIX = 'md5ctx:'
+
+_LIBCRYPTO = None
+
+
+def _load_libcrypto():
+    lib = CDLL(find_library('crypto'))
+    for func in ('MD5_Init', 'MD5_Update', 'MD5_Final'):
+        getattr(lib, func).restype = None
+    lib.MD5_Init.argtypes = [c_void_p]
+    lib.MD5_Update.argtypes = [c_void_p, c_char_p, c_size_t]
+    lib.MD5_Final.argtypes = [c_void_p, c_void_p]
+    return lib
+
+
+def _libcrypto():
+    """Get libcrypto, or `False` if it cannot be used."""
+    global _LIBCRYPTO
+    if _LIBCRYPTO is None:
+        try:
+            _LIBCRYPTO = _load_libcrypto()
+            # Ensure the layout of MD5_CTX is the one we expect
+            md5 = ResumableMD5()
+            md5.update(b'x' * 100)
+            md5 = ResumableMD5(md5.state)
+            md5.update(b'y' * 100)
+            if md5.hexdigest() != \
+                    _native_md5(b'x' * 100 + b'y' * 100).hexdigest():
+                raise ValueError('unexpected MD5_CTX layout')
+        except (OSError, AttributeError, TypeError, ValueError):
+            _LIBCRYPTO = False
+    return _LIBCRYPTO
+
+
+class ResumableMD5(object):
+    """MD5 computed by libcrypto, exposing its internal state."""
+
+    def __init__(self, state=None):
+        self._ctx = create_string_buffer(_CTX_ALLOC_SIZE)
+        if state is None:
+            _LIBCRYPTO.MD5_Init(self._ctx)
+        else:
+            if len(state) != MD5_CTX_SIZE:
+                raise ValueError('Invalid MD5 state')
+            memmove(self._ctx, state, MD5_CTX_SIZE)
+
+    @property
+    def state(self):
+        """Internal state of the checksum, as bytes."""
+        return self._ctx.raw[:MD5_CTX_SIZE]
+
+    def update(self, data):
+        _LIBCRYPTO.MD5_Update(self._ctx, data, len(data))
+
+    def digest(self):
+        # MD5_Final() alters the context, work on a copy
+        ctx = create_string_buffer(self._ctx.raw, _CTX_ALLOC_SIZE)
+        out = create_string_buffer(16)
+        _LIBCRYPTO.MD5_Final(out, ctx)
+        return out.raw
+
+    def hexdigest(self):
+        return hexlify(self.digest()).decode('ascii')
+
+
+def new_md5():
+    """Get a new resumable MD5 checksum."""
+    if _libcrypto():
+        return ResumableMD5()
+    return MD5()
+
+
+def dump_md5(md5):
+    """
+    Save the state of a checksum returned by `new_md5()` or `load_md5()`,
+    as a string which can be serialized in JSON.
+    """
+    if isinstance(md5, ResumableMD5):
+        return STATE_PREFIX + b64encode(md5.state).decode('ascii')
+    return pickle.dumps(md5)
+
+
+def load_md5(state):
+    """Resume a checksum whose state has been saved by `dump_md5()`."""
+    if not state.startswith(STATE_PREFIX):
+        # Pure-Python checksum (also saved by previous versions)
+        return pickle.loads(str(state))
+    if not _libcrypto():
+        raise ValueError('Cannot resume MD5: libcrypto is not available')
+    return ResumableMD5(b64decode(state[len(STATE_PREFIX):]))
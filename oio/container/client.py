@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+from copy import deepcopy
+from functools import wraps
 import warnings
 
 try:
@@ -21,12 +23,16 @@ except ImportError:
     from urllib import unquote_plus
 from oio.common.client import ProxyClient
 from oio.common.decorators import ensure_headers
+from oio.common.easy_value import float_value, int_value
 from oio.common.json import json
 from oio.common import exceptions
+from oio.common.utils import LRUCache, cid_from_name, monotonic_time
 
 CONTENT_HEADER_PREFIX = 'x-oio-content-meta-'
 SYSMETA_KEYS = ("chunk-method", "ctime", "deleted", "hash", "hash-method",
                 "id", "length", "mime-type", "name", "policy", "version")
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, float('inf'))
 
 
 def extract_content_headers_meta(headers):
@@ -51,15 +57,146 @@ def extract_content_headers_meta(headers):
     return resp_headers
 
 
+def content_cache_stats(perfdata, hit, duration):
+    """
+    Count a cache hit or miss in `perfdata`, and add the duration
+    of the call to the matching latency histogram.
+    """
+    counter = 'content_cache_hits' if hit else 'content_cache_misses'
+    perfdata[counter] = perfdata.get(counter, 0) + 1
+    hits = perfdata.get('content_cache_hits', 0)
+    perfdata['content_cache_hit_ratio'] = \
+        float(hits) / (hits + perfdata.get('content_cache_misses', 0))
+    histogram = perfdata.setdefault(
+        'content_cache_hit_latency' if hit else 'content_cache_miss_latency',
+        dict())
+    for bound in LATENCY_BUCKETS:
+        if duration <= bound:
+            histogram[bound] = histogram.get(bound, 0) + 1
+            break
+
+
+def invalidate_content_cache(fnc):
+    """
+    Forget the cached descriptions of the object modified by the
+    decorated method, once the modification is done.
+    """
+    @wraps(fnc)
+    def _invalidate_content_cache(self, account=None, reference=None,
+                                  path=None, *args, **kwargs):
+        try:
+            return fnc(self, account, reference, path, *args, **kwargs)
+        finally:
+            self.content_cache_invalidate(account, reference, path,
+                                          cid=kwargs.get('cid'))
+    return _invalidate_content_cache
+
+
 class ContainerClient(ProxyClient):
     """
     Intermediate level class to manage containers.
     """
 
-    def __init__(self, conf, **kwargs):
+    def __init__(self, conf, content_cache_size=None, content_cache_ttl=None,
+                 **kwargs):
+        """
+        :param content_cache_size: number of objects whose description
+            is kept in memory (disabled by default). Descriptions are
+            forgotten when the object is modified through this client,
+            but modifications done by other clients are seen only
+            when the description expires.
+        :type content_cache_size: `int`
+        :param content_cache_ttl: how long a description is kept
+        :type content_cache_ttl: `float` seconds
+        """
         super(ContainerClient, self).__init__(conf,
                                               request_prefix="/container",
                                               **kwargs)
+        cache_size = int_value(content_cache_size,
+                               int_value(conf.get('content_cache_size'), 0))
+        cache_ttl = float_value(content_cache_ttl,
+                                float_value(conf.get('content_cache_ttl'),
+                                            60.0))
+        self.content_cache = None
+        if cache_size > 0:
+            self.content_cache = LRUCache(cache_size, ttl=cache_ttl)
+        # Incremented each time the cache is invalidated, to avoid
+        # caching a description fetched before the invalidation.
+        self._content_cache_gen = 0
+
+    def _content_cache_key(self, account=None, reference=None, path=None,
+                           cid=None):
+        if self.content_cache is None or not path:
+            return None
+        if cid:
+            return cid.upper(), path
+        if account is None or reference is None:
+            return None
+        return cid_from_name(account, reference), path
+
+    def _cached_content(self, key, variant, fetch, perfdata=None):
+        """
+        Get the object description identified by `key` and `variant`
+        from the cache, or call `fetch` and cache its result.
+        """
+        if key is None:
+            return fetch()
+        start = monotonic_time()
+        variants = self.content_cache.get(key)
+        value = variants.get(variant) if variants is not None else None
+        hit = value is not None
+        if hit:
+            value = deepcopy(value)
+        else:
+            gen = self._content_cache_gen
+            value = fetch()
+            if gen == self._content_cache_gen:
+                if variants is None or key not in self.content_cache:
+                    # Existing variants are not put back in the cache,
+                    # that would extend their lifetime.
+                    variants = dict()
+                    self.content_cache.put(key, variants)
+                variants[variant] = deepcopy(value)
+        if perfdata is None:
+            perfdata = self.perfdata
+        if perfdata is not None:
+            content_cache_stats(perfdata, hit, monotonic_time() - start)
+        return value
+
+    def content_cache_invalidate(self, account=None, reference=None,
+                                 path=None, cid=None):
+        """
+        Forget the cached descriptions of an object (all its versions),
+        or of all objects if `path` is not specified.
+        """
+        if self.content_cache is None:
+            return
+        self._content_cache_gen += 1
+        key = self._content_cache_key(account, reference, path, cid=cid)
+        if key is None:
+            self.content_cache.clear()
+        else:
+            self.content_cache.pop(key)
+
+    def content_cache_event(self, event):
+        """
+        Forget the cached descriptions of the object an event is about.
+        Meant to be fed with the events of other clients,
+        from an event consumer.
+
+        :param event: an event as emitted by meta2 services
+        :type event: `dict`
+        """
+        if self.content_cache is None or \
+                not event.get('event', '').startswith('storage.content.'):
+            return
+        url = event.get('url') or {}
+        if url.get('path'):
+            self.content_cache_invalidate(
+                url.get('account'), url.get('user'), url['path'],
+                cid=url.get('id'))
+        else:
+            self.content_cache_invalidate()
 
     def _make_uri(self, target):
         """
@@ -389,6 +526,7 @@ class ContainerClient(ProxyClient):
         return resp.headers, body
 
     @ensure_headers
+    @invalidate_content_cache
     def content_create(self, account=None, reference=None, path=None,
                        size=None, checksum=None, data=None, cid=None,
                        content_id=None, stgpol=None, version=None,
@@ -451,6 +589,7 @@ class ContainerClient(ProxyClient):
             headers=hdrs, **kwargs)
         return resp, body
 
+    @invalidate_content_cache
     def content_drain(self, account=None, reference=None, path=None, cid=None,
                       version=None, **kwargs):
         uri = self._make_uri('content/drain')
@@ -459,6 +598,7 @@ class ContainerClient(ProxyClient):
         resp, _ = self._direct_request('POST', uri, params=params, **kwargs)
         return resp.status == 204
 
+    @invalidate_content_cache
     def content_delete(self, account=None, reference=None, path=None, cid=None,
                        version=None, **kwargs):
         """
@@ -517,6 +657,10 @@ class ContainerClient(ProxyClient):
             return results
         except Exception:
             raise
+        finally:
+            for obj in paths:
+                self.content_cache_invalidate(account, reference, obj,
+                                              cid=cid)
 
     def content_locate(self, account=None, reference=None, path=None, cid=None,
                        content=None, version=None, properties=True, **kwargs):
@@ -534,6 +678,19 @@ class ContainerClient(ProxyClient):
         :returns: a tuple with content metadata `dict` as first element
             and chunk `list` as second element
         """
+        key = None
+        if not content:
+            key = self._content_cache_key(account, reference, path, cid=cid)
+        return self._cached_content(
+            key, ('locate', version, bool(properties)),
+            lambda: self._content_locate(
+                account, reference, path, cid=cid, content=content,
+                version=version, properties=properties, **kwargs),
+            perfdata=kwargs.get('perfdata'))
+
+    def _content_locate(self, account=None, reference=None, path=None,
+                        cid=None, content=None, version=None,
+                        properties=True, **kwargs):
         uri = self._make_uri('content/locate')
         params = self._make_params(account, reference, path, cid=cid,
                                    content=content, version=version)
@@ -581,6 +738,20 @@ class ContainerClient(ProxyClient):
         """
         Get a description of the content along with its user properties.
         """
+        key = None
+        if not content:
+            key = self._content_cache_key(account, reference, path, cid=cid)
+        return self._cached_content(
+            key, ('show', version,
+                  tuple(sorted(properties)) if properties else None),
+            lambda: self._content_show(
+                account, reference, path, properties=properties, cid=cid,
+                content=content, version=version, **kwargs),
+            perfdata=kwargs.get('perfdata'))
+
+    def _content_show(self, account=None, reference=None, path=None,
+                      properties=None, cid=None, content=None, version=None,
+                      **kwargs):
         uri = self._make_uri('content/get_properties')
         params = self._make_params(account, reference, path,
                                    cid=cid, content=content,
@@ -602,6 +773,7 @@ class ContainerClient(ProxyClient):
                                  properties=properties, cid=cid,
                                  version=version, **kwargs)
 
+    @invalidate_content_cache
     def content_set_properties(self, account=None, reference=None, path=None,
                                properties={}, cid=None, version=None,
                                **kwargs):
@@ -617,6 +789,7 @@ class ContainerClient(ProxyClient):
         _resp, _body = self._direct_request(
             'POST', uri, data=data, params=params, **kwargs)
 
+    @invalidate_content_cache
     def content_del_properties(self, account=None, reference=None, path=None,
                                properties=[], cid=None, version=None,
                                **kwargs):
@@ -652,6 +825,7 @@ class ContainerClient(ProxyClient):
             'POST', uri, data=data, params=params, **kwargs)
         return body
 
+    @invalidate_content_cache
     def content_truncate(self, account=None, reference=None, path=None,
                          cid=None, size=0, **kwargs):
         uri = self._make_uri('content/truncate')
@@ -661,6 +835,7 @@ class ContainerClient(ProxyClient):
             'POST', uri, params=params, **kwargs)
         return body
 
+    @invalidate_content_cache
     def content_purge(self, account=None, reference=None, path=None, cid=None,
                       maxvers=None, **kwargs):
         uri = self._make_uri('content/purge')
@@ -1,4 +1,4 @@
-# Copyright (C) 2015-2017 OpenIO SAS, as part of OpenIO SDS
+# Copyright (C) 2015-2018 OpenIO SAS, as part of OpenIO SDS
 #
 # This program is free software: you can redistribute it and/or modify
 # it under the terms of the GNU Affero General Public License as
@@ -21,14 +21,22 @@ from __future__ import print_function
 import os
 import csv
 import sys
+import json
+from collections import defaultdict, deque
+from functools import partial
 from io import StringIO
 import argparse
 
+from eventlet import Semaphore
 from eventlet.event import Event
 from eventlet.greenpool import GreenPool
+from six.moves.urllib_parse import urlparse
 
 from oio.common import exceptions as exc
+from oio.common.constants import HEADER_PREFIX
+from oio.common.easy_value import true_value
 from oio.common.storage_method import STORAGE_METHODS
+from oio.common.utils import LRUCache
 from oio.account.client import AccountClient
 from oio.container.client import ContainerClient
 from oio.blob.client import BlobClient
@@ -60,19 +68,117 @@ class Target(object):
         return s
 
 
+class Checkpoint(object):
+    """
+    Keep track of the progress of a crawl in a file, to be able to resume
+    it. Each line is a JSON object telling that a container has been
+    completely checked, or up to which object (marker) it has been checked.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.markers = dict()
+        if os.path.exists(path):
+            with open(path) as fd:
+                for line in fd:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line may be incomplete after a crash
+                        continue
+                    key = (entry['account'], entry['container'])
+                    if entry.get('done'):
+                        self.done.add(key)
+                        self.markers.pop(key, None)
+                    else:
+                        self.markers[key] = entry['marker']
+        self._file = open(path, 'a')
+
+    def is_done(self, account, container):
+        return (account, container) in self.done
+
+    def marker(self, account, container):
+        """Get the name of the last object checked in the container."""
+        return self.markers.get((account, container))
+
+    def save(self, account, container, marker=None, done=False):
+        entry = {'account': account, 'container': container}
+        if done:
+            entry['done'] = True
+            self.done.add((account, container))
+            self.markers.pop((account, container), None)
+        else:
+            entry['marker'] = marker
+            self.markers[(account, container)] = marker
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ContainerWalk(object):
+    """
+    Follow the objects of a container being checked, page by page,
+    to know up to which object the container has been checked.
+    """
+
+    def __init__(self, account, container):
+        self.account = account
+        self.container = container
+        # [last object name, objects still being checked]
+        self.pages = deque()
+        self.marker = None
+        self.listed = False
+
+    def add_page(self, objects):
+        page = [objects[-1]['name'], len(objects)]
+        self.pages.append(page)
+        return page
+
+    def object_done(self, page):
+        """
+        Tell that an object of `page` has been checked.
+        Return True if the checked marker has advanced.
+        """
+        page[1] -= 1
+        progress = False
+        while self.pages and self.pages[0][1] <= 0:
+            self.marker = self.pages.popleft()[0]
+            progress = True
+        return progress
+
+    @property
+    def complete(self):
+        return self.listed and not self.pages
+
+
+class Countdown(object):
+    """Call `callback` once `done()` has been called `count` times."""
+
+    def __init__(self, count, callback):
+        self.count = count
+        self.callback = callback
+
+    def done(self):
+        self.count -= 1
+        if self.count == 0:
+            self.callback()
+
+
 class Checker(object):
     def __init__(self, namespace, concurrency=50,
                  error_file=None, rebuild_file=None, full=True,
-                 limit_listings=0, request_attempts=1):
+                 request_attempts=1, cache_size=1000,
+                 concurrency_per_rawx=10, checkpoint_file=None,
+                 checksum=False):
         self.pool = GreenPool(concurrency)
         self.error_file = error_file
         self.full = bool(full)
-        # Optimisation for when we are only checking one object
-        # or one container.
-        # 0 -> do not limit
-        # 1 -> limit account listings (list of containers)
-        # 2 -> limit container listings (list of objects)
-        self.limit_listings = limit_listings
+        # Compare checksums of objects, metachunks and chunks,
+        # requires the extended attributes of the chunks.
+        self.checksum = bool(checksum) and self.full
         if self.error_file:
             f = open(self.error_file, 'a')
             self.error_writer = csv.writer(f, delimiter=' ')
@@ -82,6 +188,10 @@ class Checker(object):
             fd = open(self.rebuild_file, 'a')
             self.rebuild_writer = csv.writer(fd, delimiter='|')
 
+        self.checkpoint = None
+        if checkpoint_file:
+            self.checkpoint = Checkpoint(checkpoint_file)
+
         conf = {'namespace': namespace}
         self.account_client = AccountClient(
             conf,
@@ -104,9 +214,17 @@ class Checker(object):
         self.container_exceptions = 0
         self.object_exceptions = 0
         self.chunk_exceptions = 0
+        self.checksum_errors = 0
 
-        self.list_cache = {}
+        # Listings are not kept: containers are checked page by page.
+        # Only container metadata, and the chunks of the objects explicitly
+        # checked, are cached, and the number of entries is bounded.
+        self.container_cache = LRUCache(cache_size)
+        self.object_cache = LRUCache(cache_size)
         self.running = {}
+        # Limit the number of concurrent requests to each rawx service
+        self.rawx_semaphores = defaultdict(
+            partial(Semaphore, concurrency_per_rawx))
 
     def write_error(self, target):
         error = [target.account]
@@ -125,16 +243,14 @@ class Checker(object):
             cid = ct_meta['properties']['sys.name'].split('.', 1)[0]
         self.rebuild_writer.writerow((cid, obj_meta['id'], target.chunk))
 
-    def write_chunk_error(self, target, obj_meta, chunk=None):
+    def write_chunk_error(self, target, obj_meta, ct_meta, chunk=None):
         if chunk is not None:
             target = target.copy()
             target.chunk = chunk
         if self.error_file:
             self.write_error(target)
         if self.rebuild_file:
-            self.write_rebuilder_input(
-                target, obj_meta,
-                self.list_cache[(target.account, target.container)][1])
+            self.write_rebuilder_input(target, obj_meta, ct_meta)
 
     def _check_chunk_xattr(self, target, obj_meta, xattr_meta):
         error = False
@@ -158,10 +274,18 @@ class Checker(object):
             error = True
         return error
 
-    def check_chunk(self, target):
+    def _chunk_head(self, chunk):
+        with self.rawx_semaphores[urlparse(chunk).netloc]:
+            return self.blob_client.chunk_head(chunk, xattr=self.full)
+
+    def _check_chunk(self, target, obj_listing, obj_meta, ct_meta):
+        """
+        Check a chunk, and return its extended attributes
+        (None if it could not be reached).
+        """
         chunk = target.chunk
+        xattr_meta = None
 
-        obj_listing, obj_meta = self.check_obj(target)
         error = False
         if chunk not in obj_listing:
             print('  Chunk %s missing from object listing' % target)
@@ -171,7 +295,7 @@ class Checker(object):
             db_meta = obj_listing[chunk]
 
         try:
-            xattr_meta = self.blob_client.chunk_head(chunk, xattr=self.full)
+            xattr_meta = self._chunk_head(chunk)
         except exc.NotFound as e:
             self.chunk_not_found += 1
             error = True
@@ -185,11 +309,151 @@ class Checker(object):
                 error = self._check_chunk_xattr(target, db_meta, xattr_meta)
 
         if error:
-            self.write_chunk_error(target, obj_meta)
+            self.write_chunk_error(target, obj_meta, ct_meta)
 
         self.chunks_checked += 1
+        return xattr_meta
+
+    def check_chunk(self, target):
+        ct_meta = self._container_meta(target)
+        obj_listing, obj_meta = self._object_chunks(target, ct_meta)
+        self._check_chunk(target, obj_listing, obj_meta, ct_meta)
 
-    def check_obj_policy(self, target, obj_meta, chunks):
+    def _check_chunks(self, target, chunk_listing, obj_meta, ct_meta,
+                      callback=None):
+        """
+        Check the chunks of an object, in the pool. Chunks hosted by
+        different rawx services are interleaved, so a slow service does not
+        hold the whole pool. `callback` is called when all the checks
+        are done.
+
+        In checksum mode, the checksums of the object are compared
+        once all its chunks have been checked.
+        """
+        xattrs = None
+        if self.checksum and obj_meta:
+            xattrs = dict()
+            callback = partial(self._check_checksums_then, callback,
+                               target, chunk_listing, xattrs, obj_meta,
+                               ct_meta)
+        if not chunk_listing:
+            if callback:
+                callback()
+            return
+        countdown = None
+        if callback:
+            countdown = Countdown(len(chunk_listing), callback)
+        by_rawx = defaultdict(deque)
+        for chunk in chunk_listing:
+            by_rawx[urlparse(chunk).netloc].append(chunk)
+        queues = deque(by_rawx.values())
+        while queues:
+            queue = queues.popleft()
+            t = target.copy()
+            t.chunk = queue.popleft()
+            self.pool.spawn_n(self._check_chunk_then, countdown, xattrs,
+                              t, chunk_listing, obj_meta, ct_meta)
+            if queue:
+                queues.append(queue)
+
+    def _check_chunk_then(self, countdown, xattrs, target, *args):
+        try:
+            xattr_meta = self._check_chunk(target, *args)
+            if xattrs is not None and xattr_meta:
+                xattrs[target.chunk] = xattr_meta
+        finally:
+            if countdown:
+                countdown.done()
+
+    def _check_checksums_then(self, callback, *args):
+        try:
+            self.check_obj_checksums(*args)
+        finally:
+            if callback:
+                callback()
+
+    def _checksum_error(self, target, msg, *args):
+        self.checksum_errors += 1
+        print('  Checksum error %s: %s' % (target, msg % args))
+
+    def check_obj_checksums(self, target, chunks, xattrs, obj_meta, ct_meta):
+        """
+        Check that the checksums and sizes of an object, of its metachunks
+        and of their chunks are consistent, using only the metadata
+        returned by meta2 and by the rawx services (HEAD requests).
+        No data is transferred: this catches chunks which have been
+        overwritten, truncated or misplaced, and inconsistent metadata,
+        not silent corruption of the data of an intact chunk.
+
+        `xattrs` holds the extended attributes of the chunks,
+        indexed by URL.
+        """
+        stg_met = STORAGE_METHODS.load(obj_meta['chunk_method'])
+        chunks_by_pos = defaultdict(list)
+        for url, chunk in chunks.items():
+            chunks_by_pos[int(chunk['pos'].split('.', 1)[0])].append(url)
+
+        obj_error = False
+        for pos in range(max(chunks_by_pos) + 1 if chunks_by_pos else 0):
+            if pos not in chunks_by_pos:
+                self._checksum_error(target, 'no chunk at position %d', pos)
+                self.write_chunk_error(target, obj_meta, ct_meta, str(pos))
+                obj_error = True
+
+        for pos, urls in chunks_by_pos.items():
+            heads = [(url, xattrs[url]) for url in urls if url in xattrs]
+            for url, xattr in heads:
+                if xattr.get('chunk_pos') != chunks[url]['pos']:
+                    self._checksum_error(
+                        target, 'chunk %s at position %s, expected %s',
+                        url, xattr.get('chunk_pos'), chunks[url]['pos'])
+                    self.write_chunk_error(target, obj_meta, ct_meta, url)
+            if not stg_met.ec:
+                continue
+            # Fragments of a metachunk all have the same size, and since
+            # they embed their index, they all have a different checksum.
+            sizes = [xattr.get('chunk_size') for _, xattr in heads]
+            size = max(set(sizes), key=sizes.count) if sizes else None
+            seen = dict()
+            for url, xattr in sorted(heads,
+                                     key=lambda x: x[1].get('chunk_pos')):
+                frag_hash = (xattr.get('chunk_hash') or '').upper()
+                if xattr.get('chunk_size') != size:
+                    self._checksum_error(
+                        target, 'fragment %s has size %s, expected %s',
+                        url, xattr.get('chunk_size'), size)
+                    self.write_chunk_error(target, obj_meta, ct_meta, url)
+                elif frag_hash and frag_hash in seen:
+                    self._checksum_error(
+                        target, 'fragment %s has the checksum of %s',
+                        url, seen[frag_hash])
+                    self.write_chunk_error(target, obj_meta, ct_meta, url)
+                else:
+                    seen[frag_hash] = url
+
+        # Metachunks make up the object
+        if chunks_by_pos and not obj_error:
+            mc_sizes = [int(chunks[urls[0]]['size'])
+                        for _, urls in sorted(chunks_by_pos.items())]
+            length = obj_meta.get('length')
+            if length is not None and sum(mc_sizes) != int(length):
+                self._checksum_error(
+                    target, 'metachunks total %d bytes, object has %s',
+                    sum(mc_sizes), length)
+                obj_error = True
+            # The checksum of a single metachunk is the one of the object
+            obj_hash = (obj_meta.get('hash') or '').upper()
+            mc_hash = (chunks[chunks_by_pos[0][0]].get('hash') or '').upper()
+            if len(mc_sizes) == 1 and obj_hash and mc_hash and \
+                    obj_hash != mc_hash:
+                self._checksum_error(
+                    target, 'metachunk checksum %s, object has %s',
+                    mc_hash, obj_hash)
+                obj_error = True
+        if obj_error and self.error_file:
+            self.write_error(target)
+
+    def check_obj_policy(self, target, obj_meta, chunks, ct_meta):
         """
         Check that the list of chunks of an object matches
         the object's storage policy.
@@ -208,32 +472,29 @@ class Checker(object):
                     subs = {x['num'] for x in clist}
                     for sub in range(required):
                         if sub not in subs:
-                            self.write_chunk_error(target, obj_meta,
+                            self.write_chunk_error(target, obj_meta, ct_meta,
                                                    '%d.%d' % (pos, sub))
                 else:
-                    self.write_chunk_error(target, obj_meta, str(pos))
+                    self.write_chunk_error(target, obj_meta, ct_meta,
+                                           str(pos))
 
-    def check_obj(self, target, recurse=False):
+    def _check_obj(self, target, ct_meta, listed=False):
+        """
+        Check an object, and return its chunks. `listed` tells that the
+        object has been found in the listing of its container.
+        """
         account = target.account
         container = target.container
         obj = target.obj
 
-        if (account, container, obj) in self.running:
-            self.running[(account, container, obj)].wait()
-        if (account, container, obj) in self.list_cache:
-            return self.list_cache[(account, container, obj)]
-        self.running[(account, container, obj)] = Event()
         print('Checking object "%s"' % target)
-        container_listing, ct_meta = self.check_container(target)
         error = False
-        if obj not in container_listing:
-            print('  Object %s missing from container listing' % target)
-            error = True
-            # checksum = None
-        else:
-            # TODO check checksum match
-            # checksum = container_listing[obj]['hash']
-            pass
+        if not listed:
+            page = self._list_objects(target, prefix=obj, limit=1)
+            if page is not None and \
+                    not any(x['name'] == obj for x in page[0]):
+                print('  Object %s missing from container listing' % target)
+                error = True
 
         results = []
         meta = dict()
@@ -256,149 +517,216 @@ class Checker(object):
 
         # Skip the check if we could not locate the object
         if meta:
-            self.check_obj_policy(target.copy(), meta, results)
-            self.list_cache[(account, container, obj)] = (chunk_listing, meta)
+            self.check_obj_policy(target.copy(), meta, results, ct_meta)
 
         self.objects_checked += 1
-        self.running[(account, container, obj)].send(True)
-        del self.running[(account, container, obj)]
-
-        if recurse:
-            for chunk in chunk_listing:
-                t = target.copy()
-                t.chunk = chunk
-                self.pool.spawn_n(self.check_chunk, t)
         if error and self.error_file:
             self.write_error(target)
         return chunk_listing, meta
 
-    def check_container(self, target, recurse=False):
+    def _object_chunks(self, target, ct_meta):
+        """
+        Check an object which has been explicitly asked for, only once
+        when several of its chunks are checked.
+        """
+        key = (target.account, target.container, target.obj)
+        if key in self.running:
+            self.running[key].wait()
+        cached = self.object_cache.get(key)
+        if cached is not None:
+            return cached
+        self.running[key] = Event()
+        try:
+            chunk_listing, meta = self._check_obj(target, ct_meta)
+            if meta:
+                self.object_cache.put(key, (chunk_listing, meta))
+        finally:
+            self.running.pop(key).send(True)
+        return chunk_listing, meta
+
+    def check_obj(self, target, recurse=False):
+        ct_meta = self._container_meta(target)
+        chunk_listing, meta = self._object_chunks(target, ct_meta)
+        if recurse:
+            self._check_chunks(target, chunk_listing, meta, ct_meta)
+        return chunk_listing, meta
+
+    def _walk_obj(self, target, ct_meta, callback):
+        """Check an object found in a container listing, and its chunks."""
+        try:
+            chunk_listing, meta = self._check_obj(target, ct_meta,
+                                                  listed=True)
+        except Exception:
+            callback()
+            raise
+        self._check_chunks(target, chunk_listing, meta, ct_meta, callback)
+
+    def _list_objects(self, target, **kwargs):
+        """
+        Get one page of the listing of a container. Return the objects,
+        the container metadata, and whether the listing is truncated,
+        or None if the listing failed.
+        """
+        try:
+            headers, resp = self.container_client.content_list(
+                account=target.account, reference=target.container,
+                **kwargs)
+        except exc.NotFound as e:
+            self.container_not_found += 1
+            print('  Not found container "%s": %s' % (target, str(e)))
+            return None
+        except Exception as e:
+            self.container_exceptions += 1
+            print('  Exception container "%s": %s' % (target, str(e)))
+            return None
+        objects = resp.pop('objects', None) or []
+        resp.pop('prefixes', None)
+        # Older services do not tell if the listing is truncated,
+        # stop at the first empty page.
+        truncated = true_value(headers.get(HEADER_PREFIX + 'list-truncated',
+                                           bool(objects)))
+        return objects, resp, truncated
+
+    def _container_listed(self, target):
+        """Tell if the container appears in the listing of its account."""
+        try:
+            resp = self.account_client.container_list(
+                target.account, prefix=target.container, limit=1)
+        except Exception as e:
+            self.account_exceptions += 1
+            print('  Exception account "%s": %s' % (
+                Target(target.account), str(e)))
+            if self.error_file:
+                self.write_error(Target(target.account))
+            return False
+        return any(x[0] == target.container for x in resp['listing'])
+
+    def _container_meta(self, target):
+        """
+        Check a container which has been explicitly asked for (or one of
+        its objects), only once, and return its metadata.
+        """
+        key = (target.account, target.container)
+        if key in self.running:
+            self.running[key].wait()
+        ct_meta = self.container_cache.get(key)
+        if ct_meta is not None:
+            return ct_meta
+        self.running[key] = Event()
+        try:
+            print('Checking container "%s"' % target)
+            error = False
+            if not self._container_listed(target):
+                error = True
+                print('  Container %s missing from account listing' % target)
+            ct_meta = dict()
+            page = self._list_objects(target, limit=1)
+            if page is None:
+                error = True
+            else:
+                ct_meta = page[1]
+            self.container_cache.put(key, ct_meta)
+            self.containers_checked += 1
+            if error and self.error_file:
+                t = Target(target.account, target.container)
+                self.write_error(t)
+        finally:
+            self.running.pop(key).send(True)
+        return ct_meta
+
+    def _object_done(self, walk, page):
+        if walk.object_done(page):
+            if walk.complete:
+                self._container_done(walk)
+            elif self.checkpoint:
+                self.checkpoint.save(walk.account, walk.container,
+                                     marker=walk.marker)
+
+    def _container_done(self, walk):
+        self.container_cache.pop((walk.account, walk.container))
+        if self.checkpoint:
+            self.checkpoint.save(walk.account, walk.container, done=True)
+
+    def _walk_container(self, target, listed=False):
+        """
+        Check all objects of a container, one page of the listing
+        at a time. `listed` tells that the container has been found
+        in the listing of its account.
+        """
         account = target.account
         container = target.container
+        if self.checkpoint and self.checkpoint.is_done(account, container):
+            print('Container "%s" already checked' % target)
+            return
 
-        if (account, container) in self.running:
-            self.running[(account, container)].wait()
-        if (account, container) in self.list_cache:
-            return self.list_cache[(account, container)]
-        self.running[(account, container)] = Event()
         print('Checking container "%s"' % target)
-        account_listing = self.check_account(target)
         error = False
-        if container not in account_listing:
+        if not listed and not self._container_listed(target):
             error = True
             print('  Container %s missing from account listing' % target)
 
+        walk = ContainerWalk(account, container)
         marker = None
-        results = []
-        ct_meta = dict()
-        extra_args = dict()
-        if self.limit_listings > 1 and target.obj:
-            # When we are explicitly checking one object, start the listing
-            # where this object is supposed to be, and list only one object.
-            extra_args['prefix'] = target.obj
-            extra_args['limit'] = 1
+        if self.checkpoint:
+            marker = self.checkpoint.marker(account, container)
+            walk.marker = marker
         while True:
-            try:
-                _, resp = self.container_client.content_list(
-                    account=account, reference=container, marker=marker,
-                    **extra_args)
-            except exc.NotFound as e:
-                self.container_not_found += 1
-                error = True
-                print('  Not found container "%s": %s' % (target, str(e)))
-                break
-            except Exception as e:
-                self.container_exceptions += 1
+            page = self._list_objects(target, marker=marker)
+            if page is None:
                 error = True
-                print('  Exception container "%s": %s' % (target, str(e)))
                 break
-
-            if resp['objects']:
-                marker = resp['objects'][-1]['name']
-                results.extend(resp['objects'])
-                if self.limit_listings > 1:
-                    break
-            else:
-                ct_meta = resp
-                ct_meta.pop('objects')
+            objects, ct_meta, truncated = page
+            self.container_cache.put((account, container), ct_meta)
+            if objects:
+                marker = objects[-1]['name']
+                done = partial(self._object_done, walk, walk.add_page(objects))
+                for obj in objects:
+                    t = target.copy()
+                    t.obj = obj['name']
+                    self.pool.spawn_n(self._walk_obj, t, ct_meta, done)
+            if not truncated:
+                walk.listed = True
                 break
 
-        container_listing = dict()
-        for obj in results:
-            container_listing[obj['name']] = obj
-
-        if self.limit_listings <= 1:
-            # We just listed the whole container, keep the result in a cache
-            self.containers_checked += 1
-            self.list_cache[(account, container)] = container_listing, ct_meta
-        self.running[(account, container)].send(True)
-        del self.running[(account, container)]
-
-        if recurse:
-            for obj in container_listing:
-                t = target.copy()
-                t.obj = obj
-                self.pool.spawn_n(self.check_obj, t, True)
+        self.containers_checked += 1
+        if walk.complete:
+            self._container_done(walk)
         if error and self.error_file:
             self.write_error(target)
-        return container_listing, ct_meta
+
+    def check_container(self, target, recurse=False, listed=False):
+        if recurse:
+            self._walk_container(target, listed=listed)
+        else:
+            return self._container_meta(target)
 
     def check_account(self, target, recurse=False):
         account = target.account
 
-        if account in self.running:
-            self.running[account].wait()
-        if account in self.list_cache:
-            return self.list_cache[account]
-        self.running[account] = Event()
         print('Checking account "%s"' % target)
         error = False
         marker = None
-        results = []
-        extra_args = dict()
-        if self.limit_listings > 0 and target.container:
-            # When we are explicitly checking one container, start the listing
-            # where this container is supposed to be, and list only one
-            # container.
-            extra_args['prefix'] = target.container
-            extra_args['limit'] = 1
         while True:
             try:
                 resp = self.account_client.container_list(
-                    account, marker=marker, **extra_args)
+                    account, marker=marker)
             except Exception as e:
                 self.account_exceptions += 1
                 error = True
                 print('  Exception account "%s": %s' % (target, str(e)))
                 break
-            if resp['listing']:
-                marker = resp['listing'][-1][0]
-                results.extend(resp['listing'])
-                if self.limit_listings > 0:
-                    break
-            else:
+            if not resp['listing']:
                 break
-
-        containers = dict()
-        for e in results:
-            containers[e[0]] = (e[1], e[2])
-
-        if self.limit_listings <= 0:
-            # We just listed the whole account, keep the result in a cache
-            self.accounts_checked += 1
-            self.list_cache[account] = containers
-        self.running[account].send(True)
-        del self.running[account]
-
-        if recurse:
-            for container in containers:
-                t = target.copy()
-                t.container = container
-                self.pool.spawn_n(self.check_container, t, True)
-
+            marker = resp['listing'][-1][0]
+            if recurse:
+                for entry in resp['listing']:
+                    t = target.copy()
+                    t.container = entry[0]
+                    self.pool.spawn_n(self._walk_container, t, True)
+
+        self.accounts_checked += 1
         if error and self.error_file:
             self.write_error(target)
-        return containers
 
     def check(self, target):
         if target.chunk and target.obj and target.container:
@@ -412,6 +740,8 @@ class Checker(object):
 
     def wait(self):
         self.pool.waitall()
+        if self.checkpoint:
+            self.checkpoint.close()
 
     def report(self):
         def _report_stat(name, stat):
@@ -442,9 +772,12 @@ class Checker(object):
             _report_stat("Missing chunks", self.chunk_not_found)
         if self.chunk_exceptions:
             _report_stat("Exceptions", self.chunk_exceptions)
+        if self.checksum:
+            print()
+            _report_stat("Checksum errors", self.checksum_errors)
 
 
-def main():
+def make_arg_parser():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('namespace', help='Namespace name')
     parser.add_argument(
@@ -468,6 +801,11 @@ def main():
     parser.add_argument('-p', '--presence',
                         action='store_true', default=False,
                         help="Presence check, the xattr check is skipped.")
+    parser.add_argument('--checksum',
+                        action='store_true', default=False,
+                        help=("Compare the checksums of objects, metachunks "
+                              "and chunks, from the metadata of the chunks "
+                              "(no data is downloaded)."))
     parser.add_argument('-v', '--verbose',
                         action='store_true', help='verbose output')
     parser.add_argument('--concurrency', '--workers', type=int,
@@ -476,28 +814,45 @@ def main():
     parser.add_argument('--attempts', type=int, default=1,
                         help=('Number of attempts for '
                               'listing requests (default: 1).'))
+    parser.add_argument('--concurrency-per-rawx', type=int, default=10,
+                        help=('Number of concurrent chunk checks '
+                              'on each rawx service (default: 10).'))
+    parser.add_argument('--cache-size', type=int, default=1000,
+                        help=('Number of containers and objects whose '
+                              'metadata is kept in memory (default: 1000).'))
+    parser.add_argument('--checkpoint',
+                        help=('Progress file. Containers already checked '
+                              'according to this file are skipped, the '
+                              'others are checked from where they were '
+                              'left.'))
+    return parser
+
 
-    args = parser.parse_args()
+def main():
+    args = make_arg_parser().parse_args()
 
     if args.attempts < 1:
         raise ValueError('attempts must be at least 1')
+    if args.checksum and args.presence:
+        raise ValueError('--checksum cannot be used with --presence')
 
     if not os.isatty(sys.stdin.fileno()):
         source = sys.stdin
-        limit_listings = 0  # do full listings, cache the results
     else:
         if not args.account:
             raise ValueError('missing account argument')
         source = StringIO(u' '.join([args.account] + args.target))
-        limit_listings = len(args.target)
     checker = Checker(
         args.namespace,
         error_file=args.output,
         concurrency=args.concurrency,
         rebuild_file=args.output_for_blob_rebuilder,
         full=not args.presence,
-        limit_listings=limit_listings,
         request_attempts=args.attempts,
+        cache_size=args.cache_size,
+        concurrency_per_rawx=args.concurrency_per_rawx,
+        checkpoint_file=args.checkpoint,
+        checksum=args.checksum,
     )
     args = csv.reader(source, delimiter=' ')
     for entry in args:
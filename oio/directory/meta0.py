@@ -17,15 +17,30 @@
 """Meta0 client and meta1 balancing operations"""
 from six import itervalues, iteritems, string_types
 from six.moves import range
+from collections import defaultdict
+from contextlib import contextmanager
+from heapq import heapify, heappop, heappush
+from itertools import count
+import os
 import random
 
+import eventlet
+from eventlet import Semaphore
+
 from oio.common.json import json
 from oio.common.client import ProxyClient
 from oio.common.exceptions import ConfigurationException, \
         OioException, ServiceBusy
+from oio.common.utils import monotonic_time
 from oio.directory.admin import AdminClient
 
 
+# Number of bases processed in parallel when applying a mapping
+APPLY_CONCURRENCY = 10
+# Number of bases processed in parallel on each meta1 service
+APPLY_CONCURRENCY_PER_SERVICE = 2
+
+
 class Meta0Client(ProxyClient):
     """Meta0 administration client"""
 
@@ -46,9 +61,165 @@ class Meta0Client(ProxyClient):
         return obody
 
 
+class ApplyJournal(object):
+    """
+    Progress of the application of a prefix mapping, saved in a file.
+
+    The first line records the plan: the target mapping, the list
+    of bases to move, their peers before the move, and what the plan
+    has been computed for. Each following line records a step done
+    on a base, with the peers of the base at that time. The last line
+    tells when all the bases have been moved.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.plan = None
+        self.complete = False
+        self.done = dict()
+        for entry in self.read(path):
+            if 'plan' in entry:
+                self.plan = entry['plan']
+            elif 'complete' in entry:
+                self.complete = True
+            else:
+                self.done[(entry['base'], entry['step'])] = entry['peers']
+        self._file = open(path, 'a')
+
+    @staticmethod
+    def read(path):
+        """Yield the entries of the journal at `path`, if it exists."""
+        if not os.path.exists(path):
+            return
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Partial line, written when interrupted
+                    continue
+
+    @classmethod
+    def has_plan(cls, path):
+        """Tell if the journal at `path` records a plan to resume."""
+        return any('plan' in entry for entry in cls.read(path))
+
+    def record_plan(self, mapping, moved, old_peers, origin=None):
+        """
+        Record the plan of the application.
+
+        :param mapping: the target mapping, as returned by
+            `PrefixMapping.to_json()`
+        :param moved: the list of bases to move
+        :param old_peers: the peers of each moved base before the move
+        :param origin: JSON-serializable description of the operation
+            the plan has been computed for
+        """
+        self.plan = {'mapping': mapping, 'moved': list(moved),
+                     'old_peers': old_peers, 'origin': origin}
+        self._write({'plan': self.plan})
+
+    def record_complete(self):
+        """Record that all the bases of the plan have been moved."""
+        self.complete = True
+        self._write({'complete': True})
+
+    def is_done(self, base, step, peers):
+        """Tell if `step` has been done on `base` with the same peers."""
+        return self.done.get((base, step)) == list(peers)
+
+    def record(self, base, step, peers):
+        """Record that `step` has been done on `base`."""
+        self.done[(base, step)] = list(peers)
+        self._write({'base': base, 'step': step, 'peers': list(peers)})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BaseAllocator(object):
+    """
+    Priority queue of the meta1 services of a `PrefixMapping`,
+    ordered by number of managed bases.
+
+    The queue is updated (in logarithmic time) each time the bases
+    of a service change: outdated entries are left in the queue,
+    and dropped when they reach its head.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self._counter = count()
+        # Sequence number of the last entry of each service
+        self._seq = dict()
+        self._heap = list()
+        self.rebuild()
+
+    def rebuild(self):
+        """Rebuild the queue, without outdated entries."""
+        self._heap = list()
+        for svc in itervalues(self.mapping.services):
+            seq = next(self._counter)
+            self._seq[svc['addr']] = seq
+            self._heap.append(
+                (len(self.mapping.get_managed_bases(svc)), seq, svc['addr']))
+        heapify(self._heap)
+
+    def update(self, svc):
+        """Take into account a change of the bases managed by `svc`."""
+        addr = svc['addr']
+        if addr not in self.mapping.services:
+            return
+        seq = next(self._counter)
+        self._seq[addr] = seq
+        heappush(self._heap,
+                 (len(self.mapping.get_managed_bases(svc)), seq, addr))
+        if len(self._heap) > 2 * len(self._seq) + 64:
+            self.rebuild()
+
+    def find(self, known=None, min_score=1):
+        """
+        Find `replicas` services, including the ones of `known`,
+        choosing the ones with less managed bases first.
+        """
+        mapping = self.mapping
+        services = known if known else list()
+        known_addrs = {svc['addr'] for svc in services}
+        known_locations = [mapping.get_loc_parts(svc) for svc in services]
+        popped = list()
+        try:
+            while len(services) < mapping.replicas and self._heap:
+                entry = heappop(self._heap)
+                _, seq, addr = entry
+                if self._seq.get(addr) != seq:
+                    continue  # outdated
+                popped.append(entry)
+                svc = mapping.services[addr]
+                if addr in known_addrs or mapping.get_score(svc) < min_score:
+                    continue
+                loc = mapping.get_loc_parts(svc)
+                if all(mapping.dist_between_parts(loc, loc1) >=
+                       mapping.min_dist for loc1 in known_locations):
+                    known_addrs.add(addr)
+                    known_locations.append(loc)
+                    services.append(svc)
+        finally:
+            # The services chosen will be updated when they are assigned
+            for entry in popped:
+                heappush(self._heap, entry)
+        return services
+
+
 class PrefixMapping(object):
     """Represents the content of the meta0 database"""
 
+    # Seconds between two reports of the progress of `apply()`
+    APPLY_REPORT_INTERVAL = 10.0
+
     def __init__(self, meta0_client, conscience_client, replicas=3,
                  digits=None, logger=None, min_dist=1, **kwargs):
         """
@@ -75,6 +246,11 @@ class PrefixMapping(object):
         if self.digits > 4:
             raise ConfigurationException("meta_digits must be <= 4")
         self.min_dist = min_dist
+        # Attempts and initial delay when a meta1 service is busy
+        self.busy_retries = int(kwargs.get('busy_retries', 5))
+        self.busy_backoff = float(kwargs.get('busy_backoff', 1.0))
+        self._allocator = None
+        self._loc_parts = dict()
         self.reset()
 
     @property
@@ -90,6 +266,15 @@ class PrefixMapping(object):
         self.svc_by_base.clear()
         for svc in self.cs.all_services("meta1"):
             self.services[svc["addr"]] = svc
+        self._allocator = None
+        self._loc_parts.clear()
+
+    @property
+    def allocator(self):
+        """Queue of the services, by number of managed bases."""
+        if self._allocator is None:
+            self._allocator = BaseAllocator(self)
+        return self._allocator
 
     def __nonzero__(self):
         return bool(self.svc_by_base)
@@ -112,22 +297,32 @@ class PrefixMapping(object):
             loc = svc["addr"].rsplit(":", 1)[0]
         return str(loc)
 
+    def get_loc_parts(self, svc):
+        """
+        Get the location of a service, split in its parts.
+        Locations of known services are cached until the next `reset()`.
+        """
+        addr = svc if isinstance(svc, string_types) else svc['addr']
+        parts = self._loc_parts.get(addr)
+        if parts is None:
+            parts = tuple(self.get_loc(svc).split('.', 3))
+            if addr in self.services:
+                self._loc_parts[addr] = parts
+        return parts
+
     @staticmethod
-    def dist_between(loc1, loc2):
-        loc1_parts = loc1.split('.', 3)
-        loc2_parts = loc2.split('.', 3)
-        max_dist = max(len(loc1_parts), len(loc2_parts))
+    def dist_between_parts(loc1_parts, loc2_parts):
+        """Compute the distance between two locations, already split."""
         in_common = 0
-        loc1_part = loc1_parts.pop(0)
-        loc2_part = loc2_parts.pop(0)
-        try:
-            while loc1_part == loc2_part:
-                in_common += 1
-                loc1_part = loc1_parts.pop(0)
-                loc2_part = loc2_parts.pop(0)
-        except IndexError:
-            pass
-        return max_dist - in_common
+        for loc1_part, loc2_part in zip(loc1_parts, loc2_parts):
+            if loc1_part != loc2_part:
+                break
+            in_common += 1
+        return max(len(loc1_parts), len(loc2_parts)) - in_common
+
+    @classmethod
+    def dist_between(cls, loc1, loc2):
+        return cls.dist_between_parts(loc1.split('.', 3), loc2.split('.', 3))
 
     def get_score(self, svc):
         """Get the score of a service, or 0 if it is unknown"""
@@ -219,74 +414,227 @@ class PrefixMapping(object):
             # Deep copy the list
             self.raw_svc_by_base[base] = [str(x) for x in services_addrs]
 
-    # TODO(FVE): move the following method in a generic class
-    def _apply_copy_bases(self, svc_type, moved, **kwargs):
-        """Step 1 of base reassignation algorithm."""
-        moved_ok = list()
-        for base in moved:
-            peers = [v['addr'] for v in self.svc_by_base[base]]
-            old_peers = self.raw_svc_by_base[base]
-            new_peers = [v for v in peers if v not in old_peers]
-            kept_peers = [v for v in peers if v in old_peers]
-            self.logger.info("old: %s, new: %s", old_peers, new_peers)
-            cid = base.ljust(64, '0')
+    def _retry_busy(self, func, *args, **kwargs):
+        """
+        Call `func`, and call it again after an increasing delay
+        (with some jitter) as long as it raises `ServiceBusy`.
+        """
+        for attempt in range(self.busy_retries):
             try:
-                self.admin.set_peers(svc_type, cid=cid, peers=peers)
-                all_peers_ok = True
-                for svc_to in new_peers:
-                    this_peer_ok = False
-                    for svc_from in kept_peers:
-                        self.logger.info("Copying base %s from %s to %s",
-                                         base, svc_from, svc_to)
-                        try:
-                            self.admin.copy_base_from(
-                                svc_type, cid=cid,
-                                svc_from=svc_from, svc_to=svc_to)
-                            this_peer_ok = True
-                            break
-                        except OioException:
-                            self.logger.warn(
-                                "Failed to copy base %s to %s",
-                                base, svc_to)
-                    if not this_peer_ok:
-                        all_peers_ok = False
-                if all_peers_ok:
-                    moved_ok.append(base)
-            except ServiceBusy:
-                self.logger.warn('Failed to set peers to %s for base %s',
-                                 peers, base)
-        return moved_ok
+                return func(*args, **kwargs)
+            except ServiceBusy as exc:
+                if attempt >= self.busy_retries - 1:
+                    raise
+                delay = self.busy_backoff * (2 ** attempt)
+                delay *= random.uniform(0.5, 1.5)
+                self.logger.info("Service busy (%s), retrying in %.1fs",
+                                 exc, delay)
+                eventlet.sleep(delay)
+
+    @contextmanager
+    def _limit_services(self, limits, services):
+        """
+        Wait until none of `services` is used by more than the allowed
+        number of concurrent operations.
+        """
+        acquired = list()
+        try:
+            # Always acquire in the same order, to avoid deadlocks
+            for svc in sorted(set(services)):
+                limits[svc].acquire()
+                acquired.append(limits[svc])
+            yield
+        finally:
+            for sem in acquired:
+                sem.release()
+
+    # TODO(FVE): move the following method in a generic class
+    def _copy_base(self, svc_type, base, peers):
+        """Set the peers of a base, and copy it to the new peers."""
+        old_peers = self.raw_svc_by_base[base]
+        new_peers = [v for v in peers if v not in old_peers]
+        kept_peers = [v for v in peers if v in old_peers]
+        self.logger.info("old: %s, new: %s", old_peers, new_peers)
+        cid = base.ljust(64, '0')
+        try:
+            self._retry_busy(self.admin.set_peers,
+                             svc_type, cid=cid, peers=peers)
+        except ServiceBusy:
+            self.logger.warn('Failed to set peers to %s for base %s',
+                             peers, base)
+            return False
+        all_peers_ok = True
+        for svc_to in new_peers:
+            this_peer_ok = False
+            for svc_from in kept_peers:
+                self.logger.info("Copying base %s from %s to %s",
+                                 base, svc_from, svc_to)
+                try:
+                    self._retry_busy(self.admin.copy_base_from,
+                                     svc_type, cid=cid,
+                                     svc_from=svc_from, svc_to=svc_to)
+                    this_peer_ok = True
+                    break
+                except OioException:
+                    self.logger.warn(
+                        "Failed to copy base %s to %s", base, svc_to)
+            if not this_peer_ok:
+                all_peers_ok = False
+        return all_peers_ok
 
     # TODO(FVE): move the following method in a generic class
-    def _apply_reset_elections(self, svc_type, moved, **kwargs):
+    def _reset_election(self, svc_type, base):
+        cid = base.ljust(64, '0')
+        try:
+            self._retry_busy(self.admin.election_leave, svc_type, cid=cid)
+            election = self._retry_busy(self.admin.election_status,
+                                        svc_type, cid=cid)
+            for svc, status in election['peers'].items():
+                if status['status']['status'] not in (200, 303):
+                    self.logger.warn("Election not started for %s: %s",
+                                     svc, status)
+        except OioException as exc:
+            self.logger.warn(
+                "Failed to get election status for base %s: %s",
+                cid, exc)
+
+    def _apply_step(self, step, moved, action, journal,
+                    concurrency, per_service):
+        """
+        Run `action(base, peers)` on each base of `moved`, concurrently,
+        except on bases for which the step is already in the journal.
+
+        :returns: the list of bases for which `action` succeeded
+        """
+        limits = defaultdict(lambda: Semaphore(per_service))
+        done = list()
+        stats = {'count': 0, 'last_report': monotonic_time()}
+        start = stats['last_report']
+
+        def _run(base):
+            peers = [v['addr'] for v in self.svc_by_base[base]]
+            if journal and journal.is_done(base, step, peers):
+                return base, True
+            with self._limit_services(limits, peers):
+                success = action(base, peers)
+            if success and journal:
+                journal.record(base, step, peers)
+            stats['count'] += 1
+            return base, success
+
+        pool = eventlet.GreenPool(concurrency)
+        for base, success in pool.imap(_run, moved):
+            if success:
+                done.append(base)
+            now = monotonic_time()
+            if now - stats['last_report'] >= self.APPLY_REPORT_INTERVAL:
+                stats['last_report'] = now
+                self.logger.info(
+                    "%s: %d/%d bases (%.1f bases/s)", step, len(done),
+                    len(moved), stats['count'] / (now - start))
+        elapsed = monotonic_time() - start
+        self.logger.info(
+            "%s: %d/%d bases done, %d in %.1fs (%.1f bases/s)",
+            step, len(done), len(moved), stats['count'], elapsed,
+            stats['count'] / elapsed if elapsed else 0.0)
+        return done
+
+    def _apply_copy_bases(self, svc_type, moved, journal=None,
+                          concurrency=APPLY_CONCURRENCY,
+                          per_service=APPLY_CONCURRENCY_PER_SERVICE,
+                          **kwargs):
+        """Step 1 of base reassignation algorithm."""
+        return self._apply_step(
+            'copy', moved,
+            lambda base, peers: self._copy_base(svc_type, base, peers),
+            journal, concurrency, per_service)
+
+    def _apply_reset_elections(self, svc_type, moved, journal=None,
+                               concurrency=APPLY_CONCURRENCY,
+                               per_service=APPLY_CONCURRENCY_PER_SERVICE,
+                               **kwargs):
         """Step 3 of base reassignation algorithm."""
-        for base in moved:
-            cid = base.ljust(64, '0')
-            try:
-                self.admin.election_leave(svc_type, cid=cid)
-                election = self.admin.election_status(svc_type, cid=cid)
-                for svc, status in election['peers'].items():
-                    if status['status']['status'] not in (200, 303):
-                        self.logger.warn("Election not started for %s: %s",
-                                         svc, status)
-            except OioException as exc:
-                self.logger.warn(
-                    "Failed to get election status for base %s: %s",
-                    cid, exc)
-
-    def apply(self, moved=None, **kwargs):
+        def _reset(base, _peers):
+            self._reset_election(svc_type, base)
+            return True
+        self._apply_step('election', moved, _reset,
+                         journal, concurrency, per_service)
+
+    def apply(self, moved=None, concurrency=APPLY_CONCURRENCY,
+              per_service=APPLY_CONCURRENCY_PER_SERVICE, journal=None,
+              origin=None, **kwargs):
         """
         Upload the current mapping to the meta0 services, and set peers
         accordingly in meta1 databases.
 
         :param moved: list of bases that have moved.
+        :param concurrency: number of bases processed in parallel
+        :param per_service: maximum number of bases processed in parallel
+            on each meta1 service
+        :param journal: path to a file where the plan and the progress
+            are saved. When the file already records a plan, the mapping
+            and the list of moved bases are reloaded from it (`moved` is
+            ignored), and the bases already processed are skipped.
+        :param origin: JSON-serializable description of the operation
+            the mapping has been computed for (command, arguments).
+            It is saved with the plan, and a plan computed for
+            another operation is not resumed.
+        :raises ValueError: if the journal records a plan already
+            applied, or computed for another operation
+        """
+        if journal:
+            journal = ApplyJournal(journal)
+        try:
+            if journal and journal.complete:
+                raise ValueError(
+                    "The plan saved in %s has already been applied" %
+                    journal.path)
+            if journal and journal.plan:
+                if origin is not None and \
+                        journal.plan.get('origin') != origin:
+                    raise ValueError(
+                        "The plan saved in %s has been computed for %s, "
+                        "not for %s" % (journal.path,
+                                        journal.plan.get('origin'), origin))
+                moved = self._load_plan(journal.plan)
+                self.logger.info("Resuming from %s: %d bases to move",
+                                 journal.path, len(moved))
+            elif journal:
+                journal.record_plan(
+                    self.to_json(), moved or list(),
+                    {base: self.raw_svc_by_base.get(base, list())
+                     for base in moved or list()}, origin=origin)
+            if moved:
+                moved_ok = self._apply_copy_bases(
+                    'meta1', moved, journal=journal,
+                    concurrency=concurrency, per_service=per_service)
+            else:
+                moved_ok = list()
+            self.m0.force(self.to_json(moved_ok).strip(), **kwargs)
+            self._apply_reset_elections(
+                'meta1', moved_ok, journal=journal,
+                concurrency=concurrency, per_service=per_service)
+            if journal and len(moved_ok) == len(moved or ()):
+                journal.record_complete()
+        finally:
+            if journal:
+                journal.close()
+
+    def _load_plan(self, plan):
         """
-        if moved:
-            moved_ok = self._apply_copy_bases('meta1', moved, **kwargs)
-        else:
-            moved_ok = list()
-        self.m0.force(self.to_json(moved_ok).strip(), **kwargs)
-        self._apply_reset_elections('meta1', moved_ok, **kwargs)
+        Load the target mapping of a plan saved in an `ApplyJournal`,
+        and restore the peers of the moved bases before the move.
+
+        :returns: the list of bases to move
+        """
+        self.svc_by_base.clear()
+        for svc in itervalues(self.services):
+            svc.pop('bases', None)
+        self._allocator = None
+        self.load(plan['mapping'], swap_bytes=False)
+        for base, peers in iteritems(plan['old_peers']):
+            self.raw_svc_by_base[base] = [str(x) for x in peers]
+        return plan['moved']
 
     def _find_services(self, known=None, lookup=None, max_lookup=50):
         """
@@ -296,7 +644,7 @@ class PrefixMapping(object):
         :param lookup: a function that returns an iterable of services
         """
         services = known if known else list()
-        known_locations = {self.get_loc(svc) for svc in services}
+        known_locations = {self.get_loc_parts(svc) for svc in services}
         iterations = 0
         while len(services) < self.replicas and iterations < max_lookup:
             iterations += 1
@@ -304,8 +652,8 @@ class PrefixMapping(object):
             if not svcs:
                 break
             for svc in svcs:
-                loc = self.get_loc(svc)
-                if all(self.dist_between(loc, loc1) >= self.min_dist
+                loc = self.get_loc_parts(svc)
+                if all(self.dist_between_parts(loc, loc1) >= self.min_dist
                        for loc1 in known_locations):
                     known_locations.add(loc)
                     services.append(svc)
@@ -322,22 +670,7 @@ class PrefixMapping(object):
 
     def find_services_less_bases(self, known=None, min_score=1, **_kwargs):
         """Find `replicas` services, including the ones of `known`"""
-        if known is None:
-            known = list()
-        filtered = [x for x in itervalues(self.services)
-                    if self.get_score(x) >= min_score]
-        # Reverse the list so we can quickly pop the service
-        # with less managed bases
-        filtered.sort(key=(lambda x: len(self.get_managed_bases(x))),
-                      reverse=True)
-
-        def _lookup(known2):
-            while filtered:
-                svc = filtered.pop()
-                if svc not in known2:
-                    return (svc,)
-            return None
-        return self._find_services(known, _lookup, len(filtered))
+        return self.allocator.find(known, min_score=min_score)
 
     def find_services_m1_pool(self, known=None, **_kwargs):
         """
@@ -362,6 +695,8 @@ class PrefixMapping(object):
             base_set = svc.get('bases') or set()
             base_set.add(base)
             svc['bases'] = base_set
+            if self._allocator is not None:
+                self._allocator.update(svc)
         self.svc_by_base[base] = services
 
     def bootstrap(self, strategy=None):
@@ -371,7 +706,7 @@ class PrefixMapping(object):
         """
         self.reset()
         if not strategy:
-            strategy = self.find_services_random
+            strategy = self.find_services_less_bases
         last_percent = 0
         for base_int in range(0, self.num_bases()):
             base = "%0*X" % (self.digits, base_int)
@@ -441,6 +776,8 @@ class PrefixMapping(object):
                 svc["bases"].remove(base)
             except KeyError:
                 pass
+            if self._allocator is not None:
+                self._allocator.update(svc)
             new_svcs = strategy(known=self.svc_by_base[base])
             self.assign_services(base, new_svcs)
         moved += bases_to_remove
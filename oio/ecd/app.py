@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
 from six.moves import range
 from hashlib import md5
 
@@ -21,12 +22,14 @@ from werkzeug.routing import Map, Rule
 from werkzeug.wrappers import Response
 
 from oio.common.storage_method import STORAGE_METHODS
-from oio.api.ec import EcMetachunkWriter, ECChunkDownloadHandler
+from oio.api.ec import EcMetachunkWriter, ECChunkDownloadHandler, \
+    CodecExecutor
 from oio.api.replication import ReplicatedMetachunkWriter
 from oio.api.backblaze import BackblazeChunkWriteHandler, \
     BackblazeChunkDownloadHandler
 from oio.api.backblaze_http import BackblazeUtils, BackblazeUtilsException
 from oio.api.io import ChunkReader
+from oio.common.easy_value import int_value
 from oio.common.exceptions import OioException
 from oio.common.wsgi import WerkzeugApp
 
@@ -114,16 +117,24 @@ def part_backblaze_to_bytes_iter(stream):
 class ECD(WerkzeugApp):
     def __init__(self, conf):
         self.conf = conf
+        self.codec_executor = CodecExecutor(
+            int_value(conf.get('ec_codec_processes'), 0),
+            int_value(conf.get('ec_codec_queue_depth'), None))
         self.url_map = Map([
             Rule('/', endpoint='metachunk'),
         ])
         super(ECD, self).__init__(self.url_map)
 
+    def close(self):
+        """Stop the erasure code processes."""
+        self.codec_executor.close()
+
     def write_ec_meta_chunk(self, source, size, storage_method, sysmeta,
                             meta_chunk):
         meta_checksum = md5()
         handler = EcMetachunkWriter(sysmeta, meta_chunk, meta_checksum,
-                                    storage_method)
+                                    storage_method,
+                                    ec_codec_executor=self.codec_executor)
         bytes_transferred, checksum, chunks = handler.stream(source, size)
         return Response("OK")
 
@@ -157,8 +168,9 @@ class ECD(WerkzeugApp):
     def read_ec_meta_chunk(self, storage_method, meta_chunk,
                            meta_start=None, meta_end=None):
         headers = {}
-        handler = ECChunkDownloadHandler(storage_method, meta_chunk,
-                                         meta_start, meta_end, headers)
+        handler = ECChunkDownloadHandler(
+            storage_method, meta_chunk, meta_start, meta_end, headers,
+            ec_codec_executor=self.codec_executor)
         stream = handler.get_stream()
         return Response(part_iter_to_bytes_iter(stream), 200)
 
@@ -275,6 +287,7 @@ class ECD(WerkzeugApp):
 
 def create_app(conf={}):
     app = ECD(conf)
+    atexit.register(app.close)
     return app
 
 
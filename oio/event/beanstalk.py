@@ -19,7 +19,7 @@ import sys
 from six import iteritems
 import yaml
 from eventlet.green import socket
-from eventlet.queue import Empty, LifoQueue
+from eventlet.queue import Empty, LifoQueue, LightQueue
 try:
     from urllib.parse import urlparse
 except ImportError:
@@ -316,6 +316,20 @@ class Connection(object):
 
     def send_command(self, command, *args, **kwargs):
         command = self.pack_command(command, kwargs.get('body'), *args)
+        self._send_packed(command)
+
+    def send_commands(self, commands):
+        """
+        Send several commands at once, without waiting for the responses.
+
+        :param commands: `list` of (args, kwargs) tuples, as would be
+            passed to `send_command`
+        """
+        self._send_packed(''.join(
+            self.pack_command(args[0], kwargs.get('body'), *args[1:])
+            for args, kwargs in commands))
+
+    def _send_packed(self, command):
         if not self._sock:
             self.connect()
         try:
@@ -390,10 +404,12 @@ def parse_body(connection, response, **kwargs):
 class Beanstalk(object):
     RESPONSE_CALLBACKS = dict_merge(
         {'reserve': parse_body,
+         'reserve-with-timeout': parse_body,
          'stats-tube': parse_yaml}
     )
     EXPECTED_OK = dict_merge(
         {'reserve': ['RESERVED'],
+         'reserve-with-timeout': ['RESERVED'],
          'delete': ['DELETED'],
          'release': ['RELEASED'],
          'bury': ['BURIED'],
@@ -407,6 +423,7 @@ class Beanstalk(object):
     )
     EXPECTED_ERR = dict_merge(
         {'reserve': ['DEADLINE_SOON', 'TIMED_OUT'],
+         'reserve-with-timeout': ['DEADLINE_SOON', 'TIMED_OUT'],
          'delete': ['NOT_FOUND'],
          'release': ['BURIED', 'NOT_FOUND', 'OUT_OF_MEMORY'],
          'bury': ['NOT_FOUND', 'OUT_OF_MEMORY'],
@@ -477,6 +494,35 @@ class Beanstalk(object):
         finally:
             self._release_connection(connection)
 
+    def execute_pipeline(self, commands):
+        """
+        Send several commands at once, then read all their responses.
+
+        :param commands: `list` of (args, kwargs) tuples, as would be
+            passed to `execute_command`
+        :returns: a `list` with the result of each command, or the
+            `ResponseError` it raised
+        """
+        if not commands:
+            return []
+        connection = self._get_connection()
+        try:
+            connection.send_commands(commands)
+            results = list()
+            for args, kwargs in commands:
+                try:
+                    results.append(self.parse_response(
+                        connection, args[0], **kwargs))
+                except ResponseError as exc:
+                    results.append(exc)
+            return results
+        except (ConnectionError, TimeoutError, InvalidResponse):
+            # The following responses cannot be trusted anymore
+            connection.disconnect()
+            raise
+        finally:
+            self._release_connection(connection)
+
     def parse_response(self, connection, command_name, **kwargs):
         response = connection.read_response()
         status, results = response
@@ -545,3 +591,136 @@ class Beanstalk(object):
     def close(self):
         if self._connection:
             self._connection.disconnect()
+
+
+class BeanstalkPrefetcher(object):
+    """
+    Reserve jobs ahead of the consumers, into a bounded local queue,
+    and pipeline the acknowledgements (delete, release, bury) of the
+    jobs with the next reservations.
+
+    All the commands are sent by `step`, which must be called in a loop
+    by a single greenthread. The consumers call `get` to fetch jobs,
+    then `delete`, `release` or `bury` on the same object (these calls
+    only queue the command and never block).
+    """
+
+    def __init__(self, beanstalk, prefetch=10, reserve_timeout=1,
+                 poll_interval=0.1, logger=None):
+        """
+        :param prefetch: maximum number of jobs reserved and not yet
+            acknowledged
+        :param reserve_timeout: how long to wait for a job (in seconds)
+            when no job is being processed
+        :param poll_interval: how often to look for new jobs when the
+            tube is empty but jobs are still being processed
+        """
+        self.beanstalk = beanstalk
+        self.prefetch = prefetch
+        self.reserve_timeout = reserve_timeout
+        self.poll_interval = poll_interval
+        self.logger = logger
+        self.jobs = LightQueue()
+        self.acks = LightQueue()
+        # IDs of the jobs reserved and not acknowledged yet
+        self.reserved = set()
+        self.starving = False
+
+    def get(self):
+        """Get a (job_id, data) tuple, wait until there is one."""
+        return self.jobs.get()
+
+    def delete(self, job_id):
+        self.acks.put((('delete', job_id), {}))
+
+    def release(self, job_id, priority=DEFAULT_PRIORITY, delay=0):
+        self.acks.put((('release', job_id, priority, delay), {}))
+
+    def bury(self, job_id, priority=DEFAULT_PRIORITY):
+        self.acks.put((('bury', job_id, priority), {}))
+
+    def _next_acks(self, wait=True):
+        """Get the acknowledgements to send, wait for one if needed."""
+        acks = list()
+        room = self.prefetch - len(self.reserved)
+        if wait and self.reserved and self.acks.empty() and \
+                (room <= 0 or self.starving):
+            # Nothing to reserve: wait for a consumer to finish a job,
+            # or poll the tube from time to time.
+            try:
+                acks.append(self.acks.get(
+                    timeout=self.poll_interval if room > 0 else None))
+            except Empty:
+                pass
+        while True:
+            try:
+                acks.append(self.acks.get_nowait())
+            except Empty:
+                break
+        # Drop the acknowledgements of jobs reserved on a previous
+        # connection, beanstalkd already released them.
+        valid = list()
+        for ack in acks:
+            job_id = ack[0][1]
+            if job_id in self.reserved:
+                self.reserved.discard(job_id)
+                valid.append(ack)
+        return valid
+
+    def step(self):
+        """
+        Send the pending acknowledgements and as many reservations
+        as there is room for, then read all the responses.
+        """
+        commands = self._next_acks()
+        room = self.prefetch - len(self.reserved)
+        if room > 0:
+            if not self.reserved and not commands:
+                # Nothing in progress, wait for a job on the server side
+                commands.append(
+                    (('reserve-with-timeout', self.reserve_timeout), {}))
+            else:
+                # Do not delay the acknowledgements
+                count = 1 if self.starving else room
+                commands.extend(
+                    [(('reserve-with-timeout', 0), {})] * count)
+        self.starving = self._execute(commands)
+
+    def flush(self):
+        """Send the pending acknowledgements, do not reserve more jobs."""
+        self._execute(self._next_acks(wait=False))
+
+    def _execute(self, commands):
+        """
+        Execute the commands, queue the reserved jobs.
+
+        :returns: True if some reservations timed out
+        """
+        results = self.beanstalk.execute_pipeline(commands)
+        starving = False
+        for (args, _), result in zip(commands, results):
+            if args[0] == 'reserve-with-timeout':
+                if isinstance(result, ResponseError):
+                    # TIMED_OUT or DEADLINE_SOON
+                    starving = True
+                else:
+                    self.reserved.add(result[0])
+                    self.jobs.put(result)
+            elif isinstance(result, ResponseError) and self.logger:
+                self.logger.warn('Failed to %s job %s: %s',
+                                 args[0], args[1], result)
+        return starving
+
+    def reset(self):
+        """
+        Forget the jobs reserved on the current connection,
+        after a connection error.
+        """
+        self.beanstalk.close()
+        while True:
+            try:
+                self.jobs.get_nowait()
+            except Empty:
+                break
+        self.reserved.clear()
+        self.starving = False
@@ -26,7 +26,8 @@ from oio.common.exceptions import OioNetworkException, ClientException
 
 from oio.conscience.client import ConscienceClient
 from oio.rdir.client import RdirClient
-from oio.event.beanstalk import Beanstalk, ConnectionError
+from oio.event.beanstalk import Beanstalk, BeanstalkError, \
+    BeanstalkPrefetcher, ConnectionError
 from oio.common.utils import drop_privileges
 from oio.common.easy_value import true_value, int_value
 from oio.common.json import json
@@ -61,6 +62,29 @@ class StopServe(Exception):
     pass
 
 
+class _JobAcks(object):
+    """
+    Send the acknowledgements of a job to `beanstalk`,
+    and remember if one has been sent.
+    """
+
+    def __init__(self, beanstalk):
+        self.beanstalk = beanstalk
+        self.sent = False
+
+    def delete(self, job_id):
+        self.sent = True
+        self.beanstalk.delete(job_id)
+
+    def release(self, job_id, **kwargs):
+        self.sent = True
+        self.beanstalk.release(job_id, **kwargs)
+
+    def bury(self, job_id, **kwargs):
+        self.sent = True
+        self.beanstalk.bury(job_id, **kwargs)
+
+
 class Worker(object):
 
     SIGNALS = [getattr(signal, "SIG%s" % x)
@@ -177,10 +201,26 @@ class EventWorker(Worker):
         coros = []
         queue_url = self.conf.get('queue_url', 'beanstalk://127.0.0.1:11300')
         concurrency = int_value(self.conf.get('concurrency'), 10)
+        # Number of jobs reserved in advance (per queue URL),
+        # 0 to let each greenthread reserve its own jobs.
+        prefetch = int_value(self.conf.get('prefetch'), 0)
 
         server_gt = greenthread.getcurrent()
 
         for url in queue_url.split(';'):
+            if prefetch > 0:
+                beanstalk = Beanstalk.from_url(url)
+                prefetcher = BeanstalkPrefetcher(
+                    beanstalk, prefetch=prefetch, logger=self.logger)
+                gt = eventlet.spawn(self.prefetch, prefetcher)
+                gt.link(_eventlet_stop, server_gt, beanstalk)
+                coros.append(gt)
+                for i in range(concurrency):
+                    gt = eventlet.spawn(self.handle_prefetched, prefetcher)
+                    gt.link(_stop, server_gt)
+                    coros.append(gt)
+                beanstalk, prefetcher, gt = None, None, None
+                continue
             for i in range(concurrency):
                 beanstalk = Beanstalk.from_url(url)
                 gt = eventlet.spawn(self.handle, beanstalk)
@@ -224,29 +264,80 @@ class EventWorker(Worker):
                         conn_error = True
                     eventlet.sleep(BEANSTALK_RECONNECTION)
                     continue
-                event = self.safe_decode_job(job_id, data)
-                if not event:
-                    self.logger.warn("Burying event %s: %s",
-                                     job_id, "malformed")
-                    beanstalk.bury(job_id)
-                else:
-                    try:
-                        self.process_event(job_id, event, beanstalk)
-                    except (ClientException, OioNetworkException) as exc:
-                        self.logger.warn("Burying event %s (%s): %s",
-                                         job_id, event.get('event'), exc)
-                        beanstalk.bury(job_id)
-                    except ExplicitBury:
-                        self.logger.info("Burying event %s (%s)",
-                                         job_id, event.get('event'))
-                        beanstalk.bury(job_id)
-                    except Exception:
-                        self.logger.exception("Burying event %s: %s",
-                                              job_id, event)
-                        beanstalk.bury(job_id)
+                self.handle_job(job_id, data, beanstalk)
+        except StopServe:
+            pass
+
+    def prefetch(self, prefetcher):
+        """Reserve jobs in advance, send acknowledgements."""
+        conn_error = False
+        try:
+            if self.tube:
+                prefetcher.beanstalk.use(self.tube)
+                prefetcher.beanstalk.watch(self.tube)
+            while True:
+                try:
+                    prefetcher.step()
+                    if conn_error:
+                        self.logger.warn("beanstalk reconnected")
+                        conn_error = False
+                except BeanstalkError as exc:
+                    if not conn_error:
+                        self.logger.warn("beanstalk connection error: %s",
+                                         exc)
+                        conn_error = True
+                    prefetcher.reset()
+                    eventlet.sleep(BEANSTALK_RECONNECTION)
+        except StopServe:
+            # Do not let beanstalkd release the jobs already processed
+            try:
+                prefetcher.flush()
+            except BeanstalkError as exc:
+                self.logger.warn("Failed to acknowledge jobs: %s", exc)
+
+    def handle_prefetched(self, prefetcher):
+        """Process the jobs reserved by a prefetcher."""
+        try:
+            while True:
+                job_id, data = prefetcher.get()
+                self.handle_job(job_id, data, prefetcher)
         except StopServe:
             pass
 
+    def handle_job(self, job_id, data, beanstalk):
+        # The job stays reserved (and takes a prefetch slot)
+        # until it is acknowledged.
+        acks = _JobAcks(beanstalk)
+        try:
+            self._handle_job(job_id, data, acks)
+        finally:
+            if not acks.sent:
+                self.logger.warn("Releasing event %s: not acknowledged "
+                                 "by its handler", job_id)
+                beanstalk.release(job_id, delay=RELEASE_DELAY)
+
+    def _handle_job(self, job_id, data, beanstalk):
+        event = self.safe_decode_job(job_id, data)
+        if not event:
+            self.logger.warn("Burying event %s: %s",
+                             job_id, "malformed")
+            beanstalk.bury(job_id)
+        else:
+            try:
+                self.process_event(job_id, event, beanstalk)
+            except (ClientException, OioNetworkException) as exc:
+                self.logger.warn("Burying event %s (%s): %s",
+                                 job_id, event.get('event'), exc)
+                beanstalk.bury(job_id)
+            except ExplicitBury:
+                self.logger.info("Burying event %s (%s)",
+                                 job_id, event.get('event'))
+                beanstalk.bury(job_id)
+            except Exception:
+                self.logger.exception("Burying event %s: %s",
+                                      job_id, event)
+                beanstalk.bury(job_id)
+
     def process_event(self, job_id, event, beanstalk):
         handler = self.get_handler(event)
         if not handler:
@@ -14,7 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from oio.common.exceptions import ClientException, OioTimeout
+from collections import OrderedDict
+
+import eventlet
+from eventlet.event import Event as GreenEvent
+
+from oio.common.easy_value import float_value, int_value
+from oio.common.exceptions import ClientException, OioTimeout, from_status
 from oio.common.logger import get_logger
 from oio.account.client import AccountClient
 from oio.event.evob import Event, EventError
@@ -30,6 +36,130 @@ CONTAINER_EVENTS = [
         EventTypes.CONTAINER_DELETED]
 
 
+def merge_container_updates(old, new):
+    """
+    Merge two updates of the same container, as if they had been
+    applied one after the other by the account service: the most recent
+    modification time wins (with its object and byte counts), and so
+    does the most recent deletion time.
+    """
+    if new.get('mtime', 0) > old.get('mtime', 0):
+        latest = new
+    else:
+        latest = old
+    merged = {k: latest[k] for k in ('mtime', 'objects', 'bytes')
+              if k in latest}
+    dtime = max(old.get('dtime', 0), new.get('dtime', 0))
+    if dtime:
+        merged['dtime'] = dtime
+    return merged
+
+
+class _PendingUpdate(object):
+    """Latest known state of a container, and the jobs waiting for it."""
+
+    __slots__ = ('account', 'container', 'body', 'result')
+
+    def __init__(self, account, container, body):
+        self.account = account
+        self.container = container
+        self.body = body
+        self.result = GreenEvent()
+
+
+class AccountUpdateBatcher(object):
+    """
+    Coalesce the updates of the same container over a short window,
+    then send them to the account service with a single request.
+    """
+
+    def __init__(self, account, logger, window=0.05, batch_size=10):
+        self.account = account
+        self.logger = logger
+        self.window = window
+        self.batch_size = batch_size
+        self.pending = OrderedDict()
+        self.waiting = 0
+        self.flusher = None
+        self.batch_supported = True
+        # Statistics
+        self.events = 0
+        self.updates = 0
+
+    def update(self, account, container, body):
+        """
+        Queue an update of a container, and wait until it (or a more
+        recent update of the same container) has been persisted.
+
+        :returns: None on success, or the exception explaining the failure
+        """
+        key = (account, container)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = _PendingUpdate(account, container, body)
+            self.pending[key] = pending
+        else:
+            pending.body = merge_container_updates(pending.body, body)
+        self.waiting += 1
+        self.events += 1
+        if self.waiting >= self.batch_size:
+            if self.flusher is not None:
+                self.flusher.cancel()
+            self.flusher = eventlet.spawn(self.flush)
+        elif self.flusher is None:
+            self.flusher = eventlet.spawn_after(self.window, self.flush)
+        return pending.result.wait()
+
+    def flush(self):
+        """Send the pending updates, wake up the jobs waiting for them."""
+        self.flusher = None
+        pending, self.pending = self.pending, OrderedDict()
+        waiting, self.waiting = self.waiting, 0
+        if not pending:
+            return
+        updates = list(pending.values())
+        try:
+            results = self._send(updates)
+        except Exception as exc:
+            results = [exc] * len(updates)
+        self.updates += len(updates)
+        self.logger.debug('%d container events coalesced into %d updates',
+                          waiting, len(updates))
+        for update, result in zip(updates, results):
+            update.result.send(result)
+
+    def _send(self, updates):
+        if self.batch_supported:
+            body = list()
+            for update in updates:
+                data = dict(update.body)
+                data['account'] = update.account
+                data['name'] = update.container
+                body.append(data)
+            try:
+                statuses = self.account.container_update_many(
+                    body, read_timeout=ACCOUNT_TIMEOUT)
+                return [None if res['status'] // 100 == 2
+                        else from_status(res['status'], res.get('message'))
+                        for res in statuses]
+            except ClientException as exc:
+                if exc.http_status != 404:
+                    raise
+                self.logger.warn('The account service does not support '
+                                 'batch updates, sending them one by one')
+                self.batch_supported = False
+        results = list()
+        for update in updates:
+            try:
+                self.account.container_update(
+                    update.account, update.container, dict(update.body),
+                    read_timeout=ACCOUNT_TIMEOUT)
+                results.append(None)
+            except Exception as exc:
+                results.append(exc)
+        return results
+
+
 class AccountUpdateFilter(Filter):
 
     def __init__(self, app, conf, **kwargs):
@@ -37,6 +167,30 @@ class AccountUpdateFilter(Filter):
         super(AccountUpdateFilter, self).__init__(app, conf,
                                                   logger=self.logger, **kwargs)
         self.account = AccountClient(conf, logger=self.logger)
+        # Updates of the same container are coalesced during update_window
+        # seconds, or until update_batch_size events are waiting.
+        # All the filters of a worker share the same batcher.
+        window = float_value(conf.get('update_window'), 0.05)
+        if window > 0.0:
+            self.batcher = self.app_env.get('account_update_batcher')
+            if self.batcher is None:
+                self.batcher = AccountUpdateBatcher(
+                    self.account, self.logger, window=window,
+                    batch_size=int_value(conf.get('update_batch_size'),
+                                         int_value(conf.get('concurrency'),
+                                                   10)))
+                self.app_env['account_update_batcher'] = self.batcher
+        else:
+            self.batcher = None
+
+    def _container_update(self, account, container, body):
+        if self.batcher is not None:
+            err = self.batcher.update(account, container, body)
+            if err is not None:
+                raise err
+        else:
+            self.account.container_update(
+                account, container, body, read_timeout=ACCOUNT_TIMEOUT)
 
     def process(self, env, cb):
         event = Event(env)
@@ -55,9 +209,8 @@ class AccountUpdateFilter(Filter):
             elif event.event_type == EventTypes.CONTAINER_NEW:
                 body['mtime'] = mtime
             try:
-                self.account.container_update(
-                    url.get('account'), url.get('user'), body,
-                    read_timeout=ACCOUNT_TIMEOUT)
+                self._container_update(
+                    url.get('account'), url.get('user'), body)
             except OioTimeout as exc:
                 msg = 'account update failure: %s' % str(exc)
                 resp = EventError(event=Event(env), body=msg)
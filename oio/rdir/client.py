@@ -13,16 +13,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from itertools import product
+
+from eventlet import sleep, spawn
+from eventlet.queue import Queue
 from six import iteritems
 from oio.api.base import HttpApi
 from oio.common.exceptions import ClientException, NotFound, VolumeException
 from oio.common.exceptions import ServiceUnavailable, ServerException
 from oio.common.exceptions import OioNetworkException
-from oio.common.utils import request_id
+from oio.common.utils import monotonic_time, request_id
 from oio.common.logger import get_logger
 from oio.conscience.client import ConscienceClient
 from oio.directory.client import DirectoryClient
-from time import sleep
 
 
 RDIR_ACCT = '_RDIR'
@@ -30,6 +33,16 @@ RDIR_ACCT = '_RDIR'
 # Special target that will match any service from the "known" service list
 JOKER_SVC_TARGET = '__any_slot'
 
+# Number of chunk records sent per request by `RdirClient.chunk_push_many`
+RDIR_PUSH_BATCH_SIZE = 256
+
+# Maximum number of chunk records returned by rdir for each fetch request
+RDIR_FETCH_MAX_LIMIT = 4096
+
+# Container IDs are uppercase hexadecimal strings
+_CID_DIGITS = '0123456789ABCDEF'
+_CID_LENGTH = 64
+
 
 def _make_id(ns, type_, addr):
     return "%s|%s|%s" % (ns, type_, addr)
@@ -193,6 +206,13 @@ class RdirDispatcher(object):
 
     def _poll_rdir(self, avoid=None, known=None, **kwargs):
         """Call the special rdir service pool (created if missing)"""
+        if self.cs.service_cache is not None:
+            try:
+                return self.cs.service_cache.choose(
+                    'rdir', avoid=avoid, known=known)[0]
+            except ServiceUnavailable as exc:
+                self.logger.debug(
+                    'Failed to select a rdir service locally: %s', exc)
         try:
             svcs = self.cs.poll('__rawx_rdir', avoid=avoid, known=known,
                                 **kwargs)
@@ -211,6 +231,87 @@ class RdirDispatcher(object):
         raise ServerException("LB returned incoherent result: %s" % svcs)
 
 
+def _fetch_shards(container_id, shards):
+    """
+    Split the container ID space (below `container_id`, if specified)
+    in `shards` lists of contiguous prefixes.
+    """
+    container_id = container_id or ''
+    if shards <= 1 or len(container_id) >= _CID_LENGTH:
+        return [[container_id]]
+    digits = 1
+    while len(_CID_DIGITS) ** digits < shards and \
+            len(container_id) + digits < _CID_LENGTH:
+        digits += 1
+    prefixes = [container_id + ''.join(suffix)
+                for suffix in product(_CID_DIGITS, repeat=digits)]
+    shards = min(shards, len(prefixes))
+    return [prefixes[i * len(prefixes) // shards:
+                     (i + 1) * len(prefixes) // shards]
+            for i in range(shards)]
+
+
+class ChunkPrefetcher(object):
+    """
+    Iterate over pages of chunk records fetched from rdir by background
+    green threads, ahead of the consumer. Each thread fetches a shard of
+    the container ID space.
+
+    The size of the pages doubles (up to `max_limit`) each time the
+    consumer has to wait for a page, and halves (down to the size
+    initially requested) when pages pile up.
+    """
+
+    def __init__(self, fetch_page, req_body, shards, prefetch=2,
+                 max_limit=RDIR_FETCH_MAX_LIMIT):
+        self.fetch_page = fetch_page
+        self.req_body = req_body
+        self.min_limit = req_body['limit']
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = self.min_limit
+        self.queue = Queue(max(prefetch, 1) * len(shards))
+        self.threads = [spawn(self._fetch_shard, prefixes)
+                        for prefixes in shards]
+
+    def _fetch_shard(self, prefixes):
+        try:
+            for prefix in prefixes:
+                req_body = dict(self.req_body)
+                if prefix:
+                    req_body['container_id'] = prefix
+                while True:
+                    req_body['limit'] = self.limit
+                    page = self.fetch_page(req_body)
+                    if not page:
+                        break
+                    if self.queue.full():
+                        self.limit = max(self.limit // 2, self.min_limit)
+                    self.queue.put(page)
+                    req_body['start_after'] = page[-1][0]
+            self.queue.put(None)
+        except Exception as exc:
+            self.queue.put(exc)
+
+    def __iter__(self):
+        running = len(self.threads)
+        first = True
+        while running:
+            if self.queue.empty() and not first:
+                self.limit = min(self.limit * 2, self.max_limit)
+            first = False
+            page = self.queue.get()
+            if page is None:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+
+    def close(self):
+        for thread in self.threads:
+            thread.kill()
+
+
 class RdirClient(HttpApi):
     """
     Client class for rdir services.
@@ -219,6 +320,7 @@ class RdirClient(HttpApi):
     def __init__(self, conf, **kwargs):
         super(RdirClient, self).__init__(conf, **kwargs)
         self.directory = DirectoryClient(conf, **kwargs)
+        self.logger = kwargs.get('logger') or get_logger(conf)
         self._addr_cache = dict()
 
     def _clear_cache(self, volume_id):
@@ -276,6 +378,67 @@ class RdirClient(HttpApi):
         self._rdir_request(volume_id, 'POST', 'push', create=True,
                            json=body)
 
+    def _chunk_push_each(self, volume_id, records):
+        failed = list()
+        for record in records:
+            try:
+                data = record.copy()
+                self.chunk_push(volume_id, data.pop('container_id'),
+                                data.pop('content_id'),
+                                data.pop('chunk_id'), **data)
+            except Exception as exc:
+                failed.append((record, exc))
+        return failed
+
+    def _chunk_push_batch(self, volume_id, records, max_attempts=3,
+                          **kwargs):
+        for i in range(max_attempts):
+            try:
+                self._rdir_request(volume_id, 'POST', 'push', create=True,
+                                   json=records, **kwargs)
+                return []
+            except OioNetworkException as exc:
+                err = exc
+            except ClientException as exc:
+                if exc.http_status == 400:
+                    # Either a record is malformed, or the service
+                    # does not support batches: push them one by one.
+                    return self._chunk_push_each(volume_id, records)
+                if exc.http_status < 500:
+                    return [(record, exc) for record in records]
+                err = exc
+            # Monotonic backoff
+            if i < max_attempts - 1:
+                sleep(i * 1.0)
+        return [(record, err) for record in records]
+
+    def chunk_push_many(self, volume_id, records,
+                        batch_size=RDIR_PUSH_BATCH_SIZE, max_attempts=3,
+                        **kwargs):
+        """
+        Reference many chunks in the reverse directory,
+        sending `batch_size` records per request.
+
+        A request failing because of the network or a server error
+        is retried, up to `max_attempts` times. The other requests
+        are not affected.
+
+        :param records: chunk records, `dict` with at least
+            'container_id', 'content_id' and 'chunk_id' keys,
+            and optionally 'mtime' and 'rtime'
+        :type records: iterable of `dict`
+        :returns: the records which could not be pushed,
+            with the associated exception
+        :rtype: `list` of `tuple`
+        """
+        records = list(records)
+        failed = list()
+        for start in range(0, len(records), batch_size):
+            failed.extend(self._chunk_push_batch(
+                volume_id, records[start:start + batch_size],
+                max_attempts=max_attempts, **kwargs))
+        return failed
+
     def chunk_delete(self, volume_id, container_id, content_id, chunk_id):
         """Unreference a chunk from the reverse directory"""
         body = {'container_id': container_id,
@@ -284,46 +447,92 @@ class RdirClient(HttpApi):
 
         self._rdir_request(volume_id, 'DELETE', 'delete', json=body)
 
+    def _chunk_fetch_page(self, volume, req_body, max_attempts=3):
+        for i in range(max_attempts):
+            try:
+                _, resp_body = self._rdir_request(
+                    volume, 'POST', 'fetch', json=req_body)
+                return resp_body
+            except OioNetworkException:
+                # Monotonic backoff
+                if i < max_attempts - 1:
+                    sleep(i * 1.0)
+                    continue
+                # Too many attempts
+                raise
+
+    def _chunk_fetch_pages(self, volume, req_body, max_attempts=3):
+        while True:
+            resp_body = self._chunk_fetch_page(volume, req_body,
+                                               max_attempts=max_attempts)
+            if len(resp_body) == 0:
+                break
+            yield resp_body
+            req_body['start_after'] = resp_body[-1][0]
+
     def chunk_fetch(self, volume, limit=100, rebuild=False,
-                    container_id=None, max_attempts=3):
+                    container_id=None, max_attempts=3, start_after=None,
+                    prefetch=0, shards=1, max_limit=RDIR_FETCH_MAX_LIMIT):
         """
         Fetch the list of chunks belonging to the specified volume.
 
         :param volume: the volume to get chunks from
         :type volume: `str`
         :param limit: maximum number of results to return
+            (by each request)
         :type limit: `int`
         :param rebuild:
         :type rebuild: `bool`
         :keyword container_id: get only chunks belonging to
-           the specified container
+           the specified container (or to containers whose ID starts
+           with this prefix)
         :type container_id: `str`
+        :keyword start_after: get only chunks whose key
+            ("container|content|chunk") comes after this one
+        :type start_after: `str`
+        :keyword prefetch: number of pages to fetch in background while
+            the current one is consumed (0 to fetch them on demand)
+        :type prefetch: `int`
+        :keyword shards: number of parallel fetchers, each one on a part
+            of the container ID space (the chunks are then not yielded
+            in order)
+        :type shards: `int`
+        :keyword max_limit: when prefetching, the size of the pages
+            adapts to the speed of the consumer, up to this limit
+        :type max_limit: `int`
         """
         req_body = {'limit': limit}
         if rebuild:
             req_body['rebuild'] = True
-        if container_id:
-            req_body['container_id'] = container_id
+        if start_after:
+            req_body['start_after'] = start_after
+
+        shards = _fetch_shards(container_id, shards)
+        if prefetch <= 0 and len(shards) == 1:
+            if container_id:
+                req_body['container_id'] = container_id
+            pages = self._chunk_fetch_pages(volume, req_body,
+                                            max_attempts=max_attempts)
+        else:
+            pages = ChunkPrefetcher(
+                lambda body: self._chunk_fetch_page(
+                    volume, body, max_attempts=max_attempts),
+                req_body, shards, prefetch=prefetch, max_limit=max_limit)
 
-        while True:
-            for i in range(max_attempts):
-                try:
-                    resp, resp_body = self._rdir_request(
-                        volume, 'POST', 'fetch', json=req_body)
-                    break
-                except OioNetworkException:
-                    # Monotonic backoff
-                    if i < max_attempts - 1:
-                        sleep(i * 1.0)
-                        continue
-                    # Too many attempts
-                    raise
-            if len(resp_body) == 0:
-                break
-            for (key, value) in resp_body:
-                container, content, chunk = key.split('|')
-                yield container, content, chunk, value
-            req_body['start_after'] = key
+        count = 0
+        start = monotonic_time()
+        try:
+            for page in pages:
+                for (key, value) in page:
+                    container, content, chunk = key.split('|')
+                    yield container, content, chunk, value
+                count += len(page)
+        finally:
+            pages.close()
+            elapsed = (monotonic_time() - start) or 0.000001
+            self.logger.info(
+                'Fetched %d chunks of volume %s in %.2fs (%.2f chunks/s)',
+                count, volume, elapsed, count / elapsed)
 
     def admin_incident_set(self, volume, date):
         body = {'date': int(float(date))}
@@ -43,6 +43,9 @@ class BlobRebuilder(Rebuilder):
                                         DEFAULT_REBUILDER_TUBE)
         self.beanstalk = None
         self.rdir_fetch_limit = int_value(conf.get('rdir_fetch_limit'), 100)
+        self.rdir_fetch_prefetch = int_value(conf.get('rdir_fetch_prefetch'),
+                                             2)
+        self.rdir_fetch_shards = int_value(conf.get('rdir_fetch_shards'), 1)
 
     def _fetch_chunks_from_event(self, job_id, data):
         env = json.loads(data)
@@ -104,9 +107,10 @@ class BlobRebuilder(Rebuilder):
         elif self.beanstalkd_addr:
             return self._fetch_chunks_from_beanstalk()
         else:
-            return self.rdir_client.chunk_fetch(self.volume,
-                                                limit=self.rdir_fetch_limit,
-                                                rebuild=True)
+            return self.rdir_client.chunk_fetch(
+                self.volume, limit=self.rdir_fetch_limit, rebuild=True,
+                prefetch=self.rdir_fetch_prefetch,
+                shards=self.rdir_fetch_shards)
 
     def rebuilder_pass_with_lock(self):
         self.rdir_client.admin_lock(self.volume,
@@ -502,6 +502,36 @@ _db_vol_push(const char *volid, gboolean autocreate, GString *key,
 	return _map_errno_to_gerror(errno, errmsg);
 }
 
+static GError *
+_db_vol_push_many(const char *volid, gboolean autocreate, GPtrArray *keys,
+		GPtrArray *values)
+{
+	struct rdir_base_s *base = NULL;
+	GError *err = _db_get(volid, autocreate, &base);
+	if (err)
+		return err;
+
+	char *errmsg = NULL;
+
+	leveldb_writebatch_t *batch = leveldb_writebatch_create();
+	for (guint i = 0; i < keys->len; i++) {
+		GString *key = keys->pdata[i], *value = values->pdata[i];
+		leveldb_writebatch_put(batch, key->str, key->len,
+				value->str, value->len);
+	}
+
+	leveldb_writeoptions_t *options = leveldb_writeoptions_create();
+	leveldb_writeoptions_set_sync(options, 0);
+	leveldb_write(base->base, options, batch, &errmsg);
+	int errsav = errno;
+	leveldb_writeoptions_destroy(options);
+	leveldb_writebatch_destroy(batch);
+
+	if (!errmsg)
+		return NULL;
+	return _map_errno_to_gerror(errsav, errmsg);
+}
+
 static GError *
 _db_vol_fetch(const char *volid, GString *value,
 		const char *start_after, gint64 limit, gboolean rebuild,
@@ -981,10 +1011,64 @@ _route_vol_delete(struct req_args_s *args, struct json_object *jbody,
 	return _reply_ok(args->rp, NULL);
 }
 
+static void
+_gstring_free(gpointer p)
+{
+	g_string_free(p, TRUE);
+}
+
+/* Push all the records of a JSON array at once. If any record is malformed,
+ * none is pushed. */
+static enum http_rc_e
+_route_vol_push_many(struct req_args_s *args, struct json_object *jbody,
+		const char *volid, gboolean autocreate)
+{
+	GError *err = NULL;
+	const int nb_records = json_object_array_length(jbody);
+	GPtrArray *keys = g_ptr_array_new_full(nb_records, _gstring_free);
+	GPtrArray *values = g_ptr_array_new_full(nb_records, _gstring_free);
+
+	/* extract all the records' fields */
+	for (int i = 0; !err && i < nb_records; i++) {
+		struct json_object *jrecord = json_object_array_get_idx(jbody, i);
+		struct rdir_record_s rec = {0};
+		if (!jrecord || !json_object_is_type(jrecord, json_type_object)) {
+			err = BADREQ("record %d is not an object", i);
+		} else if (!(err = _record_extract(&rec, jrecord))) {
+			GString *value = g_string_sized_new(1024);
+			_record_encode(&rec, value);
+			g_ptr_array_add(keys, _record_to_key(&rec));
+			g_ptr_array_add(values, value);
+		}
+	}
+
+	if (err) {
+		g_ptr_array_free(keys, TRUE);
+		g_ptr_array_free(values, TRUE);
+		return _reply_format_error(args->rp, err);
+	}
+
+	/* Eventually push the records in the database */
+	if (keys->len > 0)
+		err = _db_vol_push_many(volid, autocreate, keys, values);
+	g_ptr_array_free(keys, TRUE);
+	g_ptr_array_free(values, TRUE);
+
+	if (err)
+		return _reply_common_error(args->rp, err);
+	return _reply_ok(args->rp, NULL);
+}
+
 static enum http_rc_e
 _route_vol_push(struct req_args_s *args, struct json_object *jbody,
 		const char *volid, const char *str_autocreate)
 {
+	if (jbody && json_object_is_type(jbody, json_type_array)) {
+		if (!volid)
+			return _reply_format_error(args->rp, BADREQ("no volume id"));
+		return _route_vol_push_many(args, jbody, volid,
+				oio_str_parse_bool(str_autocreate, FALSE));
+	}
 	if (!jbody || !json_object_is_type(jbody, json_type_object))
 		return _reply_format_error(args->rp, BADREQ("null body"));
 	if (!volid)
@@ -25,7 +25,7 @@ import random
 from oio.account.backend import AccountBackend
 from oio.common.timestamp import Timestamp
 from tests.utils import BaseTestCase, random_str
-from werkzeug.exceptions import Conflict
+from werkzeug.exceptions import BadRequest, Conflict
 from testtools.testcase import ExpectedException
 
 
@@ -595,3 +595,27 @@ class TestAccountBackend(BaseTestCase):
         self.assertEqual(self.conn.hget(account_key, 'objects'), '0')
         self.assertEqual(self.conn.zcard("containers:%s" % account_id), 0)
         self.assertEqual(self.conn.exists("container:test:*"), 0)
+
+    def test_update_containers(self):
+        backend = AccountBackend({}, self.conn)
+        account_id = random_str(16)
+        account_key = 'account:%s' % account_id
+        mtime = Timestamp(time()).normal
+        updates = [
+            {'account': account_id, 'name': 'ct0', 'mtime': mtime,
+             'objects': 1, 'bytes': 10},
+            {'account': account_id, 'name': 'ct1', 'mtime': mtime,
+             'objects': 2, 'bytes': 20},
+            {'account': account_id},
+        ]
+        errors = backend.update_containers(updates)
+        self.assertEqual([None, None], errors[:2])
+        self.assertIsInstance(errors[2], BadRequest)
+        self.assertEqual(self.conn.hget(account_key, 'bytes'), '30')
+        self.assertEqual(self.conn.hget(account_key, 'objects'), '3')
+        self.assertEqual(self.conn.zcard("containers:%s" % account_id), 2)
+
+        # Same events again: no update needed
+        errors = backend.update_containers(updates[:2])
+        for err in errors:
+            self.assertIsInstance(err, Conflict)
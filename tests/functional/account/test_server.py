@@ -77,6 +77,24 @@ class TestAccountServer(BaseTestCase):
                              data=data, query_string={'id': self.account_id})
         self.assertEqual(resp.status_code, 200)
 
+    def test_account_container_update_many(self):
+        mtime = Timestamp(time()).normal
+        data = {'containers': [
+            {'account': self.account_id, 'name': 'foo', 'mtime': mtime,
+             'objects': 0, 'bytes': 0},
+            {'account': self.account_id, 'name': 'foo', 'mtime': mtime,
+             'objects': 0, 'bytes': 0},
+            {'account': self.account_id}]}
+        resp = self.app.post('/v1.0/account/container/update_many',
+                             data=json.dumps(data))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([200, 409, 400],
+                         [res['status'] for res in json.loads(resp.data)])
+
+        resp = self.app.post('/v1.0/account/container/update_many',
+                             data=json.dumps({'foo': 'bar'}))
+        self.assertEqual(resp.status_code, 400)
+
     def test_account_containers(self):
         args = {'id': self.account_id}
         resp = self.app.post('/v1.0/account/containers',
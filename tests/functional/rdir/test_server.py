@@ -558,3 +558,32 @@ class TestRdirServer3(RdirTestCase):
         proc1 = subprocess.Popen(['oio-rdir-server', cfg], stderr=fd)
         self.garbage_procs.append(proc1)
         self.assertTrue(_check_process_absent(proc1))
+
+    def test_push_many(self):
+        recs = [self._record() for _ in range(4)]
+
+        resp = self._post(
+                "/v1/rdir/push", params={'vol': self.vol, 'create': True},
+                data=json.dumps(recs))
+        self.assertEqual(resp.status, 204)
+
+        resp = self._post("/v1/rdir/fetch", params={'vol': self.vol})
+        self.assertEqual(resp.status, 200)
+        reference = sorted(
+            [_key(rec), {'mtime': rec['mtime'], 'rtime': 0}] for rec in recs)
+        self.assertListEqual(self.json_loads(resp.data), reference)
+
+    def test_push_many_malformed(self):
+        good = self._record()
+        bad = self._record()
+        del bad['chunk_id']
+
+        resp = self._post(
+                "/v1/rdir/push", params={'vol': self.vol, 'create': True},
+                data=json.dumps([good, bad]))
+        self.assertEqual(resp.status, 400)
+
+        # Nothing of the batch must have been written
+        resp = self._post("/v1/rdir/fetch", params={'vol': self.vol})
+        if resp.status == 200:
+            self.assertEqual(self.json_loads(resp.data), [])
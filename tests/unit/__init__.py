@@ -20,9 +20,21 @@ import mock
 import oio
 
 
+def stopped(timeout):
+    """
+    Cancel the timer of a Timeout that is only used as an exception,
+    so that it does not fire later, in another test.
+    """
+    timeout.cancel()
+    return timeout
+
+
 @contextmanager
 def set_http_requests(cb):
     class FakeConn(object):
+        pool = None
+        reused = False
+
         def __init__(self, req):
             self.req = req
             self.resp = None
@@ -31,6 +43,12 @@ def set_http_requests(cb):
             self.resp = cb(self.req)
             return self.resp
 
+        def close(self):
+            pass
+
+        def release(self):
+            pass
+
     class ConnectionRecord(object):
         def __init__(self):
             self.records = []
@@ -38,7 +56,7 @@ def set_http_requests(cb):
         def __len__(self):
             return len(self.records)
 
-        def __call__(self, host, method, path, headers):
+        def __call__(self, host, method, path, headers, **_kwargs):
             req = {'host': host,
                    'method': method,
                    'path': path,
@@ -86,6 +104,9 @@ class FakeStatus(object):
 
 def fake_http_connect(*status_iter, **kwargs):
     class FakeConn(object):
+        pool = None
+        reused = False
+
         def __init__(self, status, body=b'', headers=None, cb_body=None,
                      conn_id=None):
             if not isinstance(status, FakeStatus):
@@ -124,6 +145,9 @@ def fake_http_connect(*status_iter, **kwargs):
         def close(self):
             self.closed = True
 
+        def release(self):
+            self.close()
+
     if isinstance(kwargs.get('headers'), (list, tuple)):
         headers_iter = iter(kwargs['headers'])
     else:
@@ -17,7 +17,8 @@ import unittest
 from mock import MagicMock as Mock, patch
 
 from oio.common.exceptions import Conflict, ServiceBusy
-from tests.unit.api import FakeStorageApi
+from oio.container.client import LATENCY_BUCKETS
+from tests.unit.api import FakeApiResponse, FakeStorageApi
 
 
 class ContainerClientTest(unittest.TestCase):
@@ -71,3 +72,99 @@ class ContainerClientTest(unittest.TestCase):
                 ServiceBusy,
                 self.api.container.content_create,
                 self.account, self.container, "test", size=1, data={})
+
+
+class ContentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.perfdata = dict()
+        self.api = FakeStorageApi("NS", endpoint="http://1.2.3.4:8000",
+                                  content_cache_size=10,
+                                  perfdata=self.perfdata)
+        self.account = "test_content_cache"
+        self.container = "fake_container"
+        resp = FakeApiResponse()
+        resp.headers = {'x-oio-content-meta-chunk-method': 'plain/nb_copy=3',
+                        'x-oio-content-meta-version': '1'}
+        self.chunks = [{'url': 'http://127.0.0.1:6010/AAAA', 'pos': '0',
+                        'size': 32, 'hash': '00' * 16}]
+        self.request = Mock(return_value=(resp, self.chunks))
+        self.api.container._direct_request = self.request
+
+    def _locate(self, obj='obj', **kwargs):
+        return self.api.object_locate(self.account, self.container, obj,
+                                      **kwargs)
+
+    def test_hit(self):
+        meta, chunks = self._locate()
+        self.assertEqual('1', meta['version'])
+        self.assertEqual(self.chunks, chunks)
+        meta['container_id'] = 'modified by the caller'
+        meta2, chunks2 = self._locate()
+        self.assertEqual(1, self.request.call_count)
+        self.assertNotIn('container_id', meta2)
+        self.assertEqual(self.chunks, chunks2)
+        # Other version, other object: not in the cache
+        self._locate(version='2')
+        self._locate('obj2')
+        self.assertEqual(3, self.request.call_count)
+
+        self.assertEqual(1, self.perfdata['content_cache_hits'])
+        self.assertEqual(3, self.perfdata['content_cache_misses'])
+        self.assertEqual(0.25, self.perfdata['content_cache_hit_ratio'])
+        self.assertEqual(1, sum(self.perfdata['content_cache_hit_latency']
+                                .values()))
+        self.assertEqual(3, sum(self.perfdata['content_cache_miss_latency']
+                                .values()))
+        for bound in self.perfdata['content_cache_hit_latency']:
+            self.assertIn(bound, LATENCY_BUCKETS)
+
+    def test_invalidate_on_write(self):
+        self._locate()
+        self._locate(version='1')
+        self.api.object_set_properties(self.account, self.container, 'obj',
+                                       {'a': 'b'})
+        self.assertEqual(3, self.request.call_count)
+        # All versions have been forgotten
+        self._locate()
+        self._locate(version='1')
+        self.assertEqual(5, self.request.call_count)
+
+        self.request.return_value = (
+            FakeApiResponse(), {'contents': [{'name': 'obj', 'status': 204},
+                                             {'name': 'obj2', 'status': 204}]})
+        self.api.object_delete_many(self.account, self.container,
+                                    ['obj', 'obj2'])
+        self.request.return_value = (FakeApiResponse(), self.chunks)
+        self._locate()
+        self.assertEqual(7, self.request.call_count)
+
+    def test_invalidate_on_failed_write(self):
+        self._locate()
+        self.request.side_effect = ServiceBusy()
+        self.assertRaises(ServiceBusy, self.api.object_delete,
+                          self.account, self.container, 'obj')
+        self.request.side_effect = None
+        self._locate()
+        self.assertEqual(3, self.request.call_count)
+
+    def test_invalidate_from_event(self):
+        cid = self.api.container._content_cache_key(
+            self.account, self.container, 'obj')[0]
+        self._locate()
+        self.api.container.content_cache_event(
+            {'event': 'storage.container.new', 'url': {'id': cid}})
+        self._locate()
+        self.assertEqual(1, self.request.call_count)
+        self.api.container.content_cache_event(
+            {'event': 'storage.content.deleted',
+             'url': {'id': cid, 'path': 'obj'}})
+        self._locate()
+        self.assertEqual(2, self.request.call_count)
+
+    def test_disabled(self):
+        api = FakeStorageApi("NS", endpoint="http://1.2.3.4:8000")
+        self.assertIsNone(api.container.content_cache)
+        api.container._direct_request = self.request
+        api.object_locate(self.account, self.container, 'obj')
+        api.object_locate(self.account, self.container, 'obj')
+        self.assertEqual(2, self.request.call_count)
@@ -13,22 +13,27 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+import os
 import unittest
 import random
 from io import BytesIO
 from collections import defaultdict
 import hashlib
 from copy import deepcopy
-from eventlet import Timeout
+from eventlet import GreenPile, Timeout, sleep, spawn
 from mock import patch
 from oio.common.storage_method import STORAGE_METHODS
+from oio.api import ec
 from oio.api.ec import EcMetachunkWriter, ECChunkDownloadHandler, \
-    ECRebuildHandler
+    ECRebuildHandler, ECWriteHandler, CodecExecutor, ECCodec, ec_encode
 from oio.common import exceptions as exc, green
+from oio.api.io import HedgingPolicy
 from oio.common.constants import CHUNK_HEADERS
+from oio.common.utils import monotonic_time
 from tests.unit.api import empty_stream, decode_chunked_body, \
     FakeResponse, CHUNK_SIZE, EMPTY_MD5, EMPTY_SHA256
-from tests.unit import set_http_connect, set_http_requests
+from tests.unit import set_http_connect, set_http_requests, stopped, \
+    fake_http_connect
 from oio.common.constants import OIO_VERSION
 
 
@@ -132,7 +137,7 @@ class TestEC(unittest.TestCase):
 
     def test_write_connect_errors(self):
         test_cases = [
-                {'error': green.ConnectionTimeout(1.0),
+                {'error': stopped(green.ConnectionTimeout(1.0)),
                  'msg': 'connect: Connection timeout 1.0 second'},
                 {'error': Exception('failure'), 'msg': 'connect: failure'},
         ]
@@ -163,7 +168,7 @@ class TestEC(unittest.TestCase):
 
     def test_write_response_error(self):
         test_cases = [
-                {'error': green.ChunkWriteTimeout(1.0),
+                {'error': stopped(green.ChunkWriteTimeout(1.0)),
                  'msg': 'resp: Chunk write timeout 1.0 second'},
                 {'error': Exception('failure'), 'msg': 'resp: failure'},
         ]
@@ -209,7 +214,7 @@ class TestEC(unittest.TestCase):
     def test_write_timeout_source(self):
         class TestReader(object):
             def read(self, size):
-                raise Timeout(1.0)
+                raise stopped(Timeout(1.0))
         checksum = self.checksum()
         source = TestReader()
         size = CHUNK_SIZE * self.storage_method.ec_nb_data
@@ -238,6 +243,17 @@ class TestEC(unittest.TestCase):
                               size)
 
     def test_write_transfer(self):
+        self._test_write_transfer()
+
+    def test_write_transfer_offloaded_codec(self):
+        perfdata = {}
+        executor = CodecExecutor(processes=2, queue_depth=2)
+        self.addCleanup(executor.close)
+        self._test_write_transfer(ec_codec_executor=executor,
+                                  perfdata=perfdata)
+        self.assertGreater(perfdata['ec_codec'], 0.0)
+
+    def _test_write_transfer(self, **kwargs):
         checksum = self.checksum()
         segment_size = self.storage_method.ec_segment_size
         test_data = (b'1234' * segment_size)[:-10]
@@ -256,7 +272,8 @@ class TestEC(unittest.TestCase):
 
         with set_http_connect(*resps, cb_body=cb_body):
             handler = EcMetachunkWriter(self.sysmeta, self.meta_chunk(),
-                                        checksum, self.storage_method)
+                                        checksum, self.storage_method,
+                                        **kwargs)
             bytes_transferred, checksum, chunks = handler.stream(source, size)
 
         self.assertEqual(len(test_data), bytes_transferred)
@@ -295,6 +312,95 @@ class TestEC(unittest.TestCase):
         self.assertEqual(
             test_data_checksum, self.checksum(final_data).hexdigest())
 
+    def _pipelined_handler(self, data, chunk_size, nb_metachunks,
+                           in_flight):
+        sysmeta = dict(self.sysmeta, chunk_size=chunk_size)
+        chunk_prep = {
+            pos: [dict(chunk, pos='%d.%d' % (pos, chunk['num']),
+                       url='http://127.0.0.1:%d/%d.%d' % (
+                           7000 + chunk['num'], pos, chunk['num']))
+                  for chunk in self.meta_chunk()]
+            for pos in range(nb_metachunks)}
+        return ECWriteHandler(
+            BytesIO(data), sysmeta, chunk_prep, self.storage_method,
+            metachunks_in_flight=in_flight)
+
+    def test_write_pipelined(self):
+        segment_size = self.storage_method.ec_segment_size
+        # One segment per metachunk
+        chunk_size = segment_size // 3
+        test_data = os.urandom(segment_size * 2 + segment_size // 2)
+        nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
+        failed_path = '/1.3'
+        good = fake_http_connect(*([201] * (nb * 3 - 1)))
+        bad = fake_http_connect(500)
+        put_parts = defaultdict(list)
+
+        def _connect(host, method, path, headers, **kwargs):
+            connect = bad if path == failed_path else good
+            conn = connect(host, method, path, headers, **kwargs)
+            conn.cb_body = lambda _conn_id, part: put_parts[path].append(part)
+            return conn
+
+        running = [0, 0]
+        write_metachunk = ECWriteHandler._write_metachunk
+
+        def _write_metachunk(handler, *args):
+            running[0] += 1
+            running[1] = max(running)
+            try:
+                sleep(0.01)
+                return write_metachunk(handler, *args)
+            finally:
+                running[0] -= 1
+
+        with patch('oio.api.io.http_connect', _connect), \
+                patch.object(ECWriteHandler, '_write_metachunk',
+                             _write_metachunk):
+            handler = self._pipelined_handler(test_data, chunk_size, 6, 2)
+            chunks, bytes_transferred, checksum = handler.stream()
+
+        self.assertEqual(2, running[1])
+        self.assertEqual(len(test_data), bytes_transferred)
+        self.assertEqual(self.checksum(test_data).hexdigest(), checksum)
+        # The failed fragment is not saved
+        self.assertEqual(nb * 3 - 1, len(chunks))
+        self.assertNotIn('1.3', [chunk['pos'] for chunk in chunks])
+        for chunk in chunks:
+            pos = int(chunk['pos'].split('.')[0])
+            data = test_data[pos * segment_size:(pos + 1) * segment_size]
+            self.assertEqual(self.checksum(data).hexdigest(), chunk['hash'])
+            self.assertEqual(len(data), chunk['size'])
+
+        for pos in range(3):
+            data = test_data[pos * segment_size:(pos + 1) * segment_size]
+            fragments = list()
+            for num in range(nb):
+                path = '/%d.%d' % (pos, num)
+                if path == failed_path:
+                    continue
+                body, trailers = decode_chunked_body(
+                    b''.join(put_parts[path]))
+                self.assertEqual(
+                    len(data),
+                    int(trailers[CHUNK_HEADERS['metachunk_size']]))
+                self.assertEqual(
+                    self.checksum(data).hexdigest(),
+                    trailers[CHUNK_HEADERS['metachunk_hash']])
+                fragments.append(body)
+            self.assertEqual(
+                data, self.storage_method.driver.decode(fragments))
+
+    def test_write_pipelined_exception(self):
+        segment_size = self.storage_method.ec_segment_size
+        test_data = os.urandom(segment_size * 2)
+        nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
+        resps = [201] * nb + [500] * nb
+        with set_http_connect(*resps):
+            handler = self._pipelined_handler(
+                test_data, segment_size // 3, 2, 2)
+            self.assertRaises(exc.OioException, handler.stream)
+
     def _test_write_checksum_algo(self, expected_checksum, **kwargs):
         global_checksum = self.checksum()
         source = empty_stream()
@@ -360,6 +466,125 @@ class TestEC(unittest.TestCase):
         ec_chunks = [b''.join(frag) for frag in zip(*fragments_data)]
         return ec_chunks
 
+    def test_codec_processes_free_the_hub(self):
+        executor = CodecExecutor(processes=1)
+        self.addCleanup(executor.close)
+        segment = b'x' * (8 * 1024 * 1024)
+        ticks = [0]
+
+        def _tick():
+            while True:
+                ticks[0] += 1
+                sleep(0)
+
+        ticker = spawn(_tick)
+        try:
+            fragments, elapsed = executor.execute(
+                self.storage_method, 'encode', segment)
+        finally:
+            ticker.kill()
+        self.assertEqual(self.storage_method.driver.encode(segment),
+                         fragments)
+        self.assertGreater(elapsed, 0.0)
+        # Other greenthreads ran during the computation
+        self.assertGreater(ticks[0], 1)
+
+    def test_codec_processes_errors(self):
+        executor = CodecExecutor(processes=1)
+        self.addCleanup(executor.close)
+        self.assertRaises(Exception, executor.execute,
+                          self.storage_method, 'decode', [b'bad'])
+        # The process is still usable
+        fragments, _ = executor.execute(self.storage_method, 'encode',
+                                        b'data')
+        self.assertEqual(self.storage_method.driver.encode(b'data'),
+                         fragments)
+        # An interrupted call discards the process
+        with patch('oio.api.ec._recv_msg', side_effect=Timeout(None)):
+            self.assertRaises(Timeout, executor.execute,
+                              self.storage_method, 'encode', b'data')
+        self.assertEqual(0, executor._started)
+        fragments, _ = executor.execute(self.storage_method, 'encode',
+                                        b'data')
+        self.assertEqual(1, executor._started)
+
+    def test_codec_processes_close(self):
+        executor = CodecExecutor(processes=2)
+        self.addCleanup(executor.close)
+        pile = GreenPile()
+        for _ in range(2):
+            pile.spawn(executor.execute, self.storage_method, 'encode',
+                       b'x' * 65536)
+        list(pile)
+        self.assertEqual(2, executor._started)
+        pids = [proc.pid for proc in executor._procs]
+        # The children do not keep the sockets of each other
+        # (or of the parent) open, closing does not block
+        start = monotonic_time()
+        executor.close()
+        self.assertLess(monotonic_time() - start, 1.0)
+        self.assertEqual(0, executor._started)
+        with Timeout(5.0):
+            while any(pid in ec._unreaped for pid in pids):
+                sleep(0.01)
+                ec._reap_children()
+
+    def test_codec_processes_timeout(self):
+        executor = CodecExecutor(processes=1)
+        self.addCleanup(executor.close)
+        segment = b'x' * (16 * 1024 * 1024)
+        start = monotonic_time()
+        self.assertRaises(Timeout, self._timed_execute, executor,
+                          segment, 0.001)
+        self.assertLess(monotonic_time() - start, 1.0)
+        self.assertEqual(0, executor._started)
+
+    def _timed_execute(self, executor, segment, timeout):
+        with Timeout(timeout):
+            executor.execute(self.storage_method, 'encode', segment)
+
+    def test_encode_offloaded_codec_order(self):
+        segment_size = self.storage_method.ec_segment_size
+        test_data = b''.join(chr(ord('a') + i) * segment_size
+                             for i in range(5))[:-10]
+        nb = self.storage_method.ec_nb_data + self.storage_method.ec_nb_parity
+        executor = CodecExecutor(processes=2, queue_depth=2)
+        self.addCleanup(executor.close)
+        codec = ECCodec(self.storage_method, executor)
+        ec_stream = ec_encode(self.storage_method, nb, codec=codec)
+        ec_stream.send(None)
+        results = []
+        for i in range(0, len(test_data), 65536):
+            results.append(ec_stream.send(test_data[i:i + 65536]))
+        results.append(ec_stream.send(b''))
+        # Some segments are returned later than they are completed
+        self.assertIn(None, results[segment_size // 65536:])
+        fragments = [b''.join(f) for f in
+                     zip(*[r for r in results if r is not None])]
+        self.assertEqual(self._make_ec_chunks(test_data), fragments)
+        self.assertGreater(codec.codec_time, 0.0)
+
+    def test_read_offloaded_codec(self):
+        segment_size = self.storage_method.ec_segment_size
+        test_data = (b'1234' * segment_size)[:-657]
+        ec_chunks = self._make_ec_chunks(test_data)
+        resps = [200] * self.storage_method.ec_nb_data
+        body_iter = ec_chunks[:self.storage_method.ec_nb_data]
+
+        perfdata = {}
+        meta_chunk = self.meta_chunk()
+        meta_chunk[0]['size'] = len(test_data)
+        executor = CodecExecutor(processes=2, queue_depth=2)
+        self.addCleanup(executor.close)
+        with set_http_connect(*resps, body_iter=body_iter):
+            handler = ECChunkDownloadHandler(
+                self.storage_method, meta_chunk, None, None, {},
+                ec_codec_executor=executor, perfdata=perfdata)
+            stream = handler.get_stream()
+            body = b''.join(b''.join(part['iter']) for part in stream)
+        self.assertEqual(test_data, body)
+        self.assertGreater(perfdata['ec_codec'], 0.0)
+
     def test_read(self):
         segment_size = self.storage_method.ec_segment_size
 
@@ -633,6 +858,39 @@ class TestEC(unittest.TestCase):
         # TODO test log output
         # TODO verify ranges
 
+    def test_read_hedged(self):
+        segment_size = self.storage_method.ec_segment_size
+        test_data = (b'1234' * segment_size)[:-333]
+        ec_chunks = self._make_ec_chunks(test_data)
+
+        def get_response(req):
+            if req['host'].endswith(':7002'):
+                # Slow disk
+                sleep(1.0)
+            return FakeResponse(200, ec_chunks[int(req['path'][-1])])
+
+        meta_chunk = self.meta_chunk()
+        meta_chunk[0]['size'] = len(test_data)
+        perfdata = {}
+        hedging = HedgingPolicy(delay=0.01, percentile=95)
+        start = monotonic_time()
+        with set_http_requests(get_response) as conn_record:
+            handler = ECChunkDownloadHandler(
+                self.storage_method, meta_chunk, None, None, {},
+                hedging=hedging, perfdata=perfdata)
+            stream = handler.get_stream()
+            body = b''.join(b''.join(part['iter']) for part in stream)
+        self.assertLess(monotonic_time() - start, 0.5)
+        self.assertEqual(test_data, body)
+        self.assertEqual(self.storage_method.ec_nb_data + 1,
+                         len(conn_record))
+        self.assertEqual(1, perfdata['hedged_requests'])
+        self.assertEqual(1, perfdata['hedged_wins'])
+        # The cancelled fetcher is counted with the time it waited
+        self.assertEqual(self.storage_method.ec_nb_data + 1,
+                         len(hedging.samples))
+        self.assertGreaterEqual(max(hedging.samples), 0.01)
+
     def test_read_timeout(self):
         segment_size = self.storage_method.ec_segment_size
         test_data = (b'1234' * segment_size)[:-333]
@@ -15,7 +15,8 @@
 
 import unittest
 from mock import patch
-from oio.api.io import ChunkReader, discard_bytes, MetachunkWriter
+from oio.api.io import ChunkReader, discard_bytes, HedgingPolicy, \
+    MetachunkWriter, MetachunkPreparer, RecordBuffer
 from oio.common import exceptions
 from oio.common import green
 from oio.common.storage_method import STORAGE_METHODS
@@ -127,6 +128,59 @@ class IOTest(unittest.TestCase):
 
         self.assertEqual(data, [b'1234abcd', b'5678efgh'])
 
+    def test_reader_buf_discard(self):
+        reader = ChunkReader(None, 4, {})
+        reader.discard_bytes = 6
+
+        source = FakeSource([b'123', b'4abcd', b'1234abcd', b'12'])
+
+        data = list(reader._create_iter({}, source))
+        self.assertEqual(data, [b'cd12', b'34ab', b'cd12'])
+        self.assertEqual(0, reader.discard_bytes)
+
+    def test_reader_no_buf_size(self):
+        reader = ChunkReader(None, None, {})
+        source = FakeSource([b'1234', b'abcdef', b'12'])
+        data = list(reader._create_iter({}, source))
+        self.assertEqual(data, [b'1234', b'abcdef', b'12'])
+
+
+class RecordBufferTest(unittest.TestCase):
+    """Test oio.api.io.RecordBuffer class."""
+
+    def _fill_all(self, buf, source):
+        out = list()
+        while buf.fill(source):
+            out.extend(buf.records())
+        out.append(buf.flush())
+        return out
+
+    def test_records_across_pieces(self):
+        blob = b''.join(b'%04d' % i for i in range(1000))
+        pieces = [blob[i:i + 7] for i in range(0, len(blob), 7)]
+        buf = RecordBuffer(10, read_size=7)
+        out = self._fill_all(buf, FakeSource(pieces))
+        self.assertEqual(blob, b''.join(out))
+        for rec in out[:-1]:
+            self.assertEqual(10, len(rec))
+        self.assertEqual(0, len(buf))
+
+    def test_whole_piece_not_copied(self):
+        piece = b'x' * 16
+        buf = RecordBuffer(16, read_size=16)
+        buf.fill(FakeSource([piece]))
+        self.assertIs(piece, next(buf.records()))
+
+    def test_discard(self):
+        buf = RecordBuffer(4, read_size=8)
+        buf.fill(FakeSource([b'12345']))
+        self.assertEqual(5, buf.discard(10))
+        self.assertEqual(0, len(buf))
+        buf.fill(FakeSource([b'abcdefgh']))
+        self.assertEqual(3, buf.discard(3))
+        self.assertEqual([b'defg'], list(buf.records()))
+        self.assertEqual(b'h', buf.flush())
+
 
 class MetachunkWriterTest(unittest.TestCase):
     """Test oio.api.io.MetachunkWriter class."""
@@ -200,3 +254,107 @@ class MetachunkWriterTest(unittest.TestCase):
         self.assertRaises(exceptions.SourceReadError,
                           self.mcw.quorum_or_fail, successes, failures)
         self._check_message(successes, failures)
+
+
+class FakeContainerClient(object):
+    """Generate chunk locations like the proxy does."""
+
+    def __init__(self, chunk_method='plain/nb_copy=3', nb_chunks=3,
+                 chunk_size=100):
+        self.chunk_method = chunk_method
+        self.nb_chunks = nb_chunks
+        self.chunk_size = chunk_size
+        self.sizes = list()
+
+    def content_prepare(self, account, container, path, size, **_kwargs):
+        self.sizes.append(size)
+        mc_size = self.chunk_size
+        if self.chunk_method.startswith('ec'):
+            mc_size *= 6
+        body = list()
+        for pos in range(max(1, -(-size // mc_size))):
+            for num in range(self.nb_chunks):
+                if self.chunk_method.startswith('ec'):
+                    cpos = '%d.%d' % (pos, num)
+                else:
+                    cpos = str(pos)
+                body.append({'url': 'http://127.0.0.1:6000/' + random_id(64),
+                             'pos': cpos, 'size': self.chunk_size})
+        meta = {'chunk_method': self.chunk_method,
+                'chunk_size': self.chunk_size}
+        return meta, body
+
+
+class MetachunkPreparerTest(unittest.TestCase):
+    """Test oio.api.io.MetachunkPreparer class."""
+
+    def _take(self, prep, count):
+        gen = prep()
+        mcs = [next(gen) for _ in range(count)]
+        gen.close()
+        return mcs
+
+    def _check_positions(self, metachunks, ec=False):
+        for mc_pos, metachunk in enumerate(metachunks):
+            for chunk in metachunk:
+                self.assertEqual(mc_pos, int(chunk['pos'].split('.')[0]))
+            if ec:
+                self.assertEqual(list(range(len(metachunk))),
+                                 [c['num'] for c in metachunk])
+
+    def test_known_length(self):
+        client = FakeContainerClient()
+        prep = MetachunkPreparer(client, 'a', 'c', 'o', content_length=450)
+        metachunks = self._take(prep, 5)
+        self._check_positions(metachunks)
+        self.assertEqual([450], client.sizes)
+        self.assertEqual(15, len(prep.all_chunks_so_far()))
+
+    def test_known_length_ec(self):
+        client = FakeContainerClient(
+            'ec/algo=liberasurecode_rs_vand,k=6,m=3', nb_chunks=9)
+        prep = MetachunkPreparer(client, 'a', 'c', 'o', content_length=1300)
+        metachunks = self._take(prep, 3)
+        self._check_positions(metachunks, ec=True)
+        self.assertEqual([1300], client.sizes)
+
+    def test_unknown_length_adaptive(self):
+        client = FakeContainerClient()
+        prep = MetachunkPreparer(client, 'a', 'c', 'o',
+                                 prepare_batch_size=4)
+        metachunks = self._take(prep, 12)
+        self._check_positions(metachunks)
+        # 1 + 2 + 4 + 4 + 4 metachunks
+        self.assertEqual([1, 200, 400, 400, 400], client.sizes)
+        urls = set(c['url'] for mc in metachunks for c in mc)
+        self.assertEqual(36, len(urls))
+        # Only chunks that have been yielded must be reported
+        self.assertEqual(36, len(prep.all_chunks_so_far()))
+
+    def test_single_metachunk_no_extra_request(self):
+        client = FakeContainerClient()
+        prep = MetachunkPreparer(client, 'a', 'c', 'o')
+        self._take(prep, 1)
+        self.assertEqual([1], client.sizes)
+
+    def test_meta_pos(self):
+        client = FakeContainerClient()
+        prep = MetachunkPreparer(client, 'a', 'c', 'o', meta_pos=3)
+        metachunks = self._take(prep, 3)
+        self.assertEqual(['3', '4', '5'],
+                         [mc[0]['pos'] for mc in metachunks])
+
+
+class TestHedgingPolicy(unittest.TestCase):
+    def test_fixed_delay(self):
+        policy = HedgingPolicy(delay=0.5)
+        for _ in range(100):
+            policy.record(1.0)
+        self.assertEqual(0.5, policy.delay)
+
+    def test_percentile(self):
+        policy = HedgingPolicy(percentile=90)
+        self.assertIsNone(policy.delay)
+        for i in range(HedgingPolicy.MIN_SAMPLES * 2):
+            policy.record(float(i))
+        self.assertEqual(36.0, policy.delay)
@@ -50,6 +50,20 @@ class ObjectStorageTest(unittest.TestCase):
         self.policy = "THREECOPIES"
         self.uri_base = self.fake_endpoint + "/v3.0/NS"
 
+    def test_close_codec_executor(self):
+        api = FakeStorageApi("NS", endpoint=self.fake_endpoint,
+                             ec_codec_processes=2)
+        executor = api._global_kwargs['ec_codec_executor']
+        executor.close = Mock()
+        api.close()
+        executor.close.assert_called_once_with()
+        # Executors given by the caller are not closed
+        executor = Mock()
+        api = FakeStorageApi("NS", endpoint=self.fake_endpoint,
+                             ec_codec_executor=executor)
+        api.close()
+        executor.close.assert_not_called()
+
     def test_handle_container_not_found(self):
         @handle_container_not_found
         def test(self, account, container):
@@ -428,3 +442,84 @@ class ObjectStorageTest(unittest.TestCase):
         self.assertRaises(
             exceptions.Conflict, self.api.container_refresh, self.account,
             self.container)
+
+    def _snapshot_mocks(self, versions=(('a', 1), ('a', 2), ('b', 1),
+                                        ('b', 2), ('b', 3), ('c', 1))):
+        api = self.api
+        for method in ('container_freeze', 'container_snapshot',
+                       'container_enable', 'container_raw_update'):
+            setattr(api.container, method, Mock())
+        entries = [{'name': name, 'version': version,
+                    'content': '%s%d' % (name.upper(), version)}
+                   for name, version in versions]
+
+        def _object_list(_account, _container, marker=None, prefix=None,
+                         versions=False, **_kwargs):
+            # Like meta2: names after the marker, pages of 4 entries,
+            # the marker of the next page is the last name.
+            matches = [e for e in entries
+                       if (marker is None or e['name'] > marker) and
+                       (prefix is None or e['name'].startswith(prefix))]
+            resp = {'objects': matches[:4], 'truncated': len(matches) > 4}
+            if resp['truncated']:
+                resp['next_marker'] = matches[3]['name']
+            return resp
+
+        api.object_list = Mock(side_effect=_object_list)
+        api.object_locate = Mock(
+            side_effect=lambda _a, _c, name, version=None, **_kw: (
+                {}, [chunk('%s%d' % (name, version), 0)]))
+        api._blob_client = Mock()
+        api._blob_client.chunk_link = Mock(return_value=Mock(status=201))
+
+    def test_container_snapshot(self):
+        self._snapshot_mocks()
+        progress = list()
+        stats = self.api.container_snapshot(
+            self.account, self.container, self.account, 'snap', batch=1,
+            concurrency=2, progress_callback=progress.append)
+        self.api.container.container_snapshot.assert_called_once()
+        self.api.container.container_enable.assert_called_once()
+        self.assertEqual(6, self.api._blob_client.chunk_link.call_count)
+        # The versions of an object are updated together, even when
+        # the first page ends in the middle of them
+        updates = self.api.container.container_raw_update.call_args_list
+        self.assertEqual(
+            [['a1', 'a2'], ['b1', 'b2', 'b3'], ['c1']],
+            [[bean['id'].rsplit('/', 1)[1] for bean in call[0][0]]
+             for call in updates])
+        self.assertEqual(['a', 'b', 'c'], [p['marker'] for p in progress])
+        self.assertEqual(6, stats['objects'])
+        self.assertEqual(6, stats['chunks'])
+        self.assertEqual(
+            [(None, None), (None, 'b'), ('b', None)],
+            [(call[1].get('marker'), call[1].get('prefix'))
+             for call in self.api.object_list.call_args_list])
+
+    def test_container_snapshot_resume(self):
+        self._snapshot_mocks()
+        self.api.container_snapshot(
+            self.account, self.container, self.account, 'snap', marker='a')
+        self.api.container.container_snapshot.assert_not_called()
+        self.assertEqual('a', self.api.object_list.call_args_list[0][1][
+            'marker'])
+        self.assertEqual(1, self.api.object_list.call_count)
+        self.assertEqual(4, self.api._blob_client.chunk_link.call_count)
+
+    def test_container_snapshot_too_many_versions(self):
+        self._snapshot_mocks(
+            versions=[('a', version) for version in range(1, 6)])
+        self.assertRaises(
+            exceptions.OioException, self.api.container_snapshot,
+            self.account, self.container, self.account, 'snap')
+        self.api.container.container_raw_update.assert_not_called()
+        self.api.container.container_enable.assert_called_once()
+
+    def test_container_snapshot_link_error(self):
+        self._snapshot_mocks()
+        self.api._blob_client.chunk_link.return_value = Mock(status=500)
+        self.assertRaises(
+            exceptions.ChunkException, self.api.container_snapshot,
+            self.account, self.container, self.account, 'snap')
+        self.api.container.container_raw_update.assert_not_called()
+        self.api.container.container_enable.assert_called_once()
@@ -17,17 +17,21 @@ import unittest
 from collections import defaultdict
 from io import BytesIO
 import hashlib
-from eventlet import Timeout
+import os
+from eventlet import Timeout, sleep
 from mock import patch
 
 from oio.common import exceptions as exc
 from oio.common import green
-from oio.api.replication import ReplicatedMetachunkWriter
+from oio.api.replication import ReplicatedMetachunkWriter, \
+    ReplicatedWriteHandler
+from oio.common.utils import monotonic_time
+from oio.common.storage_functions import fetch_stream_parallel
 from oio.common.storage_method import STORAGE_METHODS
 from tests.unit.api import CHUNK_SIZE, EMPTY_MD5, EMPTY_SHA256, \
     empty_stream, decode_chunked_body, FakeResponse
 from oio.api import io
-from tests.unit import set_http_connect, set_http_requests
+from tests.unit import set_http_connect, set_http_requests, stopped
 from oio.common.constants import OIO_VERSION
 
 
@@ -132,7 +136,7 @@ class TestReplication(unittest.TestCase):
         size = CHUNK_SIZE
         meta_chunk = self.meta_chunk()
         resps = [201] * (len(meta_chunk) - 1)
-        resps.append(Timeout(1.0))
+        resps.append(stopped(Timeout(1.0)))
         with set_http_connect(*resps):
             handler = ReplicatedMetachunkWriter(
                 self.sysmeta, meta_chunk, checksum, self.storage_method)
@@ -193,7 +197,7 @@ class TestReplication(unittest.TestCase):
     def test_write_timeout_source(self):
         class TestReader(object):
             def read(self, size):
-                raise Timeout(1.0)
+                raise stopped(Timeout(1.0))
 
         checksum = self.checksum()
         source = TestReader()
@@ -297,6 +301,56 @@ class TestReplication(unittest.TestCase):
                 EMPTY_MD5, chunk_checksum_algo=None, headers=headers)
             algo_new.assert_not_called()
 
+    def _pipelined_handler(self, data, chunk_size, nb_metachunks,
+                           in_flight):
+        sysmeta = dict(self.sysmeta, chunk_size=chunk_size)
+        chunk_prep = {pos: [dict(chunk, pos=str(pos))
+                            for chunk in self.meta_chunk()]
+                      for pos in range(nb_metachunks)}
+        return ReplicatedWriteHandler(
+            BytesIO(data), sysmeta, chunk_prep, self.storage_method,
+            metachunks_in_flight=in_flight)
+
+    def test_write_pipelined(self):
+        chunk_size = 4096
+        test_data = os.urandom(chunk_size * 3 + 100)
+        resps = [201] * len(self.meta_chunk()) * 4
+        running = [0, 0]
+        write_metachunk = ReplicatedWriteHandler._write_metachunk
+
+        def _write_metachunk(handler, *args):
+            running[0] += 1
+            running[1] = max(running)
+            try:
+                sleep(0.01)
+                return write_metachunk(handler, *args)
+            finally:
+                running[0] -= 1
+
+        with set_http_connect(*resps), \
+                patch.object(ReplicatedWriteHandler, '_write_metachunk',
+                             _write_metachunk):
+            handler = self._pipelined_handler(test_data, chunk_size, 6, 2)
+            chunks, bytes_transferred, checksum = handler.stream()
+
+        self.assertEqual(2, running[1])
+        self.assertEqual(len(test_data), bytes_transferred)
+        self.assertEqual(self.checksum(test_data).hexdigest(), checksum)
+        self.assertEqual(len(self.meta_chunk()) * 4, len(chunks))
+        for chunk in chunks:
+            pos = int(chunk['pos'])
+            data = test_data[pos * chunk_size:(pos + 1) * chunk_size]
+            self.assertEqual(self.checksum(data).hexdigest(), chunk['hash'])
+
+    def test_write_pipelined_exception(self):
+        chunk_size = 4096
+        test_data = os.urandom(chunk_size * 2)
+        resps = [201] * len(self.meta_chunk())
+        resps += [500] * len(self.meta_chunk())
+        with set_http_connect(*resps):
+            handler = self._pipelined_handler(test_data, chunk_size, 2, 2)
+            self.assertRaises(exc.OioException, handler.stream)
+
     def test_read(self):
         test_data = (b'1234' * 1024)[:-10]
         data_checksum = self.checksum(test_data).hexdigest()
@@ -450,6 +504,94 @@ class TestReplication(unittest.TestCase):
         # TODO test log output
         # TODO verify ranges
 
+    def test_read_parallel(self):
+        sizes = [10000, 10000, 1234]
+        test_data = os.urandom(sum(sizes))
+        chunks = {}
+        offset = 0
+        for pos, size in enumerate(sizes):
+            chunks[pos] = [
+                {'url': 'http://127.0.0.1:700%d/%d%d' % (i, pos, i),
+                 'pos': str(pos), 'size': size, 'offset': offset}
+                for i in range(3)]
+            offset += size
+        requests = []
+
+        def get_response(req):
+            requests.append(req)
+            if req['host'].endswith(':7001'):
+                # Fail over to the other replicas
+                return FakeResponse(503)
+            pos = int(req['path'][-2])
+            start, end = [int(x) for x in
+                          req['headers']['Range'][6:].split('-')]
+            start += chunks[pos][0]['offset']
+            end += chunks[pos][0]['offset']
+            return FakeResponse(
+                206, test_data[start:end + 1],
+                {'Content-Range': 'bytes %d-%d/%d' % (
+                    start, end, sizes[pos])})
+
+        with set_http_requests(get_response):
+            data = b''.join(fetch_stream_parallel(
+                chunks, None, self.storage_method, concurrency=3,
+                segment_size=4096))
+        self.assertEqual(test_data, data)
+        # 3 segments for the first 2 metachunks, 1 for the last one
+        self.assertEqual(7, len([req for req in requests
+                                 if not req['host'].endswith(':7001')]))
+        self.assertEqual(
+            set(['127.0.0.1:7000', '127.0.0.1:7001', '127.0.0.1:7002']),
+            set(req['host'] for req in requests))
+
+        with set_http_requests(get_response):
+            data = b''.join(fetch_stream_parallel(
+                chunks, [(9000, 11999)], self.storage_method,
+                concurrency=2, segment_size=512))
+        self.assertEqual(test_data[9000:12000], data)
+
+    def test_read_parallel_error(self):
+        chunks = {0: [{'url': 'http://127.0.0.1:700%d/0%d' % (i, i),
+                       'pos': '0', 'size': 10000} for i in range(3)]}
+
+        def get_response(req):
+            return FakeResponse(404)
+
+        with set_http_requests(get_response) as conn_record:
+            stream = fetch_stream_parallel(
+                chunks, None, self.storage_method, concurrency=2,
+                segment_size=4096)
+            self.assertRaises(exc.UnrecoverableContent, b''.join, stream)
+        # Both segments in flight tried all the replicas
+        self.assertEqual(6, len(conn_record))
+
+    def test_read_hedged(self):
+        test_data = (b'1234' * 1024)[:-10]
+        meta_chunk = self.meta_chunk()
+
+        def get_response(req):
+            if req['host'].endswith(':7000'):
+                # Slow disk
+                sleep(1.0)
+            return FakeResponse(200, test_data)
+
+        perfdata = {}
+        hedging = io.HedgingPolicy(delay=0.01, percentile=95)
+        start = monotonic_time()
+        with set_http_requests(get_response) as conn_record:
+            reader = io.ChunkReader(
+                iter(meta_chunk), None, {},
+                hedging=hedging, perfdata=perfdata)
+            data = b''.join(reader.stream())
+        self.assertLess(monotonic_time() - start, 0.5)
+        self.assertEqual(test_data, data)
+        self.assertEqual(2, len(conn_record))
+        self.assertEqual({'hedged_requests': 1, 'hedged_wins': 1},
+                         perfdata)
+        # The cancelled request is counted with the time it waited
+        self.assertEqual(2, len(hedging.samples))
+        self.assertGreaterEqual(max(hedging.samples), 0.01)
+
     def test_read_timeout(self):
         test_data = (b'1234' * 1024 * 1024)[:-10]
         data_checksum = self.checksum(test_data).hexdigest()
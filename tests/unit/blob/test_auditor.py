@@ -0,0 +1,158 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+import eventlet
+from mock import MagicMock as Mock, patch
+
+from oio.blob.auditor import BlobAuditorWorker, ChunkReader, percentile
+from oio.common import exceptions as exc
+from oio.common.utils import POSIX_FADV_SEQUENTIAL, POSIX_FADV_DONTNEED
+
+
+class TestChunkReader(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(10000)
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.data)
+        os.close(fd)
+        self.md5 = hashlib.md5(self.data).hexdigest()
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _read(self, size=None, md5=None, **kwargs):
+        sizes = []
+        with io.open(self.path, 'rb', buffering=0) as f:
+            reader = ChunkReader(f, size or len(self.data), md5 or self.md5,
+                                 **kwargs)
+            for buf in reader:
+                sizes.append(len(buf))
+            reader.close()
+        return sizes
+
+    def test_read_by_blocks(self):
+        with patch('oio.blob.auditor.fadvise') as fadvise:
+            sizes = self._read(buf_size=4096)
+        self.assertEqual([4096, 4096, 1808], sizes)
+        advices = [call[0][1] for call in fadvise.call_args_list]
+        self.assertEqual([POSIX_FADV_SEQUENTIAL] + [POSIX_FADV_DONTNEED] * 3,
+                         advices)
+        self.assertEqual(8192, fadvise.call_args_list[-1][0][2])
+
+    def test_read_no_drop_cache(self):
+        with patch('oio.blob.auditor.fadvise') as fadvise:
+            self._read(buf_size=4096, drop_cache=False)
+        fadvise.assert_not_called()
+
+    def test_read_offload(self):
+        self.assertEqual([10000], self._read(offload=True))
+
+    def test_corrupted(self):
+        self.assertRaises(exc.CorruptedChunk, self._read, md5='0' * 32)
+
+    def test_faulty_size(self):
+        self.assertRaises(exc.FaultyChunk, self._read, size=10001)
+
+
+class TestBlobAuditorWorker(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(0.0, percentile([], 50))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertEqual(1, percentile(values, 0))
+
+    def _worker(self, **kwargs):
+        conf = {'namespace': 'NS', 'proxyd_url': 'http://127.0.0.1:6000',
+                'chunks_per_second': 0, 'report_interval': 0}
+        conf.update(kwargs)
+        return BlobAuditorWorker(conf, Mock(), '/vol')
+
+    def test_audit_pass_concurrency(self):
+        paths = ['/vol/%d' % i for i in range(10)]
+        worker = self._worker(concurrency=3, batch_size=1)
+        running = [0, 0]
+
+        def _audit(path):
+            running[0] += 1
+            running[1] = max(running)
+            eventlet.sleep(0.001)
+            running[0] -= 1
+            return {'container_id': 'C', 'content_path': path}
+
+        with patch('oio.blob.auditor.check_volume',
+                   return_value=('NS', '127.0.0.1:6000')), \
+                patch('oio.blob.auditor.paths_gen',
+                      return_value=iter(paths)):
+            worker.chunk_data_audit = _audit
+            worker.chunk_location_audit = Mock()
+            worker.audit_pass()
+        self.assertEqual(10, worker.total_chunks_processed)
+        self.assertEqual(3, running[1])
+        self.assertTrue(worker.logger.info.called)
+
+    def _chunk_meta(self, content, pos):
+        return {'container_id': 'C' * 64, 'content_path': content,
+                'content_version': '1', 'chunk_id': content + pos,
+                'chunk_pos': pos, 'chunk_size': '8', 'chunk_hash': 'A' * 32}
+
+    def _located(self, content, nb_chunks):
+        return ({}, [{'url': 'http://127.0.0.1:6004/%s%d' % (content, i),
+                      'pos': str(i), 'size': 8, 'hash': 'A' * 32}
+                     for i in range(nb_chunks)])
+
+    def test_batch_locates_each_content_once(self):
+        worker = self._worker(batch_size=10)
+        metas = {'/vol/%d' % i: self._chunk_meta('abc'[i % 3], str(i // 3))
+                 for i in range(9)}
+        worker.chunk_data_audit = metas.get
+        worker.container_client.content_locate = Mock(
+            side_effect=lambda path, **_kw: self._located(path, 3))
+        worker.safe_chunks_audit(sorted(metas))
+
+        self.assertEqual(3, worker.container_client.content_locate.call_count)
+        self.assertEqual(6, worker.locate_cache.hits)
+        self.assertEqual(9, worker.passes)
+        self.assertEqual(0, worker.errors + worker.faulty_chunks +
+                         worker.orphan_chunks)
+
+    def test_batch_orphan_and_faulty(self):
+        worker = self._worker(batch_size=10)
+        metas = {'/vol/0': self._chunk_meta('a', '0'),
+                 '/vol/1': self._chunk_meta('a', '5'),
+                 '/vol/2': self._chunk_meta('b', '0'),
+                 '/vol/3': self._chunk_meta('b', '1')}
+        metas['/vol/1']['chunk_id'] = 'a1'
+
+        def _locate(path, **_kwargs):
+            if path == 'b':
+                raise exc.NotFound()
+            return self._located(path, 2)
+
+        worker.chunk_data_audit = metas.get
+        worker.container_client.content_locate = Mock(side_effect=_locate)
+        worker.safe_chunks_audit(sorted(metas))
+
+        self.assertEqual(2, worker.container_client.content_locate.call_count)
+        self.assertEqual(1, worker.faulty_chunks)
+        self.assertEqual(2, worker.orphan_chunks)
+        self.assertEqual(4, worker.passes)
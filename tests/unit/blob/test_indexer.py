@@ -0,0 +1,105 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import threading
+import unittest
+
+import eventlet
+from mock import MagicMock as Mock, patch
+
+from oio.blob.indexer import BlobIndexer
+from oio.common.exceptions import FaultyChunk, OioNetworkException
+
+
+class TestBlobIndexer(unittest.TestCase):
+    def setUp(self):
+        conf = {'namespace': 'NS', 'proxyd_url': 'http://127.0.0.1:6000',
+                'volume': '/vol', 'chunks_per_second': 0,
+                'batch_size': 2}
+        with patch('oio.blob.indexer.check_volume',
+                   return_value=('NS', '127.0.0.1:6004')):
+            self.indexer = BlobIndexer(conf)
+        self.indexer.logger = Mock()
+        self.paths = ['/vol/%03X/%064X' % (i, i) for i in range(5)]
+
+    def _chunk_record(self, path):
+        if path.endswith('3'):
+            raise FaultyChunk('Missing extended attribute')
+        return {'chunk_id': path[-64:]}
+
+    def _index_pass(self):
+        self.indexer.chunk_record = self._chunk_record
+        push_many = Mock(return_value=[])
+        self.indexer.index_client.chunk_push_many = push_many
+        with patch('oio.blob.indexer.paths_gen',
+                   return_value=iter(self.paths)) as paths_gen:
+            self.indexer.index_pass()
+        paths_gen.assert_called_once_with('/vol', chunks_only=True)
+        return push_many
+
+    def test_index_pass_batches(self):
+        push_many = self._index_pass()
+        batches = [[rec['chunk_id'][-1] for rec in call[0][1]]
+                   for call in push_many.call_args_list]
+        self.assertEqual([['0', '1'], ['2', '4']], batches)
+        self.assertEqual(4, self.indexer.successes)
+        self.assertEqual(1, self.indexer.errors)
+
+    def test_index_pass_push_errors(self):
+        self.indexer.batch_size = 10
+        push_many = Mock()
+        push_many.side_effect = lambda _vol, records, **_kw: \
+            [(records[0], OioNetworkException('reset'))]
+        self.indexer.chunk_record = self._chunk_record
+        self.indexer.index_client.chunk_push_many = push_many
+        with patch('oio.blob.indexer.paths_gen',
+                   return_value=iter(self.paths)):
+            self.indexer.index_pass()
+        self.assertEqual(1, push_many.call_count)
+        self.assertEqual(3, self.indexer.successes)
+        self.assertEqual(2, self.indexer.errors)
+
+    def test_index_pass_flush_by_age(self):
+        self.indexer.batch_size = 10
+        self.indexer.batch_age = 0.01
+
+        def _slow_paths():
+            for path in self.paths[:2]:
+                yield path
+            eventlet.sleep(0.05)
+            yield self.paths[2]
+
+        self.indexer.chunk_record = self._chunk_record
+        push_many = Mock(return_value=[])
+        self.indexer.index_client.chunk_push_many = push_many
+        with patch('oio.blob.indexer.paths_gen', return_value=_slow_paths()):
+            self.indexer.index_pass()
+        self.assertEqual([2, 1], [len(call[0][1])
+                                  for call in push_many.call_args_list])
+
+    def test_index_pass_push_from_greenthread(self):
+        threads = list()
+
+        def _push_many(_vol, _records, **_kwargs):
+            threads.append(threading.current_thread())
+            return []
+
+        self.indexer.chunk_record = self._chunk_record
+        self.indexer.index_client.chunk_push_many = Mock(
+            side_effect=_push_many)
+        with patch('oio.blob.indexer.paths_gen',
+                   return_value=iter(self.paths)):
+            self.indexer.index_pass()
+        self.assertEqual([threading.current_thread()] * 2, threads)
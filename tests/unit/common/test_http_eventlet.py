@@ -0,0 +1,180 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import os
+import resource
+import unittest
+
+import eventlet
+from eventlet import wsgi
+from eventlet.green import socket
+from mock import MagicMock as Mock
+
+from oio.common.http_eventlet import ConnectionPool, http_connect, \
+    frame_chunk, send_chunk, sendv
+
+
+class _NullLog(object):
+    def write(self, *_args):
+        pass
+
+
+def _app(env, start_response):
+    body = b'x' * 1024
+    headers = [('Content-Length', str(len(body)))]
+    if env['PATH_INFO'].endswith('/close'):
+        headers.append(('Connection', 'close'))
+    start_response('200 OK', headers)
+    return [body]
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+        self._start_server()
+        self.pool = ConnectionPool(max_idle_per_host=2, idle_timeout=30.0)
+
+    def _start_server(self, **kwargs):
+        if self.server:
+            self.server.kill()
+        sock = eventlet.listen(('127.0.0.1', 0))
+        self.host = '127.0.0.1:%d' % sock.getsockname()[1]
+        self.server = eventlet.spawn(wsgi.server, sock, _app,
+                                     log=_NullLog(), **kwargs)
+        eventlet.sleep(0)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.kill()
+
+    def _get(self, path='chunk', read=True):
+        conn = http_connect(self.host, 'GET', path, pool=self.pool)
+        resp = conn.getresponse()
+        self.assertEqual(200, resp.status)
+        if read:
+            resp.read()
+        conn.release()
+        return conn
+
+    def test_reuse(self):
+        conn0 = self._get()
+        conn1 = self._get()
+        self.assertIs(conn0, conn1)
+        self.assertEqual(1, self.pool.stats['misses'])
+        self.assertEqual(1, self.pool.stats['hits'])
+        self.assertEqual(2, self.pool.stats['released'])
+
+    def test_reuse_high_fd(self):
+        # Take the file descriptors below FD_SETSIZE
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < 1100:
+            if hard != resource.RLIM_INFINITY and hard < 1100:
+                self.skipTest('Not enough file descriptors allowed')
+            resource.setrlimit(resource.RLIMIT_NOFILE, (1100, hard))
+            self.addCleanup(resource.setrlimit, resource.RLIMIT_NOFILE,
+                            (soft, hard))
+        fds = list()
+        try:
+            while not fds or fds[-1] < 1024:
+                fds.append(os.dup(0))
+            conn0 = self._get()
+            self.assertGreaterEqual(conn0.sock.fileno(), 1024)
+            conn1 = self._get()
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.assertIs(conn0, conn1)
+        self.assertEqual(1, self.pool.stats['hits'])
+
+    def test_unread_response_not_reused(self):
+        conn0 = self._get(read=False)
+        conn1 = self._get()
+        self.assertIsNot(conn0, conn1)
+        self.assertEqual(1, self.pool.stats['discarded'])
+        self.assertEqual(0, self.pool.stats['hits'])
+
+    def test_server_close_not_reused(self):
+        self._get('chunk/close')
+        self._get()
+        self.assertEqual(0, self.pool.stats['hits'])
+        self.assertEqual(1, self.pool.stats['discarded'])
+
+    def test_half_closed_socket(self):
+        self._start_server(socket_timeout=0.05)
+        conn0 = self._get()
+        # Let the server close the idle connection
+        eventlet.sleep(0.2)
+        conn1 = self._get()
+        self.assertIsNot(conn0, conn1)
+        self.assertEqual(1, self.pool.stats['stale'])
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0.0
+        self._get()
+        eventlet.sleep(0.01)
+        self._get()
+        self.assertEqual(0, self.pool.stats['hits'])
+        self.assertEqual(1, self.pool.stats['evicted'])
+
+    def test_max_idle_per_host(self):
+        conns = [http_connect(self.host, 'GET', 'chunk', pool=self.pool)
+                 for _ in range(3)]
+        for conn in conns:
+            conn.getresponse().read()
+            conn.release()
+        self.assertEqual(2, self.pool.stats['released'])
+        self.assertEqual(1, self.pool.stats['discarded'])
+
+
+class TestSendv(unittest.TestCase):
+    def setUp(self):
+        self.left, self.right = socket.socketpair()
+
+    def tearDown(self):
+        self.left.close()
+        self.right.close()
+
+    def _read_all(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.right.recv(65536)
+        return data
+
+    def test_sendv(self):
+        # Bigger than the socket buffers: partial writes, then wait
+        buffers = [b'head', b'x' * (4 * 1024 * 1024), b'', b'y', b'tail']
+        expected = b''.join(buffers)
+        reader = eventlet.spawn(self._read_all, len(expected))
+        sendv(self.left, buffers)
+        self.assertEqual(expected, reader.wait())
+
+    def test_sendv_timeout(self):
+        self.left.settimeout(0.05)
+        self.assertRaises(socket.timeout, sendv, self.left,
+                          [b'x' * (16 * 1024 * 1024)])
+
+    def test_frame_chunk(self):
+        self.assertEqual(b'1a\r\n' + b'x' * 26 + b'\r\n',
+                         frame_chunk(b'x' * 26))
+        self.assertEqual(b'0\r\n\r\n', frame_chunk(b''))
+
+    def test_send_chunk(self):
+        conn = Mock(spec=['sendv'])
+        send_chunk(conn, b'x' * 26)
+        conn.sendv.assert_called_once_with((b'1a\r\n', b'x' * 26, b'\r\n'))
+        # Connections without vectored writes
+        conn = Mock(spec=['send'])
+        send_chunk(conn, b'')
+        conn.send.assert_called_once_with(b'0\r\n\r\n')
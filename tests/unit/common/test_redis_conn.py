@@ -0,0 +1,57 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import unittest
+
+from mock import patch
+import redis
+
+from oio.common.redis_conn import RedisConn
+
+
+class TestRedisConn(unittest.TestCase):
+    def test_single_server(self):
+        conn = RedisConn({'redis_host': '127.0.0.2', 'redis_port': '6380',
+                          'redis_max_connections': '8',
+                          'redis_socket_timeout': '2.5'})
+        client = conn.conn
+        self.assertIs(client, conn.conn)
+        pool = client.connection_pool
+        self.assertEqual(8, pool.max_connections)
+        self.assertEqual('127.0.0.2', pool.connection_kwargs['host'])
+        self.assertEqual(6380, pool.connection_kwargs['port'])
+        self.assertEqual(2.5, pool.connection_kwargs['socket_timeout'])
+
+    def test_sentinel_master_cached(self):
+        conf = {'sentinel_hosts': '127.0.0.1:26379,127.0.0.2:26379',
+                'sentinel_master_name': 'oio-master',
+                'redis_socket_timeout': '2.5',
+                'sentinel_socket_timeout': '0.5'}
+        with patch('redis.sentinel.Sentinel') as sentinel:
+            conn = RedisConn(conf)
+            self.assertIs(conn.conn, conn.conn)
+        sentinel.assert_called_once_with(
+            [('127.0.0.1', 26379), ('127.0.0.2', 26379)],
+            sentinel_kwargs={'socket_timeout': 0.5})
+        sentinel.return_value.master_for.assert_called_once_with(
+            'oio-master', redis_class=redis.StrictRedis, socket_timeout=2.5)
+
+    def test_connection_provided(self):
+        client = redis.StrictRedis()
+        with patch('redis.sentinel.Sentinel') as sentinel:
+            conn = RedisConn({'sentinel_hosts': '127.0.0.1:26379'},
+                             connection=client)
+            self.assertIs(client, conn.conn)
+        sentinel.assert_not_called()
@@ -0,0 +1,131 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import os
+from hashlib import sha256
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from oio.common.utils import LRUCache, paths_gen
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(2, len(cache))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertEqual(0, len(cache))
+        self.assertEqual('x', cache.get('a', 'x'))
+
+    def test_ttl(self):
+        cache = LRUCache(2, ttl=5.0)
+        with patch('oio.common.utils.monotonic_time', return_value=100.0):
+            cache.put('a', 1)
+        with patch('oio.common.utils.monotonic_time', return_value=104.0):
+            self.assertIn('a', cache)
+            self.assertEqual(1, cache.get('a'))
+        with patch('oio.common.utils.monotonic_time', return_value=106.0):
+            self.assertNotIn('a', cache)
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0, len(cache))
+
+
+class TestPathsGen(unittest.TestCase):
+    def setUp(self):
+        self.volume = tempfile.mkdtemp()
+        self.chunks = list()
+        for i in range(32):
+            chunk_id = sha256(str(i)).hexdigest().upper()
+            self.chunks.append(self._touch(chunk_id[:3], chunk_id))
+        self.others = [
+            self._touch(self.chunks[0].split('/')[-2],
+                        'F' * 64 + '.pending'),
+            self._touch('lost+found', '%064X' % 2),
+            self._touch('', 'rawx.lock'),
+        ]
+        self.chunks.sort()
+
+    def tearDown(self):
+        shutil.rmtree(self.volume)
+
+    def _touch(self, dirname, name):
+        dirname = os.path.join(self.volume, dirname)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        path = os.path.join(dirname, name)
+        open(path, 'w').close()
+        return path
+
+    def test_all_files(self):
+        paths = list(paths_gen(self.volume))
+        self.assertEqual(sorted(self.chunks + self.others), paths)
+
+    def test_chunks_only(self):
+        paths = list(paths_gen(self.volume, chunks_only=True))
+        self.assertEqual(self.chunks, paths)
+
+    def test_marker(self):
+        marker = self.chunks[10]
+        paths = list(paths_gen(self.volume, marker=marker, chunks_only=True))
+        self.assertEqual(self.chunks[11:], paths)
+        # Relative marker, and marker on a directory
+        relative = marker[len(self.volume) + 1:]
+        paths = list(paths_gen(self.volume, marker=relative,
+                               chunks_only=True))
+        self.assertEqual(self.chunks[11:], paths)
+        paths = list(paths_gen(self.volume, marker=os.path.dirname(marker),
+                               chunks_only=True))
+        self.assertEqual(
+            [p for p in self.chunks if p > os.path.dirname(marker) + '/'],
+            paths)
+
+    def test_marker_removed(self):
+        marker = self.chunks[10]
+        os.remove(marker)
+        paths = list(paths_gen(self.volume, marker=marker, chunks_only=True))
+        self.assertEqual(self.chunks[11:], paths)
+
+    def test_shards(self):
+        shards = [list(paths_gen(self.volume, chunks_only=True,
+                                 shard=i, shards=3))
+                  for i in range(3)]
+        self.assertEqual(self.chunks, sorted(sum(shards, [])))
+        for shard in shards:
+            self.assertTrue(shard)
+        self.assertRaises(ValueError, paths_gen, self.volume,
+                          shard=3, shards=3)
@@ -0,0 +1,143 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import unittest
+
+import eventlet
+from mock import MagicMock as Mock, patch
+
+from oio.common.exceptions import ServiceUnavailable
+from oio.conscience.cache import ServiceCache
+from oio.conscience.client import ConscienceClient
+
+
+def _service(addr, score=50, **tags):
+    return {'addr': addr, 'score': score, 'tags': tags}
+
+
+class TestServiceCache(unittest.TestCase):
+    def setUp(self):
+        self.services = {
+            'rawx': [
+                _service('10.0.0.1:6200', **{'tag.slots': 'rawx,rawx-eu'}),
+                _service('10.0.0.2:6200', **{'tag.slots': 'rawx,rawx-us'}),
+                _service('10.0.0.3:6200', score=0),
+                _service('10.0.0.4:6200', **{'tag.up': False}),
+            ],
+            'rdir': [
+                _service('10.0.0.1:6300'),
+                _service('10.0.0.2:6300', **{'tag.id': 'rdir-2'}),
+            ],
+        }
+        self.conscience = Mock()
+        self.conscience.all_services.side_effect = \
+            lambda type_, full=False: self.services[type_]
+        self.cache = ServiceCache(self.conscience, 'NS', ttl=5.0,
+                                  max_stale=10.0)
+
+    def _addrs(self, services):
+        return sorted(srv['addr'] for srv in services)
+
+    def test_choose(self):
+        chosen = self.cache.choose('rawx', size=2)
+        self.assertEqual(['10.0.0.1:6200', '10.0.0.2:6200'],
+                         self._addrs(chosen))
+        self.assertIn({'addr': '10.0.0.1:6200', 'id': 'NS|rawx|10.0.0.1:6200',
+                       'score': 50}, chosen)
+        self.assertRaises(ServiceUnavailable, self.cache.choose, 'rawx',
+                          size=3)
+        # Listed only once
+        self.assertEqual(1, self.conscience.all_services.call_count)
+
+    def test_choose_slot(self):
+        for slot in ('eu', 'rawx-eu'):
+            chosen = self.cache.choose('rawx', size=1, slot=slot)
+            self.assertEqual(['10.0.0.1:6200'], self._addrs(chosen))
+
+    def test_choose_slot_list(self):
+        chosen = self.cache.choose('rawx', size=2, slot='rawx-eu,us')
+        self.assertEqual(['10.0.0.1:6200', '10.0.0.2:6200'],
+                         self._addrs(chosen))
+        chosen = self.cache.choose('rawx', size=1, slot='rawx-asia,eu')
+        self.assertEqual(['10.0.0.1:6200'], self._addrs(chosen))
+        chosen = self.cache.choose('rawx', size=2, slot='asia,rawx')
+        self.assertEqual(2, len(chosen))
+        self.assertRaises(ServiceUnavailable, self.cache.choose, 'rawx',
+                          slot='asia,africa')
+
+    def test_choose_avoid_known(self):
+        chosen = self.cache.choose('rawx', avoid=['NS|rawx|10.0.0.1:6200'])
+        self.assertEqual(['10.0.0.2:6200'], self._addrs(chosen))
+        # Prefer services far from the known ones
+        for _ in range(10):
+            chosen = self.cache.choose(
+                'rdir', known=['NS|rawx|10.0.0.1:6200'])
+            self.assertEqual([{'addr': '10.0.0.2:6300', 'id': 'NS|rdir|rdir-2',
+                               'score': 50}], chosen)
+        # ...unless there is no other choice
+        chosen = self.cache.choose('rdir', known=['NS|rdir|rdir-2'])
+        self.assertEqual(['10.0.0.1:6300'], self._addrs(chosen))
+
+    def test_stale_while_revalidate(self):
+        with patch('oio.conscience.cache.monotonic_time',
+                   return_value=100.0):
+            self.cache.services('rawx')
+        self.assertEqual(1, self.conscience.all_services.call_count)
+        self.services['rawx'] = []
+        with patch('oio.conscience.cache.monotonic_time',
+                   return_value=106.0):
+            # Expired: the stale list is returned, and refreshed
+            self.assertEqual(4, len(self.cache.services('rawx')))
+            eventlet.sleep(0)
+            self.assertEqual(2, self.conscience.all_services.call_count)
+            self.assertEqual([], self.cache.services('rawx'))
+
+    def test_too_stale(self):
+        with patch('oio.conscience.cache.monotonic_time',
+                   return_value=100.0):
+            self.cache.services('rawx')
+        self.services['rawx'] = []
+        with patch('oio.conscience.cache.monotonic_time',
+                   return_value=116.0):
+            self.assertEqual([], self.cache.services('rawx'))
+        self.assertEqual(2, self.conscience.all_services.call_count)
+
+
+class TestConscienceClientCache(unittest.TestCase):
+    def setUp(self):
+        self.conf = {'namespace': 'NS', 'proxyd_url': 'http://127.0.0.1:6000'}
+
+    def test_no_cache(self):
+        client = ConscienceClient(self.conf)
+        self.assertIsNone(client.service_cache)
+        self.assertIsNone(client.lb.service_cache)
+
+    def test_next_instance(self):
+        client = ConscienceClient(self.conf, lb_cache_ttl=5.0)
+        client.all_services = Mock(
+            return_value=[_service('10.0.0.1:6009')])
+        client.lb._request = Mock()
+        instance = client.next_instance('account')
+        self.assertEqual('10.0.0.1:6009', instance['addr'])
+        client.lb._request.assert_not_called()
+
+    def test_next_instance_fallback(self):
+        client = ConscienceClient(self.conf, lb_cache_ttl=5.0)
+        client.all_services = Mock(return_value=[])
+        client.lb._request = Mock(
+            return_value=(Mock(status=200), [{'addr': '10.0.0.2:6009'}]))
+        instance = client.next_instance('account')
+        self.assertEqual('10.0.0.2:6009', instance['addr'])
+        self.assertEqual(1, client.lb._request.call_count)
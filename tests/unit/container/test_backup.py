@@ -0,0 +1,229 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import json
+import pickle
+import time
+import unittest
+from hashlib import md5
+from io import BytesIO
+
+from mock import MagicMock as Mock, patch
+from werkzeug.exceptions import ServiceUnavailable
+
+from oio.container.backup import CONTAINER_MANIFEST, ContainerBackup, \
+    LimitedStream, Manifest
+from oio.container.checksum import ResumableMD5, dump_md5, load_md5, \
+    new_md5
+from oio.container.md5py import MD5
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = dict()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+def _entries(count):
+    return [{'name': 'obj-%04d' % i, 'size': 1000 * i, 'hdr_blocks': 1,
+             'blocks': 1 + i % 5, 'slo': None}
+            for i in range(count)]
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+
+    def _build(self, count, segment_size=7):
+        return Manifest.build(self.redis, 'manifest', iter(_entries(count)),
+                              60, segment_size=segment_size)
+
+    def test_build_empty(self):
+        self.assertIsNone(self._build(0))
+        self.assertIsNone(Manifest.load(self.redis, 'manifest'))
+
+    def test_build(self):
+        manifest = self._build(100)
+        entries = list(manifest.entries())
+        self.assertEqual(101, len(entries))
+        self.assertEqual(CONTAINER_MANIFEST, entries[0]['name'])
+        start = 0
+        for entry in entries:
+            self.assertEqual(start, entry['start_block'])
+            start += entry['blocks']
+            self.assertEqual(start - 1, entry['end_block'])
+        self.assertEqual(start, manifest.blocks)
+        # 15 segments, and the index
+        self.assertEqual(16, len(self.redis.data))
+
+        # Same serialization as a manifest built at once
+        data = json.dumps(entries, sort_keys=True)
+        self.assertEqual(manifest.size, len(data))
+        self.assertEqual(data, manifest.read(0, manifest.size))
+        for start, end in ((0, 10), (100, 2000), (2000, manifest.size - 3)):
+            self.assertEqual(data[start:end], manifest.read(start, end))
+
+    def test_entries_from_block(self):
+        manifest = self._build(100)
+        entries = list(manifest.entries())
+        for entry in entries:
+            for block in (entry['start_block'], entry['end_block']):
+                self.assertEqual(entry, next(manifest.entries(block)))
+
+    def test_load(self):
+        manifest = self._build(20)
+        loaded = Manifest.load(self.redis, 'manifest')
+        self.assertEqual(manifest.blocks, loaded.blocks)
+        self.assertEqual(list(manifest.entries()), list(loaded.entries()))
+        # Manifests stored by previous versions are ignored
+        self.redis.set('manifest', json.dumps(_entries(3)))
+        self.assertIsNone(Manifest.load(self.redis, 'manifest'))
+
+    def test_expired_segment(self):
+        manifest = self._build(20)
+        self.redis.delete('%s:2' % manifest.index['prefix'])
+        self.assertRaises(ServiceUnavailable, list, manifest.entries())
+
+
+class TestContainerBackupManifest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        with patch('oio.container.backup.ObjectStorageApi'):
+            self.app = ContainerBackup(None)
+        self.app.conf['manifest_segment_size'] = '3'
+        self.app.proxy.container_get_properties.return_value = \
+            {'properties': {}, 'system': {}}
+        objects = [{'name': 'obj-%d' % i, 'deleted': i == 3}
+                   for i in range(10)]
+        self.app.proxy.object_list.side_effect = [
+            {'objects': objects[:5], 'truncated': True,
+             'next_marker': 'obj-4'},
+            {'objects': objects[5:], 'truncated': False},
+        ]
+
+    def _tar_entry(self, _proxy, _account, _container, name):
+        tar = Mock(filesize=1024, header_blocks=1, data_blocks=2,
+                   slo=None, checksums={})
+        tar.name = name
+        return tar
+
+    def test_generate_manifest(self):
+        with patch('oio.container.backup.OioTarEntry',
+                   side_effect=self._tar_entry), \
+                patch.object(ContainerBackup, 'redis', self.redis):
+            manifest = self.app.generate_manifest('acct', 'ref')
+            self.assertEqual(2, self.app.proxy.object_list.call_count)
+            self.assertEqual(
+                'obj-4', self.app.proxy.object_list.call_args[1]['marker'])
+            names = [entry['name'] for entry in manifest.entries()][1:]
+            self.assertEqual(['obj-%d' % i for i in range(10) if i != 3],
+                             names)
+            # Cached
+            cached = self.app.generate_manifest('acct', 'ref')
+            self.assertEqual(manifest.index['prefix'],
+                             cached.index['prefix'])
+            self.assertEqual(list(manifest.entries()),
+                             list(cached.entries()))
+            self.assertEqual(2, self.app.proxy.object_list.call_count)
+
+    def test_object_entries_concurrency(self):
+        self.app.conf['manifest_concurrency'] = '9'
+
+        def _slow_tar_entry(*args):
+            # Blocking, like the requests of the service
+            time.sleep(0.2)
+            return self._tar_entry(*args)
+
+        with patch('oio.container.backup.OioTarEntry',
+                   side_effect=_slow_tar_entry):
+            start = time.time()
+            names = [tar.name for tar in
+                     self.app._object_entries('acct', 'ref')]
+            elapsed = time.time() - start
+        self.assertEqual(['obj-%d' % i for i in range(10) if i != 3],
+                         names)
+        # Not one after the other (9 x 0.2s)
+        self.assertLess(elapsed, 0.9)
+
+
+class TestResumableChecksum(unittest.TestCase):
+    def test_resume(self):
+        data = b'0123456789' * 1000
+        checksum = new_md5()
+        self.assertIsInstance(checksum, ResumableMD5)
+        checksum.update(data[:4321])
+        state = json.loads(json.dumps({'md5': dump_md5(checksum)}))['md5']
+        checksum = load_md5(state)
+        checksum.update(data[4321:])
+        self.assertEqual(md5(data).hexdigest(), checksum.hexdigest())
+        # The digest does not alter the state
+        checksum.update(b'x')
+        self.assertEqual(md5(data + b'x').hexdigest(), checksum.hexdigest())
+
+    def test_resume_legacy(self):
+        checksum = MD5()
+        checksum.update(b'abc')
+        checksum = load_md5(pickle.dumps(checksum))
+        checksum.update(b'def')
+        self.assertEqual(md5(b'abcdef').hexdigest(), checksum.hexdigest())
+
+
+class TestLimitedStream(unittest.TestCase):
+    def setUp(self):
+        self.data = b'0123456789abcdef' * 4096
+        self.entry = {'name': 'obj', 'size': len(self.data),
+                      'checksums': dict()}
+        for idx, offset in enumerate(range(0, len(self.data), 20000)):
+            chunk = self.data[offset:offset + 20000]
+            self.entry['checksums'][idx] = {
+                'hash': md5(chunk).hexdigest().upper(),
+                'size': len(chunk), 'offset': offset}
+
+    def _read(self, start, end):
+        stream = LimitedStream(BytesIO(self.data[start:end]), end - start,
+                               entry=self.entry, offset=start)
+        while stream.read(7000):
+            pass
+        return stream
+
+    def test_verify_by_ranges(self):
+        for start, end in ((0, 12345), (12345, 50000),
+                           (50000, len(self.data))):
+            self._read(start, end)
+        for chk in self.entry['checksums'].values():
+            self.assertTrue(chk.get('verified'))
+
+    def test_invalid_checksum(self):
+        self._read(0, 12345)
+        self.data = self.data[:12345] + b'x' + self.data[12346:]
+        stream = LimitedStream(BytesIO(self.data[12345:]),
+                               len(self.data) - 12345,
+                               entry=self.entry, offset=12345)
+        self.assertRaises(IOError, stream.read, 10000)
+        self.assertTrue(stream.invalid_checksum)
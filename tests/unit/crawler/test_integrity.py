@@ -0,0 +1,271 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+
+import eventlet
+from mock import MagicMock as Mock, patch
+
+from oio.common.constants import HEADER_PREFIX
+from oio.crawler.integrity import Checker, Checkpoint, Target, \
+    make_arg_parser
+
+
+OBJECTS = ['obj%02d' % i for i in range(10)]
+RAWX = ['127.0.0.1:600%d' % i for i in range(3)]
+
+
+def fake_content_list(account, reference, marker=None, prefix=None,
+                      limit=3):
+    names = [x for x in OBJECTS if (marker is None or x > marker) and
+             (prefix is None or x.startswith(prefix))]
+    headers = {HEADER_PREFIX + 'list-truncated': str(len(names) > limit)}
+    return headers, {'objects': [{'name': x} for x in names[:limit]],
+                     'system': {'sys.name': 'CID.1'}}
+
+
+def fake_content_locate(account, reference, path, properties=False):
+    chunks = [{'url': 'http://%s/%s%d' % (rawx, path, i), 'pos': '0',
+               'size': 8, 'hash': 'A' * 32}
+              for i, rawx in enumerate(RAWX * 2)]
+    return {'id': path, 'chunk_method': 'plain/nb_copy=6'}, chunks
+
+
+class TestIntegrityCrawler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+        self.patchers = [
+            patch('oio.crawler.integrity.AccountClient'),
+            patch('oio.crawler.integrity.ContainerClient'),
+            patch('oio.crawler.integrity.BlobClient')]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _checker(self, **kwargs):
+        kwargs.setdefault('full', False)
+        checker = Checker('OPENIO', **kwargs)
+        checker.account_client.container_list = Mock(
+            return_value={'listing': [['cont', 0, 0, 0, 0]]})
+        checker.container_client.content_list = Mock(
+            side_effect=fake_content_list)
+        checker.container_client.content_locate = Mock(
+            side_effect=fake_content_locate)
+        checker.blob_client.chunk_head = Mock(return_value={})
+        return checker
+
+    def test_container_by_pages(self):
+        checker = self._checker(checkpoint_file=self.checkpoint)
+        checker.check(Target('acct', 'cont'))
+        checker.wait()
+
+        self.assertEqual(len(OBJECTS), checker.objects_checked)
+        self.assertEqual(len(OBJECTS) * 6, checker.chunks_checked)
+        markers = [c[1].get('marker') for c in
+                   checker.container_client.content_list.call_args_list]
+        self.assertEqual([None, 'obj02', 'obj05', 'obj08'], markers)
+        # The subtree is complete, the container is not cached anymore
+        self.assertEqual(0, len(checker.container_cache))
+        self.assertTrue(Checkpoint(self.checkpoint).is_done('acct', 'cont'))
+
+    def test_resume_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as fd:
+            fd.write(json.dumps({'account': 'acct', 'container': 'cont',
+                                 'marker': 'obj05'}) + '\n')
+            fd.write(json.dumps({'account': 'acct', 'container': 'done',
+                                 'done': True}) + '\n')
+        checker = self._checker(checkpoint_file=self.checkpoint)
+        checker.check(Target('acct', 'cont'))
+        checker.check(Target('acct', 'done'))
+        checker.wait()
+
+        self.assertEqual(4, checker.objects_checked)
+        checker.container_client.content_list.assert_any_call(
+            account='acct', reference='cont', marker='obj05')
+        for call in checker.container_client.content_list.call_args_list:
+            self.assertEqual('cont', call[1]['reference'])
+
+    def test_checkpoint_markers(self):
+        checkpoint = Checkpoint(self.checkpoint)
+        checkpoint.save('acct', 'cont', marker='obj02')
+        checkpoint.save('acct', 'cont', marker='obj05')
+        checkpoint.save('acct', 'other', done=True)
+        checkpoint.close()
+        with open(self.checkpoint, 'a') as fd:
+            fd.write('{"account": "acct", "cont')
+
+        checkpoint = Checkpoint(self.checkpoint)
+        self.assertEqual('obj05', checkpoint.marker('acct', 'cont'))
+        self.assertIsNone(checkpoint.marker('acct', 'other'))
+        self.assertTrue(checkpoint.is_done('acct', 'other'))
+        self.assertFalse(checkpoint.is_done('acct', 'cont'))
+        checkpoint.close()
+
+    def test_concurrency_per_rawx(self):
+        checker = self._checker(concurrency=50, concurrency_per_rawx=2)
+        current = defaultdict(int)
+        highest = defaultdict(int)
+
+        def _chunk_head(url, **_kwargs):
+            host = url.split('/')[2]
+            current[host] += 1
+            highest[host] = max(highest[host], current[host])
+            eventlet.sleep(0.001)
+            current[host] -= 1
+            return {}
+
+        checker.blob_client.chunk_head = Mock(side_effect=_chunk_head)
+        checker.check(Target('acct', 'cont'))
+        checker.wait()
+
+        self.assertEqual(len(OBJECTS) * 6, checker.chunks_checked)
+        self.assertEqual({rawx: 2 for rawx in RAWX}, dict(highest))
+
+    def test_arg_parser(self):
+        args = make_arg_parser().parse_args(
+            ['NS', 'acct', 'cont', '--checkpoint', self.checkpoint,
+             '--cache-size', '5', '--concurrency-per-rawx', '3'])
+        self.assertEqual(['cont'], args.target)
+        self.assertEqual(self.checkpoint, args.checkpoint)
+        self.assertEqual(5, args.cache_size)
+        self.assertEqual(3, args.concurrency_per_rawx)
+
+    def test_explicit_chunks_share_object_check(self):
+        checker = self._checker()
+        for i in range(3):
+            checker.check(Target('acct', 'cont', 'obj01',
+                                 'http://%s/obj01%d' % (RAWX[i], i)))
+        checker.wait()
+
+        self.assertEqual(3, checker.chunks_checked)
+        self.assertEqual(1, checker.objects_checked)
+        self.assertEqual(1, checker.containers_checked)
+        self.assertEqual(
+            1, checker.container_client.content_locate.call_count)
+
+
+class TestIntegrityChecksums(unittest.TestCase):
+    def setUp(self):
+        self.patchers = [
+            patch('oio.crawler.integrity.AccountClient'),
+            patch('oio.crawler.integrity.ContainerClient'),
+            patch('oio.crawler.integrity.BlobClient')]
+        for patcher in self.patchers:
+            patcher.start()
+        self.checker = Checker('OPENIO', checksum=True)
+        self.checker.write_chunk_error = Mock()
+        self.target = Target('acct', 'cont', 'obj')
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _ec_object(self, metachunks=2):
+        obj_meta = {'id': 'ID', 'hash': 'F' * 32,
+                    'length': str(100 * metachunks),
+                    'chunk_method': 'ec/algo=liberasurecode_rs_vand,k=2,m=1'}
+        chunks = dict()
+        xattrs = dict()
+        for pos in range(metachunks):
+            for sub in range(3):
+                url = 'http://127.0.0.1:600%d/%d%d' % (sub, pos, sub)
+                chunks[url] = {'url': url, 'pos': '%d.%d' % (pos, sub),
+                               'size': 100, 'hash': '%032X' % pos}
+                xattrs[url] = {'chunk_pos': '%d.%d' % (pos, sub),
+                               'chunk_size': '60',
+                               'chunk_hash': '%030X%d%d' % (0, pos, sub),
+                               'metachunk_size': '100',
+                               'metachunk_hash': '%032X' % pos}
+        return obj_meta, chunks, xattrs
+
+    def _errors(self):
+        return sorted(c[0][3] for c in
+                      self.checker.write_chunk_error.call_args_list)
+
+    def test_ec_consistent(self):
+        obj_meta, chunks, xattrs = self._ec_object()
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(0, self.checker.checksum_errors)
+        self.assertEqual([], self._errors())
+
+    def test_ec_fragments(self):
+        obj_meta, chunks, xattrs = self._ec_object()
+        # Truncated fragment
+        xattrs['http://127.0.0.1:6001/01']['chunk_size'] = '42'
+        # Fragment copied over another one
+        xattrs['http://127.0.0.1:6002/12']['chunk_hash'] = \
+            xattrs['http://127.0.0.1:6001/11']['chunk_hash']
+        # Misplaced fragment
+        xattrs['http://127.0.0.1:6000/10']['chunk_pos'] = '1.2'
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(3, self.checker.checksum_errors)
+        self.assertEqual(['http://127.0.0.1:6000/10',
+                          'http://127.0.0.1:6001/01',
+                          'http://127.0.0.1:6002/12'], self._errors())
+
+    def test_missing_metachunk(self):
+        obj_meta, chunks, xattrs = self._ec_object(metachunks=3)
+        for url in list(chunks):
+            if chunks[url]['pos'].startswith('1.'):
+                del chunks[url]
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(1, self.checker.checksum_errors)
+        self.assertEqual(['1'], self._errors())
+
+    def test_object_size_and_hash(self):
+        obj_meta, chunks, xattrs = self._ec_object()
+        obj_meta['length'] = '150'
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(1, self.checker.checksum_errors)
+
+        obj_meta, chunks, xattrs = self._ec_object(metachunks=1)
+        obj_meta['chunk_method'] = 'plain/nb_copy=3'
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(2, self.checker.checksum_errors)
+        obj_meta['hash'] = '0' * 32
+        self.checker.check_obj_checksums(self.target, chunks, xattrs,
+                                         obj_meta, {})
+        self.assertEqual(2, self.checker.checksum_errors)
+
+    def test_check_object(self):
+        obj_meta, chunks, xattrs = self._ec_object()
+        xattrs['http://127.0.0.1:6001/01']['chunk_size'] = '42'
+        self.checker.container_client.content_list = Mock(
+            side_effect=fake_content_list)
+        self.checker.container_client.content_locate = Mock(
+            return_value=(obj_meta, list(chunks.values())))
+        self.checker.blob_client.chunk_head = Mock(
+            side_effect=lambda url, **kwargs: xattrs[url])
+        self.checker.check(self.target)
+        self.checker.wait()
+
+        self.assertEqual(6, self.checker.chunks_checked)
+        self.assertEqual(1, self.checker.checksum_errors)
+        self.assertEqual(['http://127.0.0.1:6001/01'], self._errors())
@@ -0,0 +1,133 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import unittest
+
+import eventlet
+from mock import MagicMock as Mock
+
+from oio.common.exceptions import ClientException
+from oio.event.consumer import EventTypes
+from oio.event.filters.account_update import AccountUpdateFilter, \
+    merge_container_updates
+
+
+class TestMergeContainerUpdates(unittest.TestCase):
+    def test_latest_state_wins(self):
+        old = {'mtime': 1.0, 'objects': 1, 'bytes': 10}
+        new = {'mtime': 2.0, 'objects': 2, 'bytes': 20}
+        self.assertEqual(new, merge_container_updates(old, new))
+        self.assertEqual(new, merge_container_updates(new, old))
+
+    def test_same_mtime_keeps_first(self):
+        old = {'mtime': 1.0, 'objects': 1, 'bytes': 10}
+        new = {'mtime': 1.0, 'objects': 2, 'bytes': 20}
+        self.assertEqual(old, merge_container_updates(old, new))
+
+    def test_deletion(self):
+        state = {'mtime': 1.0, 'objects': 1, 'bytes': 10}
+        deleted = {'dtime': 2.0}
+        self.assertEqual({'mtime': 1.0, 'objects': 1, 'bytes': 10,
+                          'dtime': 2.0},
+                         merge_container_updates(state, deleted))
+        # Container created again after the deletion
+        created = {'mtime': 3.0}
+        self.assertEqual({'mtime': 3.0, 'dtime': 2.0},
+                         merge_container_updates(
+                             merge_container_updates(state, deleted),
+                             created))
+
+
+class TestAccountUpdateFilter(unittest.TestCase):
+    def setUp(self):
+        self.app = Mock(app_env=dict())
+        self.conf = {'namespace': 'NS', 'proxyd_url': 'http://127.0.0.1:6000',
+                     'update_window': 0.01, 'update_batch_size': 4}
+        self.filter = AccountUpdateFilter(self.app, self.conf)
+        self.account = Mock()
+        self.account.container_update_many.side_effect = \
+            lambda updates, **_kw: [{'status': 200} for _ in updates]
+        self.filter.batcher.account = self.account
+
+    def _event(self, container, when, objects=0):
+        return {'event': EventTypes.CONTAINER_STATE,
+                'job_id': '%s-%d' % (container, when),
+                'when': when * 1000000,
+                'url': {'account': 'AUTH_test', 'user': container},
+                'data': {'object-count': objects,
+                         'bytes-count': objects * 10}}
+
+    def _process(self, *events):
+        cbs = [Mock() for _ in events]
+        pool = eventlet.GreenPool()
+        for event, cb in zip(events, cbs):
+            pool.spawn(self.filter.process, event, cb)
+        pool.waitall()
+        return cbs
+
+    def test_coalesce(self):
+        self._process(self._event('ct0', 1, 1),
+                      self._event('ct1', 1, 5),
+                      self._event('ct0', 3, 3),
+                      self._event('ct0', 2, 2))
+        self.assertEqual(1, self.account.container_update_many.call_count)
+        updates = self.account.container_update_many.call_args[0][0]
+        self.assertEqual(
+            [{'account': 'AUTH_test', 'name': 'ct0',
+              'mtime': 3.0, 'objects': 3, 'bytes': 30},
+             {'account': 'AUTH_test', 'name': 'ct1',
+              'mtime': 1.0, 'objects': 5, 'bytes': 50}],
+            updates)
+        # Each job is acknowledged after the update has been persisted
+        self.assertEqual(4, self.app.call_count)
+        self.assertEqual(4, self.filter.batcher.events)
+        self.assertEqual(2, self.filter.batcher.updates)
+
+    def test_flush_by_window(self):
+        self._process(self._event('ct0', 1), self._event('ct1', 1))
+        self.assertEqual(1, self.account.container_update_many.call_count)
+        self.assertEqual(2, self.app.call_count)
+
+    def test_update_errors(self):
+        self.account.container_update_many.side_effect = None
+        self.account.container_update_many.return_value = [
+            {'status': 409,
+             'message': 'No update needed, event older than last update'},
+            {'status': 404, 'message': 'Account AUTH_test not found'}]
+        cbs = self._process(self._event('ct0', 1), self._event('ct1', 1))
+        # Outdated event: discarded
+        self.assertEqual(1, self.app.call_count)
+        self.assertEqual(0, cbs[0].call_count)
+        # Other errors: the job is released
+        cbs[1].assert_called_once_with(500, 'account update failure: '
+                                       'Account AUTH_test not found '
+                                       '(HTTP 404)')
+
+    def test_batch_not_supported(self):
+        self.account.container_update_many.side_effect = \
+            ClientException(404)
+        self._process(self._event('ct0', 1), self._event('ct1', 1))
+        self.assertEqual(2, self.account.container_update.call_count)
+        self.assertFalse(self.filter.batcher.batch_supported)
+        self.assertEqual(2, self.app.call_count)
+
+    def test_no_window(self):
+        self.conf['update_window'] = 0
+        self.app.app_env.clear()
+        self.filter = AccountUpdateFilter(self.app, self.conf)
+        self.assertIsNone(self.filter.batcher)
+        self.filter.account = self.account
+        self._process(self._event('ct0', 1), self._event('ct0', 2))
+        self.assertEqual(2, self.account.container_update.call_count)
@@ -0,0 +1,203 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import unittest
+from collections import deque
+
+import eventlet
+from mock import MagicMock as Mock
+
+from oio.event.beanstalk import Beanstalk, BeanstalkPrefetcher, \
+    ResponseError
+from oio.event.consumer import EventWorker
+
+
+class FakeBeanstalkd(object):
+    """Minimal beanstalkd, with a single tube."""
+
+    def __init__(self):
+        self.ready = deque()
+        self.reserved = dict()
+        self.deleted = list()
+        self.buried = list()
+        self.max_reserved = 0
+        self.last_id = 0
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.url = 'beanstalk://127.0.0.1:%d' % self.sock.getsockname()[1]
+        self.server = eventlet.spawn(self._serve)
+
+    def put(self, body):
+        self.last_id += 1
+        self.ready.append((str(self.last_id), body))
+
+    def stop(self):
+        self.server.kill()
+        self.sock.close()
+
+    def _serve(self):
+        pool = eventlet.GreenPool()
+        while True:
+            conn, _ = self.sock.accept()
+            pool.spawn(self._handle, conn)
+
+    def _reserve(self, conn, timeout):
+        deadline = eventlet.hubs.get_hub().clock() + timeout
+        while not self.ready:
+            if eventlet.hubs.get_hub().clock() >= deadline:
+                return 'TIMED_OUT\r\n'
+            eventlet.sleep(0.001)
+        job_id, body = self.ready.popleft()
+        self.reserved[job_id] = (conn, body)
+        self.max_reserved = max(self.max_reserved, len(self.reserved))
+        return 'RESERVED %s %d\r\n%s\r\n' % (job_id, len(body), body)
+
+    def _ack(self, conn, job_id, action):
+        owner, body = self.reserved.get(job_id, (None, None))
+        if owner is not conn:
+            return 'NOT_FOUND\r\n'
+        del self.reserved[job_id]
+        if action == 'delete':
+            self.deleted.append(job_id)
+            return 'DELETED\r\n'
+        elif action == 'bury':
+            self.buried.append(job_id)
+            return 'BURIED\r\n'
+        self.ready.append((job_id, body))
+        return 'RELEASED\r\n'
+
+    def _handle(self, conn):
+        fp = conn.makefile('rb')
+        try:
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                args = line.split()
+                if args[0] in ('use', 'watch'):
+                    reply = 'USING %s\r\n' % args[1] \
+                        if args[0] == 'use' else 'WATCHING 1\r\n'
+                elif args[0] == 'reserve':
+                    reply = self._reserve(conn, 3600)
+                elif args[0] == 'reserve-with-timeout':
+                    reply = self._reserve(conn, int(args[1]))
+                else:
+                    reply = self._ack(conn, args[1], args[0])
+                conn.sendall(reply)
+        finally:
+            # Jobs reserved by a closed connection are ready again
+            for job_id, (owner, body) in list(self.reserved.items()):
+                if owner is conn:
+                    del self.reserved[job_id]
+                    self.ready.appendleft((job_id, body))
+            conn.close()
+
+
+class TestBeanstalk(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeBeanstalkd()
+        self.beanstalk = Beanstalk.from_url(self.server.url)
+
+    def tearDown(self):
+        self.beanstalk.close()
+        self.server.stop()
+
+    def test_reserve_with_timeout(self):
+        self.server.put('job')
+        self.assertEqual(('1', 'job'), self.beanstalk.reserve(timeout=0))
+        self.assertRaises(ResponseError, self.beanstalk.reserve, timeout=0)
+
+    def test_execute_pipeline(self):
+        for i in range(2):
+            self.server.put('job%d' % i)
+        results = self.beanstalk.execute_pipeline(
+            [(('reserve-with-timeout', 0), {})] * 3 +
+            [(('delete', '1'), {})])
+        self.assertEqual([('1', 'job0'), ('2', 'job1')], results[:2])
+        self.assertIsInstance(results[2], ResponseError)
+        self.assertEqual(('DELETED', []), results[3])
+        self.assertEqual(['1'], self.server.deleted)
+
+    def test_prefetcher(self):
+        for i in range(50):
+            self.server.put('job%d' % i)
+        prefetcher = BeanstalkPrefetcher(self.beanstalk, prefetch=8,
+                                         poll_interval=0.01)
+        processed = list()
+
+        def _consume():
+            while True:
+                job_id, data = prefetcher.get()
+                eventlet.sleep(0.001)
+                processed.append(data)
+                if data == 'job7':
+                    prefetcher.bury(job_id)
+                else:
+                    prefetcher.delete(job_id)
+
+        pool = eventlet.GreenPool()
+        for _ in range(4):
+            pool.spawn(_consume)
+        with eventlet.Timeout(10):
+            while len(self.server.deleted) + len(self.server.buried) < 50:
+                prefetcher.step()
+        self.assertEqual(50, len(processed))
+        self.assertEqual(['8'], self.server.buried)
+        self.assertLessEqual(self.server.max_reserved, 8)
+        # The tube is now empty
+        prefetcher.reserve_timeout = 0
+        prefetcher.step()
+        self.assertTrue(prefetcher.starving)
+        for gt in list(pool.coroutines_running):
+            gt.kill()
+
+    def test_prefetcher_reset(self):
+        for i in range(4):
+            self.server.put('job%d' % i)
+        prefetcher = BeanstalkPrefetcher(self.beanstalk, prefetch=2)
+        # Wait for a first job, then prefetch another one
+        prefetcher.step()
+        prefetcher.step()
+        job_id, _ = prefetcher.get()
+        self.assertEqual(2, len(prefetcher.reserved))
+        # Connection lost: beanstalkd makes the jobs ready again
+        prefetcher.reset()
+        eventlet.sleep(0.01)
+        self.assertEqual(0, prefetcher.jobs.qsize())
+        self.assertEqual(4, len(self.server.ready))
+        # The acknowledgement of an old job is not sent
+        prefetcher.delete(job_id)
+        prefetcher.flush()
+        self.assertEqual([], self.server.deleted)
+
+    def test_prefetcher_handler_without_ack(self):
+        for event in ('forgotten', 'done'):
+            self.server.put('{"event": "%s"}' % event)
+        worker = EventWorker(0, {}, Mock())
+        worker.handlers = {
+            'forgotten': lambda event, cb: None,
+            'done': lambda event, cb: cb(200, None)}
+        prefetcher = BeanstalkPrefetcher(self.beanstalk, prefetch=2)
+        prefetcher.step()
+        prefetcher.step()
+        for _ in range(2):
+            worker.handle_job(*(prefetcher.get() + (prefetcher, )))
+        prefetcher.flush()
+        # The job not acknowledged by its handler is released
+        self.assertEqual(set(), prefetcher.reserved)
+        self.assertEqual({}, self.server.reserved)
+        self.assertEqual(['2'], self.server.deleted)
+        self.assertEqual([('1', '{"event": "forgotten"}')],
+                         list(self.server.ready))
+        self.assertEqual(1, worker.logger.warn.call_count)
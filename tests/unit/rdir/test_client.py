@@ -0,0 +1,156 @@
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library.
+
+import unittest
+from hashlib import md5
+
+from mock import MagicMock as Mock, patch
+
+from oio.common.exceptions import ClientException, OioNetworkException
+from oio.rdir.client import RdirClient, _fetch_shards
+
+
+class FakeRdirFetch(object):
+    """Serve fetch requests like an rdir service would."""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.requests = list()
+
+    def __call__(self, volume, method, action, json=None, **kwargs):
+        self.requests.append(dict(json))
+        prefix = json.get('container_id', '')
+        after = json.get('start_after', '')
+        limit = min(max(json['limit'], 1), 4096)
+        page = [[key, {'mtime': 1}] for key in self.keys
+                if key.startswith(prefix) and key > after][:limit]
+        return None, page
+
+
+class TestRdirClient(unittest.TestCase):
+    def setUp(self):
+        self.rdir_client = RdirClient(
+            {'namespace': 'NS', 'proxyd_url': 'http://127.0.0.1:6000'})
+        self.rdir_client._get_rdir_addr = Mock(return_value='127.0.0.1:6300')
+        self.records = [{'container_id': 'C', 'content_id': 'D',
+                         'chunk_id': str(i), 'mtime': 1} for i in range(5)]
+
+    def _pushed(self, request):
+        return [call[1]['json'] for call in request.call_args_list]
+
+    def test_chunk_push_many_batches(self):
+        self.rdir_client._direct_request = Mock(return_value=(None, None))
+        failed = self.rdir_client.chunk_push_many(
+            'vol', self.records, batch_size=2)
+        self.assertEqual([], failed)
+        self.assertEqual([self.records[0:2], self.records[2:4],
+                          self.records[4:]],
+                         self._pushed(self.rdir_client._direct_request))
+
+    def test_chunk_push_many_retry_failed_batch(self):
+        self.rdir_client._direct_request = Mock(side_effect=[
+            (None, None),
+            OioNetworkException('reset'),
+            (None, None),
+            (None, None)])
+        with patch('oio.rdir.client.sleep'):
+            failed = self.rdir_client.chunk_push_many(
+                'vol', self.records, batch_size=2)
+        self.assertEqual([], failed)
+        self.assertEqual([self.records[0:2], self.records[2:4],
+                          self.records[2:4], self.records[4:]],
+                         self._pushed(self.rdir_client._direct_request))
+
+    def test_chunk_push_many_failed_subset(self):
+        self.rdir_client._direct_request = Mock(side_effect=[
+            (None, None),
+            ClientException(503),
+            ClientException(503),
+            (None, None)])
+        with patch('oio.rdir.client.sleep'):
+            failed = self.rdir_client.chunk_push_many(
+                'vol', self.records, batch_size=2, max_attempts=2)
+        self.assertEqual(self.records[2:4], [rec for rec, _ in failed])
+        self.assertEqual(4, self.rdir_client._direct_request.call_count)
+
+    def test_chunk_push_many_fallback(self):
+        self.rdir_client._direct_request = Mock(side_effect=[
+            ClientException(400),
+            (None, None),
+            ClientException(400)])
+        failed = self.rdir_client.chunk_push_many(
+            'vol', self.records[:2], batch_size=2)
+        self.assertEqual([self.records[1]], [rec for rec, _ in failed])
+        pushed = self._pushed(self.rdir_client._direct_request)
+        self.assertEqual(self.records[:2], pushed[0])
+        self.assertEqual(self.records[0], pushed[1])
+
+    def _fetch_keys(self, count=1000):
+        return sorted('%s|%032X|%064X' % (
+            md5(str(i)).hexdigest().upper() * 2, i, i) for i in range(count))
+
+    def test_chunk_fetch_pages(self):
+        keys = self._fetch_keys(250)
+        self.rdir_client._rdir_request = FakeRdirFetch(keys)
+        fetched = list(self.rdir_client.chunk_fetch('vol', limit=100))
+        self.assertEqual(keys, ['|'.join(x[:3]) for x in fetched])
+        self.assertEqual(
+            [None, keys[99], keys[199], keys[249]],
+            [r.get('start_after')
+             for r in self.rdir_client._rdir_request.requests])
+
+    def test_chunk_fetch_prefetch(self):
+        keys = self._fetch_keys(2000)
+        self.rdir_client._rdir_request = FakeRdirFetch(keys)
+        fetched = list(self.rdir_client.chunk_fetch(
+            'vol', limit=10, prefetch=2, max_limit=160))
+        self.assertEqual(keys, ['|'.join(x[:3]) for x in fetched])
+        limits = [r['limit']
+                  for r in self.rdir_client._rdir_request.requests]
+        # The consumer is faster than the fetch, the pages grow
+        self.assertEqual(10, limits[0])
+        self.assertEqual(160, max(limits))
+        self.assertEqual(limits, sorted(limits))
+
+    def test_chunk_fetch_shards(self):
+        keys = self._fetch_keys(1000)
+        self.rdir_client._rdir_request = FakeRdirFetch(keys)
+        fetched = list(self.rdir_client.chunk_fetch(
+            'vol', limit=50, shards=4, start_after=keys[100]))
+        self.assertEqual(keys[101:], sorted('|'.join(x[:3]) for x in fetched))
+        prefixes = set(r['container_id']
+                       for r in self.rdir_client._rdir_request.requests)
+        self.assertEqual(set('0123456789ABCDEF'), prefixes)
+
+    def test_chunk_fetch_prefetch_error(self):
+        self.rdir_client._rdir_request = Mock(
+            side_effect=OioNetworkException('reset'))
+        with patch('oio.rdir.client.sleep'):
+            self.assertRaises(
+                OioNetworkException, list,
+                self.rdir_client.chunk_fetch('vol', prefetch=2, shards=2))
+        self.assertEqual(6, self.rdir_client._rdir_request.call_count)
+
+    def test_fetch_shards(self):
+        self.assertEqual([['']], _fetch_shards(None, 1))
+        shards = _fetch_shards(None, 3)
+        self.assertEqual(3, len(shards))
+        self.assertEqual([str(x) for x in range(10)] + list('ABCDEF'),
+                         sum(shards, []))
+        shards = _fetch_shards('AB', 20)
+        self.assertEqual(20, len(shards))
+        self.assertEqual(256, len(sum(shards, [])))
+        self.assertEqual('AB00', shards[0][0])
+        self.assertEqual([['F' * 64]], _fetch_shards('F' * 64, 4))
@@ -13,12 +13,18 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library.
 
+import json
 import logging
+import os
+import tempfile
 import unittest
+from collections import defaultdict
 from six import itervalues, iteritems
 
+import eventlet
 from mock import MagicMock as Mock
 
+from oio.common.exceptions import ServiceBusy
 from oio.directory.meta0 import PrefixMapping
 
 
@@ -46,10 +52,10 @@ class TestPrefixMapping(unittest.TestCase):
         self.m0_client = Mock(conf={'namespace': 'OPENIO'})
         self.logger = logging.getLogger('test')
 
-    def make_mapping(self, replicas=3, digits=None):
+    def make_mapping(self, replicas=3, digits=None, **kwargs):
         mapping = PrefixMapping(self.m0_client, self.cs_client,
                                 replicas=replicas, digits=digits,
-                                logger=self.logger)
+                                logger=self.logger, **kwargs)
         return mapping
 
     def test_bootstrap_3_services(self):
@@ -112,6 +118,46 @@ class TestPrefixMapping(unittest.TestCase):
     def test_bootstrap_3_services_1_digit_rebalanced(self):
         return self._test_bootstrap_rebalanced(3, 3, digits=1)
 
+    def test_bootstrap_less_bases_balanced(self):
+        self.cs_client.generate_services(7, locations=7)
+        mapping = self.make_mapping(replicas=3, digits=2)
+        mapping.bootstrap()
+        self.assertTrue(mapping.check_replicas())
+        counts = mapping.count_pfx_by_svc().values()
+        self.assertLessEqual(max(counts) - min(counts), 1)
+
+    def test_allocator(self):
+        self.cs_client.generate_services(5, locations=5)
+        mapping = self.make_mapping(replicas=2, digits=2)
+        svcs = sorted(mapping.services.values(), key=lambda x: x['addr'])
+        for i, svc in enumerate(svcs):
+            for j in range(5 - i):
+                mapping.assign_services('%X%X' % (i, j), [svc])
+        found = mapping.find_services_less_bases()
+        self.assertEqual([svcs[4], svcs[3]], found)
+        # Queue updated when bases are assigned
+        mapping.assign_services('A0', [svcs[4], svcs[3]])
+        mapping.assign_services('A1', [svcs[4], svcs[3]])
+        found = mapping.find_services_less_bases(known=[svcs[0]])
+        self.assertEqual([svcs[0], svcs[2]], found)
+        # Services too close to the known ones are skipped
+        svcs[2]['tags']['tag.loc'] = svcs[0]['tags']['tag.loc']
+        mapping._loc_parts.clear()
+        found = mapping.find_services_less_bases(known=[svcs[0]])
+        self.assertEqual([svcs[0], svcs[4]], found)
+        # ...as well as services without score
+        svcs[3]['score'] = 0
+        svcs[4]['score'] = 0
+        found = mapping.find_services_less_bases(known=[svcs[0]])
+        self.assertEqual([svcs[0], svcs[1]], found)
+
+    def test_dist_between(self):
+        self.assertEqual(0, PrefixMapping.dist_between('a.b.c.d', 'a.b.c.d'))
+        self.assertEqual(1, PrefixMapping.dist_between('a.b.c.d', 'a.b.c.e'))
+        self.assertEqual(4, PrefixMapping.dist_between('a.b.c.d', 'e.b.c.d'))
+        self.assertEqual(1, PrefixMapping.dist_between('a.b', 'a.c'))
+        self.assertEqual(2, PrefixMapping.dist_between('a', 'a.c.d'))
+
     def test_decommission(self):
         n = 20
         replicas = 3
@@ -206,3 +252,140 @@ class TestPrefixMapping(unittest.TestCase):
         mapping._admin.copy_base_from.assert_called()
         mapping._admin.election_leave.assert_called()
         mapping._admin.election_status.assert_called()
+
+    def _decommissioned_mapping(self):
+        self.cs_client.generate_services(7, locations=7)
+        mapping = self.make_mapping(replicas=3, digits=2)
+        mapping.bootstrap()
+        mapping_str = mapping.to_json()
+        mapping = self.make_mapping(replicas=3, digits=2, busy_backoff=0.0)
+        mapping._admin = Mock()
+        mapping._admin.election_status = Mock(return_value={'peers': {}})
+        mapping.load(mapping_str, swap_bytes=False)
+        svc = sorted(mapping.services.values(), key=lambda x: x['addr'])[0]
+        return mapping, mapping.decommission(svc)
+
+    def test_apply_per_service_limit(self):
+        mapping, moved = self._decommissioned_mapping()
+        running = defaultdict(int)
+        max_running = defaultdict(int)
+
+        def _copy(_svc_type, cid=None, svc_from=None, svc_to=None):
+            for svc in (svc_from, svc_to):
+                running[svc] += 1
+                max_running[svc] = max(max_running[svc], running[svc])
+            eventlet.sleep(0.001)
+            for svc in (svc_from, svc_to):
+                running[svc] -= 1
+
+        mapping._admin.copy_base_from.side_effect = _copy
+        mapping.apply(moved, concurrency=20, per_service=2)
+        self.assertEqual(len(moved),
+                         mapping._admin.copy_base_from.call_count)
+        self.assertEqual(2, max(max_running.values()))
+        self.assertEqual(len(moved),
+                         mapping._admin.election_leave.call_count)
+
+    def test_apply_journal(self):
+        mapping, moved = self._decommissioned_mapping()
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, journal)
+        # Busy once, then fails on the 2nd base
+        mapping._admin.set_peers.side_effect = \
+            [ServiceBusy(), None, ServiceBusy()] + \
+            [ServiceBusy()] * mapping.busy_retries + \
+            [None] * len(moved)
+        mapping.apply(moved, concurrency=1, journal=journal)
+        self.assertEqual(len(moved) - 1,
+                         mapping._admin.copy_base_from.call_count)
+
+        # Resume: only the failed base is copied
+        mapping._admin.reset_mock()
+        mapping._admin.election_status = Mock(return_value={'peers': {}})
+        mapping.apply(moved, journal=journal)
+        self.assertEqual(1, mapping._admin.set_peers.call_count)
+        self.assertEqual(1, mapping._admin.copy_base_from.call_count)
+        self.assertEqual(1, mapping._admin.election_leave.call_count)
+        forced = mapping.m0.force.call_args[0][0]
+        # 256 prefixes per base
+        self.assertEqual(len(moved) * 256, len(json.loads(forced)))
+
+    def test_apply_journal_resume_after_force(self):
+        mapping, moved = self._decommissioned_mapping()
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, journal)
+        targets = {base: [x['addr'] for x in mapping.svc_by_base[base]]
+                   for base in moved}
+        old_peers = {base: list(mapping.raw_svc_by_base[base])
+                     for base in moved}
+        # Interrupted while resetting the election of the 2nd base
+        mapping._admin.election_status.side_effect = \
+            [{'peers': {}}, KeyboardInterrupt()]
+        self.assertRaises(KeyboardInterrupt, mapping.apply, moved,
+                          concurrency=1, journal=journal)
+        self.assertEqual(1, self.m0_client.force.call_count)
+
+        # Resume with a new mapping, not loaded from meta0
+        self.m0_client.reset_mock()
+        mapping = self.make_mapping(replicas=3, digits=2)
+        mapping._admin = Mock()
+        mapping._admin.election_status = Mock(return_value={'peers': {}})
+        mapping.apply(journal=journal)
+        for base in moved:
+            self.assertEqual(
+                targets[base],
+                [x['addr'] for x in mapping.svc_by_base[base]])
+            self.assertEqual(old_peers[base], mapping.raw_svc_by_base[base])
+        mapping._admin.set_peers.assert_not_called()
+        mapping._admin.copy_base_from.assert_not_called()
+        self.assertEqual(len(moved) - 1,
+                         mapping._admin.election_leave.call_count)
+        forced = json.loads(self.m0_client.force.call_args[0][0])
+        self.assertEqual(len(moved) * 256, len(forced))
+        for base in moved:
+            self.assertEqual(targets[base], forced[base + '00'])
+
+    def test_apply_journal_complete(self):
+        mapping, moved = self._decommissioned_mapping()
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, journal)
+        origin = {'command': 'decommission', 'addr': '127.0.1.1:6001',
+                  'bases': []}
+        mapping.apply(moved, journal=journal, origin=origin)
+        self.assertEqual(1, self.m0_client.force.call_count)
+
+        # The plan has been applied, it is not applied again
+        self.m0_client.reset_mock()
+        mapping = self.make_mapping(replicas=3, digits=2)
+        mapping._admin = Mock()
+        self.assertRaises(ValueError, mapping.apply, journal=journal,
+                          origin=origin)
+        self.m0_client.force.assert_not_called()
+        mapping._admin.set_peers.assert_not_called()
+
+    def test_apply_journal_other_origin(self):
+        mapping, moved = self._decommissioned_mapping()
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, journal)
+        # Interrupted while copying the 2nd base
+        mapping._admin.set_peers.side_effect = [None, KeyboardInterrupt()]
+        self.assertRaises(
+            KeyboardInterrupt, mapping.apply, moved, concurrency=1,
+            journal=journal,
+            origin={'command': 'decommission', 'addr': '127.0.1.1:6001',
+                    'bases': []})
+
+        # Another operation does not resume the plan
+        mapping = self.make_mapping(replicas=3, digits=2)
+        mapping._admin = Mock()
+        for origin in ({'command': 'rebalance'},
+                       {'command': 'decommission', 'addr': '127.0.1.1:6002',
+                        'bases': []}):
+            self.assertRaises(ValueError, mapping.apply, journal=journal,
+                              origin=origin)
+        self.m0_client.force.assert_not_called()
+        mapping._admin.set_peers.assert_not_called()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# oio-bench-account-update.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the throughput of container updates in the account backend,
+against a local Redis, directly or through Sentinel. With Sentinel, the
+cached master client is compared with a client resolved at each access
+(the former behavior).
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+import uuid
+
+import eventlet
+eventlet.monkey_patch()
+
+from oio.account.backend import AccountBackend  # noqa: E402
+
+
+class UncachedAccountBackend(AccountBackend):
+    """Resolve the Sentinel master at each access, like before."""
+
+    @property
+    def conn(self):
+        return self._sentinel.master_for(self._sentinel_name,
+                                         **self._conn_kwargs)
+
+
+def run(name, backend, count, concurrency):
+    account = 'bench-%s' % uuid.uuid4().hex
+    backend.create_account(account)
+    pool = eventlet.GreenPool(concurrency)
+
+    def _update(i):
+        backend.update_container(account, 'container-%d' % (i % 1000),
+                                 time.time(), 0, i, i)
+
+    start = time.time()
+    for _ in pool.imap(_update, range(count)):
+        pass
+    elapsed = time.time() - start
+    backend.flush_account(account)
+    backend.delete_account(account)
+    print('%-24s %8.1f updates/s' % (name, count / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--redis-host', default='127.0.0.1')
+    parser.add_argument('--redis-port', default='6379')
+    parser.add_argument('--sentinel-hosts',
+                        help='comma separated list of Sentinel addresses, '
+                             'to also run the tests through Sentinel')
+    parser.add_argument('--sentinel-master-name', default='oio')
+    parser.add_argument('--count', type=int, default=10000,
+                        help='number of container updates')
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    conf = {'redis_host': args.redis_host, 'redis_port': args.redis_port,
+            'redis_max_connections': str(args.concurrency),
+            'autocreate': 'true'}
+    run('direct', AccountBackend(conf), args.count, args.concurrency)
+
+    if args.sentinel_hosts:
+        conf['sentinel_hosts'] = args.sentinel_hosts
+        conf['sentinel_master_name'] = args.sentinel_master_name
+        run('sentinel (cached)', AccountBackend(conf),
+            args.count, args.concurrency)
+        run('sentinel (uncached)', UncachedAccountBackend(conf),
+            args.count, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
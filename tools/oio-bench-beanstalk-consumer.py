@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+# oio-bench-beanstalk-consumer.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the event consumption rate of one connection per greenthread
+(reserve, then delete) with the prefetching consumer, against a fake
+beanstalkd simulating a network round-trip time.
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import time
+from collections import deque
+
+import eventlet
+
+from oio.event.beanstalk import Beanstalk, BeanstalkPrefetcher
+
+
+def fake_beanstalkd(sock, jobs, rtt):
+    """
+    Serve `jobs` jobs. Each batch of commands read from a connection
+    is answered after `rtt` seconds.
+    """
+    ready = deque((str(i), 'x' * 256) for i in range(jobs))
+    reserved = dict()
+
+    def _reserve(timeout):
+        if not ready:
+            if timeout == 0:
+                return 'TIMED_OUT\r\n'
+            # The benchmark is over
+            eventlet.sleep(3600)
+        job_id, body = ready.popleft()
+        reserved[job_id] = body
+        return 'RESERVED %s %d\r\n%s\r\n' % (job_id, len(body), body)
+
+    def _handle(conn):
+        buf = ''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            eventlet.sleep(rtt)
+            buf += data
+            lines = buf.split('\r\n')
+            buf = lines.pop()
+            replies = list()
+            for line in lines:
+                args = line.split()
+                if args[0] == 'use':
+                    replies.append('USING %s\r\n' % args[1])
+                elif args[0] == 'watch':
+                    replies.append('WATCHING 1\r\n')
+                elif args[0] == 'reserve':
+                    replies.append(_reserve(None))
+                elif args[0] == 'reserve-with-timeout':
+                    replies.append(_reserve(int(args[1])))
+                elif reserved.pop(args[1], None) is None:
+                    replies.append('NOT_FOUND\r\n')
+                else:
+                    replies.append('DELETED\r\n')
+            conn.sendall(''.join(replies))
+
+    pool = eventlet.GreenPool()
+    while True:
+        conn, _ = sock.accept()
+        pool.spawn(_handle, conn)
+
+
+def start_server(jobs, rtt):
+    sock = eventlet.listen(('127.0.0.1', 0))
+    url = 'beanstalk://127.0.0.1:%d' % sock.getsockname()[1]
+    proc = multiprocessing.Process(target=fake_beanstalkd,
+                                   args=(sock, jobs, rtt))
+    proc.daemon = True
+    proc.start()
+    sock.close()
+    return url, proc
+
+
+def legacy(url, jobs, concurrency, work):
+    done = [0]
+    finished = eventlet.event.Event()
+
+    def _consume():
+        beanstalk = Beanstalk.from_url(url)
+        beanstalk.use('oio')
+        beanstalk.watch('oio')
+        while True:
+            job_id, _data = beanstalk.reserve()
+            if work:
+                eventlet.sleep(work)
+            beanstalk.delete(job_id)
+            done[0] += 1
+            if done[0] == jobs:
+                finished.send()
+
+    pool = eventlet.GreenPool()
+    for _ in range(concurrency):
+        pool.spawn(_consume)
+    finished.wait()
+    for gt in list(pool.coroutines_running):
+        gt.kill()
+
+
+def prefetching(url, jobs, concurrency, work, prefetch):
+    done = [0]
+    beanstalk = Beanstalk.from_url(url)
+    beanstalk.use('oio')
+    beanstalk.watch('oio')
+    prefetcher = BeanstalkPrefetcher(beanstalk, prefetch=prefetch)
+
+    def _consume():
+        while True:
+            job_id, _data = prefetcher.get()
+            if work:
+                eventlet.sleep(work)
+            prefetcher.delete(job_id)
+            done[0] += 1
+
+    pool = eventlet.GreenPool()
+    for _ in range(concurrency):
+        pool.spawn(_consume)
+    while done[0] < jobs or not prefetcher.acks.empty():
+        prefetcher.step()
+    for gt in list(pool.coroutines_running):
+        gt.kill()
+    beanstalk.close()
+
+
+def run(name, func, args, *func_args):
+    url, proc = start_server(args.jobs, args.rtt)
+    try:
+        start = time.time()
+        func(url, args.jobs, *func_args)
+        elapsed = time.time() - start
+    finally:
+        proc.terminate()
+    print('%-28s %10.0f events/s' % (name, args.jobs / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=5000,
+                        help='number of jobs to consume')
+    parser.add_argument('--rtt', type=float, default=0.001,
+                        help='simulated round-trip time, in seconds')
+    parser.add_argument('--work', type=float, default=0.0,
+                        help='time spent processing each event, in seconds')
+    parser.add_argument('--concurrency', type=int, action='append',
+                        help='number of handler greenthreads '
+                             '(may be repeated), default: 1, 10, 50')
+    parser.add_argument('--prefetch', type=int,
+                        help='number of jobs reserved in advance '
+                             '(default: 2 * concurrency)')
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency or (1, 10, 50):
+        prefetch = args.prefetch or 2 * concurrency
+        print('concurrency: %d' % concurrency)
+        run('reserve/delete', legacy, args, concurrency, args.work)
+        run('prefetch=%d' % prefetch, prefetching, args,
+            concurrency, args.work, prefetch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# oio-bench-chunk-reader.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the record buffer used by ChunkReader.iter_from_resp
+with the former `buf += data` implementation.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from oio.api.io import RecordBuffer, READ_CHUNK_SIZE
+
+
+class MemorySource(object):
+    """In-memory source returning at most `read_size` bytes per read."""
+
+    def __init__(self, total, block):
+        self.remaining = total
+        self.block = block
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        # Like a socket, return a freshly allocated buffer
+        return self.block[1:size + 1]
+
+
+def legacy_iter(source, buf_size):
+    buf = b''
+    while True:
+        data = source.read(READ_CHUNK_SIZE)
+        buf += data
+        if not data:
+            if buf:
+                yield buf
+            break
+        while len(buf) >= buf_size:
+            read_d = buf[:buf_size]
+            buf = buf[buf_size:]
+            yield read_d
+
+
+def record_buffer_iter(source, buf_size):
+    buf = RecordBuffer(buf_size)
+    while buf.fill(source):
+        for data in buf.records():
+            yield data
+    data = buf.flush()
+    if data:
+        yield data
+
+
+def run(name, func, source, buf_size):
+    total = source.remaining
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    count = 0
+    for data in func(source, buf_size):
+        count += len(data)
+    elapsed = time.time() - start
+    alloc = ''
+    if tracemalloc:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        alloc = ', peak allocated %d KiB' % (peak // 1024)
+    assert count == total
+    print('%-24s %8.1f MiB/s%s' % (
+        name, total / elapsed / 1024.0 / 1024.0, alloc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1024,
+                        help='amount of data to read, in MiB')
+    parser.add_argument('--buf-size', type=int, action='append',
+                        help='record size (may be repeated), '
+                             'default: 8192, 65536, 174843 (EC fragment)')
+    args = parser.parse_args()
+
+    total = args.size * 1024 * 1024
+    block = b'x' * (READ_CHUNK_SIZE + 1)
+    for buf_size in args.buf_size or (8192, 65536, 174843):
+        print('record size: %d' % buf_size)
+        run('legacy', legacy_iter, MemorySource(total, block), buf_size)
+        run('record buffer', record_buffer_iter,
+            MemorySource(total, block), buf_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# oio-bench-chunked-write.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the client CPU time spent to upload replicated chunks to a local
+fake rawx (which discards the data), framing each block once for all
+replicas, and with the former framing of each block for each replica.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import multiprocessing
+import resource
+import time
+
+import eventlet
+from eventlet.queue import Queue
+
+import oio.api.replication
+from oio.api import io
+from oio.api.replication import ReplicatedMetachunkWriter
+from oio.common.constants import OIO_VERSION
+from oio.common.http_eventlet import ConnectionPool, frame_chunk
+from oio.common.storage_method import STORAGE_METHODS
+
+
+def fake_rawx(sock):
+    """Read chunked PUT requests, discard the data, reply 201."""
+
+    def _handle(conn):
+        fp = conn.makefile('rb', 65536)
+        while True:
+            line = fp.readline()
+            if not line:
+                break
+            # Request line and headers
+            while line not in (b'\r\n', b''):
+                line = fp.readline()
+            while True:
+                size = int(fp.readline().split(b';')[0], 16)
+                if size == 0:
+                    break
+                fp.read(size + 2)
+            # Trailers
+            while fp.readline() not in (b'\r\n', b''):
+                pass
+            conn.sendall(b'HTTP/1.1 201 Created\r\n'
+                         b'Content-Length: 0\r\n\r\n')
+        conn.close()
+
+    pool = eventlet.GreenPool()
+    while True:
+        conn, _ = sock.accept()
+        pool.spawn(_handle, conn)
+
+
+class Source(object):
+    """Always return the same block, like a zero-copy reader."""
+
+    def __init__(self, size):
+        self.block = b'x' * io.WRITE_CHUNK_SIZE
+        self.remaining = size
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        if size == len(self.block):
+            return self.block
+        return self.block[:size]
+
+
+class LegacyQueue(Queue):
+    """Frame each block when queued, like the former code did."""
+
+    def put(self, data, *args, **kwargs):
+        if data != b'0\r\n\r\n':
+            data = ('%x\r\n' % len(data)).encode() + data + b'\r\n'
+        return super(LegacyQueue, self).put(data, *args, **kwargs)
+
+
+def legacy_frame_chunk(data):
+    # Let LegacyQueue frame the data, once per replica
+    return data
+
+
+def upload(addr, replicas, chunk_size, count, pool):
+    method = 'plain/nb_copy=%d' % replicas
+    sysmeta = {
+        'id': '705229BB7F330500A65C3A49A3116B83',
+        'version': '1463998577463950',
+        'chunk_method': method,
+        'container_id': '3E32B63E6039FD3104F63BFAE034FADAA823371DD64599A8'
+                        '779BA02B3439A268',
+        'policy': 'BENCH',
+        'content_path': 'bench',
+        'full_path': ['account/container/bench'],
+        'oio_version': OIO_VERSION,
+    }
+    storage_method = STORAGE_METHODS.load(method)
+    for i in range(count):
+        meta_chunk = [{'url': 'http://%s/%064X' % (addr, i * replicas + j),
+                       'pos': '0'} for j in range(replicas)]
+        writer = ReplicatedMetachunkWriter(
+            sysmeta, meta_chunk, hashlib.md5(), storage_method,
+            rawx_pool=pool)
+        writer.stream(Source(chunk_size), chunk_size)
+
+
+def run(name, addr, replicas, args):
+    pool = ConnectionPool()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    upload(addr, replicas, args.chunk_size, args.chunks, pool)
+    elapsed = time.time() - start
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    pool.clear()
+    cpu = (end.ru_utime - usage.ru_utime) + (end.ru_stime - usage.ru_stime)
+    uploaded = float(args.chunk_size * args.chunks * replicas) / 1024 ** 3
+    print('%-8s %d replicas: %8.1f MiB/s, %6.2f CPU s/GiB' % (
+        name, replicas, uploaded * 1024 / elapsed, cpu / uploaded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024 * 1024,
+                        help='size of each chunk (default: 64MiB)')
+    parser.add_argument('--chunks', type=int, default=8,
+                        help='number of metachunks uploaded per run')
+    parser.add_argument('--replicas', type=int, action='append',
+                        help='number of replicas (may be repeated), '
+                             'default: 1, 3, 6')
+    args = parser.parse_args()
+
+    sock = eventlet.listen(('127.0.0.1', 0))
+    addr = '127.0.0.1:%d' % sock.getsockname()[1]
+    proc = multiprocessing.Process(target=fake_rawx, args=(sock, ))
+    proc.daemon = True
+    proc.start()
+    try:
+        for replicas in args.replicas or (1, 3, 6):
+            run('shared', addr, replicas, args)
+            oio.api.replication.frame_chunk = legacy_frame_chunk
+            oio.api.replication.Queue = LegacyQueue
+            try:
+                run('legacy', addr, replicas, args)
+            finally:
+                oio.api.replication.frame_chunk = frame_chunk
+                oio.api.replication.Queue = Queue
+    finally:
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
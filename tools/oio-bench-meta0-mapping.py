@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# oio-bench-meta0-mapping.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the time spent computing meta1 prefix mappings (bootstrap,
+rebalance, decommission of one service), with fake meta1 services.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from oio.directory.meta0 import PrefixMapping
+
+
+class FakeConscience(object):
+    def __init__(self, count, locations):
+        self.services = [
+            {'addr': '10.0.%d.%d:6110' % (i // 250, i % 250), 'score': 100,
+             'tags': {'tag.loc': 'rack%d.host%d' % (i % locations, i)}}
+            for i in range(count)]
+
+    def all_services(self, *_args, **_kwargs):
+        return [dict(svc) for svc in self.services]
+
+
+class FakeMeta0(object):
+    conf = {}
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    res = func(*args, **kwargs)
+    return time.time() - start, res
+
+
+def run(count, digits, replicas, locations, strategy):
+    mapping = PrefixMapping(FakeMeta0(), FakeConscience(count, locations),
+                            replicas=replicas, digits=digits)
+    boot, _ = timed(mapping.bootstrap,
+                    strategy=getattr(mapping, 'find_services_' + strategy))
+    rebalance, moved = timed(mapping.rebalance)
+    decommission, _ = timed(mapping.decommission,
+                            sorted(mapping.services)[0])
+    assert mapping.check_replicas()
+    counts = sorted(mapping.count_pfx_by_svc().values())
+    print('%5d services %10.2fs %10.2fs (%5d moved) %10.2fs'
+          '   bases/svc: %d-%d' % (
+              count, boot, rebalance, len(moved or ()), decommission,
+              counts[1], counts[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--digits', type=int, default=4)
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--locations', type=int, default=10,
+                        help='number of racks the services are spread in')
+    parser.add_argument('--strategy', choices=('random', 'less_bases'),
+                        default='random',
+                        help='strategy used by the bootstrap')
+    parser.add_argument('services', type=int, nargs='*',
+                        help='numbers of meta1 services '
+                             '(default: 100, 500, 1000)')
+    args = parser.parse_args()
+
+    print('%d digits, %d replicas, %s bootstrap' % (
+        args.digits, args.replicas, args.strategy))
+    print('%14s %11s %11s %11s %11s' % (
+        '', 'bootstrap', 'rebalance', '', 'decommission'))
+    for count in args.services or (100, 500, 1000):
+        run(count, args.digits, args.replicas, args.locations,
+            args.strategy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# oio-bench-rdir-fetch.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the throughput of the chunk listing used by the blob rebuilder
+(`RdirClient.chunk_fetch`), against a fake rdir service answering with
+a fixed latency, with and without prefetching and sharding.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import time
+from bisect import bisect_right
+from hashlib import md5
+
+import eventlet
+eventlet.monkey_patch()
+from eventlet import wsgi  # noqa: E402
+
+from oio.rdir.client import RdirClient  # noqa: E402
+
+
+class FakeRdir(object):
+    """Serve the chunk records of one volume, like rdir's fetch route."""
+
+    def __init__(self, count, latency, record_cost):
+        self.keys = sorted('%s|%032X|%064X' % (
+            md5(str(i)).hexdigest().upper() * 2, i, i)
+            for i in range(count))
+        self.latency = latency
+        self.record_cost = record_cost
+        self.requests = 0
+
+    def __call__(self, env, start_response):
+        body = json.loads(env['wsgi.input'].read() or '{}')
+        prefix = body.get('container_id', '')
+        limit = min(max(body.get('limit', 4096), 1), 4096)
+        start = bisect_right(self.keys, max(prefix, body.get('start_after',
+                                                             '')))
+        page = list()
+        for key in self.keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            page.append([key, {'mtime': 1, 'rtime': 0}])
+        self.requests += 1
+        eventlet.sleep(self.latency + self.record_cost * len(page))
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(page)]
+
+
+def run(name, addr, fake, args, **kwargs):
+    client = RdirClient({'namespace': 'BENCH',
+                         'proxyd_url': 'http://127.0.0.1:1'})
+    client._addr_cache['bench'] = addr
+    fake.requests = 0
+    count = 0
+    start = time.time()
+    for _ in client.chunk_fetch('bench', limit=args.limit, **kwargs):
+        count += 1
+        # Rebuilder workers consuming the chunks
+        if count % 100 == 0:
+            eventlet.sleep(args.consumer_delay * 100)
+    elapsed = time.time() - start
+    print('%-24s %10.1f chunks/s %6d requests' % (
+        name, count / elapsed, fake.requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of chunks on the volume')
+    parser.add_argument('--limit', type=int, default=100,
+                        help='number of chunks requested per page')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='latency of each fetch request, in seconds')
+    parser.add_argument('--record-cost', type=float, default=0.00001,
+                        help='time spent by rdir for each record, '
+                             'in seconds')
+    parser.add_argument('--consumer-delay', type=float, default=0.00002,
+                        help='time spent by the consumer on each chunk, '
+                             'in seconds')
+    parser.add_argument('--shards', type=int, default=4)
+    args = parser.parse_args()
+
+    fake = FakeRdir(args.count, args.latency, args.record_cost)
+    sock = eventlet.listen(('127.0.0.1', 0))
+    # Headers and body are sent separately, do not wait for delayed ACKs
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    eventlet.spawn_n(wsgi.server, sock, fake, log=open(os.devnull, 'w'))
+    addr = '%s:%d' % sock.getsockname()
+
+    run('sequential', addr, fake, args)
+    run('prefetch', addr, fake, args, prefetch=2)
+    run('prefetch + %d shards' % args.shards, addr, fake, args,
+        prefetch=2, shards=args.shards)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# oio-bench-rdir-push.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare RdirClient.chunk_push and RdirClient.chunk_push_many,
+against a local stand-in for the rdir service.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import time
+
+from oio.rdir.client import RdirClient, RDIR_PUSH_BATCH_SIZE
+
+
+class _NullLog(object):
+    def write(self, *_args):
+        pass
+
+
+def fake_rdir(sock, latency):
+    """Accept pushes of one record or of a list of records."""
+    import eventlet
+    from eventlet import wsgi
+
+    records = dict()
+
+    def app(env, start_response):
+        if latency:
+            eventlet.sleep(latency)
+        length = int(env.get('CONTENT_LENGTH') or 0)
+        body = json.loads(env['wsgi.input'].read(length))
+        if not isinstance(body, list):
+            body = [body]
+        for record in body:
+            key = '|'.join((record['container_id'], record['content_id'],
+                            record['chunk_id']))
+            records[key] = record
+        start_response('204 No Content', [])
+        return []
+
+    wsgi.server(sock, app, log=_NullLog())
+
+
+def make_records(count):
+    return [{'container_id': '%064X' % (i // 100),
+             'content_id': '%032X' % (i // 10),
+             'chunk_id': '%064X' % i,
+             'mtime': int(time.time())}
+            for i in range(count)]
+
+
+def push_each(client, volume, records, **_kwargs):
+    for record in records:
+        data = record.copy()
+        client.chunk_push(volume, data.pop('container_id'),
+                          data.pop('content_id'), data.pop('chunk_id'),
+                          **data)
+
+
+def push_many(client, volume, records, batch_size=RDIR_PUSH_BATCH_SIZE):
+    failed = client.chunk_push_many(volume, records, batch_size=batch_size)
+    assert not failed, failed
+
+
+def run(name, func, client, volume, records, **kwargs):
+    start = time.time()
+    func(client, volume, records, **kwargs)
+    elapsed = time.time() - start
+    print('%-24s %8d chunks in %6.2fs: %10.1f chunks/s' % (
+        name, len(records), elapsed, len(records) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=10000,
+                        help='number of chunk records to push')
+    parser.add_argument('--batch-size', type=int, action='append',
+                        help='records per request (may be repeated), '
+                             'default: %d' % RDIR_PUSH_BATCH_SIZE)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency added by the fake rdir, in seconds')
+    args = parser.parse_args()
+
+    import eventlet
+    sock = eventlet.listen(('127.0.0.1', 0))
+    addr = '127.0.0.1:%d' % sock.getsockname()[1]
+    server = multiprocessing.Process(target=fake_rdir,
+                                     args=(sock, args.latency))
+    server.daemon = True
+    server.start()
+
+    try:
+        client = RdirClient({'namespace': 'NS',
+                             'proxyd_url': 'http://127.0.0.1:1'})
+        volume = '127.0.0.1:6004'
+        # Do not ask the directory where the rdir service is
+        client._addr_cache[volume] = addr
+
+        records = make_records(args.chunks)
+        run('chunk_push', push_each, client, volume, records)
+        for batch_size in args.batch_size or (RDIR_PUSH_BATCH_SIZE, ):
+            run('chunk_push_many (%d)' % batch_size, push_many,
+                client, volume, records, batch_size=batch_size)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
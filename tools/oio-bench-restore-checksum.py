@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# oio-bench-restore-checksum.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the throughput of the checksum verification done while restoring
+a container, with the resumable libcrypto MD5 and with the former
+pure-Python MD5. The object is uploaded by several ranges, so the state
+of the checksum is saved and resumed in the middle of chunks.
+"""
+
+from __future__ import print_function
+
+import argparse
+import pickle
+import time
+from hashlib import md5
+from io import BytesIO
+
+from oio.container import backup
+from oio.container import checksum
+from oio.container.md5py import MD5
+
+
+def make_entry(data, chunk_size):
+    checksums = dict()
+    for idx, offset in enumerate(range(0, len(data), chunk_size)):
+        chunk = data[offset:offset + chunk_size]
+        checksums[idx] = {'hash': md5(chunk).hexdigest().upper(),
+                          'size': len(chunk), 'offset': offset}
+    return {'name': 'bench', 'size': len(data), 'checksums': checksums}
+
+
+def restore(data, entry, range_size):
+    """Read `data` by ranges, like successive restore requests."""
+    offset = 0
+    while offset < len(data):
+        size = min(range_size, len(data) - offset)
+        stream = backup.LimitedStream(BytesIO(data[offset:offset + size]),
+                                      size, entry=entry, offset=offset)
+        while stream.read(1024 * 1024):
+            pass
+        offset += size
+    return all(chk.get('verified') for chk in entry['checksums'].values())
+
+
+def run(name, data, chunk_size, range_size):
+    entry = make_entry(data, chunk_size)
+    start = time.time()
+    verified = restore(data, entry, range_size)
+    elapsed = time.time() - start
+    assert verified, "some chunks have not been verified"
+    print('%-16s %8.1f MiB/s' % (
+        name, len(data) / elapsed / 1024.0 / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=16,
+                        help='size of the object, in MiB')
+    parser.add_argument('--chunk-size', type=int, default=3,
+                        help='size of the chunks, in MiB')
+    parser.add_argument('--range-size', type=int, default=5,
+                        help='size of each restore request, in MiB')
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='do not run the (slow) pure-Python MD5')
+    args = parser.parse_args()
+
+    data = b'0123456789abcdef' * (args.size * 64 * 1024)
+    chunk_size = args.chunk_size * 1024 * 1024
+    range_size = args.range_size * 1024 * 1024
+    print('object: %d MiB, chunks: %d MiB, ranges: %d MiB' % (
+        args.size, args.chunk_size, args.range_size))
+
+    if not isinstance(checksum.new_md5(), checksum.ResumableMD5):
+        print('libcrypto is not available, pure-Python MD5 is used')
+    run('resumable MD5', data, chunk_size, range_size)
+
+    if not args.skip_legacy:
+        backup.new_md5 = MD5
+        backup.dump_md5 = pickle.dumps
+        backup.load_md5 = pickle.loads
+        run('md5py', data, chunk_size, range_size)
+
+
+if __name__ == '__main__':
+    main()
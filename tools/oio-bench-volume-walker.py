@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# oio-bench-volume-walker.py
+# Copyright (C) 2018 OpenIO SAS, as part of OpenIO SDS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the volume walker of paths_gen with the former os.walk
+implementation (followed by the chunk ID check of the indexer),
+on a synthetic rawx volume.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from hashlib import sha256
+from string import hexdigits
+
+from oio.common.constants import STRLEN_CHUNKID
+from oio.common.utils import paths_gen
+
+
+def make_volume(path, count, hash_width, hash_depth):
+    """Create `count` empty chunk files, in rawx hash directories."""
+    for i in range(count):
+        chunk_id = sha256(str(i).encode('utf-8')).hexdigest().upper()
+        parts = [chunk_id[j * hash_width:(j + 1) * hash_width]
+                 for j in range(hash_depth)]
+        dirname = os.path.join(path, *parts)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        open(os.path.join(dirname, chunk_id), 'w').close()
+        if i % 100 == 0:
+            # Some noise: chunks being uploaded
+            open(os.path.join(dirname, chunk_id + '.pending'), 'w').close()
+
+
+def legacy_walk(volume):
+    for root, dirs, files in os.walk(volume):
+        for name in files:
+            path = os.path.join(root, name)
+            chunk_id = path.rsplit('/', 1)[-1]
+            if len(chunk_id) != STRLEN_CHUNKID:
+                continue
+            if any(c not in hexdigits for c in chunk_id):
+                continue
+            yield path
+
+
+def scandir_walk(volume):
+    return paths_gen(volume, chunks_only=True)
+
+
+def sharded_walk(volume, shards):
+    for shard in range(shards):
+        for path in paths_gen(volume, chunks_only=True,
+                              shard=shard, shards=shards):
+            yield path
+
+
+def run(name, gen, drop_caches):
+    if drop_caches:
+        os.system('sync; echo 3 > /proc/sys/vm/drop_caches')
+    start = time.time()
+    count = sum(1 for _ in gen)
+    elapsed = time.time() - start
+    print('%-24s %8d paths %8.3fs %10.0f paths/s' % (
+        name, count, elapsed, count / elapsed))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=200000,
+                        help='number of chunk files of the synthetic volume')
+    parser.add_argument('--hash-width', type=int, default=3)
+    parser.add_argument('--hash-depth', type=int, default=1)
+    parser.add_argument('--shards', type=int, default=4,
+                        help='number of shards walked one after the other')
+    parser.add_argument('--volume',
+                        help='walk this existing volume '
+                             'instead of creating a synthetic one')
+    parser.add_argument('--drop-caches', action='store_true',
+                        help='drop the page cache before each run '
+                             '(needs to be root)')
+    args = parser.parse_args()
+
+    volume = args.volume
+    if not volume:
+        volume = tempfile.mkdtemp(prefix='oio-bench-walker-')
+        print('Creating %d chunks in %s' % (args.chunks, volume))
+        make_volume(volume, args.chunks, args.hash_width, args.hash_depth)
+    try:
+        counts = set()
+        counts.add(run('os.walk', legacy_walk(volume), args.drop_caches))
+        counts.add(run('paths_gen', scandir_walk(volume), args.drop_caches))
+        counts.add(run('paths_gen (%d shards)' % args.shards,
+                       sharded_walk(volume, args.shards), args.drop_caches))
+        assert len(counts) == 1, 'walkers did not find the same chunks'
+    finally:
+        if not args.volume:
+            shutil.rmtree(volume)
+
+
+if __name__ == '__main__':
+    main()